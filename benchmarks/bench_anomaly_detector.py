@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+流式异常检测基准测试
+
+模拟大量传感器轮流上报，测量每条读数的检测耗时和每个序列的内存占用，
+并与写入管道处理一条消息的耗时对比：
+    python benchmarks/bench_anomaly_detector.py --series 100000 --rounds 10
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from src.anomaly_detector import AnomalyDetector
+from src.models import Base
+from src.sensor_processor import SensorDataProcessor
+
+
+def bench_detector(series: int, rounds: int, seed: int):
+    rng = random.Random(seed)
+    types = ["Temperature1", "Humidity1"]
+    keys = [(index // 2, types[index % 2]) for index in range(series)]
+    # 预先生成噪声，避免把随机数生成计入检测耗时
+    noise = [round(rng.gauss(0, 0.3), 1) for _ in range(4096)]
+
+    detector = AnomalyDetector()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for device_id, sensor_type in keys:
+        detector.observe(device_id, sensor_type, 40.0, 0.0)
+    state_bytes = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    events = 0
+    started = time.perf_counter()
+    for round_index in range(1, rounds + 1):
+        ts = round_index * 10.0
+        for index, (device_id, sensor_type) in enumerate(keys):
+            events += len(detector.observe(device_id, sensor_type, 40.0 + noise[(index + round_index) & 4095], ts))
+    elapsed = time.perf_counter() - started
+    readings = series * rounds
+    return {
+        "readings": readings,
+        "per_reading_us": elapsed / readings * 1e6,
+        "bytes_per_series": state_bytes / series,
+        "events": events,
+    }
+
+
+def bench_pipeline(messages: int):
+    """不启用检测时单个消息在处理器中的耗时（SQLite临时库，每500条提交一次）"""
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    processor = SensorDataProcessor()
+    processor.anomaly_detector = None
+
+    devices = 50
+    started = time.perf_counter()
+    for index in range(messages):
+        payload = f"Temperature1: {22 + (index % 7) * 0.1:.2f} C, Humidity1: {45 + (index % 5) * 0.1:.2f} %"
+        processor.process_message(session, f"bench/{index % devices}", payload)
+        if index % 500 == 499:
+            session.commit()
+    session.commit()
+    elapsed = time.perf_counter() - started
+    session.close()
+    return elapsed / messages * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="流式异常检测基准测试")
+    parser.add_argument("--series", type=int, default=100000, help="序列数 (设备×类型)")
+    parser.add_argument("--rounds", type=int, default=10, help="每个序列的读数轮数")
+    parser.add_argument("--messages", type=int, default=2000, help="管道对比测试的消息数")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    result = bench_detector(args.series, args.rounds, args.seed)
+    print(f"序列数: {args.series}，读数: {result['readings']}")
+    print(f"每条读数检测耗时: {result['per_reading_us']:.2f} µs")
+    print(f"每个序列状态内存: {result['bytes_per_series']:.0f} 字节 "
+          f"(共 {result['bytes_per_series'] * args.series / 1024 / 1024:.1f} MiB)")
+    print(f"误报事件数: {result['events']}")
+
+    # 处理器内部有大量print，重定向后再计时
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    try:
+        per_message = bench_pipeline(args.messages)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    print(f"处理器每条消息耗时（不检测）: {per_message:.1f} µs")
+    # 每条消息含2个读数
+    print(f"检测占每条消息处理耗时: {2 * result['per_reading_us'] / per_message * 100:.2f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+历史数据块存储基准测试
+
+对比逐行存储（sensor_history）与压缩块存储（sensor_blocks）的每点字节数，
+并测量块的编码/解码吞吐：
+    python benchmarks/bench_block_storage.py --series 50 --points 8640
+"""
+
+import argparse
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from src.block_codec import decode_block
+from src.block_store import OpenBlock, block_columns, to_epoch_ms
+from src.models import SensorBlockModel, SensorHistoryModel
+
+
+def generate_series(points: int, seed: int):
+    """每10秒一个点（带几十毫秒抖动），数值为0.1分辨率的温度曲线"""
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1)
+    timestamps, values = [], []
+    for step in range(points):
+        ts = start + timedelta(seconds=step * 10, milliseconds=rng.randint(-30, 30))
+        value = round(22 + 3 * math.sin(2 * math.pi * step / 8640) + rng.gauss(0, 0.1), 1)
+        timestamps.append(ts)
+        values.append(value)
+    return timestamps, values
+
+
+def file_size(path: str) -> int:
+    return os.path.getsize(path) + (os.path.getsize(path + "-wal") if os.path.exists(path + "-wal") else 0)
+
+
+def store(path: str, model, rows):
+    engine = create_engine(f"sqlite:///{path}")
+    model.__table__.create(bind=engine)
+    Session = sessionmaker(bind=engine)
+    with Session() as db:
+        db.bulk_insert_mappings(model, rows)
+        db.commit()
+    with engine.connect() as conn:
+        conn.exec_driver_sql("VACUUM")
+    engine.dispose()
+    return file_size(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--series", type=int, default=20, help="序列数（设备×类型）")
+    parser.add_argument("--points", type=int, default=8640, help="每个序列的点数（默认一天，每10秒一个）")
+    parser.add_argument("--block-size", type=int, default=256)
+    args = parser.parse_args()
+
+    all_series = [generate_series(args.points, seed) for seed in range(args.series)]
+    total_points = args.series * args.points
+
+    row_mappings, block_mappings, encoded = [], [], []
+    encode_started = time.perf_counter()
+    for series_id, (timestamps, values) in enumerate(all_series):
+        for offset in range(0, args.points, args.block_size):
+            block = OpenBlock(None, [to_epoch_ms(ts) for ts in timestamps[offset:offset + args.block_size]],
+                              values[offset:offset + args.block_size])
+            columns = block_columns(block)
+            encoded.append(columns["data"])
+            block_mappings.append(dict(columns, device_id=series_id, type="Temperature1"))
+    encode_seconds = time.perf_counter() - encode_started
+
+    for series_id, (timestamps, values) in enumerate(all_series):
+        row_mappings.extend({"device_id": series_id, "type": "Temperature1", "value": value, "timestamp": ts}
+                            for ts, value in zip(timestamps, values))
+
+    decode_started = time.perf_counter()
+    decoded = sum(len(decode_block(data)[0]) for data in encoded)
+    decode_seconds = time.perf_counter() - decode_started
+    assert decoded == total_points
+
+    with tempfile.TemporaryDirectory() as tmp:
+        rows_size = store(os.path.join(tmp, "rows.db"), SensorHistoryModel, row_mappings)
+        blocks_size = store(os.path.join(tmp, "blocks.db"), SensorBlockModel, block_mappings)
+
+    payload_bytes = sum(len(data) for data in encoded)
+    print(f"点数: {total_points}（{args.series} 个序列 × {args.points}），块大小 {args.block_size}")
+    print(f"压缩载荷:         {payload_bytes / total_points:8.2f} 字节/点")
+    print(f"块存储SQLite文件: {blocks_size / total_points:8.2f} 字节/点")
+    print(f"逐行SQLite文件:   {rows_size / total_points:8.2f} 字节/点（{rows_size / blocks_size:.1f} 倍）")
+    print(f"编码吞吐:         {total_points / encode_seconds:,.0f} 点/秒")
+    print(f"解码吞吐:         {total_points / decode_seconds:,.0f} 点/秒")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+仪表盘汇总基准测试
+
+对比按请求全量计算（加载全部设备再分组计数 + 最近读数）与增量维护的 /api/dashboard/summary：
+    python benchmarks/bench_dashboard_summary.py --devices 100000
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_workdir = tempfile.mkdtemp(prefix="bench_dashboard_")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_workdir, 'bench.db')}"
+
+from sqlalchemy import insert  # noqa: E402
+
+from src.dashboard import DashboardAggregator, ensure_device_counters, get_dashboard_summary  # noqa: E402
+from src.database import Base, SessionLocal, engine  # noqa: E402
+from src.db_operations import get_latest_sensors  # noqa: E402
+from src.models import DeviceModel  # noqa: E402
+
+
+def full_scan(db):
+    devices = db.query(DeviceModel).all()
+    by_status = Counter(device.status for device in devices)
+    by_location = Counter(device.location for device in devices)
+    return len(devices), by_status, by_location, get_latest_sensors(db)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="仪表盘汇总基准测试")
+    parser.add_argument("--devices", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    ensure_device_counters(engine)
+    rows = [{"name": f"dev-{index:06d}", "device_type": "传感器", "status": "在线" if index % 3 else "离线",
+             "location": f"车间{index % 200}"} for index in range(args.devices)]
+    started = time.perf_counter()
+    with engine.begin() as conn:
+        conn.execute(insert(DeviceModel), rows)
+    print(f"写入 {args.devices} 个设备（含计数触发器）{time.perf_counter() - started:.2f} 秒")
+
+    aggregator = DashboardAggregator()
+    aggregator._loaded = True
+    aggregator.observe(1, [(1, "Temperature1", 25.0, time.time(), "C", "normal", "dev-000001", 1)])
+    with SessionLocal() as db:
+        started = time.perf_counter()
+        for _ in range(max(1, args.repeat // 10)):
+            full_scan(db)
+        scan = (time.perf_counter() - started) / max(1, args.repeat // 10)
+        started = time.perf_counter()
+        for _ in range(args.repeat):
+            get_dashboard_summary(db, aggregator)
+        incremental = (time.perf_counter() - started) / args.repeat
+    print(f"全量计算: 每次请求 {scan * 1000:.1f} 毫秒")
+    print(f"增量汇总: 每次请求 {incremental * 1000:.2f} 毫秒")
+
+
+if __name__ == "__main__":
+    main()
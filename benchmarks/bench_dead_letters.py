@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+死信基准测试
+
+在临时目录的SQLite库中，对比无法识别的载荷按旧行为存为 Sensor_N 读数与直接写入死信表的处理吞吐，
+以及修复解析后批量重放死信的速度：
+    python benchmarks/bench_dead_letters.py --messages 10000 --devices 400
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_workdir = tempfile.mkdtemp(prefix="bench_dead_letters_")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_workdir, 'bench.db')}"
+
+import src.sensor_processor as sensor_processor  # noqa: E402
+from src.database import Base, engine  # noqa: E402
+from src.dead_letters import DeadLetterStore, replay_dead_letters  # noqa: E402
+from src.ingest_pipeline import IngestPipeline  # noqa: E402
+
+
+def run(messages):
+    pipeline = IngestPipeline(batch_size=2000, dead_letters=DeadLetterStore(max_rows=len(messages)))
+    pipeline.start()
+    started = time.perf_counter()
+    for topic, payload in messages:
+        pipeline.submit(topic, payload, reliable=True)
+    pipeline.flush()
+    elapsed = time.perf_counter() - started
+    pipeline.stop()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="死信基准测试")
+    parser.add_argument("--messages", type=int, default=10000)
+    parser.add_argument("--devices", type=int, default=400)
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    # 处理器内部有大量print，重定向后再计时
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+
+    def messages(prefix):
+        return [(f"{prefix}/dev{index % args.devices}", f"fw=2.{index % 9} rssi=-{60 + index % 30} up={index}".encode())
+                for index in range(args.messages)]
+
+    sensor_processor.PAYLOAD_FALLBACK_PARSE = True
+    fallback = run(messages("fallback"))
+    sensor_processor.PAYLOAD_FALLBACK_PARSE = False
+    rejected = run(messages("rejected"))
+
+    # 模拟修复解析后重放
+    sensor_processor.PAYLOAD_FALLBACK_PARSE = True
+    pipeline = IngestPipeline(batch_size=2000, dead_letters=DeadLetterStore(max_rows=args.messages))
+    pipeline.start()
+    result = replay_dead_letters(pipeline)
+    pipeline.stop()
+    sys.stdout = stdout
+    print(f"旧行为（存为 Sensor_N）: {args.messages} 条 {fallback:.2f} 秒，{args.messages / fallback:,.0f} 条/秒")
+    print(f"写入死信表: {args.messages} 条 {rejected:.2f} 秒，{args.messages / rejected:,.0f} 条/秒")
+    print(f"重放: {result['submitted']} 条，已提交 {result['committed']} 条，{result['messages_per_second']:,.0f} 条/秒")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+设备批量导入基准测试
+
+在临时SQLite库中导入N个设备（每个带一个主题别名），对比逐个 create_device 与批量导入：
+    python benchmarks/bench_device_import.py --devices 20000
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from src.database import Base
+from src.db_operations import create_device
+from src.device_bulk import import_devices, iter_device_export
+import src.models  # noqa: F401  注册全部表
+
+
+def new_session():
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(bind=engine)()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="设备批量导入基准测试")
+    parser.add_argument("--devices", type=int, default=20000)
+    parser.add_argument("--single", type=int, default=1000, help="逐个创建的设备数（用于对比）")
+    args = parser.parse_args()
+
+    lines = ["name,device_type,location,topic"] + [
+        f"dev-{index},温湿度,机房{index % 50},site{index % 50}/dev{index}" for index in range(args.devices)
+    ]
+
+    db = new_session()
+    started = time.perf_counter()
+    result = import_devices(db, lines, "csv")
+    elapsed = time.perf_counter() - started
+    print(f"批量导入 {result['created']} 个设备、{result['aliases']} 个别名: "
+          f"{elapsed:.2f} 秒，{args.devices / elapsed:,.0f} 个/秒")
+
+    started = time.perf_counter()
+    exported = sum(len(chunk) for chunk in iter_device_export(db, "csv"))
+    elapsed = time.perf_counter() - started
+    print(f"导出CSV {exported / 1024:.0f} KiB: {elapsed:.2f} 秒")
+    db.close()
+
+    db = new_session()
+    started = time.perf_counter()
+    for index in range(args.single):
+        create_device(db, {"name": f"dev-{index}", "device_type": "温湿度"})
+    elapsed = time.perf_counter() - started
+    print(f"逐个 create_device {args.single} 个设备: {elapsed:.2f} 秒，{args.single / elapsed:,.0f} 个/秒")
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+旧版Flask栈MQTT写入基准测试
+
+在临时目录的SQLite库中对比两种写入方式的吞吐：
+- 旧方式：每条消息 create_app()，再整体重写 Device.sensor_data JSON
+- 新方式：MQTTHandler 复用同一个应用，按批次写入规范化的 SensorReading
+
+    python benchmarks/bench_flask_mqtt_handler.py --messages 20000 --legacy 300
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def make_messages(count, devices):
+    return [{
+        'device_id': f'传感器{index % devices:03d}',
+        'temperature': round(random.uniform(20, 30), 1),
+        'humidity': round(random.uniform(50, 70), 1),
+        'location': '实验室1',
+        'timestamp': time.time(),
+    } for index in range(count)]
+
+
+def legacy_process(data):
+    """旧版 process_sensor_data 的写法（每条消息新建应用和扩展）"""
+    from app import create_app
+    app = create_app()
+    with app.app_context():
+        Device = app.db.iot_models['Device']
+        device = Device.query.filter_by(name=data.get('device_id')).first()
+        if device:
+            device.sensor_data = json.dumps(data)
+            device.status = '在线'
+        else:
+            device = Device(name=data.get('device_id', 'Unknown'), status='在线',
+                            location=data.get('location', 'Unknown'), sensor_data=json.dumps(data))
+            app.db.session.add(device)
+        app.db.session.commit()
+        app.db.engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="旧版Flask栈MQTT写入基准测试")
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--legacy", type=int, default=300, help="旧方式写入的消息数（很慢）")
+    parser.add_argument("--devices", type=int, default=100)
+    args = parser.parse_args()
+
+    # create_app 把数据库建在当前目录
+    os.chdir(tempfile.mkdtemp())
+    from app import create_app
+    from mqtt_client import MQTTHandler
+
+    app = create_app()
+    with app.app_context():
+        app.db.create_all()
+
+    messages = make_messages(args.legacy, args.devices)
+    started = time.perf_counter()
+    for data in messages:
+        legacy_process(data)
+    elapsed = time.perf_counter() - started
+    print(f"旧方式（每条消息新建应用）{args.legacy} 条: {elapsed:.2f} 秒，{args.legacy / elapsed:,.0f} 条/秒")
+
+    handler = MQTTHandler(app=app)
+    messages = make_messages(args.messages, args.devices)
+    handler.start_writer()
+    started = time.perf_counter()
+    for data in messages:
+        handler.submit(data)
+    handler.flush()
+    elapsed = time.perf_counter() - started
+    handler.stop_writer()
+    print(f"新方式（复用应用、批量写入）{args.messages} 条: {elapsed:.2f} 秒，{args.messages / elapsed:,.0f} 条/秒，"
+          f"{handler.stats['batches']} 个批次，{handler.stats['readings']} 个读数")
+
+    with app.app_context():
+        SensorReading = app.db.iot_models['SensorReading']
+        print(f"SensorReading 行数: {SensorReading.query.count()}")
+
+
+if __name__ == "__main__":
+    main()
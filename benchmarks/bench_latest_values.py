@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+最新值读取基准测试
+
+对比 /api/latest-sensors 的两种数据来源：数据库查询（get_latest_sensors）与共享内存最新值表：
+    python benchmarks/bench_latest_values.py --devices 2000 --types 4 --requests 200
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_workdir = tempfile.mkdtemp(prefix="bench_latest_")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_workdir, 'bench.db')}"
+
+from src.database import Base, SessionLocal, engine  # noqa: E402
+from src.db_operations import get_latest_sensors  # noqa: E402
+from src.latest_values import LatestValueReader, LatestValueWriter  # noqa: E402
+from src.models import DeviceModel, SensorDataModel  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="最新值读取基准测试")
+    parser.add_argument("--devices", type=int, default=2000)
+    parser.add_argument("--types", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    path = os.path.join(_workdir, "latest")
+    writer = LatestValueWriter(path, capacity=args.devices * args.types)
+    base = datetime.utcnow()
+    with SessionLocal() as db:
+        for index in range(args.devices):
+            device = DeviceModel(name=f"bench-dev-{index}", device_type="传感器", status="在线", location="车间")
+            db.add(device)
+            db.flush()
+            for type_index in range(args.types):
+                timestamp = base - timedelta(seconds=index * args.types + type_index)
+                sensor = SensorDataModel(device_id=device.id, type=f"Temperature{type_index + 1}", value=20.0,
+                                         unit="C", timestamp=timestamp, alert_status="normal")
+                db.add(sensor)
+                db.flush()
+                writer.publish(device.id, sensor.type, sensor.value, timestamp.timestamp(), sensor.unit,
+                               sensor.alert_status, device.name, sensor.id)
+        db.commit()
+
+    started = time.perf_counter()
+    for _ in range(args.requests):
+        with SessionLocal() as db:
+            get_latest_sensors(db)
+    database = (time.perf_counter() - started) / args.requests
+
+    reader = LatestValueReader(path)
+    started = time.perf_counter()
+    for _ in range(args.requests):
+        reader.latest_sensors()
+    shared = (time.perf_counter() - started) / args.requests
+
+    print(f"{args.devices} 个设备 × {args.types} 种传感器，共 {args.devices * args.types} 个最新值")
+    print(f"数据库查询: 每次请求 {database * 1000:.2f} 毫秒")
+    print(f"共享内存:   每次请求 {shared * 1000:.2f} 毫秒（不查询数据库）")
+    writer.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+分片写入基准测试
+
+在临时目录的SQLite库中，对比单库写入管道与N个分片并行写入的吞吐：
+    python benchmarks/bench_sharded_ingest.py --messages 10000 --devices 400 --shards 4
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_workdir = tempfile.mkdtemp(prefix="bench_shards_")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_workdir, 'primary.db')}"
+
+from src.database import Base, configure_shards, engine, init_shards  # noqa: E402
+from src.ingest_pipeline import IngestPipeline, ShardedIngestPipeline  # noqa: E402
+import src.models  # noqa: E402,F401  注册全部表
+
+
+def run(pipeline, messages):
+    pipeline.start()
+    started = time.perf_counter()
+    for topic, payload in messages:
+        pipeline.submit(topic, payload, reliable=True)
+    pipeline.flush()
+    elapsed = time.perf_counter() - started
+    pipeline.stop()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="分片写入基准测试")
+    parser.add_argument("--messages", type=int, default=10000)
+    parser.add_argument("--devices", type=int, default=400)
+    parser.add_argument("--shards", type=int, default=4)
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    # 处理器内部有大量print，重定向后再计时
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+
+    def messages(prefix):
+        return [(f"{prefix}/dev{index % args.devices}",
+                 f"Temperature1: {20 + index % 17}.5 C, Humidity1: {40 + index % 23}.0 %")
+                for index in range(args.messages)]
+
+    single = run(IngestPipeline(), messages("single"))
+
+    configure_shards([f"sqlite:///{os.path.join(_workdir, f'shard{index}.db')}" for index in range(1, args.shards)])
+    init_shards()
+    sharded = run(ShardedIngestPipeline(), messages("sharded"))
+    sys.stdout = stdout
+    print(f"单库: {args.messages} 条消息 {single:.2f} 秒，{args.messages / single:,.0f} 条/秒")
+    print(f"{args.shards} 个分片: {args.messages} 条消息 {sharded:.2f} 秒，{args.messages / sharded:,.0f} 条/秒")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import pytest
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# 测试使用临时数据库，避免污染项目目录下的mqtt_iot.db
+_test_db_dir = tempfile.mkdtemp(prefix="mqtt_iot_test_")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_test_db_dir, 'test.db')}")
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class LocalBroker:
+    """本地MQTT broker进程，优先使用mosquitto，其次使用amqtt"""
+
+    def __init__(self, workdir):
+        self.port = _free_port()
+        self.workdir = workdir
+        self.process = None
+
+    def start(self):
+        if shutil.which("mosquitto"):
+            command = ["mosquitto", "-p", str(self.port)]
+        else:
+            config = os.path.join(self.workdir, f"amqtt-{self.port}.yaml")
+            with open(config, "w") as f:
+                f.write(f"listeners:\n  default:\n    type: tcp\n    bind: 127.0.0.1:{self.port}\n")
+            command = ["amqtt", "-c", config]
+        self.process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self.wait_ready()
+        return self
+
+    def wait_ready(self, timeout=10.0):
+        """等待broker开始监听端口"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                socket.create_connection(("127.0.0.1", self.port), timeout=0.5).close()
+                return
+            except OSError:
+                time.sleep(0.05)
+
+    def kill(self):
+        if self.process and self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+
+
+@pytest.fixture
+def local_broker(tmp_path):
+    """返回一个创建本地broker的工厂，测试结束后关闭所有broker"""
+    if not (shutil.which("mosquitto") or shutil.which("amqtt")):
+        pytest.skip("需要本地mosquitto或amqtt broker")
+    brokers = []
+
+    def factory():
+        broker = LocalBroker(str(tmp_path))
+        brokers.append(broker)
+        return broker
+
+    yield factory
+    for broker in brokers:
+        broker.kill()
@@ -3,6 +3,10 @@ import App from './App.vue'
 import router from './router'
 import { createPinia } from 'pinia'
 
+// Bootstrap随构建一起打包（带哈希、预压缩），不再依赖CDN
+import 'bootstrap/dist/css/bootstrap.min.css'
+import 'bootstrap/dist/js/bootstrap.bundle.min.js'
+
 // 配置axios基础URL，动态使用当前主机的协议、主机名和端口
 import axios from 'axios'
 // 使用当前页面的协议、主机名和端口作为API的基础URL
@@ -4,6 +4,13 @@ import vue from '@vitejs/plugin-vue'
 // https://vitejs.dev/config/
 export default defineConfig({
   plugins: [vue()],
+  build: {
+    // 由FastAPI直接提供（src/static_assets.py），assets/下的文件名带内容哈希，可永久缓存
+    outDir: 'dist',
+    assetsDir: 'assets',
+    // 运行 python -m src.static_assets 生成 .gz/.br 预压缩文件
+    reportCompressedSize: false
+  },
   server: {
     host: '0.0.0.0',
     port: 3000,
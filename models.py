@@ -9,6 +9,12 @@ db = SQLAlchemy()
 
 # 模型将在app创建后动态定义
 def define_models(db):
+    # 同一个db只定义一次模型，重复定义同名表会报错
+    if getattr(db, 'iot_models', None):
+        models = db.iot_models
+        globals().update(models)
+        return models['User'], models['Device']
+
     class User(UserMixin, db.Model):
         id = db.Column(db.Integer, primary_key=True)
         username = db.Column(db.String(80), unique=True, nullable=False)
@@ -42,9 +48,19 @@ def define_models(db):
                 'last_seen': self.last_seen.isoformat() if self.last_seen else None,
                 'sensor_data': self.sensor_data
             }
-    
+
+    class SensorReading(db.Model):
+        """传感器读数，每个数值一行（取代整体重写 Device.sensor_data）"""
+        __table_args__ = (db.Index('ix_sensor_reading_device_type_time', 'device_id', 'type', 'timestamp'),)
+
+        id = db.Column(db.Integer, primary_key=True)
+        device_id = db.Column(db.Integer, db.ForeignKey('device.id'), nullable=False)
+        type = db.Column(db.String(50), nullable=False)
+        value = db.Column(db.Float, nullable=False)
+        timestamp = db.Column(db.DateTime, nullable=False)
+
+    db.iot_models = {'User': User, 'Device': Device, 'SensorReading': SensorReading}
     # 将模型添加到当前模块的命名空间
-    globals()['User'] = User
-    globals()['Device'] = Device
+    globals().update(db.iot_models)
     
-    return User, Device
\ No newline at end of file
+    return User, Device
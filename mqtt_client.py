@@ -1,17 +1,48 @@
 import paho.mqtt.client as mqtt
 import json
+import queue
 import threading
 import time
-from flask import current_app
+from datetime import datetime
+
+from sqlalchemy import insert
+
+
+def _reading_time(value, default):
+    """消息中的Unix时间戳（秒或毫秒）转为UTC时间，缺失或无效时用默认值"""
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value <= 0:
+        return default
+    # 大于1e11视为毫秒
+    return datetime.utcfromtimestamp(value / 1000.0 if value > 1e11 else value)
+
+
+# 消息中不是传感器读数的字段
+META_KEYS = {'device_id', 'location', 'timestamp', 'ts', 'time'}
 
 
 class MQTTHandler:
-    def __init__(self, broker='localhost', port=1883):
+    """旧版Flask栈的MQTT接入
+
+    整个进程只使用一个Flask应用和数据库引擎：MQTT回调只把消息放入队列，
+    由写入线程在同一个应用上下文中按批次写入，每个数值一行写入 SensorReading。
+    """
+
+    def __init__(self, broker='localhost', port=1883, app=None, batch_size=500, flush_interval=0.5,
+                 max_queue=10000):
         self.broker = broker
         self.port = port
         self.client = mqtt.Client()
         self.client.on_connect = self.on_connect
         self.client.on_message = self.on_message
+        self.app = app
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.stats = {'received': 0, 'written': 0, 'readings': 0, 'batches': 0, 'failed': 0, 'dropped': 0}
+        self._models = None
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._writer = None
         
     def on_connect(self, client, userdata, flags, rc):
         print(f"MQTT连接结果: {rc}")
@@ -22,41 +53,145 @@ class MQTTHandler:
             print("MQTT连接失败")
     
     def on_message(self, client, userdata, msg):
-        print(f"收到消息: {msg.topic} - {msg.payload.decode()}")
         try:
             # 解析传感器数据
             sensor_data = json.loads(msg.payload.decode())
-            
-            # 这里可以处理传感器数据并存储到数据库
-            # 例如：更新设备状态、记录传感器读数等
-            self.process_sensor_data(sensor_data)
-        except json.JSONDecodeError:
-            print("无法解析JSON数据")
-    
-    def process_sensor_data(self, data):
-        # 处理传感器数据的逻辑
-        # 例如：更新数据库中的设备状态和传感器值
-        from app import create_app
-        app = create_app()
-        with app.app_context():
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            print(f"无法解析JSON数据: {msg.topic}")
+            return
+        if isinstance(sensor_data, dict):
+            self.submit(sensor_data)
+
+    def _ensure_app(self):
+        """首次使用时创建（或沿用传入的）Flask应用并建表，之后一直复用"""
+        with self._lock:
+            if self._models is not None:
+                return
+            if self.app is None:
+                from app import create_app
+                self.app = create_app()
             from models import define_models
-            User, Device = define_models(app.db)
-            
-            device = Device.query.filter_by(name=data.get('device_id')).first()
-            if device:
-                device.sensor_data = json.dumps(data)
+            define_models(self.app.db)
+            with self.app.app_context():
+                self.app.db.create_all()
+            self._models = self.app.db.iot_models
+
+    def start_writer(self):
+        """启动写入线程"""
+        self._ensure_app()
+        with self._lock:
+            if self._writer and self._writer.is_alive():
+                return
+            self._stop_event.clear()
+            self._writer = threading.Thread(target=self._run, name="flask-mqtt-writer", daemon=True)
+            self._writer.start()
+
+    def stop_writer(self, timeout=10.0):
+        """停止写入线程，停止前写完队列中已有的消息"""
+        self._stop_event.set()
+        if self._writer:
+            self._writer.join(timeout)
+            self._writer = None
+
+    def submit(self, data, timeout=5.0):
+        """把一条传感器数据放入写入队列，队列满且超时则丢弃"""
+        if not self._writer:
+            self.start_writer()
+        self.stats['received'] += 1
+        try:
+            self._queue.put(data, timeout=timeout)
+            return True
+        except queue.Full:
+            self.stats['dropped'] += 1
+            print("写入队列已满，丢弃消息")
+            return False
+
+    def flush(self, timeout=None):
+        """等待队列中所有消息写入完成"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def _next_batch(self):
+        batch = []
+        try:
+            batch.append(self._queue.get(timeout=self.flush_interval))
+        except queue.Empty:
+            return batch
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        # 写入线程整个生命周期只推入一次应用上下文
+        with self.app.app_context():
+            while not self._stop_event.is_set() or not self._queue.empty():
+                batch = self._next_batch()
+                if not batch:
+                    continue
+                try:
+                    self.write_batch(batch)
+                finally:
+                    for _ in batch:
+                        self._queue.task_done()
+
+    def process_sensor_data(self, data):
+        """同步写入一条传感器数据"""
+        self._ensure_app()
+        with self.app.app_context():
+            self.write_batch([data])
+
+    def write_batch(self, batch):
+        """在一个事务中写入一批传感器数据（需在应用上下文中调用）：
+        一次查询取出涉及的设备，缺少的设备自动创建，读数批量插入"""
+        session = self.app.db.session
+        Device = self._models['Device']
+        SensorReading = self._models['SensorReading']
+        now = datetime.utcnow()
+        try:
+            latest = {}
+            for data in batch:
+                latest[str(data.get('device_id') or 'Unknown')] = data
+            devices = {device.name: device
+                       for device in Device.query.filter(Device.name.in_(list(latest))).all()}
+            for name, data in latest.items():
+                device = devices.get(name)
+                if device is None:
+                    # 如果设备不存在，创建新设备
+                    device = Device(name=name, status='在线', location=data.get('location', 'Unknown'))
+                    session.add(device)
+                    devices[name] = device
                 device.status = '在线'
-            else:
-                # 如果设备不存在，创建新设备
-                device = Device(
-                    name=data.get('device_id', 'Unknown'),
-                    status='在线',
-                    location=data.get('location', 'Unknown'),
-                    sensor_data=json.dumps(data)
-                )
-                app.db.session.add(device)
-            
-            app.db.session.commit()
+                device.last_seen = now
+            session.flush()  # 获取新设备的ID
+
+            readings = []
+            for data in batch:
+                device_id = devices[str(data.get('device_id') or 'Unknown')].id
+                timestamp = _reading_time(data.get('timestamp'), now)
+                for key, value in data.items():
+                    if key in META_KEYS or isinstance(value, bool) or not isinstance(value, (int, float)):
+                        continue
+                    readings.append({'device_id': device_id, 'type': key, 'value': float(value),
+                                     'timestamp': timestamp})
+            if readings:
+                session.execute(insert(SensorReading), readings)
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            self.stats['failed'] += len(batch)
+            print(f"写入传感器数据失败（{len(batch)} 条）: {e}")
+            return False
+        self.stats['written'] += len(batch)
+        self.stats['readings'] += len(readings)
+        self.stats['batches'] += 1
+        return True
     
     def connect(self):
         try:
@@ -71,6 +206,7 @@ class MQTTHandler:
     
     def stop_loop(self):
         self.client.loop_stop()
+        self.stop_writer()
     
     def publish_message(self, topic, message):
         self.client.publish(topic, message)
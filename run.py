@@ -38,7 +38,7 @@ if __name__ == '__main__':
         
         # 初始化MQTT客户端
         from mqtt_client import MQTTHandler, SensorDataSimulator
-        mqtt_handler = MQTTHandler()
+        mqtt_handler = MQTTHandler(app=app)
         
         # 尝试连接MQTT代理
         if mqtt_handler.connect():
@@ -0,0 +1,241 @@
+import collections
+import queue
+import threading
+import time
+from typing import Callable, Dict, Optional
+import os
+
+# 过载策略：队列满时如何处理新消息
+POLICY_BLOCK = "block"              # 阻塞等待空位（把压力传导回broker）
+POLICY_DROP_OLDEST = "drop_oldest"  # 丢弃队列中最旧的消息
+POLICY_KEEP_LATEST = "keep_latest"  # 同一设备只保留最新一条，无同设备消息时丢弃最旧的
+POLICY_SAMPLE = "sample"            # 超过高水位后每个设备每N条保留1条，满时丢弃新消息
+OVERLOAD_POLICIES = (POLICY_BLOCK, POLICY_DROP_OLDEST, POLICY_KEEP_LATEST, POLICY_SAMPLE)
+
+OVERLOAD_POLICY = os.getenv("INGEST_OVERLOAD_POLICY", POLICY_KEEP_LATEST)
+# 每个设备的令牌桶：平均速率（条/秒，默认0即不限速，需要时显式开启）和突发容量
+DEVICE_RATE = float(os.getenv("INGEST_DEVICE_RATE", "0"))
+DEVICE_BURST = float(os.getenv("INGEST_DEVICE_BURST", "50"))
+# sample策略：队列超过高水位（容量比例）后每个设备每N条保留1条
+SAMPLE_EVERY = int(os.getenv("INGEST_SAMPLE_EVERY", "10"))
+SAMPLE_HIGH_WATERMARK = 0.8
+# 令牌桶数量上限，超过时清理空闲的桶，防止随机主题耗尽内存
+MAX_BUCKETS = 100000
+
+
+def device_key(topic: str) -> str:
+    """设备键（限流、丢弃统计、分片路由和主题别名）：主题前两级，如 stm32/1、sensors/dev1"""
+    parts = topic.split("/", 2)
+    return "/".join(parts[:2])
+
+
+def swap_contents(queued, incoming):
+    """keep_latest合并：把新消息的全部字段（含回调、链路追踪和补录时间戳）写入队列中的旧消息，
+    incoming变为被替换下来的旧内容"""
+    for name in type(queued).__slots__:
+        old = getattr(queued, name)
+        setattr(queued, name, getattr(incoming, name))
+        setattr(incoming, name, old)
+    return incoming
+
+
+class TokenBucket:
+    """令牌桶：按rate匀速补充令牌，最多积累burst个"""
+
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, burst: float, now: float):
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, rate: float, burst: float, now: float) -> bool:
+        self.tokens = min(burst, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return True
+        return False
+
+
+class AdmissionQueue:
+    """写入管道前的准入队列
+
+    每个设备先经过令牌桶限速（可选），超速的消息直接丢弃；
+    通过限速的消息进入有界全局队列，队列满时按过载策略处理。
+    keep_latest只合并完整主题相同的消息：同一设备前缀下不同主题（如 site/dev/temp 与 site/dev/hum）
+    是不同的读数，不能互相替换。
+    被丢弃的消息立即调用 on_committed 确认，避免broker反复重发。
+    提供写入线程使用的 queue.Queue 子集接口（get/get_nowait/task_done/qsize/empty）。
+    """
+
+    def __init__(self, maxsize: int = 10000, policy: str = OVERLOAD_POLICY,
+                 rate: float = DEVICE_RATE, burst: float = DEVICE_BURST,
+                 sample_every: int = SAMPLE_EVERY, key_func: Callable[[str], str] = device_key):
+        if policy not in OVERLOAD_POLICIES:
+            raise ValueError(f"未知的过载策略: {policy}，可选 {OVERLOAD_POLICIES}")
+        self.maxsize = maxsize
+        self.policy = policy
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.sample_every = max(1, sample_every)
+        self.key_func = key_func
+        self._items = collections.deque()
+        # keep_latest策略下每个主题在队列中最新的消息
+        self._latest: Dict[str, object] = {}
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._sample_counters: Dict[str, int] = collections.defaultdict(int)
+        self._shed_by_key: Dict[str, int] = collections.defaultdict(int)
+        self._mutex = threading.Lock()
+        self._not_empty = threading.Condition(self._mutex)
+        self._not_full = threading.Condition(self._mutex)
+        self.unfinished_tasks = 0
+        self.stats = {
+            "admitted": 0,
+            "rate_limited": 0,
+            "dropped_oldest": 0,
+            "coalesced": 0,
+            "sampled_out": 0,
+            "rejected_full": 0,
+        }
+
+    # ---- 生产者 ----
+
+    def _allow_rate(self, key: str, now: float) -> bool:
+        if self.rate <= 0:
+            return True
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= MAX_BUCKETS:
+                self._prune_buckets(now)
+            bucket = self._buckets[key] = TokenBucket(self.burst, now)
+        return bucket.take(self.rate, self.burst, now)
+
+    def _prune_buckets(self, now: float):
+        """删除已经补满令牌的桶，它们与新建的桶等价"""
+        refill = self.burst / self.rate
+        for key in [key for key, bucket in self._buckets.items() if now - bucket.updated >= refill]:
+            del self._buckets[key]
+
+    def _shed(self, key: str, reason: str):
+        self.stats[reason] += 1
+        self._shed_by_key[key] += 1
+
+    def _append(self, message, coalesce: bool = True):
+        self._items.append(message)
+        if coalesce and self.policy == POLICY_KEEP_LATEST:
+            self._latest[message.topic] = message
+        self.unfinished_tasks += 1
+        self.stats["admitted"] += 1
+        self._not_empty.notify()
+
+    def _pop_oldest(self):
+        message = self._items.popleft()
+        if self._latest.get(message.topic) is message:
+            del self._latest[message.topic]
+        return message
+
+    def _wait_for_space(self, now: float, timeout: Optional[float]):
+        deadline = None if timeout is None else now + timeout
+        while len(self._items) >= self.maxsize:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                raise queue.Full
+            self._not_full.wait(remaining)
+
+    def put(self, message, timeout: Optional[float] = None, reliable: bool = False) -> bool:
+        """提交消息，返回是否被接收（合并到同主题的排队消息也算接收）；
+        block策略下队列满且超时会抛出 queue.Full。
+        reliable为True时（HTTP批量采集）不限速、不丢弃也不参与合并，队列满时阻塞等待，超时抛出 queue.Full"""
+        key = self.key_func(message.topic)
+        now = time.monotonic()
+        dropped = None
+        admitted = True
+        with self._mutex:
+            if reliable:
+                self._wait_for_space(now, timeout)
+                self._append(message, coalesce=False)
+            elif not self._allow_rate(key, now):
+                self._shed(key, "rate_limited")
+                dropped, admitted = message, False
+            elif (self.policy == POLICY_KEEP_LATEST and message.topic in self._latest
+                  and len(self._items) >= self.maxsize):
+                # 用新读数替换队列中同一主题的旧读数，位置不变
+                queued = self._latest[message.topic]
+                dropped = swap_contents(queued, message)
+                self._shed(key, "coalesced")
+            elif self.policy == POLICY_SAMPLE and len(self._items) >= self.maxsize * SAMPLE_HIGH_WATERMARK:
+                self._sample_counters[key] += 1
+                if len(self._items) >= self.maxsize:
+                    self._shed(key, "rejected_full")
+                    dropped, admitted = message, False
+                elif self._sample_counters[key] % self.sample_every:
+                    self._shed(key, "sampled_out")
+                    dropped, admitted = message, False
+                else:
+                    self._append(message)
+            elif len(self._items) >= self.maxsize and self.policy != POLICY_BLOCK:
+                dropped = self._pop_oldest()
+                self.unfinished_tasks -= 1
+                self._shed(self.key_func(dropped.topic), "dropped_oldest")
+                self._append(message)
+            else:
+                if self.policy == POLICY_BLOCK:
+                    self._wait_for_space(now, timeout)
+                self._append(message)
+
+        if dropped is not None and dropped.on_committed:
+            try:
+                dropped.on_committed()
+            except Exception as e:
+                print(f"丢弃消息的确认失败: {e}")
+        return admitted
+
+    # ---- 消费者（写入线程） ----
+
+    def get(self, timeout: Optional[float] = None):
+        with self._not_empty:
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while not self._items:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise queue.Empty
+                self._not_empty.wait(remaining)
+            message = self._pop_oldest()
+            self._not_full.notify()
+            return message
+
+    def get_nowait(self):
+        with self._mutex:
+            if not self._items:
+                raise queue.Empty
+            message = self._pop_oldest()
+            self._not_full.notify()
+            return message
+
+    def task_done(self):
+        with self._mutex:
+            self.unfinished_tasks -= 1
+
+    def qsize(self) -> int:
+        return len(self._items)
+
+    def empty(self) -> bool:
+        return not self._items
+
+    @property
+    def shed_total(self) -> int:
+        return sum(value for name, value in self.stats.items() if name != "admitted")
+
+    def status(self, top: int = 10) -> dict:
+        with self._mutex:
+            top_keys = sorted(self._shed_by_key.items(), key=lambda item: item[1], reverse=True)[:top]
+            return {
+                "policy": self.policy,
+                "device_rate": self.rate,
+                "device_burst": self.burst,
+                "max_queue": self.maxsize,
+                "queue_size": len(self._items),
+                "stats": dict(self.stats, shed_total=self.shed_total),
+                "top_shed_devices": dict(top_keys),
+            }
+
@@ -0,0 +1,206 @@
+from datetime import datetime, timezone
+from typing import List, Optional, Sequence, Tuple
+import sys
+import os
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+# 修复相对导入问题
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+if parent_dir not in sys.path:
+    sys.path.append(parent_dir)
+
+from src.models import SensorBlockModel, SensorHistoryModel
+from src.block_codec import decode_block
+from src.block_store import HISTORY_BACKEND, from_epoch_ms, to_epoch_ms
+from src.db_operations import fan_out, get_device_shards
+
+# 移动平均序列最多返回的点数（按步长抽取）
+MAX_SERIES_POINTS = 500
+
+# SQLite中把DateTime文本直接换算为Unix毫秒，避免逐行构造datetime对象
+EPOCH_MS_SQL = "CAST(ROUND((julianday({column}) - 2440587.5) * 86400000) AS INTEGER)"
+
+# 历史行的公共过滤条件
+HISTORY_FILTER_SQL = """
+    WHERE device_id = :device_id AND type = :sensor_type
+      AND (:start IS NULL OR timestamp >= :start)
+      AND (:end IS NULL OR timestamp <= :end)
+"""
+
+_ROWS_SQL = f"""
+    SELECT {EPOCH_MS_SQL.format(column="timestamp")} AS ts, value
+    FROM sensor_history
+    {HISTORY_FILTER_SQL}
+    ORDER BY timestamp
+"""
+
+
+def _db_time(value: Optional[datetime]) -> Optional[str]:
+    """与SQLAlchemy在SQLite中存储DateTime的文本格式一致，保证按字符串比较正确；
+    带时区的时间先换算为UTC（库中存的是naive UTC，与块存储的 to_epoch_ms 一致）"""
+    if value is None:
+        return None
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.strftime("%Y-%m-%d %H:%M:%S.%f")
+
+
+def history_params(device_id: int, sensor_type: str,
+                   start: Optional[datetime], end: Optional[datetime]) -> dict:
+    return {
+        "device_id": device_id,
+        "sensor_type": sensor_type,
+        "start": _db_time(start),
+        "end": _db_time(end),
+    }
+
+
+def fetch_raw(db: Session, sql: str, params: dict) -> list:
+    """直接使用DBAPI游标取元组，百万行时比构造SQLAlchemy Row对象快一倍（查询sensor_history，分片会话中取分片库的连接）"""
+    cursor = db.connection(bind_arguments={"mapper": SensorHistoryModel}).connection.cursor()
+    try:
+        return cursor.execute(sql, params).fetchall()
+    finally:
+        cursor.close()
+
+
+def _load_rows(db: Session, device_id: int, sensor_type: str,
+               start: Optional[datetime], end: Optional[datetime]) -> Tuple[np.ndarray, np.ndarray]:
+    rows = fetch_raw(db, _ROWS_SQL, history_params(device_id, sensor_type, start, end))
+    ts = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+    values = np.fromiter((row[1] for row in rows), dtype=np.float64, count=len(rows))
+    return ts, values
+
+
+def _load_blocks(db: Session, device_id: int, sensor_type: str,
+                 start: Optional[datetime], end: Optional[datetime]) -> Tuple[np.ndarray, np.ndarray]:
+    query = db.query(SensorBlockModel.data).filter(
+        SensorBlockModel.device_id == device_id, SensorBlockModel.type == sensor_type
+    )
+    start_ms = to_epoch_ms(start) if start else None
+    end_ms = to_epoch_ms(end) if end else None
+    if start_ms is not None:
+        query = query.filter(SensorBlockModel.end_ts >= start_ms)
+    if end_ms is not None:
+        query = query.filter(SensorBlockModel.start_ts <= end_ms)
+
+    ts_parts: List[np.ndarray] = []
+    value_parts: List[np.ndarray] = []
+    for (data,) in query.order_by(SensorBlockModel.start_ts):
+        timestamps, values = decode_block(data)
+        ts_parts.append(np.array(timestamps, dtype=np.int64))
+        value_parts.append(np.array(values, dtype=np.float64))
+    if not ts_parts:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+    ts = np.concatenate(ts_parts)
+    values = np.concatenate(value_parts)
+    mask = np.ones(len(ts), dtype=bool)
+    if start_ms is not None:
+        mask &= ts >= start_ms
+    if end_ms is not None:
+        mask &= ts <= end_ms
+    return ts[mask], values[mask]
+
+
+def merge_series(parts: List[Tuple[np.ndarray, np.ndarray]]) -> Tuple[np.ndarray, np.ndarray]:
+    """合并各分片按时间排序的序列"""
+    if len(parts) == 1:
+        return parts[0]
+    ts = np.concatenate([part[0] for part in parts])
+    values = np.concatenate([part[1] for part in parts])
+    order = np.argsort(ts, kind="stable")
+    return ts[order], values[order]
+
+
+def load_series(db: Session, device_id: int, sensor_type: str,
+                start: Optional[datetime] = None, end: Optional[datetime] = None,
+                shards: Optional[List[int]] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """从历史存储加载一个序列，返回 (Unix毫秒时间戳, 数值) 两个按时间排序的数组
+
+    分片时合并设备所在的各个分片（包括分片前写在主库中的数据）。
+    """
+    loader = _load_blocks if HISTORY_BACKEND == "blocks" else _load_rows
+    if shards is None:
+        shards = get_device_shards(db, device_id)
+    return merge_series(fan_out(db, shards, lambda session: [loader(session, device_id, sensor_type, start, end)]))
+
+
+def moving_average(ts: np.ndarray, values: np.ndarray, window_s: float) -> np.ndarray:
+    """时间窗口移动平均：每个点取 (t - window, t] 内所有点的均值"""
+    cumulative = np.concatenate(([0.0], np.cumsum(values)))
+    window_start = np.searchsorted(ts, ts - int(window_s * 1000), side="right")
+    index = np.arange(1, len(values) + 1)
+    return (cumulative[index] - cumulative[window_start]) / (index - window_start)
+
+
+def compute_stats(ts: np.ndarray, values: np.ndarray, percentiles: Sequence[float] = (50, 90, 95, 99),
+                  window_s: float = 300, threshold: Optional[float] = None,
+                  max_points: int = MAX_SERIES_POINTS) -> dict:
+    """向量化计算一个序列的统计量
+
+    历史数据经死区过滤，两点之间的值按前一点保持，
+    因此时间加权均值和超阈值时长都按前一点保持计算（最后一个点不计时长）。
+    """
+    count = len(values)
+    result = {"count": int(count)}
+    if count == 0:
+        return result
+
+    durations = np.diff(ts) / 1000.0
+    result.update({
+        "start": from_epoch_ms(int(ts[0])).isoformat(),
+        "end": from_epoch_ms(int(ts[-1])).isoformat(),
+        "mean": float(values.mean()),
+        "min": float(values.min()),
+        "max": float(values.max()),
+        "std": float(values.std()),
+        "percentiles": {
+            f"p{p:g}": float(v) for p, v in zip(percentiles, np.percentile(values, percentiles))
+        } if percentiles else {},
+    })
+
+    span = float(durations.sum())
+    result["time_weighted_mean"] = float((values[:-1] * durations).sum() / span) if span > 0 else float(values[0])
+
+    # 变化率（单位/秒），忽略时间戳相同的点
+    if count > 1:
+        valid = durations > 0
+        rates = np.diff(values)[valid] / durations[valid]
+        if len(rates):
+            result["rate_of_change"] = {
+                "mean": float(rates.mean()),
+                "min": float(rates.min()),
+                "max": float(rates.max()),
+                "max_abs": float(np.abs(rates).max()),
+            }
+
+    averages = moving_average(ts, values, window_s)
+    step = max(1, -(-count // max_points))
+    result["moving_average"] = {
+        "window_s": window_s,
+        "timestamps": [from_epoch_ms(int(t)).isoformat() for t in ts[::step]],
+        "values": averages[::step].round(4).tolist(),
+        "last": float(averages[-1]),
+    }
+
+    if threshold is not None:
+        above = float(durations[values[:-1] > threshold].sum())
+        result["time_above_threshold"] = {
+            "threshold": threshold,
+            "seconds": above,
+            "ratio": above / span if span > 0 else float(values[0] > threshold),
+        }
+    return result
+
+
+def device_stats(db: Session, device_ids: Sequence[int], sensor_type: str,
+                 start: Optional[datetime] = None, end: Optional[datetime] = None, **options) -> List[dict]:
+    """计算多个设备同一类型的统计量，便于对比"""
+    results = []
+    for device_id in device_ids:
+        ts, values = load_series(db, device_id, sensor_type, start, end)
+        results.append(dict(device_id=device_id, type=sensor_type, **compute_stats(ts, values, **options)))
+    return results
@@ -0,0 +1,220 @@
+import json
+import math
+import threading
+from typing import Dict, List, Optional, Tuple
+import os
+
+# 是否在写入管道中启用流式异常检测
+ANOMALY_DETECTION = os.getenv("ANOMALY_DETECTION", "1") != "0"
+# EWMA平滑系数，越小对历史越敏感
+ANOMALY_ALPHA = float(os.getenv("ANOMALY_ALPHA", "0.05"))
+# 偏离EWMA均值超过多少个标准差视为突变
+ANOMALY_Z_THRESHOLD = float(os.getenv("ANOMALY_Z_THRESHOLD", "6"))
+# 前多少条读数只用于学习均值和方差
+ANOMALY_WARMUP = int(os.getenv("ANOMALY_WARMUP", "30"))
+# 标准差下限，避免0.1分辨率的稳定信号因方差接近0而频繁误报
+ANOMALY_MIN_STD = float(os.getenv("ANOMALY_MIN_STD", "0.1"))
+# 连续多少条完全相同的读数视为传感器卡死（仅对连续量类型检测）
+ANOMALY_STUCK_LIMIT = int(os.getenv("ANOMALY_STUCK_LIMIT", "60"))
+ANOMALY_STUCK_TYPES = [t.strip() for t in os.getenv("ANOMALY_STUCK_TYPES", "Temperature,Humidity").split(",") if t.strip()]
+# 各类型允许的最大变化率（单位/秒），按类型包含关系匹配
+ANOMALY_MAX_RATE = os.getenv("ANOMALY_MAX_RATE", '{"Temperature": 1.0, "Humidity": 5.0}')
+# 同一序列突变/变化率事件的最小间隔（秒）
+ANOMALY_COOLDOWN = float(os.getenv("ANOMALY_COOLDOWN", "60"))
+
+ANOMALY_SPIKE = "spike"
+ANOMALY_STUCK = "stuck"
+ANOMALY_RATE = "rate_of_change"
+
+
+class SeriesState:
+    """单个 (设备, 类型) 的检测状态，连同字典键约230字节"""
+
+    __slots__ = ("mean", "var", "count", "last_value", "last_ts", "stuck_count", "stuck_flagged", "last_event_ts")
+
+    def __init__(self, value: float, ts: float):
+        self.mean = value
+        self.var = 0.0
+        self.count = 1
+        self.last_value = value
+        self.last_ts = ts
+        self.stuck_count = 1
+        self.stuck_flagged = False
+        self.last_event_ts = -math.inf
+
+    def copy(self) -> "SeriesState":
+        state = SeriesState.__new__(SeriesState)
+        for name in SeriesState.__slots__:
+            setattr(state, name, getattr(self, name))
+        return state
+
+
+class SeriesRule:
+    """按类型解析出的检测参数，同一类型的所有序列共享"""
+
+    __slots__ = ("check_stuck", "max_rate")
+
+    def __init__(self, check_stuck: bool, max_rate: Optional[float]):
+        self.check_stuck = check_stuck
+        self.max_rate = max_rate
+
+
+class AnomalyDetector:
+    """流式异常检测
+
+    每条读数O(1)更新EWMA均值/方差并检查三类异常：
+    - spike: 偏离EWMA均值超过 z 个标准差
+    - stuck: 连续 ANOMALY_STUCK_LIMIT 条读数完全相同（如湿度卡在16.10%）
+    - rate_of_change: 相邻读数的变化率超过该类型的上限
+    返回需要记录的异常事件；卡死只在进入卡死状态时报告一次，其余两类受冷却时间限制。
+    与死区过滤一样，状态变化先暂存到本批次，committed() 后生效，rolled_back() 时丢弃，
+    重试的批次不会把读数重复计入EWMA，也不会因卡死标记已置位而漏记事件。
+    单条消息的保存点回滚时 message_rolled_back() 恢复这条消息之前的暂存状态。
+    """
+
+    def __init__(self, alpha: float = ANOMALY_ALPHA, z_threshold: float = ANOMALY_Z_THRESHOLD,
+                 warmup: int = ANOMALY_WARMUP, min_std: float = ANOMALY_MIN_STD,
+                 stuck_limit: int = ANOMALY_STUCK_LIMIT, stuck_types: Optional[List[str]] = None,
+                 max_rates: Optional[Dict[str, float]] = None, cooldown: float = ANOMALY_COOLDOWN):
+        self.alpha = alpha
+        self.z_threshold = z_threshold
+        self.warmup = warmup
+        self.min_std = min_std
+        self.stuck_limit = stuck_limit
+        self.stuck_types = ANOMALY_STUCK_TYPES if stuck_types is None else stuck_types
+        self.max_rates = json.loads(ANOMALY_MAX_RATE) if max_rates is None else max_rates
+        self.cooldown = cooldown
+        self._series: Dict[Tuple[int, str], SeriesState] = {}
+        # 本批次暂存的序列状态（首次改动时从已提交状态复制）和计数
+        self._pending: Dict[Tuple[int, str], SeriesState] = {}
+        self._pending_stats = {"observed": 0, ANOMALY_SPIKE: 0, ANOMALY_STUCK: 0, ANOMALY_RATE: 0}
+        # 当前消息改动前的暂存状态副本（None表示原来没有暂存）和消息开始时的计数
+        self._message_undo: Dict[Tuple[int, str], Optional[SeriesState]] = {}
+        self._message_stats = dict(self._pending_stats)
+        self._rules: Dict[str, SeriesRule] = {}
+        self._lock = threading.Lock()
+        self.stats = {"observed": 0, ANOMALY_SPIKE: 0, ANOMALY_STUCK: 0, ANOMALY_RATE: 0}
+
+    def _rule(self, sensor_type: str) -> SeriesRule:
+        rule = self._rules.get(sensor_type)
+        if rule is None:
+            max_rate = next((rate for name, rate in self.max_rates.items() if name in sensor_type), None)
+            rule = self._rules[sensor_type] = SeriesRule(
+                any(name in sensor_type for name in self.stuck_types), max_rate
+            )
+        return rule
+
+    def observe(self, device_id: int, sensor_type: str, value, ts: float) -> List[dict]:
+        """处理一条读数（ts为Unix秒），返回检测到的异常事件"""
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            return []
+        key = (device_id, sensor_type)
+        events: List[dict] = []
+        with self._lock:
+            self._pending_stats["observed"] += 1
+            state = self._pending.get(key)
+            if key not in self._message_undo:
+                self._message_undo[key] = state.copy() if state is not None else None
+            if state is None:
+                committed = self._series.get(key)
+                if committed is None:
+                    self._pending[key] = SeriesState(value, ts)
+                    return events
+                state = self._pending[key] = committed.copy()
+            rule = self._rule(sensor_type)
+
+            # 卡死：完全相同的值连续出现
+            if value == state.last_value:
+                state.stuck_count += 1
+                if rule.check_stuck and not state.stuck_flagged and state.stuck_count >= self.stuck_limit:
+                    state.stuck_flagged = True
+                    events.append(self._event(ANOMALY_STUCK, device_id, sensor_type, value, state.mean,
+                                              float(state.stuck_count), ts))
+            else:
+                state.stuck_count = 1
+                state.stuck_flagged = False
+
+            cooled = ts - state.last_event_ts >= self.cooldown
+
+            # 变化率：同一时刻的重复读数不参与
+            elapsed = ts - state.last_ts
+            if rule.max_rate is not None and elapsed > 0 and cooled:
+                rate = abs(value - state.last_value) / elapsed
+                if rate > rule.max_rate:
+                    events.append(self._event(ANOMALY_RATE, device_id, sensor_type, value, state.last_value, rate, ts))
+                    state.last_event_ts = ts
+
+            # 突变：与更新前的EWMA比较
+            diff = value - state.mean
+            if state.count >= self.warmup and cooled:
+                score = abs(diff) / max(math.sqrt(state.var), self.min_std)
+                if score > self.z_threshold:
+                    events.append(self._event(ANOMALY_SPIKE, device_id, sensor_type, value, state.mean, score, ts))
+                    state.last_event_ts = ts
+
+            increment = self.alpha * diff
+            state.mean += increment
+            state.var = (1 - self.alpha) * (state.var + diff * increment)
+            state.count += 1
+            state.last_value = value
+            state.last_ts = ts
+            for event in events:
+                self._pending_stats[event["kind"]] += 1
+        return events
+
+    def begin_message(self):
+        """一条消息的保存点开始前调用"""
+        with self._lock:
+            self._message_undo.clear()
+            self._message_stats.update(self._pending_stats)
+
+    def message_rolled_back(self):
+        """消息的保存点回滚：恢复这条消息之前的暂存状态，回滚的读数不计入EWMA"""
+        with self._lock:
+            for key, state in self._message_undo.items():
+                if state is None:
+                    self._pending.pop(key, None)
+                else:
+                    self._pending[key] = state
+            self._message_undo.clear()
+            self._pending_stats.update(self._message_stats)
+
+    def committed(self):
+        """批次提交后应用暂存的状态"""
+        with self._lock:
+            self._series.update(self._pending)
+            self._pending.clear()
+            self._message_undo.clear()
+            for name, count in self._pending_stats.items():
+                self.stats[name] += count
+                self._pending_stats[name] = 0
+
+    def rolled_back(self):
+        """批次回滚：丢弃暂存的状态"""
+        with self._lock:
+            self._pending.clear()
+            self._message_undo.clear()
+            for name in self._pending_stats:
+                self._pending_stats[name] = 0
+
+    @staticmethod
+    def _event(kind: str, device_id: int, sensor_type: str, value: float, expected: float,
+               score: float, ts: float) -> dict:
+        return {
+            "kind": kind,
+            "device_id": device_id,
+            "type": sensor_type,
+            "value": value,
+            "expected": round(expected, 4),
+            "score": round(score, 4),
+            "ts": ts,
+        }
+
+    def status(self) -> dict:
+        """统计包括本批次尚未提交的读数"""
+        with self._lock:
+            stats = {name: count + self._pending_stats[name] for name, count in self.stats.items()}
+            tracked = len(self._series) + sum(1 for key in self._pending if key not in self._series)
+        return dict(stats, tracked_series=tracked)
@@ -0,0 +1,184 @@
+"""
+时间序列块编码
+
+时间戳（毫秒整数）使用二阶差分（delta-of-delta）编码，浮点数使用Gorilla风格的XOR编码：
+    块头: 点数(16位) + 第一个时间戳(64位) + 第一个值(64位原始位)
+    时间戳: dod == 0 写 '0'；否则按范围写 '10'+7位、'110'+9位、'1110'+12位、'1111'+64位
+    数值:   与上一个值XOR为0写 '0'；否则写 '1'，有效位落在上一窗口内时写 '0'+有效位，
+            否则写 '1' + 前导零个数(5位) + 有效位长度(6位，64记为0) + 有效位
+等间隔上报且数值变化不大时，每个点平均只需几个比特。
+"""
+
+import struct
+from typing import List, Sequence, Tuple
+
+_DOUBLE = struct.Struct(">d")
+_UINT64 = struct.Struct(">Q")
+
+# (前缀, 前缀位数, 数值位数)：数值以补码形式存储
+_DOD_BUCKETS = (
+    (0b10, 2, 7),
+    (0b110, 3, 9),
+    (0b1110, 4, 12),
+)
+_DOD_FALLBACK = (0b1111, 4, 64)
+
+
+def float_to_bits(value: float) -> int:
+    return _UINT64.unpack(_DOUBLE.pack(value))[0]
+
+
+def bits_to_float(bits: int) -> float:
+    return _DOUBLE.unpack(_UINT64.pack(bits))[0]
+
+
+class BitWriter:
+    """按位写入，满8位即输出到bytearray"""
+
+    __slots__ = ("buffer", "acc", "acc_bits")
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.acc = 0
+        self.acc_bits = 0
+
+    def write(self, value: int, bits: int):
+        self.acc = (self.acc << bits) | (value & ((1 << bits) - 1))
+        self.acc_bits += bits
+        while self.acc_bits >= 8:
+            self.acc_bits -= 8
+            self.buffer.append((self.acc >> self.acc_bits) & 0xFF)
+        self.acc &= (1 << self.acc_bits) - 1
+
+    def getvalue(self) -> bytes:
+        if self.acc_bits:
+            return bytes(self.buffer) + bytes([(self.acc << (8 - self.acc_bits)) & 0xFF])
+        return bytes(self.buffer)
+
+
+class BitReader:
+    """按位读取"""
+
+    __slots__ = ("data", "pos")
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self.pos = 0
+
+    def read(self, bits: int) -> int:
+        start = self.pos >> 3
+        end = (self.pos + bits + 7) >> 3
+        chunk = int.from_bytes(self.data[start:end], "big")
+        shift = (end << 3) - self.pos - bits
+        self.pos += bits
+        return (chunk >> shift) & ((1 << bits) - 1)
+
+    def read_bit(self) -> int:
+        byte = self.data[self.pos >> 3]
+        bit = (byte >> (7 - (self.pos & 7))) & 1
+        self.pos += 1
+        return bit
+
+
+def _to_signed(value: int, bits: int) -> int:
+    return value - (1 << bits) if value >= 1 << (bits - 1) else value
+
+
+def encode_block(timestamps: Sequence[int], values: Sequence[float]) -> bytes:
+    """把一个序列块编码为字节串，timestamps为递增的毫秒时间戳"""
+    count = len(timestamps)
+    if count != len(values):
+        raise ValueError("时间戳和数值的数量不一致")
+    if count >= 1 << 16:
+        raise ValueError("单个块最多65535个点")
+    writer = BitWriter()
+    writer.write(count, 16)
+    if not count:
+        return writer.getvalue()
+
+    writer.write(timestamps[0], 64)
+    prev_bits = float_to_bits(values[0])
+    writer.write(prev_bits, 64)
+    prev_ts = timestamps[0]
+    prev_delta = 0
+    prev_leading, prev_trailing = 65, 0
+
+    for index in range(1, count):
+        # 时间戳：二阶差分
+        ts = timestamps[index]
+        delta = ts - prev_ts
+        dod = delta - prev_delta
+        prev_ts, prev_delta = ts, delta
+        if dod == 0:
+            writer.write(0, 1)
+        else:
+            for prefix, prefix_bits, value_bits in _DOD_BUCKETS:
+                if -(1 << (value_bits - 1)) <= dod < (1 << (value_bits - 1)):
+                    writer.write(prefix, prefix_bits)
+                    writer.write(dod, value_bits)
+                    break
+            else:
+                prefix, prefix_bits, value_bits = _DOD_FALLBACK
+                writer.write(prefix, prefix_bits)
+                writer.write(dod, value_bits)
+
+        # 数值：与上一个值的XOR
+        bits = float_to_bits(values[index])
+        xor = bits ^ prev_bits
+        prev_bits = bits
+        if xor == 0:
+            writer.write(0, 1)
+            continue
+        leading = min(64 - xor.bit_length(), 31)
+        trailing = (xor & -xor).bit_length() - 1
+        if leading >= prev_leading and trailing >= prev_trailing:
+            writer.write(0b10, 2)
+            writer.write(xor >> prev_trailing, 64 - prev_leading - prev_trailing)
+        else:
+            meaningful = 64 - leading - trailing
+            writer.write(0b11, 2)
+            writer.write(leading, 5)
+            writer.write(meaningful & 0x3F, 6)
+            writer.write(xor >> trailing, meaningful)
+            prev_leading, prev_trailing = leading, trailing
+    return writer.getvalue()
+
+
+def decode_block(data: bytes) -> Tuple[List[int], List[float]]:
+    """解码一个块，返回 (时间戳列表, 数值列表)"""
+    reader = BitReader(data)
+    count = reader.read(16)
+    timestamps: List[int] = []
+    values: List[float] = []
+    if not count:
+        return timestamps, values
+
+    ts = reader.read(64)
+    bits = reader.read(64)
+    timestamps.append(ts)
+    values.append(bits_to_float(bits))
+    delta = 0
+    leading, trailing = 0, 0
+
+    for _ in range(1, count):
+        if reader.read_bit():
+            if not reader.read_bit():
+                value_bits = 7
+            elif not reader.read_bit():
+                value_bits = 9
+            elif not reader.read_bit():
+                value_bits = 12
+            else:
+                value_bits = 64
+            delta += _to_signed(reader.read(value_bits), value_bits)
+        ts += delta
+        timestamps.append(ts)
+
+        if reader.read_bit():
+            if reader.read_bit():
+                leading = reader.read(5)
+                meaningful = reader.read(6) or 64
+                trailing = 64 - leading - meaningful
+            bits ^= reader.read(64 - leading - trailing) << trailing
+        values.append(bits_to_float(bits))
+    return timestamps, values
@@ -0,0 +1,226 @@
+import threading
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+import sys
+import os
+
+from sqlalchemy.orm import Session
+
+# 修复相对导入问题
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+if parent_dir not in sys.path:
+    sys.path.append(parent_dir)
+
+from src.models import SensorBlockModel
+from src.block_codec import decode_block, encode_block
+
+# 历史数据存储方式：rows（sensor_history表，每个点一行）或 blocks（sensor_blocks表，压缩块）
+HISTORY_BACKEND = os.getenv("HISTORY_BACKEND", "rows")
+# 每个块最多包含的点数
+BLOCK_SIZE = int(os.getenv("HISTORY_BLOCK_SIZE", "256"))
+
+
+def to_epoch_ms(value: datetime) -> int:
+    """naive datetime按UTC处理（与入库时的 datetime.utcnow() 一致）"""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp() * 1000)
+
+
+def from_epoch_ms(value: int) -> datetime:
+    return datetime.fromtimestamp(value / 1000, tz=timezone.utc).replace(tzinfo=None)
+
+
+class OpenBlock:
+    """内存中尚未写满的块"""
+
+    __slots__ = ("block_id", "timestamps", "values")
+
+    def __init__(self, block_id: Optional[int] = None, timestamps=None, values=None):
+        self.block_id = block_id
+        self.timestamps: List[int] = timestamps or []
+        self.values: List[float] = values or []
+
+
+def block_columns(block: OpenBlock) -> dict:
+    """块的编码数据和汇总列"""
+    return {
+        "start_ts": min(block.timestamps),
+        "end_ts": max(block.timestamps),
+        "count": len(block.values),
+        "min_value": min(block.values),
+        "max_value": max(block.values),
+        "sum_value": float(sum(block.values)),
+        "data": encode_block(block.timestamps, block.values),
+    }
+
+
+class BlockHistoryStore:
+    """压缩块历史存储（写入端）
+
+    每个 (设备, 类型) 在内存中维护一个未满的块，读数追加到块中；
+    写入管道提交批次前把本批次改动过的块重新编码写入（新块INSERT，已有块UPDATE），
+    块写满后开始新块。批次回滚时丢弃相关的内存块，下次追加时从数据库重新加载；
+    单条消息的保存点回滚时去掉这条消息追加的点，块与逐行写入的历史保持一致。
+    """
+
+    def __init__(self, block_size: int = BLOCK_SIZE):
+        self.block_size = block_size
+        self._open: Dict[Tuple[int, str], OpenBlock] = {}
+        # 本批次改动过的块（包括本批次中写满被替换的块）
+        self._dirty: Dict[int, Tuple[Tuple[int, str], OpenBlock]] = {}
+        # 当前消息改动前各序列的内存块及其点数，以及这条消息新标记为改动的块
+        self._message_undo: Dict[Tuple[int, str], Tuple[Optional[OpenBlock], int]] = {}
+        self._message_dirty: List[int] = []
+        self._message_points = 0
+        self._lock = threading.Lock()
+        self.stats = {"points": 0, "blocks_inserted": 0, "blocks_updated": 0, "bytes_written": 0}
+
+    def _load(self, db: Session, key: Tuple[int, str]) -> OpenBlock:
+        """加载该序列最后一个未写满的块（进程重启后继续追加）"""
+        row = db.query(SensorBlockModel).filter(
+            SensorBlockModel.device_id == key[0], SensorBlockModel.type == key[1]
+        ).order_by(SensorBlockModel.start_ts.desc()).first()
+        if row is not None and row.count < self.block_size:
+            timestamps, values = decode_block(row.data)
+            return OpenBlock(row.id, timestamps, values)
+        return OpenBlock()
+
+    def _remember(self, key: Tuple[int, str]):
+        if key not in self._message_undo:
+            block = self._open.get(key)
+            self._message_undo[key] = (block, len(block.values) if block else 0)
+
+    def append(self, db: Session, device_id: int, sensor_type: str, timestamp: datetime, value):
+        """追加一个点（在提交前调用 flush 写入数据库）"""
+        key = (device_id, sensor_type)
+        with self._lock:
+            self._remember(key)
+            block = self._open.get(key)
+            if block is None:
+                block = self._open[key] = self._load(db, key)
+            if len(block.values) >= self.block_size:
+                block = self._open[key] = OpenBlock()
+            block.timestamps.append(to_epoch_ms(timestamp))
+            block.values.append(float(value))
+            if id(block) not in self._dirty:
+                self._message_dirty.append(id(block))
+            self._dirty[id(block)] = (key, block)
+            self.stats["points"] += 1
+
+    def flush(self, db: Session):
+        """把本批次改动过的块写入当前事务"""
+        with self._lock:
+            for key, block in self._dirty.values():
+                columns = block_columns(block)
+                self.stats["bytes_written"] += len(columns["data"])
+                if block.block_id is None:
+                    row = SensorBlockModel(device_id=key[0], type=key[1], **columns)
+                    db.add(row)
+                    db.flush()
+                    block.block_id = row.id
+                    self.stats["blocks_inserted"] += 1
+                else:
+                    db.query(SensorBlockModel).filter(SensorBlockModel.id == block.block_id).update(
+                        columns, synchronize_session=False
+                    )
+                    self.stats["blocks_updated"] += 1
+
+    def delete_range(self, db: Session, device_id: int, sensor_type: str, start: datetime, end: datetime) -> int:
+        """删除该序列在 [start, end) 内的点（在当前事务中）：整块落在区间内的删除，部分重叠的块去掉区间内的点后重写，
+        返回删除的点数。内存中的未满块随之丢弃，下次追加时重新加载"""
+        key = (device_id, sensor_type)
+        start_ms, end_ms = to_epoch_ms(start), to_epoch_ms(end)
+        deleted = 0
+        with self._lock:
+            self._remember(key)
+            self._open.pop(key, None)
+            rows = db.query(SensorBlockModel).filter(
+                SensorBlockModel.device_id == device_id, SensorBlockModel.type == sensor_type,
+                SensorBlockModel.end_ts >= start_ms, SensorBlockModel.start_ts < end_ms,
+            ).all()
+            for row in rows:
+                timestamps, values = decode_block(row.data)
+                kept = [(ts, value) for ts, value in zip(timestamps, values) if not start_ms <= ts < end_ms]
+                deleted += len(timestamps) - len(kept)
+                if not kept:
+                    db.delete(row)
+                elif len(kept) < len(timestamps):
+                    columns = block_columns(OpenBlock(row.id, [ts for ts, _ in kept], [value for _, value in kept]))
+                    db.query(SensorBlockModel).filter(SensorBlockModel.id == row.id).update(
+                        columns, synchronize_session=False
+                    )
+        return deleted
+
+    def begin_message(self):
+        """一条消息的保存点开始前调用"""
+        with self._lock:
+            self._message_undo.clear()
+            self._message_dirty.clear()
+            self._message_points = self.stats["points"]
+
+    def message_rolled_back(self):
+        """消息的保存点回滚：去掉这条消息追加的点，恢复它替换或丢弃的内存块"""
+        with self._lock:
+            for block_key in self._message_dirty:
+                self._dirty.pop(block_key, None)
+            for key, (block, length) in self._message_undo.items():
+                if block is None:
+                    self._open.pop(key, None)
+                    continue
+                del block.timestamps[length:]
+                del block.values[length:]
+                self._open[key] = block
+            self._message_undo.clear()
+            self._message_dirty.clear()
+            self.stats["points"] = self._message_points
+
+    def committed(self):
+        with self._lock:
+            self._dirty.clear()
+            self._message_undo.clear()
+            self._message_dirty.clear()
+
+    def rolled_back(self):
+        """事务回滚：内存块可能包含未提交的点或无效的块ID，丢弃后重新加载"""
+        with self._lock:
+            for key, _ in self._dirty.values():
+                self._open.pop(key, None)
+            self._dirty.clear()
+            self._message_undo.clear()
+            self._message_dirty.clear()
+
+    def status(self) -> dict:
+        return dict(self.stats, open_series=len(self._open), block_size=self.block_size)
+
+
+def query_block_history(db: Session, device_id: int, sensor_type: Optional[str] = None,
+                        start: Optional[datetime] = None, end: Optional[datetime] = None,
+                        limit: int = 1000) -> List[dict]:
+    """区间查询：通过索引列只取出与区间重叠的块并解码，返回最近的limit个点（按时间升序）"""
+    query = db.query(SensorBlockModel).filter(SensorBlockModel.device_id == device_id)
+    if sensor_type:
+        query = query.filter(SensorBlockModel.type == sensor_type)
+    start_ms = to_epoch_ms(start) if start else None
+    end_ms = to_epoch_ms(end) if end else None
+    if start_ms is not None:
+        query = query.filter(SensorBlockModel.end_ts >= start_ms)
+    if end_ms is not None:
+        query = query.filter(SensorBlockModel.start_ts <= end_ms)
+
+    points: List[Tuple[int, str, float]] = []
+    # 从最新的块往前解码，够limit个点即停止
+    for row in query.order_by(SensorBlockModel.end_ts.desc()).yield_per(64):
+        timestamps, values = decode_block(row.data)
+        for ts, value in zip(timestamps, values):
+            if (start_ms is None or ts >= start_ms) and (end_ms is None or ts <= end_ms):
+                points.append((ts, row.type, value))
+        # 同一序列的块按时间先后追加、互不重叠，更早的块不会再贡献最近的点
+        if sensor_type and len(points) >= limit:
+            break
+    points.sort()
+    return [
+        {"type": sensor_type_, "value": value, "timestamp": from_epoch_ms(ts).isoformat()}
+        for ts, sensor_type_, value in points[-limit:]
+    ]
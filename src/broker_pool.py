@@ -0,0 +1,134 @@
+import threading
+from typing import Dict, Optional, Tuple
+import sys
+import os
+
+from sqlalchemy.orm import Session
+
+# 修复相对导入问题
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+if parent_dir not in sys.path:
+    sys.path.append(parent_dir)
+
+from src.database import SessionLocal
+from src.models import MQTTConfigModel, TopicConfigModel
+from src.config_service import get_active_mqtt_config
+from src.ingest_pipeline import IngestPipeline, ingest_pipeline
+from src.mqtt_service import MQTTService
+from src.subscription_manager import merge_topic_specs, parse_topic_specs
+
+
+class BrokerPool:
+    """多broker采集连接池
+
+    每个被激活主题配置引用的MQTT配置对应一个MQTTService，
+    同一broker上所有激活主题配置的主题合并订阅，所有客户端共享一个写入管道。
+    主题配置未指定MQTT配置时使用当前激活的MQTT配置。
+    """
+
+    def __init__(self, pipeline: Optional[IngestPipeline] = None):
+        self.pipeline = pipeline or ingest_pipeline
+        self.services: Dict[int, MQTTService] = {}
+        # 多worker部署时只有采集领导者允许启动MQTT客户端
+        self.enabled = True
+        self._lock = threading.RLock()
+
+    def load_desired_brokers(self, db: Session) -> Dict[int, Tuple[MQTTConfigModel, Dict[str, int]]]:
+        """根据激活的主题配置计算每个broker应订阅的主题及QoS"""
+        desired: Dict[int, Tuple[MQTTConfigModel, Dict[str, int]]] = {}
+        active_topic_configs = db.query(TopicConfigModel).filter(
+            TopicConfigModel.is_active == True
+        ).order_by(TopicConfigModel.id).all()
+        if not active_topic_configs:
+            return desired
+
+        default_config = get_active_mqtt_config(db)
+        for topic_config in active_topic_configs:
+            broker_id = topic_config.mqtt_config_id or (default_config.id if default_config else None)
+            if broker_id is None:
+                print(f"主题配置 {topic_config.name} 未关联MQTT配置，且没有激活的MQTT配置")
+                continue
+            entry = desired.get(broker_id)
+            if entry is None:
+                mqtt_config = db.query(MQTTConfigModel).filter(MQTTConfigModel.id == broker_id).first()
+                if not mqtt_config:
+                    print(f"未找到ID为 {broker_id} 的MQTT配置")
+                    continue
+                entry = desired[broker_id] = (mqtt_config, {})
+            desired[broker_id] = (entry[0], merge_topic_specs(entry[1], parse_topic_specs(topic_config.subscribe_topics)))
+        return desired
+
+    def sync(self) -> bool:
+        """使运行中的客户端与数据库中的激活配置保持一致，返回是否有客户端在运行"""
+        if not self.enabled:
+            print("当前进程不是MQTT采集领导者，跳过启动")
+            return False
+
+        with self._lock:
+            db = SessionLocal()
+            try:
+                desired = self.load_desired_brokers(db)
+            finally:
+                db.close()
+
+            # 停止不再需要的broker，并取消其订阅
+            for config_id in list(self.services):
+                if config_id not in desired:
+                    print(f"MQTT配置 {config_id} 已无激活的主题配置，停止采集")
+                    self.services.pop(config_id).stop(unsubscribe=True)
+
+            for config_id, (mqtt_config, topics) in desired.items():
+                service = self.services.get(config_id)
+                if service and service.connection_settings_changed(mqtt_config):
+                    print(f"MQTT配置 {config_id} 的连接参数已变化，重建连接")
+                    self.services.pop(config_id).stop()
+                    service = None
+                if service is None:
+                    service = MQTTService(mqtt_config, topics, self.pipeline)
+                    if service.start():
+                        self.services[config_id] = service
+                elif service.configured_topics != topics:
+                    service.update_topics(topics)
+
+            if self.services:
+                self.pipeline.start()
+            return bool(self.services)
+
+    def stop(self, unsubscribe: bool = False):
+        """停止所有客户端，并写完写入管道中已有的消息"""
+        with self._lock:
+            for service in self.services.values():
+                service.stop(unsubscribe=unsubscribe)
+            self.services.clear()
+            self.pipeline.stop()
+
+    def get(self, mqtt_config_id: int) -> Optional[MQTTService]:
+        return self.services.get(mqtt_config_id)
+
+    @property
+    def is_connected(self) -> bool:
+        """所有broker均已连接"""
+        services = list(self.services.values())
+        return bool(services) and all(service.is_connected for service in services)
+
+    def status(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "brokers": [service.status() for service in list(self.services.values())],
+            "pipeline": self.pipeline.status(),
+        }
+
+
+# 创建全局broker连接池实例
+broker_pool = BrokerPool()
+
+
+def start_mqtt_service():
+    """按当前激活配置启动（或同步）MQTT采集"""
+    return broker_pool.sync()
+
+
+def stop_mqtt_service():
+    """停止全部MQTT采集"""
+    broker_pool.stop()
@@ -0,0 +1,373 @@
+import bisect
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+import sys
+import os
+
+from sqlalchemy.orm import Session
+
+# 修复相对导入问题
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+if parent_dir not in sys.path:
+    sys.path.append(parent_dir)
+
+from src.models import DeviceModel, TopicConfigModel
+from src.config_service import get_active_mqtt_config
+from src.broker_pool import BrokerPool, broker_pool
+from src.ingest_pipeline import ingest_pipeline
+
+# 命令名称 -> 设备上报状态时使用的传感器类型，收到匹配的状态上报即视为命令已执行
+COMMAND_ACK_TYPES = {
+    "relay": "Relay Status",
+    "pb8": "PB8 Level",
+}
+
+# 批量命令中，发布主题不含设备占位符时，每条MQTT消息最多携带的设备数
+COMMAND_BATCH_SIZE = int(os.getenv("COMMAND_BATCH_SIZE", "500"))
+
+# 默认确认超时（秒）
+COMMAND_TIMEOUT = float(os.getenv("COMMAND_TIMEOUT", "10"))
+
+# 保留最近完成的命令数，供查询命令状态
+COMMAND_HISTORY_SIZE = 10000
+
+COMMAND_STATUS_SENT = "sent"
+COMMAND_STATUS_PENDING = "pending"
+COMMAND_STATUS_ACKED = "acked"
+COMMAND_STATUS_TIMEOUT = "timeout"
+
+
+class CommandError(Exception):
+    """命令无法下发（设备不存在、未配置发布主题或broker未连接）"""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class LatencyHistogram:
+    """固定桶的延迟直方图（毫秒），按桶上界估算分位数"""
+
+    BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, latency_ms: float):
+        self.counts[bisect.bisect_left(self.BUCKETS_MS, latency_ms)] += 1
+        self.count += 1
+        self.total_ms += latency_ms
+        self.max_ms = max(self.max_ms, latency_ms)
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return float(self.BUCKETS_MS[index]) if index < len(self.BUCKETS_MS) else self.max_ms
+        return self.max_ms
+
+    def snapshot(self) -> dict:
+        buckets = {f"le_{bound}": count for bound, count in zip(self.BUCKETS_MS, self.counts)}
+        buckets["le_inf"] = self.counts[-1]
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total_ms / self.count, 3) if self.count else None,
+            "max_ms": round(self.max_ms, 3),
+            "p50_ms": self.quantile(0.5),
+            "p95_ms": self.quantile(0.95),
+            "p99_ms": self.quantile(0.99),
+            "buckets": buckets,
+        }
+
+
+class PendingCommand:
+    """已下发、等待设备状态上报确认的命令"""
+
+    __slots__ = ("command_id", "device_id", "topic", "ack_type", "expected", "sent_at",
+                 "deadline", "status", "latency_ms", "event")
+
+    def __init__(self, command_id: str, device_id: int, topic: str, ack_type: Optional[str],
+                 expected, timeout: float):
+        self.command_id = command_id
+        self.device_id = device_id
+        self.topic = topic
+        self.ack_type = ack_type
+        self.expected = expected
+        self.sent_at = time.monotonic()
+        self.deadline = self.sent_at + timeout
+        self.status = COMMAND_STATUS_PENDING if ack_type else COMMAND_STATUS_SENT
+        self.latency_ms: Optional[float] = None
+        self.event: Optional[threading.Event] = None
+
+    def matches(self, value) -> bool:
+        if self.expected is None:
+            return True
+        try:
+            return float(value) == float(self.expected)
+        except (TypeError, ValueError):
+            return str(value) == str(self.expected)
+
+    def to_dict(self) -> dict:
+        return {
+            "command_id": self.command_id,
+            "device_id": self.device_id,
+            "topic": self.topic,
+            "status": self.status,
+            "latency_ms": self.latency_ms,
+        }
+
+
+def resolve_command_topic(template: str, device: DeviceModel) -> str:
+    """发布主题支持 {device} / {device_id} 占位符"""
+    return template.replace("{device}", device.name).replace("{device_id}", str(device.id))
+
+
+class CommandService:
+    """设备命令下发
+
+    命令通过设备所属broker的采集客户端发布到主题配置的 publish_topic，
+    载荷携带关联ID。之后该设备上报的状态（如 Relay Status）与期望值一致时视为确认，
+    记录下发到确认的往返延迟。批量命令一次查询出全部设备，按 (broker, 主题) 分组发布：
+    主题不含设备占位符时多个设备合并为一条消息，否则逐设备发布但不再访问数据库。
+    采集客户端、待确认命令和确认匹配都在采集领导者进程的内存中，命令接口只在该进程中可用：
+    单进程（MQTT_INGEST_ROLE=always）部署，或由反向代理把命令接口路由到领导者；其他进程返回503。
+    """
+
+    def __init__(self, pool: Optional[BrokerPool] = None):
+        self.pool = pool or broker_pool
+        self.pending: Dict[int, List[PendingCommand]] = {}
+        self.recent: "OrderedDict[str, PendingCommand]" = OrderedDict()
+        self.latency = LatencyHistogram()
+        self._lock = threading.Lock()
+        self._last_expire = 0.0
+        self.stats = {"sent": 0, "messages": 0, "acked": 0, "timeouts": 0, "batches": 0}
+
+    # ---- 主题与broker解析 ----
+
+    def _load_routes(self, db: Session, devices: Iterable[DeviceModel]) -> Dict[int, Tuple[int, str]]:
+        """返回 {device_id: (broker_id, 发布主题模板)}"""
+        topic_configs = {config.id: config for config in db.query(TopicConfigModel).all()}
+        active_by_broker: Dict[Optional[int], TopicConfigModel] = {}
+        for config in topic_configs.values():
+            if config.is_active and config.publish_topic:
+                active_by_broker.setdefault(config.mqtt_config_id, config)
+        default_mqtt = get_active_mqtt_config(db)
+        default_broker_id = default_mqtt.id if default_mqtt else None
+
+        routes: Dict[int, Tuple[int, str]] = {}
+        for device in devices:
+            topic_config = topic_configs.get(device.topic_config_id)
+            if not topic_config or not topic_config.publish_topic:
+                topic_config = (active_by_broker.get(device.mqtt_config_id)
+                                or active_by_broker.get(None)
+                                or next(iter(active_by_broker.values()), None))
+            if not topic_config:
+                continue
+            broker_id = device.mqtt_config_id or topic_config.mqtt_config_id or default_broker_id
+            if broker_id is None:
+                continue
+            routes[device.id] = (broker_id, topic_config.publish_topic)
+        return routes
+
+    def _require_leader(self):
+        if not self.pool.enabled:
+            raise CommandError("本进程不是采集领导者，命令只能由持有MQTT连接的采集领导者下发", status_code=503)
+
+    def _service_for(self, broker_id: int):
+        service = self.pool.get(broker_id)
+        if not service or not service.client:
+            raise CommandError(f"MQTT配置 {broker_id} 的客户端未在本进程运行", status_code=503)
+        return service
+
+    # ---- 下发 ----
+
+    @staticmethod
+    def _payload(command_id: str, command: str, value, devices: Optional[List[str]] = None,
+                 device: Optional[str] = None) -> str:
+        body = {"id": command_id, "cmd": command, "value": value}
+        if device is not None:
+            body["device"] = device
+        if devices is not None:
+            body["devices"] = devices
+        return json.dumps(body, ensure_ascii=False, separators=(",", ":"))
+
+    def _track(self, commands: List[PendingCommand]):
+        with self._lock:
+            for command in commands:
+                if command.status == COMMAND_STATUS_PENDING:
+                    self.pending.setdefault(command.device_id, []).append(command)
+                self.recent[command.command_id] = command
+            while len(self.recent) > COMMAND_HISTORY_SIZE:
+                self.recent.popitem(last=False)
+            self.stats["sent"] += len(commands)
+
+    def send(self, db: Session, device_id: int, command: str, value=None, qos: int = 1,
+             timeout: float = COMMAND_TIMEOUT, ack_type: Optional[str] = None) -> PendingCommand:
+        """向单个设备下发命令"""
+        self._require_leader()
+        device = db.query(DeviceModel).filter(DeviceModel.id == device_id).first()
+        if not device:
+            raise CommandError("Device not found", status_code=404)
+        route = self._load_routes(db, [device]).get(device.id)
+        if not route:
+            raise CommandError("设备没有可用的发布主题（请在主题配置中设置publish_topic）")
+        broker_id, template = route
+        service = self._service_for(broker_id)
+
+        ack_type = ack_type or COMMAND_ACK_TYPES.get(command)
+        command_id = uuid.uuid4().hex
+        topic = resolve_command_topic(template, device)
+        pending = PendingCommand(command_id, device.id, topic, ack_type, value, timeout)
+        # 先登记再发布，避免设备响应快于登记而错过确认
+        self._track([pending])
+        service.publish(topic, self._payload(command_id, command, value, device=device.name), qos)
+        self.stats["messages"] += 1
+        return pending
+
+    def send_batch(self, db: Session, command: str, value=None, device_ids: Optional[List[int]] = None,
+                   qos: int = 1, timeout: float = COMMAND_TIMEOUT, ack_type: Optional[str] = None) -> dict:
+        """向多个设备（默认全部设备）下发同一命令"""
+        self._require_leader()
+        query = db.query(DeviceModel)
+        if device_ids is not None:
+            query = query.filter(DeviceModel.id.in_(device_ids))
+        devices = query.all()
+        routes = self._load_routes(db, devices)
+        ack_type = ack_type or COMMAND_ACK_TYPES.get(command)
+        batch_id = uuid.uuid4().hex
+
+        # (broker_id, 主题) -> 设备列表；含占位符的主题每个设备单独一组
+        groups: Dict[Tuple[int, str], List[DeviceModel]] = {}
+        skipped: List[int] = []
+        for device in devices:
+            route = routes.get(device.id)
+            if not route:
+                skipped.append(device.id)
+                continue
+            broker_id, template = route
+            groups.setdefault((broker_id, resolve_command_topic(template, device)), []).append(device)
+
+        services = {}
+        for broker_id, _ in groups:
+            if broker_id not in services:
+                services[broker_id] = self._service_for(broker_id)
+
+        started = time.perf_counter()
+        messages = 0
+        tracked: List[PendingCommand] = []
+        for (broker_id, topic), group in groups.items():
+            service = services[broker_id]
+            for offset in range(0, len(group), COMMAND_BATCH_SIZE):
+                chunk = group[offset:offset + COMMAND_BATCH_SIZE]
+                commands = [PendingCommand(f"{batch_id}:{device.id}", device.id, topic, ack_type, value, timeout)
+                            for device in chunk]
+                self._track(commands)
+                tracked.extend(commands)
+                if len(chunk) == 1:
+                    payload = self._payload(commands[0].command_id, command, value, device=chunk[0].name)
+                else:
+                    payload = self._payload(batch_id, command, value, devices=[device.name for device in chunk])
+                service.publish(topic, payload, qos)
+                messages += 1
+
+        self.stats["messages"] += messages
+        self.stats["batches"] += 1
+        return {
+            "batch_id": batch_id,
+            "devices": len(tracked),
+            "messages": messages,
+            "skipped_device_ids": skipped,
+            "publish_ms": round((time.perf_counter() - started) * 1000, 3),
+        }
+
+    # ---- 确认匹配 ----
+
+    def on_reading(self, device_id: int, sensor_type: str, value):
+        """写入管道的读数观察者：设备上报的状态与待确认命令匹配时完成确认"""
+        if device_id not in self.pending:
+            return
+        now = time.monotonic()
+        with self._lock:
+            commands = self.pending.get(device_id)
+            if not commands:
+                return
+            remaining = []
+            for command in commands:
+                if command.ack_type == sensor_type and command.matches(value) and now <= command.deadline:
+                    command.status = COMMAND_STATUS_ACKED
+                    command.latency_ms = round((now - command.sent_at) * 1000, 3)
+                    self.latency.observe(command.latency_ms)
+                    self.stats["acked"] += 1
+                    if command.event:
+                        command.event.set()
+                else:
+                    remaining.append(command)
+            if remaining:
+                self.pending[device_id] = remaining
+            else:
+                del self.pending[device_id]
+        self.expire()
+
+    def expire(self, force: bool = False):
+        """把超过确认期限的命令标记为超时（最多每秒扫描一次）"""
+        now = time.monotonic()
+        if not force and now - self._last_expire < 1.0:
+            return
+        self._last_expire = now
+        with self._lock:
+            for device_id in list(self.pending):
+                remaining = []
+                for command in self.pending[device_id]:
+                    if now > command.deadline:
+                        command.status = COMMAND_STATUS_TIMEOUT
+                        self.stats["timeouts"] += 1
+                        if command.event:
+                            command.event.set()
+                    else:
+                        remaining.append(command)
+                if remaining:
+                    self.pending[device_id] = remaining
+                else:
+                    del self.pending[device_id]
+
+    def wait(self, command: PendingCommand, timeout: Optional[float] = None) -> PendingCommand:
+        """阻塞等待命令确认或超时"""
+        with self._lock:
+            if command.status != COMMAND_STATUS_PENDING:
+                return command
+            command.event = command.event or threading.Event()
+        command.event.wait(max(0.0, command.deadline - time.monotonic()) if timeout is None else timeout)
+        self.expire(force=True)
+        return command
+
+    def get(self, command_id: str) -> Optional[PendingCommand]:
+        self.expire()
+        with self._lock:
+            return self.recent.get(command_id)
+
+    def status(self) -> dict:
+        self.expire(force=True)
+        with self._lock:
+            pending = sum(len(commands) for commands in self.pending.values())
+            return {
+                "stats": dict(self.stats),
+                "pending": pending,
+                "latency": self.latency.snapshot(),
+            }
+
+
+# 创建全局命令服务实例，并订阅写入管道的读数用于确认匹配
+command_service = CommandService()
+ingest_pipeline.add_observer(command_service.on_reading)
@@ -0,0 +1,112 @@
+import random
+import threading
+from typing import Optional
+
+import paho.mqtt.client as mqtt
+
+
+class ReconnectBackoff:
+    """带抖动的指数退避
+
+    第n次重试的基础延迟为 initial * multiplier**n（不超过maximum），
+    实际延迟在 [基础延迟*(1-jitter), 基础延迟] 之间随机，避免大量客户端同时重连。
+    """
+
+    def __init__(self, initial: float = 1.0, maximum: float = 60.0,
+                 multiplier: float = 2.0, jitter: float = 0.5):
+        self.initial = initial
+        self.maximum = maximum
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.attempts = 0
+
+    def next_delay(self) -> float:
+        """返回下一次重试前的等待时间（秒）"""
+        base = min(self.maximum, self.initial * (self.multiplier ** self.attempts))
+        self.attempts += 1
+        return random.uniform(base * (1 - self.jitter), base)
+
+    def reset(self):
+        self.attempts = 0
+
+
+class MQTTConnectionManager:
+    """MQTT连接管理器
+
+    在后台线程中驱动 client.loop()，连接失败或断开后按退避策略重连，
+    broker在启动时不可用或中途重启都能自动恢复。
+    """
+
+    def __init__(self, client: mqtt.Client, host: str, port: int,
+                 keepalive: int = 60, backoff: Optional[ReconnectBackoff] = None):
+        self.client = client
+        self.host = host
+        self.port = port
+        self.keepalive = keepalive
+        self.backoff = backoff or ReconnectBackoff()
+        self.socket_open = False
+        self.connects = 0
+        self.last_error: Optional[str] = None
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def mark_connected(self):
+        """收到CONNACK成功后调用，重置退避计数"""
+        self.backoff.reset()
+        self.last_error = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="mqtt-connection", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stop_event.set()
+        if self.socket_open:
+            try:
+                # DISCONNECT报文由后台线程的loop发出，随后loop返回并退出线程
+                self.client.disconnect()
+            except Exception:
+                pass
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+        self._thread = None
+        self.socket_open = False
+
+    def _wait_before_retry(self):
+        delay = self.backoff.next_delay()
+        print(f"MQTT将在 {delay:.1f} 秒后重连 {self.host}:{self.port}")
+        self._stop_event.wait(delay)
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            if not self.socket_open:
+                try:
+                    self.client.connect(self.host, self.port, self.keepalive)
+                    self.socket_open = True
+                    self.connects += 1
+                except Exception as e:
+                    self.last_error = str(e)
+                    print(f"连接MQTT服务器失败: {e}")
+                    self._wait_before_retry()
+                    continue
+
+            rc = self.client.loop(timeout=1.0)
+            if rc != mqtt.MQTT_ERR_SUCCESS and not self._stop_event.is_set():
+                # 连接丢失或broker拒绝连接，关闭socket后退避重连
+                self.socket_open = False
+                self.last_error = mqtt.error_string(rc)
+                print(f"MQTT连接中断: {self.last_error}")
+                self._wait_before_retry()
+
+    def status(self) -> dict:
+        return {
+            "host": self.host,
+            "port": self.port,
+            "socket_open": self.socket_open,
+            "connects": self.connects,
+            "backoff_attempts": self.backoff.attempts,
+            "last_error": self.last_error,
+        }
@@ -0,0 +1,313 @@
+import json
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+import sys
+import os
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+# 修复相对导入问题
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+if parent_dir not in sys.path:
+    sys.path.append(parent_dir)
+
+from src.database import SessionLocal, shard_count, shard_session_factory
+from src.models import DashboardStateModel, DeviceCounterModel, DeviceModel, SensorDataModel
+
+# 最近这么多秒内有读数的设备视为在线
+DEVICE_ONLINE_SECONDS = int(os.getenv("DEVICE_ONLINE_SECONDS", "300"))
+# 采集进程把汇总快照写入数据库的最小间隔（秒），供其他进程的HTTP worker读取
+DASHBOARD_PERSIST_SECONDS = float(os.getenv("DASHBOARD_PERSIST_SECONDS", "1"))
+# 返回设备数最多的位置数，其余合并为“其他”
+DASHBOARD_TOP_LOCATIONS = int(os.getenv("DASHBOARD_TOP_LOCATIONS", "20"))
+# 在线判断按这么多秒分桶，快照中只保存各桶的设备数
+LIVENESS_BUCKET_SECONDS = 10
+MESSAGE_WINDOW_SECONDS = 60
+ALERT_SEVERITIES = ("warning", "alert")
+_STATE_NAME = "ingest"
+
+# devices表的计数触发器：插入/删除/修改状态或位置时增减 device_counters 中对应的行
+_COUNTER_TRIGGERS = (
+    "CREATE TRIGGER device_counters_insert AFTER INSERT ON devices BEGIN "
+    "INSERT INTO device_counters(dimension, key, count) VALUES ('status', coalesce(new.status, ''), 1) "
+    "ON CONFLICT(dimension, key) DO UPDATE SET count = count + 1; "
+    "INSERT INTO device_counters(dimension, key, count) VALUES ('location', coalesce(new.location, ''), 1) "
+    "ON CONFLICT(dimension, key) DO UPDATE SET count = count + 1; END",
+    "CREATE TRIGGER device_counters_delete AFTER DELETE ON devices BEGIN "
+    "UPDATE device_counters SET count = count - 1 WHERE dimension = 'status' AND key = coalesce(old.status, ''); "
+    "UPDATE device_counters SET count = count - 1 WHERE dimension = 'location' AND key = coalesce(old.location, ''); "
+    "END",
+    "CREATE TRIGGER device_counters_status AFTER UPDATE OF status ON devices "
+    "WHEN old.status IS NOT new.status BEGIN "
+    "UPDATE device_counters SET count = count - 1 WHERE dimension = 'status' AND key = coalesce(old.status, ''); "
+    "INSERT INTO device_counters(dimension, key, count) VALUES ('status', coalesce(new.status, ''), 1) "
+    "ON CONFLICT(dimension, key) DO UPDATE SET count = count + 1; END",
+    "CREATE TRIGGER device_counters_location AFTER UPDATE OF location ON devices "
+    "WHEN old.location IS NOT new.location BEGIN "
+    "UPDATE device_counters SET count = count - 1 WHERE dimension = 'location' AND key = coalesce(old.location, ''); "
+    "INSERT INTO device_counters(dimension, key, count) VALUES ('location', coalesce(new.location, ''), 1) "
+    "ON CONFLICT(dimension, key) DO UPDATE SET count = count + 1; END",
+)
+# 建立触发器时按现有设备重算一次计数（与建触发器在同一事务中）
+_COUNTER_REBUILD = (
+    "DELETE FROM device_counters",
+    "INSERT INTO device_counters(dimension, key, count) "
+    "SELECT 'status', coalesce(status, ''), count(*) FROM devices GROUP BY coalesce(status, '')",
+    "INSERT INTO device_counters(dimension, key, count) "
+    "SELECT 'location', coalesce(location, ''), count(*) FROM devices GROUP BY coalesce(location, '')",
+)
+
+_counters_ready = set()
+
+
+def ensure_device_counters(bind):
+    """建立设备计数表和触发器（已存在时跳过）"""
+    url = str(bind.url)
+    with bind.begin() as conn:
+        DeviceCounterModel.__table__.create(conn, checkfirst=True)
+        DashboardStateModel.__table__.create(conn, checkfirst=True)
+        exists = conn.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'device_counters_insert'")).first()
+        if exists is None:
+            for statement in _COUNTER_REBUILD + _COUNTER_TRIGGERS:
+                conn.execute(text(statement))
+            print("已建立设备计数触发器")
+    _counters_ready.add(url)
+
+
+def _bucket(timestamp: float, size: int) -> int:
+    return int(timestamp // size) * size
+
+
+class DashboardAggregator:
+    """采集侧的仪表盘汇总：每批次提交后按本批读数增量更新，每次更新的开销与设备总数无关
+
+    - 在线设备：按最后读数时间分桶计数（设备换桶时旧桶减一新桶加一），读取时只数未过期的桶
+    - 告警：每个 (设备, 类型) 当前的告警级别及各级别的数量
+    - 消息速率：最近60秒每秒提交的消息数
+    - 各传感器类型最近一次的读数
+    首次更新时从数据库加载已有状态（只在采集进程中发生一次）。
+    多个进程共享同一个快照行，只有 enabled 的进程（采集领导者或 MQTT_INGEST_ROLE=always）
+    汇总并写入快照，其他进程（如非领导者worker中的HTTP采集）的批次不计入，读取时使用数据库快照。
+    """
+
+    def __init__(self, online_seconds: int = DEVICE_ONLINE_SECONDS,
+                 persist_interval: float = DASHBOARD_PERSIST_SECONDS, session_factory=SessionLocal,
+                 enabled: bool = True):
+        self.online_seconds = online_seconds
+        self.persist_interval = persist_interval
+        self.session_factory = session_factory
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._loaded = False
+        self._device_bucket: Dict[int, int] = {}
+        self._online_buckets: Counter = Counter()
+        self._severity: Dict[Tuple[int, str], str] = {}
+        self._alerts: Counter = Counter()
+        self._latest_by_type: Dict[str, dict] = {}
+        self._message_seconds: Counter = Counter()
+        self._persisted_at = 0.0
+
+    @property
+    def active(self) -> bool:
+        """本进程是否在采集（汇总在内存中，不必读数据库快照）"""
+        return self.enabled and self._loaded
+
+    def set_enabled(self, enabled: bool):
+        """采集领导者当选/降级时调用；降级后清空内存中的汇总，再次当选时从数据库重新加载
+        （期间由其他进程采集）"""
+        with self._lock:
+            self.enabled = enabled
+            if not enabled:
+                self._reset()
+
+    def _load(self):
+        """从各分片的最新值表加载告警、在线状态和各类型最新值"""
+        now = time.time()
+        since = datetime.utcfromtimestamp(now - self.online_seconds)
+        for shard in range(shard_count()):
+            with shard_session_factory(shard)() as db:
+                rows = db.query(SensorDataModel.device_id, SensorDataModel.type, SensorDataModel.value,
+                                SensorDataModel.unit, SensorDataModel.alert_status, SensorDataModel.timestamp).all()
+            for device_id, sensor_type, value, unit, alert_status, timestamp in rows:
+                self._set_severity((device_id, sensor_type), alert_status)
+                if timestamp is None:
+                    continue
+                epoch = (timestamp - datetime(1970, 1, 1)).total_seconds()
+                if timestamp >= since:
+                    self._touch(device_id, epoch)
+                latest = self._latest_by_type.get(sensor_type)
+                if latest is None or epoch > latest["timestamp"]:
+                    self._latest_by_type[sensor_type] = {
+                        "device_id": device_id, "device_name": "", "value": value, "unit": unit or "",
+                        "timestamp": epoch,
+                    }
+        if self._latest_by_type:
+            ids = {latest["device_id"] for latest in self._latest_by_type.values()}
+            with self.session_factory() as db:
+                names = dict(db.query(DeviceModel.id, DeviceModel.name).filter(DeviceModel.id.in_(ids)).all())
+            for latest in self._latest_by_type.values():
+                latest["device_name"] = names.get(latest["device_id"], "")
+        self._loaded = True
+
+    def _set_severity(self, key: Tuple[int, str], severity: Optional[str]):
+        previous = self._severity.get(key)
+        if previous in ALERT_SEVERITIES:
+            self._alerts[previous] -= 1
+        self._severity[key] = severity or "normal"
+        if severity in ALERT_SEVERITIES:
+            self._alerts[severity] += 1
+
+    def _touch(self, device_id: int, epoch: float):
+        bucket = _bucket(epoch, LIVENESS_BUCKET_SECONDS)
+        previous = self._device_bucket.get(device_id)
+        if previous is not None and previous >= bucket:
+            return
+        if previous in self._online_buckets:
+            self._online_buckets[previous] -= 1
+            if not self._online_buckets[previous]:
+                del self._online_buckets[previous]
+        self._device_bucket[device_id] = bucket
+        self._online_buckets[bucket] += 1
+
+    def observe(self, messages: int, readings: List[tuple], now: Optional[float] = None):
+        """记录一个已提交批次：消息数及各条最新值
+        (device_id, type, value, 时间戳, unit, alert_status, device_name, sensor_id)"""
+        now = time.time() if now is None else now
+        with self._lock:
+            if not self.enabled:
+                return
+            if not self._loaded:
+                self._load()
+            if messages:
+                self._message_seconds[int(now)] += messages
+            for device_id, sensor_type, value, timestamp, unit, alert_status, device_name, _ in readings:
+                # 在线按收到读数的时间判断，不受设备时钟影响
+                self._touch(device_id, now)
+                self._set_severity((device_id, sensor_type), alert_status)
+                latest = self._latest_by_type.get(sensor_type)
+                if latest is None or timestamp >= latest["timestamp"]:
+                    self._latest_by_type[sensor_type] = {
+                        "device_id": device_id, "device_name": device_name, "value": value, "unit": unit,
+                        "timestamp": timestamp,
+                    }
+            self._expire(now)
+        if now - self._persisted_at >= self.persist_interval:
+            self.persist(now)
+
+    def _expire(self, now: float):
+        oldest_second = int(now) - MESSAGE_WINDOW_SECONDS
+        for second in [second for second in self._message_seconds if second <= oldest_second]:
+            del self._message_seconds[second]
+        # 过期的桶删除，桶内设备下次有读数时重新计入
+        oldest_bucket = _bucket(now - self.online_seconds, LIVENESS_BUCKET_SECONDS) - LIVENESS_BUCKET_SECONDS
+        for bucket in [bucket for bucket in self._online_buckets if bucket < oldest_bucket]:
+            del self._online_buckets[bucket]
+
+    def snapshot(self, now: Optional[float] = None) -> dict:
+        """可序列化的汇总状态，时间相关的量（在线数、消息速率）由 summarize_ingest 按读取时刻计算"""
+        now = time.time() if now is None else now
+        with self._lock:
+            self._expire(now)
+            return {
+                "updated_at": now,
+                "online_seconds": self.online_seconds,
+                "online_buckets": {str(bucket): count for bucket, count in self._online_buckets.items()},
+                "message_seconds": {str(second): count for second, count in self._message_seconds.items()},
+                "series": len(self._severity),
+                "alerts": {severity: self._alerts[severity] for severity in ALERT_SEVERITIES},
+                "latest_by_type": {sensor_type: dict(latest) for sensor_type, latest in self._latest_by_type.items()},
+            }
+
+    def persist(self, now: Optional[float] = None):
+        """把快照写入主库（失败时只打印，下一批次再试）"""
+        if not self.enabled:
+            return
+        now = time.time() if now is None else now
+        self._persisted_at = now
+        state = self.snapshot(now)
+        try:
+            with self.session_factory() as db:
+                db.merge(DashboardStateModel(name=_STATE_NAME, payload=json.dumps(state, ensure_ascii=False),
+                                             updated_at=datetime.utcfromtimestamp(now)))
+                db.commit()
+        except Exception as e:
+            print(f"保存仪表盘汇总失败: {e}")
+
+
+def summarize_ingest(state: Optional[dict], now: Optional[float] = None) -> dict:
+    """由采集快照计算读取时刻的在线设备数、每分钟消息数等"""
+    now = time.time() if now is None else now
+    if not state:
+        return {"online": 0, "messages_per_minute": 0, "series": 0,
+                "alerts": {severity: 0 for severity in ALERT_SEVERITIES}, "latest_by_type": {}, "updated_at": None}
+    # 桶 [b, b+10) 内最后一条读数在 now-online_seconds 之后即视为在线（最多多算一个桶宽）
+    cutoff = now - state["online_seconds"]
+    online = sum(count for bucket, count in state["online_buckets"].items()
+                 if int(bucket) + LIVENESS_BUCKET_SECONDS > cutoff)
+    messages = sum(count for second, count in state["message_seconds"].items()
+                   if int(second) > now - MESSAGE_WINDOW_SECONDS)
+    latest_by_type = {
+        sensor_type: {**latest, "timestamp": datetime.utcfromtimestamp(latest["timestamp"])}
+        for sensor_type, latest in state["latest_by_type"].items()
+    }
+    return {"online": online, "messages_per_minute": messages, "series": state["series"],
+            "alerts": state["alerts"], "latest_by_type": latest_by_type,
+            "updated_at": datetime.utcfromtimestamp(state["updated_at"])}
+
+
+def get_dashboard_summary(db: Session, aggregator: Optional[DashboardAggregator] = None) -> dict:
+    """仪表盘汇总：设备计数来自触发器维护的计数表，采集相关的量来自采集进程的增量汇总"""
+    aggregator = aggregator or dashboard_aggregator
+    bind = db.get_bind()
+    if str(bind.url) not in _counters_ready:
+        ensure_device_counters(bind)
+
+    by_status = {key: count for key, count in db.query(DeviceCounterModel.key, DeviceCounterModel.count).filter(
+        DeviceCounterModel.dimension == "status", DeviceCounterModel.count > 0)}
+    total = sum(by_status.values())
+    top_locations = db.query(DeviceCounterModel.key, DeviceCounterModel.count).filter(
+        DeviceCounterModel.dimension == "location", DeviceCounterModel.count > 0,
+    ).order_by(DeviceCounterModel.count.desc()).limit(DASHBOARD_TOP_LOCATIONS).all()
+    by_location = {key or "未知位置": count for key, count in top_locations}
+    others = total - sum(by_location.values())
+    if others > 0:
+        by_location["其他"] = by_location.get("其他", 0) + others
+
+    if aggregator.active:
+        state = aggregator.snapshot()
+    else:
+        row = db.get(DashboardStateModel, _STATE_NAME)
+        state = json.loads(row.payload) if row and row.payload else None
+    ingest = summarize_ingest(state)
+    online = min(ingest.pop("online"), total)
+    return {
+        "devices": {
+            "total": total,
+            "online": online,
+            "offline": total - online,
+            "by_status": by_status,
+            "by_location": by_location,
+        },
+        "sensors": {
+            "series": ingest["series"],
+            "alerts": ingest["alerts"],
+            "latest_by_type": ingest["latest_by_type"],
+        },
+        "ingest": {
+            "messages_per_minute": ingest["messages_per_minute"],
+            "updated_at": ingest["updated_at"],
+        },
+    }
+
+
+# 全局实例：写入管道的处理器在每批次提交后更新，成为采集领导者后才启用
+dashboard_aggregator = DashboardAggregator(enabled=False)
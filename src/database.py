@@ -1,16 +1,62 @@
-from sqlalchemy import create_engine
+import json
+import os
+import warnings
+import zlib
+from typing import List
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import SAWarning
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
 from contextlib import contextmanager
 
-# 数据库配置
-SQLALCHEMY_DATABASE_URL = "sqlite:///./mqtt_iot.db"
+# 数据库配置（可通过环境变量DATABASE_URL覆盖，便于测试和多实例部署）
+SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./mqtt_iot.db")
+
+# 按设备分片：设备相关的读数表分布在多个数据库文件中，每个分片有独立的写锁，
+# 设备、别名、配置等全局表及设备→分片目录只在主库中。DB_SHARDS=1（默认）时不分片
+DB_SHARDS = max(1, int(os.getenv("DB_SHARDS", "1")))  # 启动时的分片数，运行中以 shard_count() 为准
+# 站点（主题第一级）到分片的固定映射，如 {"plantA": 1, "plantB": 2}，未列出的按主题哈希分配
+SHARD_SITE_MAP = json.loads(os.getenv("SHARD_SITE_MAP", "{}"))
+# 分片存放的表（都只按device_id访问，没有跨表外键）
+SHARDED_TABLES = ("sensors", "sensor_history", "sensor_blocks", "anomaly_events")
+
+
+def _shard_url(shard: int) -> str:
+    """分片库地址：DB_SHARD_URLS（逗号分隔，按分片1..N-1）或在主库文件名后加 .shardN"""
+    urls = [url.strip() for url in os.getenv("DB_SHARD_URLS", "").split(",") if url.strip()]
+    if len(urls) >= shard:
+        return urls[shard - 1]
+    base, ext = os.path.splitext(SQLALCHEMY_DATABASE_URL)
+    return f"{base}.shard{shard}{ext or '.db'}"
+
+
+def _create_engine(url: str):
+    created = create_engine(
+        url,
+        connect_args={"check_same_thread": False}  # 仅用于SQLite
+    )
+    if url.startswith("sqlite"):
+        @event.listens_for(created, "connect")
+        def _sqlite_on_connect(dbapi_connection, connection_record):
+            # 由SQLAlchemy显式发出BEGIN，否则pysqlite会在SAVEPOINT前不开启事务，
+            # 导致写入管道中按消息隔离的SAVEPOINT提前提交
+            dbapi_connection.isolation_level = None
+            # WAL模式下读请求不阻塞批量写入
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.close()
+
+        @event.listens_for(created, "begin")
+        def _sqlite_on_begin(conn):
+            conn.exec_driver_sql("BEGIN")
+    return created
+
 
 # 创建引擎
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, 
-    connect_args={"check_same_thread": False}  # 仅用于SQLite
-)
+engine = _create_engine(SQLALCHEMY_DATABASE_URL)
+# 分片0就是主库
+shard_engines = [engine]
+
 
 # 创建会话工厂
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -18,6 +64,106 @@ SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 # 基础模型类
 Base = declarative_base()
 
+_shard_session_factories = {0: SessionLocal}
+
+
+def configure_shards(urls: List[str]):
+    """设置分片1..N-1的数据库地址，空列表表示不分片（需在写入管道启动前调用）"""
+    for shard_engine in shard_engines[1:]:
+        shard_engine.dispose()
+    shard_engines[1:] = [_create_engine(url) for url in urls]
+    _shard_session_factories.clear()
+    _shard_session_factories[0] = SessionLocal
+
+
+def shard_count() -> int:
+    return len(shard_engines)
+
+
+def _shard_binds(shard: int) -> dict:
+    return {Base.metadata.tables[name]: shard_engines[shard] for name in SHARDED_TABLES}
+
+
+def shard_session_factory(shard: int) -> sessionmaker:
+    """分片的会话工厂（读取用）：读数表绑定到分片库，其余表仍在主库"""
+    factory = _shard_session_factories.get(shard)
+    if factory is None:
+        factory = sessionmaker(autocommit=False, autoflush=False, bind=engine, binds=_shard_binds(shard))
+        _shard_session_factories[shard] = factory
+    return factory
+
+
+class ShardWriteSession(Session):
+    """分片写入管道的会话：一个批次同时写主库（自动创建的设备、设备→分片目录、死信）和分片库（读数）
+
+    两个库不能原子提交，SQLAlchemy提交多个连接的顺序也不固定。这里主库的表在单独管理的连接事务中，
+    提交时先提交主库、再提交分片：读数引用的设备总是已经存在；分片提交失败时主库中的行已经提交，
+    批次重试时按设备名找到已创建的设备、目录登记已存在时跳过，都是幂等的（死信由写入管道避免重复记录）。
+    """
+
+    def __init__(self, shard: int, **kwargs):
+        self._main = engine.connect()
+        self._main_tx = self._main.begin()
+        # 最近一次提交时主库已提交而分片提交失败
+        self.main_committed = False
+        kwargs.update(bind=self._main, binds=_shard_binds(shard), join_transaction_mode="rollback_only")
+        super().__init__(**kwargs)
+
+    def commit(self):
+        self.main_committed = False
+        self.flush()
+        self._main_tx.commit()
+        self.main_committed = True
+        super().commit()
+        self.main_committed = False
+        self._main_tx = self._main.begin()
+
+    def rollback(self):
+        if not self.main_committed:
+            super().rollback()
+            return
+        # 主库事务已提交，只需回滚分片；忽略会话对已提交的主库事务的回滚告警
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", SAWarning)
+            super().rollback()
+        self._main_tx = self._main.begin()
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            # 归还连接池时会回滚主库上未提交的事务
+            self._main.close()
+
+
+def shard_write_session_factory(shard: int) -> sessionmaker:
+    """分片写入管道的会话工厂，分片0（主库）就是 SessionLocal"""
+    if shard == 0:
+        return SessionLocal
+    return sessionmaker(class_=ShardWriteSession, autoflush=False, shard=shard)
+
+
+def shard_for_key(key: str) -> int:
+    """设备键（主题前两级）所属的分片：站点在 SHARD_SITE_MAP 中时用映射，否则按哈希"""
+    count = shard_count()
+    if count == 1:
+        return 0
+    site = key.split("/", 1)[0]
+    if site in SHARD_SITE_MAP:
+        return int(SHARD_SITE_MAP[site]) % count
+    return zlib.crc32(key.encode()) % count
+
+
+def init_shards() -> List[str]:
+    """在各分片库中创建读数表，返回分片地址"""
+    tables = [Base.metadata.tables[name] for name in SHARDED_TABLES]
+    for shard_engine in shard_engines[1:]:
+        Base.metadata.create_all(bind=shard_engine, tables=tables)
+    return [str(shard_engine.url) for shard_engine in shard_engines]
+
+
+configure_shards([_shard_url(shard) for shard in range(1, DB_SHARDS)])
+
 
 @contextmanager
 def get_db_session():
@@ -1,4 +1,5 @@
-from typing import List
+from datetime import datetime
+from typing import Callable, List, Optional
 from sqlalchemy.orm import Session
 import sys
 import os
@@ -10,8 +11,12 @@ if parent_dir not in sys.path:
     sys.path.append(parent_dir)
 
 # 使用绝对路径导入模型
-from src.models import DeviceModel, SensorDataModel, MQTTConfigModel, TopicConfigModel
-from src.database import SessionLocal
+from src.models import (
+    AnomalyEventModel, DeviceAliasModel, DeviceModel, DeviceShardModel, SensorDataModel, SensorHistoryModel,
+    MQTTConfigModel, TopicConfigModel,
+)
+from src.database import SessionLocal, shard_count, shard_session_factory
+from src.block_store import HISTORY_BACKEND, query_block_history
 
 
 def get_device_by_id(db: Session, device_id: int):
@@ -70,6 +75,8 @@ def delete_device(db: Session, device_id: int):
     """删除设备"""
     db_device = db.query(DeviceModel).filter(DeviceModel.id == device_id).first()
     if db_device:
+        db.query(DeviceAliasModel).filter(DeviceAliasModel.device_id == device_id).delete(synchronize_session=False)
+        db.query(DeviceShardModel).filter(DeviceShardModel.device_id == device_id).delete(synchronize_session=False)
         db.delete(db_device)
         db.commit()
         return True
@@ -115,6 +122,10 @@ def update_mqtt_config(db: Session, config_id: int, config_data):
             setattr(db_config, key, value)
         db.commit()
         db.refresh(db_config)
+        
+        # broker地址或认证信息变化时重建对应连接
+        from src.broker_pool import broker_pool
+        broker_pool.sync()
     return db_config
 
 
@@ -174,15 +185,106 @@ def delete_topic_config(db: Session, config_id: int):
     """删除主题配置"""
     db_config = db.query(TopicConfigModel).filter(TopicConfigModel.id == config_id).first()
     if db_config:
+        was_active = db_config.is_active
         db.delete(db_config)
         db.commit()
+        if was_active:
+            from src.broker_pool import broker_pool
+            broker_pool.sync()
         return True
     return False
 
 
-def get_device_history(db: Session, device_id: int):
-    """获取设备历史数据"""
-    return db.query(SensorDataModel).filter(SensorDataModel.device_id == device_id).all()
+def get_device_shards(db: Session, device_id: int) -> List[int]:
+    """设备读数所在的分片（查设备→分片目录）
+
+    总是包括分片0：启用分片前写入主库的读数不在目录中，设备的新读数写到其他分片后仍要能读到。
+    """
+    if shard_count() == 1:
+        return [0]
+    rows = db.query(DeviceShardModel.shard).filter(DeviceShardModel.device_id == device_id)
+    return sorted({0} | {shard for (shard,) in rows})
+
+
+def fan_out(db: Session, shards: List[int], query: Callable[[Session], list]) -> list:
+    """在多个分片上执行同一个查询并拼接结果（分片0直接用主库会话）"""
+    results = []
+    for shard in shards:
+        if shard == 0:
+            results.extend(query(db))
+        else:
+            with shard_session_factory(shard)() as session:
+                results.extend(query(session))
+    return results
+
+
+def all_shards() -> List[int]:
+    return list(range(shard_count()))
+
+
+def get_device_history(db: Session, device_id: int, sensor_type: Optional[str] = None,
+                       start: Optional[datetime] = None, end: Optional[datetime] = None, limit: int = 1000):
+    """获取设备历史数据（经死区过滤后存储，两点之间的值可按前一点保持重建）"""
+    shards = get_device_shards(db, device_id)
+    if shards == [0]:
+        return _device_history(db, device_id, sensor_type, start, end, limit)
+    rows = fan_out(db, shards, lambda session: _device_history(session, device_id, sensor_type, start, end, limit))
+    rows.sort(key=lambda row: row["timestamp"] or "")
+    return rows[-limit:]
+
+
+def _device_history(db: Session, device_id: int, sensor_type: Optional[str],
+                    start: Optional[datetime], end: Optional[datetime], limit: int):
+    if HISTORY_BACKEND == "blocks":
+        return query_block_history(db, device_id, sensor_type, start, end, limit)
+    query = db.query(SensorHistoryModel).filter(SensorHistoryModel.device_id == device_id)
+    if sensor_type:
+        query = query.filter(SensorHistoryModel.type == sensor_type)
+    if start:
+        query = query.filter(SensorHistoryModel.timestamp >= start)
+    if end:
+        query = query.filter(SensorHistoryModel.timestamp <= end)
+    rows = query.order_by(SensorHistoryModel.timestamp.desc()).limit(limit).all()
+    return [
+        {
+            "type": row.type,
+            "value": row.value,
+            "timestamp": row.timestamp.isoformat() if row.timestamp else None,
+        }
+        for row in reversed(rows)
+    ]
+
+
+def get_anomaly_events(db: Session, device_id: Optional[int] = None, kind: Optional[str] = None,
+                       start: Optional[datetime] = None, limit: int = 100):
+    """获取异常事件，按时间倒序（分片时各分片分别取前limit条再合并）"""
+    def query_events(session: Session):
+        query = session.query(AnomalyEventModel)
+        if device_id is not None:
+            query = query.filter(AnomalyEventModel.device_id == device_id)
+        if kind:
+            query = query.filter(AnomalyEventModel.kind == kind)
+        if start:
+            query = query.filter(AnomalyEventModel.timestamp >= start)
+        return query.order_by(AnomalyEventModel.timestamp.desc(), AnomalyEventModel.id.desc()).limit(limit).all()
+
+    shards = get_device_shards(db, device_id) if device_id is not None else all_shards()
+    rows = fan_out(db, shards, query_events)
+    if len(shards) > 1:
+        rows.sort(key=lambda row: (row.timestamp or datetime.min, row.id), reverse=True)
+    return [
+        {
+            "id": row.id,
+            "device_id": row.device_id,
+            "type": row.type,
+            "kind": row.kind,
+            "value": row.value,
+            "expected": row.expected,
+            "score": row.score,
+            "timestamp": row.timestamp.isoformat() if row.timestamp else None,
+        }
+        for row in rows[:limit]
+    ]
 
 
 def get_latest_device_sensors(db: Session, device_id: int):
@@ -190,9 +292,10 @@ def get_latest_device_sensors(db: Session, device_id: int):
     from sqlalchemy import desc
     
     # 获取指定设备的所有传感器数据，按时间戳降序排列
-    all_sensors = db.query(SensorDataModel).filter(
+    all_sensors = fan_out(db, get_device_shards(db, device_id), lambda session: session.query(SensorDataModel).filter(
         SensorDataModel.device_id == device_id
-    ).order_by(desc(SensorDataModel.timestamp)).all()
+    ).order_by(desc(SensorDataModel.timestamp)).all())
+    all_sensors.sort(key=lambda sensor: sensor.timestamp or datetime.min, reverse=True)
     
     # 按传感器类型分组，只保留每种类型最新的数据
     latest_sensors = {}
@@ -207,30 +310,46 @@ def get_latest_device_sensors(db: Session, device_id: int):
 
 def get_device_sensors(db: Session, device_id: int):
     """获取设备传感器数据"""
-    return db.query(SensorDataModel).filter(SensorDataModel.device_id == device_id).all()
+    return fan_out(db, get_device_shards(db, device_id),
+                   lambda session: session.query(SensorDataModel).filter(SensorDataModel.device_id == device_id).all())
 
 
 def get_realtime_sensors(db: Session):
     """获取实时传感器数据"""
     from sqlalchemy import desc
-    # 获取每个设备的最新传感器数据
-    subquery = db.query(
-        SensorDataModel.device_id,
-        db.query(SensorDataModel).filter(
-            SensorDataModel.device_id == SensorDataModel.device_id
-        ).order_by(desc(SensorDataModel.timestamp)).limit(1).subquery()
-    ).distinct(SensorDataModel.device_id).subquery()
-    
-    return db.query(SensorDataModel).join(
-        subquery, SensorDataModel.id == subquery.c.id
-    ).all()
+
+    def query_realtime(session: Session):
+        # 获取每个设备的最新传感器数据
+        subquery = session.query(
+            SensorDataModel.device_id,
+            session.query(SensorDataModel).filter(
+                SensorDataModel.device_id == SensorDataModel.device_id
+            ).order_by(desc(SensorDataModel.timestamp)).limit(1).subquery()
+        ).distinct(SensorDataModel.device_id).subquery()
+
+        return session.query(SensorDataModel).join(
+            subquery, SensorDataModel.id == subquery.c.id
+        ).all()
+
+    return fan_out(db, all_shards(), query_realtime)
+
+
+def get_recent_sensor_rows(db: Session, skip: int = 0, limit: int = 50):
+    """最近更新的传感器最新值，分片时各分片取前 skip+limit 条按时间合并"""
+    from sqlalchemy import desc
+    shards = all_shards()
+    if len(shards) == 1:
+        return db.query(SensorDataModel).order_by(desc(SensorDataModel.timestamp)).offset(skip).limit(limit).all()
+    rows = fan_out(db, shards, lambda session: session.query(SensorDataModel).order_by(
+        desc(SensorDataModel.timestamp)).limit(skip + limit).all())
+    rows.sort(key=lambda sensor: sensor.timestamp or datetime.min, reverse=True)
+    return rows[skip:skip + limit]
 
 
 def get_latest_sensors(db: Session):
     """获取最新传感器数据，按设备分组"""
-    from sqlalchemy import desc
     # 获取最新的传感器数据
-    sensors = db.query(SensorDataModel).order_by(desc(SensorDataModel.timestamp)).limit(50).all()
+    sensors = get_recent_sensor_rows(db, limit=50)
     
     # 按设备ID分组
     devices = {}
@@ -268,23 +387,33 @@ def activate_mqtt_config(db: Session, config_id: int):
     if config:
         config.is_active = True
         db.commit()
+        
+        # 未指定MQTT配置的主题配置使用激活的MQTT配置，需要同步采集连接
+        from src.broker_pool import broker_pool
+        broker_pool.sync()
+        
         return True
     return False
 
 
 def activate_topic_config(db: Session, config_id: int):
-    """激活主题配置"""
-    # 先将所有配置设为非激活
-    db.query(TopicConfigModel).update({TopicConfigModel.is_active: False})
-    # 激活指定配置
+    """激活主题配置（同一MQTT配置下只保留一个激活的主题配置，不同broker可同时激活）"""
     config = db.query(TopicConfigModel).filter(TopicConfigModel.id == config_id).first()
     if config:
+        # 先将同一broker下的其他配置设为非激活
+        same_broker = TopicConfigModel.mqtt_config_id == config.mqtt_config_id
+        if config.mqtt_config_id is None:
+            same_broker = TopicConfigModel.mqtt_config_id.is_(None)
+        db.query(TopicConfigModel).filter(
+            same_broker, TopicConfigModel.id != config_id
+        ).update({TopicConfigModel.is_active: False}, synchronize_session=False)
+        # 激活指定配置
         config.is_active = True
         db.commit()
         
-        # 启动MQTT服务
-        from src.mqtt_service import start_mqtt_service
-        start_mqtt_service()
+        # 启动或同步MQTT采集
+        from src.broker_pool import broker_pool
+        broker_pool.sync()
         
         return True
     return False
@@ -297,9 +426,9 @@ def deactivate_topic_config(db: Session, config_id: int):
         config.is_active = False
         db.commit()
         
-        # 停止MQTT服务
-        from src.mqtt_service import stop_mqtt_service, mqtt_service
-        stop_mqtt_service()
+        # 同步MQTT采集，没有激活主题配置的broker会被停止
+        from src.broker_pool import broker_pool
+        broker_pool.sync()
         
         return True
     return False
@@ -331,19 +460,18 @@ def update_topic_config(db: Session, config_id: int, config_data: dict):
             setattr(db_config, key, value)
         db.commit()
         db.refresh(db_config)
+        
+        # 订阅主题可能变化，按差异热更新订阅
+        from src.broker_pool import broker_pool
+        broker_pool.sync()
     return db_config
 
 
 def fix_device_status_null_values(db: Session):
     """修复设备表中status字段的NULL值"""
-    # 查询所有status为NULL的设备
-    null_status_devices = db.query(DeviceModel).filter(
+    # 直接用一条UPDATE语句将NULL值更新为默认值"offline"，避免逐行加载设备
+    db.query(DeviceModel).filter(
         DeviceModel.status.is_(None)
-    ).all()
-    
-    # 将NULL值更新为默认值"offline"
-    for device in null_status_devices:
-        device.status = "offline"
+    ).update({DeviceModel.status: "offline"}, synchronize_session=False)
     
     db.commit()
-
@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+死信存储：解析失败的消息不再被丢弃或误存为 Sensor_N 读数，而是连同原始载荷和原因写入 dead_letters 表。
+修复解析后可以批量重放：
+    python -m src.dead_letters summary
+    python -m src.dead_letters replay --reason unrecognized_format
+"""
+
+import argparse
+import json
+import threading
+import time
+from datetime import datetime
+from typing import List, Optional
+import sys
+import os
+
+from sqlalchemy import func
+
+# 修复相对导入问题
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+if parent_dir not in sys.path:
+    sys.path.append(parent_dir)
+
+from src.database import SessionLocal
+from src.models import DeadLetterModel
+
+# 是否记录死信
+DEAD_LETTERS = os.getenv("DEAD_LETTERS", "1") == "1"
+# 最多保留的死信条数，超出后删除最早的
+DEAD_LETTER_MAX = int(os.getenv("DEAD_LETTER_MAX", "10000"))
+# 重放时每次从表中读取的条数
+DEAD_LETTER_REPLAY_CHUNK = 2000
+# 重放时等待最后一批提交的最长时间（秒）
+DEAD_LETTER_REPLAY_TIMEOUT = float(os.getenv("DEAD_LETTER_REPLAY_TIMEOUT", "120"))
+
+# 死信原因
+REASON_DECODE = "decode_error"  # 载荷不是UTF-8文本
+REASON_TOPIC = "topic_format"  # 主题不足两级，无法确定设备
+REASON_UNRECOGNIZED = "unrecognized_format"  # 载荷不是任何已知的传感器格式
+REASON_NO_READINGS = "no_readings"  # 格式可识别但没有可保存的数值
+REASON_ERROR = "processing_error"  # 处理时的其他异常
+
+
+class PayloadRejected(ValueError):
+    """处理器拒绝的消息，reason 为上面的死信原因之一"""
+
+    def __init__(self, reason: str, detail: str = ""):
+        super().__init__(f"{reason}: {detail}" if detail else reason)
+        self.reason = reason
+        self.detail = detail
+
+
+class DeadLetterStore:
+    """死信写入：在写入管道的批次会话中追加（与同批次的确认一起提交），每写入约1%上限的条数裁剪一次"""
+
+    def __init__(self, max_rows: int = DEAD_LETTER_MAX):
+        self.max_rows = max_rows
+        self._trim_every = max(1, max_rows // 100)
+        # 启动后的第一条死信先裁剪一次（上限可能被调小）
+        self._since_trim = self._trim_every
+        self._lock = threading.Lock()
+
+    def record(self, db, topic: str, payload, error: Exception):
+        """把处理失败的消息加入当前会话（调用方在消息的保存点回滚后调用）"""
+        structured = isinstance(payload, dict)
+        if structured:
+            # 结构化读数保存原始记录的字段，重放时重新校验
+            raw = json.dumps({key: payload.get(key) for key in ("device", "type", "value", "unit", "ts")},
+                             ensure_ascii=False).encode()
+        elif isinstance(payload, str):
+            raw = payload.encode()
+        else:
+            raw = bytes(payload)
+        if isinstance(error, PayloadRejected):
+            reason, detail = error.reason, error.detail
+        else:
+            reason, detail = REASON_ERROR, f"{type(error).__name__}: {error}"
+        db.add(DeadLetterModel(topic=topic, payload=raw, structured=structured, reason=reason,
+                               detail=detail[:200], received_at=datetime.utcnow()))
+        with self._lock:
+            self._since_trim += 1
+            trim = self._since_trim >= self._trim_every
+            if trim:
+                self._since_trim = 0
+        if trim:
+            self.trim(db)
+
+    def trim(self, db):
+        """删除超出上限的最早死信"""
+        db.flush()
+        boundary = (db.query(DeadLetterModel.id).order_by(DeadLetterModel.id.desc())
+                    .offset(self.max_rows).limit(1).scalar())
+        if boundary is not None:
+            db.query(DeadLetterModel).filter(DeadLetterModel.id <= boundary).delete(synchronize_session=False)
+
+
+def _filtered(query, reason: Optional[str] = None, topic: Optional[str] = None):
+    if reason:
+        query = query.filter(DeadLetterModel.reason == reason)
+    if topic:
+        # 主题前缀匹配
+        escaped = topic.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        query = query.filter(DeadLetterModel.topic.like(f"{escaped}%", escape="\\"))
+    return query
+
+
+def _to_dict(row: DeadLetterModel) -> dict:
+    return {
+        "id": row.id,
+        "topic": row.topic,
+        "payload": row.payload.decode(errors="replace"),
+        "size": len(row.payload),
+        "structured": bool(row.structured),
+        "reason": row.reason,
+        "detail": row.detail,
+        "received_at": row.received_at,
+    }
+
+
+def summarize_dead_letters(db) -> dict:
+    """按原因分组：条数、最早/最近时间和最近一条样例"""
+    groups = (db.query(DeadLetterModel.reason, func.count(DeadLetterModel.id), func.min(DeadLetterModel.received_at),
+                       func.max(DeadLetterModel.received_at), func.max(DeadLetterModel.id))
+              .group_by(DeadLetterModel.reason).all())
+    reasons = []
+    for reason, count, first_at, last_at, latest_id in sorted(groups, key=lambda group: -group[1]):
+        reasons.append({"reason": reason, "count": count, "first_at": first_at, "last_at": last_at,
+                        "latest": _to_dict(db.get(DeadLetterModel, latest_id))})
+    return {"total": sum(group["count"] for group in reasons), "reasons": reasons}
+
+
+def list_dead_letters(db, reason: Optional[str] = None, topic: Optional[str] = None,
+                      before_id: Optional[int] = None, limit: int = 50) -> List[dict]:
+    """按时间倒序列出死信，before_id 为上一页最后一条的id"""
+    query = _filtered(db.query(DeadLetterModel), reason, topic)
+    if before_id is not None:
+        query = query.filter(DeadLetterModel.id < before_id)
+    return [_to_dict(row) for row in query.order_by(DeadLetterModel.id.desc()).limit(limit)]
+
+
+def replay_dead_letters(pipeline, reason: Optional[str] = None, topic: Optional[str] = None,
+                        ids: Optional[List[int]] = None, chunk: int = DEAD_LETTER_REPLAY_CHUNK,
+                        timeout: float = DEAD_LETTER_REPLAY_TIMEOUT) -> dict:
+    """把匹配的死信重新提交到写入管道，提交后从表中删除
+
+    只重放开始时已有的死信；仍然解析失败的消息会以新的id重新进入死信表。
+    提交不限速（reliable），按块读取、边提交边删除已提交的死信。
+    """
+    from src.http_ingest import parse_record
+
+    started = time.perf_counter()
+    committed: List[int] = []
+    condition = threading.Condition()
+    submitted = 0
+    invalid = 0
+
+    def on_committed(dead_id: int):
+        def callback():
+            with condition:
+                committed.append(dead_id)
+                condition.notify_all()
+        return callback
+
+    def delete_committed(db):
+        with condition:
+            done = committed[:]
+            del committed[:]
+        if not done:
+            return 0
+        for start in range(0, len(done), 500):
+            db.query(DeadLetterModel).filter(DeadLetterModel.id.in_(done[start:start + 500])) \
+                .delete(synchronize_session=False)
+        db.commit()
+        return len(done)
+
+    deleted = 0
+    with SessionLocal() as db:
+        upper = db.query(func.max(DeadLetterModel.id)).scalar() or 0
+        db.rollback()
+        last = 0
+        while True:
+            query = _filtered(db.query(DeadLetterModel), reason, topic) \
+                .filter(DeadLetterModel.id > last, DeadLetterModel.id <= upper)
+            if ids:
+                query = query.filter(DeadLetterModel.id.in_(ids))
+            rows = query.with_entities(DeadLetterModel.id, DeadLetterModel.topic, DeadLetterModel.payload,
+                                       DeadLetterModel.structured).order_by(DeadLetterModel.id).limit(chunk).all()
+            # 结束读事务，否则写入线程提交后本会话无法再删除（SQLite读快照不能升级为写事务）
+            db.rollback()
+            if not rows:
+                break
+            for dead_id, topic_name, payload, structured in rows:
+                if structured:
+                    try:
+                        topic_name, payload = parse_record(json.loads(payload))
+                    except ValueError as e:
+                        # 结构化记录已无法通过校验（如时间戳超出范围），保留在死信表中
+                        invalid += 1
+                        print(f"死信 {dead_id} 无法重放: {e}")
+                        continue
+                pipeline.submit(topic_name, payload, on_committed=on_committed(dead_id), reliable=True)
+                submitted += 1
+            last = rows[-1][0]
+            deleted += delete_committed(db)
+
+        deadline = time.monotonic() + timeout
+        with condition:
+            while deleted + len(committed) < submitted and time.monotonic() < deadline:
+                condition.wait(deadline - time.monotonic())
+        deleted += delete_committed(db)
+        remaining = _filtered(db.query(func.count(DeadLetterModel.id)), reason, topic).scalar()
+
+    elapsed = time.perf_counter() - started
+    return {
+        "submitted": submitted,
+        "committed": deleted,
+        "invalid": invalid,
+        "remaining": remaining,
+        "elapsed_seconds": round(elapsed, 3),
+        "messages_per_second": round(submitted / elapsed, 1) if elapsed > 0 else None,
+    }
+
+
+# 全局实例：各写入管道共用
+dead_letter_store = DeadLetterStore()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="查看和重放死信")
+    parser.add_argument("command", choices=["summary", "replay"])
+    parser.add_argument("--reason", help="只处理该原因的死信")
+    parser.add_argument("--topic", help="只处理主题以此开头的死信")
+    args = parser.parse_args()
+
+    from src.database import Base, engine, init_shards
+    Base.metadata.create_all(bind=engine)
+    if args.command == "summary":
+        with SessionLocal() as db:
+            summary = summarize_dead_letters(db)
+        print(f"死信共 {summary['total']} 条")
+        for group in summary["reasons"]:
+            latest = group["latest"]
+            print(f"  {group['reason']}: {group['count']} 条，最近 {group['last_at']}，"
+                  f"样例 {latest['topic']} {latest['payload'][:80]!r}")
+        return
+
+    init_shards()
+    from src.ingest_pipeline import ingest_pipeline
+    ingest_pipeline.start()
+    try:
+        result = replay_dead_letters(ingest_pipeline, reason=args.reason, topic=args.topic)
+    finally:
+        ingest_pipeline.stop()
+    print(f"重放 {result['submitted']} 条，已提交 {result['committed']} 条，无法重放 {result['invalid']} 条，"
+          f"匹配的死信还剩 {result['remaining']} 条，{result['messages_per_second']} 条/秒")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+import json
+import threading
+from typing import Dict, Optional, Tuple
+import os
+
+# 默认死区阈值：读数与上次存储值之差不超过阈值时不写入历史（0表示任何变化都写入）
+DEADBAND_DEFAULT = float(os.getenv("HISTORY_DEADBAND", "0"))
+# 最长心跳间隔（秒）：即使读数不变，超过该间隔也写入一条历史
+HEARTBEAT_SECONDS = float(os.getenv("HISTORY_HEARTBEAT_SECONDS", "300"))
+# 按传感器类型或 "设备ID:类型" 配置的阈值，如 {"Temperature": 0.2, "Humidity": 0.5, "3:Temperature1": 0.05}
+# 值也可以是 {"threshold": 0.2, "heartbeat": 600}
+DEADBAND_RULES = os.getenv(
+    "HISTORY_DEADBAND_RULES",
+    '{"Temperature": 0.2, "Humidity": 0.5}',
+)
+
+
+class DeadbandState:
+    """单个 (设备, 类型) 最近一次写入历史的值和时间"""
+
+    __slots__ = ("value", "stored_at")
+
+    def __init__(self, value: float, stored_at: float):
+        self.value = value
+        self.stored_at = stored_at
+
+
+def parse_deadband_rules(rules_str: Optional[str]) -> Dict[str, Tuple[float, float]]:
+    """解析阈值配置为 {键: (阈值, 心跳秒数)}"""
+    if not rules_str:
+        return {}
+    try:
+        raw = json.loads(rules_str)
+    except (json.JSONDecodeError, TypeError):
+        print(f"死区配置不是合法的JSON，已忽略: {rules_str}")
+        return {}
+    rules = {}
+    for key, rule in raw.items():
+        if isinstance(rule, dict):
+            rules[key] = (float(rule.get("threshold", DEADBAND_DEFAULT)),
+                          float(rule.get("heartbeat", HEARTBEAT_SECONDS)))
+        else:
+            rules[key] = (float(rule), HEARTBEAT_SECONDS)
+    return rules
+
+
+class DeadbandFilter:
+    """历史数据死区 + 心跳过滤器
+
+    在内存中为每个 (设备, 类型) 记录最近一次写入历史的值，
+    只有变化超过阈值或距上次写入超过心跳间隔时才写入新行。
+    以上次写入值重建曲线时，误差不超过阈值。
+    状态更新先暂存到本批次，批次提交后 committed() 才生效，回滚时 rolled_back() 丢弃，
+    否则重试的批次会与已回滚的值比较而被过滤掉。单条消息的保存点回滚时 message_rolled_back()
+    恢复这条消息之前的暂存状态。
+    """
+
+    def __init__(self, rules: Optional[Dict[str, Tuple[float, float]]] = None,
+                 default_threshold: float = DEADBAND_DEFAULT, heartbeat: float = HEARTBEAT_SECONDS):
+        self.rules = parse_deadband_rules(DEADBAND_RULES) if rules is None else rules
+        self.default = (default_threshold, heartbeat)
+        self._state: Dict[Tuple[int, str], DeadbandState] = {}
+        # 本批次暂存的状态和计数
+        self._pending: Dict[Tuple[int, str], DeadbandState] = {}
+        self._pending_stats = {"stored": 0, "suppressed": 0}
+        # 当前消息覆盖前的暂存状态（None表示原来没有暂存）和消息开始时的计数
+        self._message_undo: Dict[Tuple[int, str], Optional[DeadbandState]] = {}
+        self._message_stats = dict(self._pending_stats)
+        self._rule_cache: Dict[Tuple[int, str], Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+        self.stats = {"stored": 0, "suppressed": 0}
+
+    def rule_for(self, device_id: int, sensor_type: str) -> Tuple[float, float]:
+        """优先匹配 "设备ID:类型"，其次精确类型，最后按类型包含关系（如 Temperature 匹配 Temperature1）"""
+        key = (device_id, sensor_type)
+        rule = self._rule_cache.get(key)
+        if rule is None:
+            rule = self.rules.get(f"{device_id}:{sensor_type}") or self.rules.get(sensor_type)
+            if rule is None:
+                rule = next((value for name, value in self.rules.items()
+                             if ":" not in name and name in sensor_type), self.default)
+            self._rule_cache[key] = rule
+        return rule
+
+    def should_store(self, device_id: int, sensor_type: str, value, now: float) -> bool:
+        """判断读数是否需要写入历史，需要时暂存新状态（同批次后续读数与暂存值比较）"""
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            return True
+        threshold, heartbeat = self.rule_for(device_id, sensor_type)
+        key = (device_id, sensor_type)
+        with self._lock:
+            state = self._pending.get(key) or self._state.get(key)
+            if state is None or abs(value - state.value) > threshold or now - state.stored_at >= heartbeat:
+                if key not in self._message_undo:
+                    self._message_undo[key] = self._pending.get(key)
+                self._pending[key] = DeadbandState(value, now)
+                self._pending_stats["stored"] += 1
+                return True
+            self._pending_stats["suppressed"] += 1
+            return False
+
+    def begin_message(self):
+        """一条消息的保存点开始前调用"""
+        with self._lock:
+            self._message_undo.clear()
+            self._message_stats.update(self._pending_stats)
+
+    def message_rolled_back(self):
+        """消息的保存点回滚：恢复这条消息之前的暂存状态，下一条读数与实际写入的值比较"""
+        with self._lock:
+            for key, state in self._message_undo.items():
+                if state is None:
+                    self._pending.pop(key, None)
+                else:
+                    self._pending[key] = state
+            self._message_undo.clear()
+            self._pending_stats.update(self._message_stats)
+
+    def committed(self):
+        """批次提交后应用暂存的状态"""
+        with self._lock:
+            self._state.update(self._pending)
+            self._pending.clear()
+            self._message_undo.clear()
+            for name, count in self._pending_stats.items():
+                self.stats[name] += count
+                self._pending_stats[name] = 0
+
+    def rolled_back(self):
+        """批次回滚：丢弃暂存的状态，重试时与上次提交的值比较"""
+        with self._lock:
+            self._pending.clear()
+            self._message_undo.clear()
+            for name in self._pending_stats:
+                self._pending_stats[name] = 0
+
+    def forget(self, device_id: int, sensor_type: Optional[str] = None):
+        """清除状态（如删除设备后），下一条读数必定写入"""
+        with self._lock:
+            for states in (self._state, self._pending):
+                for key in [key for key in states
+                            if key[0] == device_id and (sensor_type is None or key[1] == sensor_type)]:
+                    del states[key]
+
+    def status(self) -> dict:
+        """统计包括本批次尚未提交的读数"""
+        with self._lock:
+            stats = {name: count + self._pending_stats[name] for name, count in self.stats.items()}
+            tracked = len(self._state) + sum(1 for key in self._pending if key not in self._state)
+        total = stats["stored"] + stats["suppressed"]
+        return dict(
+            stats,
+            tracked_series=tracked,
+            store_ratio=round(stats["stored"] / total, 4) if total else None,
+        )
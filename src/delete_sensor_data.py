@@ -5,9 +5,6 @@
 用于删除数据库中device_id为1和2的传感器数据
 """
 
-from sqlalchemy import create_engine, and_
-from sqlalchemy.orm import sessionmaker
-from contextlib import contextmanager
 import sys
 import os
 
@@ -18,7 +15,7 @@ if parent_dir not in sys.path:
     sys.path.append(parent_dir)
 
 from src.models import SensorDataModel
-from src.database import SQLALCHEMY_DATABASE_URL
+from src.database import shard_count, shard_session_factory
 
 
 def delete_sensor_data_by_device_ids(device_ids):
@@ -28,11 +25,13 @@ def delete_sensor_data_by_device_ids(device_ids):
     Args:
         device_ids: 设备ID列表，例如 [1, 2]
     """
-    # 创建数据库引擎和会话
-    engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
-    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-    
-    with SessionLocal() as db:
+    # 分片时各分片分别删除
+    for shard in range(shard_count()):
+        _delete_in_shard(shard, device_ids)
+
+
+def _delete_in_shard(shard, device_ids):
+    with shard_session_factory(shard)() as db:
         try:
             # 查询要删除的记录数量
             query = db.query(SensorDataModel).filter(SensorDataModel.device_id.in_(device_ids))
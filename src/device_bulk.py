@@ -0,0 +1,384 @@
+import csv
+import io
+import json
+import time
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple
+import sys
+import os
+
+from sqlalchemy import select, text, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+# 修复相对导入问题
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+if parent_dir not in sys.path:
+    sys.path.append(parent_dir)
+
+from src.models import DeviceAliasModel, DeviceModel
+from src.admission import device_key
+
+# 每个事务写入的设备数
+BULK_CHUNK_SIZE = int(os.getenv("DEVICE_BULK_CHUNK_SIZE", "2000"))
+# 结果中最多返回的逐行错误数（计数不受限制）
+MAX_REPORTED_ERRORS = 1000
+MAX_NAME_LENGTH = 128
+# 导出时每页的设备数
+_EXPORT_BATCH = 1000
+
+# 名称已存在时的处理方式
+CONFLICT_SKIP = "skip"
+CONFLICT_UPDATE = "update"
+CONFLICT_ERROR = "error"
+CONFLICT_MODES = (CONFLICT_SKIP, CONFLICT_UPDATE, CONFLICT_ERROR)
+
+BULK_FORMATS = ("csv", "ndjson")
+DEVICE_FIELDS = ("name", "device_type", "status", "location", "mqtt_config_id", "topic_config_id")
+EXPORT_FIELDS = ("id",) + DEVICE_FIELDS + ("aliases",)
+# 多个别名在CSV中以 | 分隔
+ALIAS_SEPARATOR = "|"
+
+
+def _optional_str(value) -> Optional[str]:
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def _optional_int(value, field: str) -> Optional[int]:
+    if value is None or value == "":
+        return None
+    if isinstance(value, bool):
+        raise ValueError(f"{field} 应为整数")
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{field} 应为整数: {value!r}")
+
+
+def validate_device_row(raw: dict) -> Tuple[dict, List[str]]:
+    """校验一行设备数据，返回 (设备字段, 主题别名列表)；无效时抛出ValueError"""
+    if not isinstance(raw, dict):
+        raise ValueError("每行应为JSON对象")
+    name = _optional_str(raw.get("name"))
+    if not name:
+        raise ValueError("name 不能为空")
+    if len(name) > MAX_NAME_LENGTH:
+        raise ValueError(f"name 超过{MAX_NAME_LENGTH}个字符")
+    device_type = _optional_str(raw.get("device_type"))
+    if not device_type:
+        raise ValueError("device_type 不能为空")
+    fields = {
+        "name": name,
+        "device_type": device_type,
+        "status": _optional_str(raw.get("status")) or "offline",
+        "location": _optional_str(raw.get("location")),
+        "mqtt_config_id": _optional_int(raw.get("mqtt_config_id"), "mqtt_config_id"),
+        "topic_config_id": _optional_int(raw.get("topic_config_id"), "topic_config_id"),
+    }
+
+    # 主题别名：topic 列和 aliases 列（列表或 | 分隔），统一取主题前两级
+    candidates = []
+    if raw.get("topic"):
+        candidates.append(raw["topic"])
+    aliases_value = raw.get("aliases")
+    if isinstance(aliases_value, list):
+        candidates.extend(aliases_value)
+    elif aliases_value:
+        candidates.extend(str(aliases_value).split(ALIAS_SEPARATOR))
+    aliases = []
+    for candidate in candidates:
+        candidate = str(candidate).strip()
+        if not candidate:
+            continue
+        if "+" in candidate or "#" in candidate:
+            raise ValueError(f"主题别名不能包含通配符: {candidate}")
+        alias = device_key(candidate)
+        if "/" not in alias:
+            raise ValueError(f"主题别名至少需要两级，如 stm32/2: {candidate}")
+        if alias not in aliases:
+            aliases.append(alias)
+    return fields, aliases
+
+
+class RowParser:
+    """逐行解析CSV（首行为表头）或NDJSON"""
+
+    def __init__(self, fmt: str):
+        if fmt not in BULK_FORMATS:
+            raise ValueError(f"不支持的格式: {fmt}")
+        self.fmt = fmt
+        self.header: Optional[List[str]] = None
+
+    def parse(self, line: str) -> Optional[dict]:
+        """返回一行数据；CSV表头行返回None；格式错误抛出ValueError"""
+        if self.fmt == "ndjson":
+            try:
+                return json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"JSON格式错误: {e}")
+        values = next(csv.reader([line]))
+        if self.header is None:
+            header = [column.strip().lower() for column in values]
+            if "name" not in header:
+                raise ValueError("CSV表头缺少 name 列")
+            self.header = header
+            return None
+        if len(values) != len(self.header):
+            raise ValueError(f"列数为{len(values)}，表头为{len(self.header)}列")
+        return dict(zip(self.header, values))
+
+
+async def aiter_lines(chunks: AsyncIterator[bytes], keep_blank: bool = False) -> AsyncIterator[Tuple[int, str]]:
+    """把请求体字节流切分为 (行号, 文本)，跳过空行（keep_blank 时保留，CSV引号内的字段可能包含空行）"""
+    buffer = b""
+    line_no = 0
+    async for chunk in chunks:
+        buffer += chunk
+        lines = buffer.split(b"\n")
+        buffer = lines.pop()
+        for line in lines:
+            line_no += 1
+            text = line.decode("utf-8-sig" if line_no == 1 else "utf-8").rstrip("\r")
+            if keep_blank or text.strip():
+                yield line_no, text
+    if buffer.strip():
+        line_no += 1
+        yield line_no, buffer.decode("utf-8-sig" if line_no == 1 else "utf-8").rstrip("\r")
+
+
+# 以一个JSON数组参数代替数千个IN绑定参数，避免每块重新编译大语句
+_NAMES_TO_IDS_SQL = text("SELECT name, id FROM devices WHERE name IN (SELECT value FROM json_each(:names))")
+_ALIAS_OWNERS_SQL = text(
+    "SELECT alias, device_id FROM device_aliases WHERE alias IN (SELECT value FROM json_each(:aliases))"
+)
+
+
+class DeviceImporter:
+    """批量导入设备
+
+    逐行校验后攒满 chunk_size 行在一个事务中写入：一次查询出本块中已存在的名称，
+    新设备用 INSERT ... ON CONFLICT(name) DO NOTHING 批量插入（与采集自动创建设备并发时不冲突），
+    已存在的设备按 on_conflict 跳过、更新或报错，最后批量登记主题别名。
+    """
+
+    def __init__(self, db: Session, fmt: str, on_conflict: str = CONFLICT_SKIP,
+                 chunk_size: int = BULK_CHUNK_SIZE):
+        if on_conflict not in CONFLICT_MODES:
+            raise ValueError(f"on_conflict 应为 {' / '.join(CONFLICT_MODES)}")
+        self.db = db
+        self.parser = RowParser(fmt)
+        self.on_conflict = on_conflict
+        self.chunk_size = chunk_size
+        self._pending: List[Tuple[int, dict, List[str]]] = []
+        # CSV引号内的字段包含换行时，尚未结束的记录 (起始行号, 已读入的文本)
+        self._partial: Optional[Tuple[int, str]] = None
+        self._seen: set = set()
+        self.errors: List[dict] = []
+        self.started = time.monotonic()
+        self.stats = {"rows": 0, "created": 0, "updated": 0, "skipped": 0, "failed": 0, "aliases": 0, "chunks": 0}
+
+    def error(self, line: int, message: str, name: Optional[str] = None):
+        self.stats["failed"] += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"line": line, "name": name, "error": message})
+
+    def add_line(self, line: int, text: str) -> bool:
+        """解析、校验并缓存一行，返回缓存是否已满（满时调用 flush 写入）；CSV表头无效时抛出ValueError
+
+        CSV的一条记录可以跨多行（引号内的字段包含换行），引号未闭合时与后续行拼接后再解析，错误按记录的起始行报告。
+        """
+        if self.parser.fmt == "csv" and self._partial is not None:
+            line, text = self._partial[0], self._partial[1] + "\n" + text
+            self._partial = None
+        elif not text.strip():
+            return False
+        if self.parser.fmt == "csv" and text.count('"') % 2:
+            self._partial = (line, text)
+            return False
+        try:
+            raw = self.parser.parse(text)
+        except ValueError as e:
+            if self.parser.fmt == "csv" and self.parser.header is None:
+                raise
+            self.stats["rows"] += 1
+            self.error(line, str(e))
+            return False
+        if raw is None:
+            return False
+        self.stats["rows"] += 1
+        try:
+            fields, aliases = validate_device_row(raw)
+        except ValueError as e:
+            self.error(line, str(e), raw.get("name") if isinstance(raw, dict) else None)
+            return False
+        if fields["name"] in self._seen:
+            self.error(line, "名称在导入数据中重复", fields["name"])
+            return False
+        self._seen.add(fields["name"])
+        self._pending.append((line, fields, aliases))
+        return len(self._pending) >= self.chunk_size
+
+    def finish(self):
+        """输入结束：报告引号未闭合的CSV记录并写入剩余的行"""
+        if self._partial is not None:
+            line, _ = self._partial
+            self._partial = None
+            self.stats["rows"] += 1
+            self.error(line, "CSV引号未闭合")
+        self.flush()
+
+    def flush(self):
+        """把缓存的行写入一个事务"""
+        chunk, self._pending = self._pending, []
+        if not chunk:
+            return
+        failed, reported = self.stats["failed"], len(self.errors)
+        try:
+            counts = self._write_chunk(chunk)
+            self.db.commit()
+        except SQLAlchemyError as e:
+            self.db.rollback()
+            print(f"批量导入设备失败: {e}")
+            # 整块回滚，本块中已记录的错误改为写入失败
+            self.stats["failed"] = failed
+            del self.errors[reported:]
+            for line, fields, _ in chunk:
+                self.error(line, f"写入失败: {e.__class__.__name__}", fields["name"])
+            return
+        for key, value in counts.items():
+            self.stats[key] += value
+        self.stats["chunks"] += 1
+
+    def _write_chunk(self, chunk: List[Tuple[int, dict, List[str]]]) -> Dict[str, int]:
+        db = self.db
+        names = [fields["name"] for _, fields, _ in chunk]
+        existing: Dict[str, int] = dict(db.execute(_NAMES_TO_IDS_SQL, {"names": json.dumps(names)}).all())
+
+        inserts, updates, accepted = [], [], []
+        counts = {"created": 0, "updated": 0, "skipped": 0}
+        for line, fields, aliases in chunk:
+            device_id = existing.get(fields["name"])
+            if device_id is None:
+                inserts.append(fields)
+            elif self.on_conflict == CONFLICT_UPDATE:
+                updates.append(dict(fields, id=device_id))
+            elif self.on_conflict == CONFLICT_ERROR:
+                self.error(line, "设备名称已存在", fields["name"])
+                continue
+            else:
+                counts["skipped"] += 1
+                continue
+            accepted.append((line, fields, aliases))
+
+        if inserts:
+            statement = sqlite_insert(DeviceModel.__table__).on_conflict_do_nothing(index_elements=["name"])
+            result = db.connection().execute(statement, inserts)
+            counts["created"] = result.rowcount
+            # 写入期间被采集自动创建的同名设备视为已存在而跳过
+            counts["skipped"] += len(inserts) - result.rowcount
+        if updates:
+            db.execute(update(DeviceModel), updates)
+            counts["updated"] = len(updates)
+
+        alias_rows = self._alias_rows(accepted)
+        if alias_rows:
+            statement = sqlite_insert(DeviceAliasModel.__table__)
+            if self.on_conflict == CONFLICT_UPDATE:
+                statement = statement.on_conflict_do_update(
+                    index_elements=["alias"], set_={"device_id": statement.excluded.device_id}
+                )
+            else:
+                statement = statement.on_conflict_do_nothing(index_elements=["alias"])
+            db.connection().execute(statement, alias_rows)
+        counts["aliases"] = len(alias_rows)
+        return counts
+
+    def _alias_rows(self, accepted: List[Tuple[int, dict, List[str]]]) -> List[dict]:
+        """登记别名；非update模式下已属于其他设备的别名报错（设备本身仍会导入）"""
+        wanted = {alias for _, _, aliases in accepted for alias in aliases}
+        if not wanted:
+            return []
+        db = self.db
+        names = [fields["name"] for _, fields, aliases in accepted if aliases]
+        ids: Dict[str, int] = dict(db.execute(_NAMES_TO_IDS_SQL, {"names": json.dumps(names)}).all())
+        owners: Dict[str, int] = dict(db.execute(_ALIAS_OWNERS_SQL, {"aliases": json.dumps(sorted(wanted))}).all())
+        rows, claimed = [], {}
+        for line, fields, aliases in accepted:
+            device_id = ids.get(fields["name"])
+            for alias in aliases:
+                owner = claimed.get(alias, owners.get(alias))
+                if owner is not None and owner != device_id and self.on_conflict != CONFLICT_UPDATE:
+                    self.error(line, f"主题别名 {alias} 已属于设备 {owner}", fields["name"])
+                    continue
+                claimed[alias] = device_id
+                rows.append({"alias": alias, "device_id": device_id})
+        # 同一别名在本块中出现多次时以最后一行为准
+        return list({row["alias"]: row for row in rows}.values())
+
+    def result(self) -> dict:
+        elapsed = time.monotonic() - self.started
+        return dict(
+            self.stats,
+            on_conflict=self.on_conflict,
+            elapsed_ms=round(elapsed * 1000, 1),
+            rows_per_second=round(self.stats["rows"] / elapsed) if elapsed > 0 else None,
+            errors=self.errors,
+            errors_truncated=self.stats["failed"] > len(self.errors),
+        )
+
+
+def import_devices(db: Session, lines, fmt: str, on_conflict: str = CONFLICT_SKIP,
+                   chunk_size: int = BULK_CHUNK_SIZE) -> dict:
+    """同步导入（供脚本和测试使用），lines 为文本行的可迭代对象"""
+    importer = DeviceImporter(db, fmt, on_conflict, chunk_size)
+    for line_no, line in enumerate(lines, 1):
+        if importer.add_line(line_no, line.rstrip("\r\n")):
+            importer.flush()
+    importer.finish()
+    return importer.result()
+
+
+def iter_device_export(db: Session, fmt: str) -> Iterator[str]:
+    """按ID分页导出全部设备（含主题别名），CSV/NDJSON可直接重新导入"""
+    if fmt not in BULK_FORMATS:
+        raise ValueError(f"不支持的格式: {fmt}")
+    columns = [getattr(DeviceModel, field) for field in ("id",) + DEVICE_FIELDS]
+
+    if fmt == "csv":
+        buffer = io.StringIO()
+        csv.writer(buffer).writerow(EXPORT_FIELDS)
+        yield buffer.getvalue()
+    last_id = 0
+    while True:
+        rows = db.execute(
+            select(*columns).where(DeviceModel.id > last_id).order_by(DeviceModel.id).limit(_EXPORT_BATCH)
+        ).all()
+        if not rows:
+            return
+        last_id = rows[-1][0]
+        aliases: Dict[int, List[str]] = {}
+        for alias, device_id in db.execute(
+            select(DeviceAliasModel.alias, DeviceAliasModel.device_id)
+            .where(DeviceAliasModel.device_id.between(rows[0][0], last_id))
+            .order_by(DeviceAliasModel.alias)
+        ):
+            aliases.setdefault(device_id, []).append(alias)
+
+        if fmt == "csv":
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows(
+                ["" if value is None else value for value in row] + [ALIAS_SEPARATOR.join(aliases.get(row[0], []))]
+                for row in rows
+            )
+            yield buffer.getvalue()
+        else:
+            lines = []
+            for row in rows:
+                record = dict(zip(EXPORT_FIELDS, row))
+                record["aliases"] = aliases.get(row[0], [])
+                lines.append(json.dumps(record, ensure_ascii=False))
+            yield "\n".join(lines) + "\n"
@@ -0,0 +1,195 @@
+import base64
+import json
+from typing import List, Optional
+import sys
+import os
+
+from sqlalchemy import column, literal_column, or_, select, table, text, tuple_
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+# 修复相对导入问题
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+if parent_dir not in sys.path:
+    sys.path.append(parent_dir)
+
+from src.models import DeviceModel
+
+# 可排序的字段（都有索引），排序相同时按id保证翻页稳定
+SEARCH_SORT_KEYS = {
+    "id": DeviceModel.id,
+    "name": DeviceModel.name,
+    "location": DeviceModel.location,
+    "status": DeviceModel.status,
+    "device_type": DeviceModel.device_type,
+}
+SEARCH_ORDERS = ("asc", "desc")
+# prefix: 名称或位置以q开头；substring: 名称或位置包含q
+SEARCH_MATCH_MODES = ("prefix", "substring")
+MAX_SEARCH_LIMIT = 500
+# trigram索引只能匹配至少3个字符的子串，更短的子串退回LIKE扫描
+MIN_TRIGRAM_LENGTH = 3
+
+# 名称/位置的trigram全文索引（外部内容表，由触发器与devices表保持同步）
+_SEARCH_DDL = (
+    "CREATE INDEX IF NOT EXISTS ix_devices_name_nocase ON devices (name COLLATE NOCASE)",
+    "CREATE INDEX IF NOT EXISTS ix_devices_location_nocase ON devices (location COLLATE NOCASE)",
+)
+_FTS_DDL = (
+    "CREATE VIRTUAL TABLE devices_fts USING fts5("
+    "name, location, content='devices', content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER IF NOT EXISTS devices_fts_insert AFTER INSERT ON devices BEGIN "
+    "INSERT INTO devices_fts(rowid, name, location) VALUES (new.id, new.name, new.location); END",
+    "CREATE TRIGGER IF NOT EXISTS devices_fts_delete AFTER DELETE ON devices BEGIN "
+    "INSERT INTO devices_fts(devices_fts, rowid, name, location) VALUES ('delete', old.id, old.name, old.location); END",
+    "CREATE TRIGGER IF NOT EXISTS devices_fts_update AFTER UPDATE OF name, location ON devices BEGIN "
+    "INSERT INTO devices_fts(devices_fts, rowid, name, location) VALUES ('delete', old.id, old.name, old.location); "
+    "INSERT INTO devices_fts(rowid, name, location) VALUES (new.id, new.name, new.location); END",
+    "INSERT INTO devices_fts(devices_fts) VALUES ('rebuild')",
+)
+
+_fts = table("devices_fts", column("rowid"))
+# 各数据库的全文索引是否可用（SQLite需3.34+并启用FTS5）
+_fts_available = {}
+
+
+def ensure_device_search_index(bind) -> bool:
+    """创建设备搜索所需的索引和trigram全文索引（已存在时跳过），并更新统计信息供查询规划使用
+
+    返回全文索引是否可用；不可用时子串搜索退回LIKE扫描。
+    """
+    url = str(bind.url)
+    with bind.begin() as conn:
+        # 旧数据库的devices表在增加列索引之前就已创建
+        for index in DeviceModel.__table__.indexes:
+            index.create(conn, checkfirst=True)
+        for statement in _SEARCH_DDL:
+            conn.execute(text(statement))
+    exists = False
+    try:
+        with bind.begin() as conn:
+            exists = conn.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'devices_fts'")).first() is not None
+            if not exists:
+                for statement in _FTS_DDL:
+                    conn.execute(text(statement))
+                print("已建立设备搜索全文索引")
+        _fts_available[url] = True
+    except OperationalError as e:
+        print(f"设备搜索全文索引不可用，子串搜索将使用LIKE: {e}")
+        _fts_available[url] = False
+    with bind.begin() as conn:
+        conn.execute(text("ANALYZE devices"))
+    return _fts_available[url]
+
+
+def _fts_ready(db: Session) -> bool:
+    bind = db.get_bind()
+    url = str(bind.url)
+    if url not in _fts_available:
+        ensure_device_search_index(bind)
+    return _fts_available[url]
+
+
+def _like_escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def encode_cursor(sort: str, order: str, value, device_id: int) -> str:
+    raw = json.dumps([sort, order, value, device_id], ensure_ascii=False).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, sort: str, order: str):
+    """解析翻页游标，返回 (排序值, id)；游标与本次排序方式不一致时报错"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cursor_sort, cursor_order, value, device_id = json.loads(raw)
+    except (ValueError, TypeError):
+        raise ValueError("无效的翻页游标")
+    if cursor_sort != sort or cursor_order != order or not isinstance(device_id, int):
+        raise ValueError("翻页游标与排序方式不一致")
+    return value, device_id
+
+
+def _after_cursor(sort_column, id_column, order: str, value, device_id: int):
+    """键集分页条件：排序在游标之后的行（SQLite升序时NULL在前，降序时在后）"""
+    if sort_column is id_column:
+        return id_column > device_id if order == "asc" else id_column < device_id
+    if order == "asc":
+        if value is None:
+            return or_((sort_column.is_(None)) & (id_column > device_id), sort_column.isnot(None))
+        return tuple_(sort_column, id_column) > tuple_(value, device_id)
+    if value is None:
+        return (sort_column.is_(None)) & (id_column < device_id)
+    return or_(tuple_(sort_column, id_column) < tuple_(value, device_id), sort_column.is_(None))
+
+
+def search_devices(
+    db: Session,
+    q: Optional[str] = None,
+    match: str = "substring",
+    status: Optional[List[str]] = None,
+    device_type: Optional[List[str]] = None,
+    mqtt_config_id: Optional[List[int]] = None,
+    topic_config_id: Optional[List[int]] = None,
+    sort: str = "id",
+    order: str = "asc",
+    cursor: Optional[str] = None,
+    limit: int = 50,
+) -> dict:
+    """按名称/位置搜索设备并过滤、排序，键集分页
+
+    返回 {"items": [DeviceModel...], "next_cursor": 下一页游标或None}。
+    子串搜索（至少3个字符）使用trigram全文索引，前缀搜索使用NOCASE索引，均不区分大小写。
+    """
+    if sort not in SEARCH_SORT_KEYS:
+        raise ValueError(f"不支持的排序字段: {sort}")
+    if order not in SEARCH_ORDERS:
+        raise ValueError(f"不支持的排序方向: {order}")
+    if match not in SEARCH_MATCH_MODES:
+        raise ValueError(f"不支持的匹配方式: {match}")
+    limit = max(1, min(limit, MAX_SEARCH_LIMIT))
+
+    query = db.query(DeviceModel)
+    id_column = DeviceModel.id
+    q = (q or "").strip()
+    if q and match == "substring" and len(q) >= MIN_TRIGRAM_LENGTH and _fts_ready(db):
+        condition = literal_column("devices_fts").op("MATCH")('"' + q.replace('"', '""') + '"')
+        if sort == "id":
+            # 按全文索引的rowid顺序遍历，匹配很多行时也能在取满一页后停止
+            query = query.join(_fts, _fts.c.rowid == DeviceModel.id).filter(condition)
+            id_column = _fts.c.rowid
+        else:
+            query = query.filter(DeviceModel.id.in_(select(_fts.c.rowid).where(condition)))
+    elif q:
+        pattern = _like_escape(q) + "%"
+        if match == "substring":
+            pattern = "%" + pattern
+        query = query.filter(or_(DeviceModel.name.like(pattern, escape="\\"),
+                                 DeviceModel.location.like(pattern, escape="\\")))
+
+    for field, values in (("status", status), ("device_type", device_type),
+                          ("mqtt_config_id", mqtt_config_id), ("topic_config_id", topic_config_id)):
+        if values:
+            query = query.filter(getattr(DeviceModel, field).in_(values))
+
+    sort_column = id_column if sort == "id" else SEARCH_SORT_KEYS[sort]
+    if cursor:
+        value, device_id = decode_cursor(cursor, sort, order)
+        query = query.filter(_after_cursor(sort_column, id_column, order, value, device_id))
+    if sort == "id":
+        ordering = [sort_column.asc() if order == "asc" else sort_column.desc()]
+    elif order == "asc":
+        ordering = [sort_column.asc(), id_column.asc()]
+    else:
+        ordering = [sort_column.desc(), id_column.desc()]
+
+    items = query.order_by(*ordering).limit(limit + 1).all()
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        last = items[-1]
+        next_cursor = encode_cursor(sort, order, getattr(last, sort), last.id)
+    return {"items": items, "next_cursor": next_cursor}
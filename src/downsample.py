@@ -0,0 +1,169 @@
+from datetime import datetime
+from typing import List, Optional, Tuple
+import sys
+import os
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+# 修复相对导入问题
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+if parent_dir not in sys.path:
+    sys.path.append(parent_dir)
+
+from src.models import SensorBlockModel
+from src.block_store import HISTORY_BACKEND, to_epoch_ms
+from src.analytics import EPOCH_MS_SQL, HISTORY_FILTER_SQL, fetch_raw, history_params, load_series
+from src.db_operations import fan_out, get_device_shards
+
+# 原始点数超过 目标点数 × RAW_FACTOR 时改用汇总数据（块汇总或SQL分桶聚合）再做LTTB
+RAW_FACTOR = int(os.getenv("CHART_RAW_FACTOR", "50"))
+# 使用分桶聚合时，聚合桶数为目标点数的倍数，LTTB再从中选点
+ROLLUP_FACTOR = 4
+
+_RANGE_SQL = f"""
+    SELECT COUNT(*), {EPOCH_MS_SQL.format(column="MIN(timestamp)")}, {EPOCH_MS_SQL.format(column="MAX(timestamp)")}
+    FROM sensor_history
+    {HISTORY_FILTER_SQL}
+"""
+
+_BUCKET_SQL = f"""
+    SELECT CAST(AVG(ts) AS INTEGER), AVG(value), MIN(value), MAX(value)
+    FROM (
+        SELECT {EPOCH_MS_SQL.format(column="timestamp")} AS ts, value
+        FROM sensor_history
+        {HISTORY_FILTER_SQL}
+    )
+    GROUP BY CAST((ts - :range_start) / :bucket_ms AS INTEGER)
+    ORDER BY 1
+"""
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """Largest-Triangle-Three-Buckets：返回保留点的下标
+
+    首尾点必选；中间的点均分为 threshold-2 个桶，每个桶选与上一个选中点、
+    下一个桶平均点构成三角形面积最大的点，保留曲线的形状和峰谷。
+    """
+    count = len(x)
+    if threshold >= count or threshold < 3:
+        return np.arange(count)
+
+    x = x.astype(np.float64)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    every = (count - 2) / (threshold - 2)
+    previous = 0
+    for bucket in range(threshold - 2):
+        start = int(bucket * every) + 1
+        end = int((bucket + 1) * every) + 1
+        next_end = min(int((bucket + 2) * every) + 1, count)
+        if end >= count - 1 or next_end <= end:
+            avg_x, avg_y = x[count - 1], y[count - 1]
+        else:
+            avg_x, avg_y = x[end:next_end].mean(), y[end:next_end].mean()
+        areas = np.abs(
+            (x[previous] - avg_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (avg_y - y[previous])
+        )
+        previous = start + int(areas.argmax())
+        selected[bucket + 1] = previous
+    selected[-1] = count - 1
+    return selected
+
+
+def _block_rollups(db: Session, device_id: int, sensor_type: str,
+                   start: Optional[datetime], end: Optional[datetime]):
+    """块汇总：每个块取 (中点时间, 均值, 最小值, 最大值)，不解码BLOB"""
+    query = db.query(
+        SensorBlockModel.start_ts, SensorBlockModel.end_ts, SensorBlockModel.count,
+        SensorBlockModel.sum_value, SensorBlockModel.min_value, SensorBlockModel.max_value,
+    ).filter(SensorBlockModel.device_id == device_id, SensorBlockModel.type == sensor_type)
+    if start:
+        query = query.filter(SensorBlockModel.end_ts >= to_epoch_ms(start))
+    if end:
+        query = query.filter(SensorBlockModel.start_ts <= to_epoch_ms(end))
+    return query.order_by(SensorBlockModel.start_ts).all()
+
+
+def _count_points(db: Session, shards: List[int], device_id: int, sensor_type: str,
+                  start: Optional[datetime], end: Optional[datetime]) -> Tuple[int, Optional[int], Optional[int]]:
+    """区间内的原始点数及首尾时间（块存储按块的索引列估算），分片时汇总各分片"""
+    ranges = [item for item in fan_out(db, shards, lambda session: [
+        _shard_points(session, device_id, sensor_type, start, end)]) if item[0]]
+    if not ranges:
+        return 0, None, None
+    return sum(item[0] for item in ranges), min(item[1] for item in ranges), max(item[2] for item in ranges)
+
+
+def _shard_points(db: Session, device_id: int, sensor_type: str,
+                  start: Optional[datetime], end: Optional[datetime]) -> Tuple[int, Optional[int], Optional[int]]:
+    if HISTORY_BACKEND == "blocks":
+        blocks = _block_rollups(db, device_id, sensor_type, start, end)
+        if not blocks:
+            return 0, None, None
+        return sum(block.count for block in blocks), blocks[0].start_ts, blocks[-1].end_ts
+    count, first, last = fetch_raw(db, _RANGE_SQL, history_params(device_id, sensor_type, start, end))[0]
+    return count, first, last
+
+
+def _rollup_series(db: Session, shards: List[int], device_id: int, sensor_type: str, start: Optional[datetime],
+                   end: Optional[datetime], first: int, last: int, buckets: int):
+    """各分片的汇总点按时间合并（分桶边界由全局首尾时间确定，各分片一致）"""
+    parts = fan_out(db, shards, lambda session: [
+        _shard_rollups(session, device_id, sensor_type, start, end, first, last, buckets)])
+    if len(parts) == 1:
+        return parts[0]
+    ts = np.concatenate([part[0] for part in parts])
+    order = np.argsort(ts, kind="stable")
+    return tuple(np.concatenate([part[index] for part in parts])[order] for index in range(4))
+
+
+def _shard_rollups(db: Session, device_id: int, sensor_type: str, start: Optional[datetime],
+                   end: Optional[datetime], first: int, last: int, buckets: int):
+    if HISTORY_BACKEND == "blocks":
+        blocks = _block_rollups(db, device_id, sensor_type, start, end)
+        ts = np.array([(block.start_ts + block.end_ts) // 2 for block in blocks], dtype=np.int64)
+        means = np.array([block.sum_value / block.count for block in blocks])
+        mins = np.array([block.min_value for block in blocks])
+        maxs = np.array([block.max_value for block in blocks])
+        return ts, means, mins, maxs
+
+    params = history_params(device_id, sensor_type, start, end)
+    params.update(range_start=first, bucket_ms=max(1, -(-(last - first + 1) // buckets)))
+    rows = fetch_raw(db, _BUCKET_SQL, params)
+    data = np.array(rows, dtype=np.float64).reshape(-1, 4)
+    return data[:, 0].astype(np.int64), data[:, 1], data[:, 2], data[:, 3]
+
+
+def chart_series(db: Session, device_id: int, sensor_type: str, start: Optional[datetime] = None,
+                 end: Optional[datetime] = None, points: int = 800) -> dict:
+    """图表数据：列式数组，点数不超过points
+
+    原始点数不多时直接读原始点做LTTB；点数很多时先用汇总数据（块存储的块汇总，
+    或SQLite分桶聚合）缩减到 points×4 个桶，再做LTTB，同时返回每个点所代表区间的最小/最大值供绘制范围带。
+    """
+    shards = get_device_shards(db, device_id)
+    raw_points, first, last = _count_points(db, shards, device_id, sensor_type, start, end)
+    result = {"device_id": device_id, "type": sensor_type, "raw_points": raw_points}
+    if raw_points == 0:
+        return dict(result, source="raw", timestamps=[], values=[])
+
+    if raw_points <= points * RAW_FACTOR:
+        ts, values = load_series(db, device_id, sensor_type, start, end, shards)
+        keep = lttb_indices(ts, values, points)
+        return dict(result, source="raw", timestamps=ts[keep].tolist(), values=values[keep].tolist())
+
+    ts, means, mins, maxs = _rollup_series(db, shards, device_id, sensor_type, start, end,
+                                           first, last, points * ROLLUP_FACTOR)
+    keep = lttb_indices(ts, means, points)
+    # 范围带覆盖从该点到下一个选中点之间的所有桶，尖峰不会因未被选中而丢失
+    return dict(
+        result,
+        source="rollup",
+        timestamps=ts[keep].tolist(),
+        values=means[keep].round(4).tolist(),
+        min=np.minimum.reduceat(mins, keep).tolist(),
+        max=np.maximum.reduceat(maxs, keep).tolist(),
+    )
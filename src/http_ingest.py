@@ -0,0 +1,262 @@
+import codecs
+import functools
+import json
+import math
+import threading
+import time
+from datetime import datetime
+from typing import AsyncIterator, List, Optional, Tuple
+import sys
+import os
+
+# 修复相对导入问题
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+if parent_dir not in sys.path:
+    sys.path.append(parent_dir)
+
+from src.device_bulk import MAX_NAME_LENGTH, MAX_REPORTED_ERRORS, aiter_lines
+from src.tracing import parse_timestamp_value
+
+# 每攒够这么多条记录交给写入管道一次（在线程池中提交，队列满时阻塞，背压传导给客户端）
+HTTP_INGEST_CHUNK = int(os.getenv("HTTP_INGEST_CHUNK", "1000"))
+# 单条记录提交到队列的最长等待时间（秒）
+HTTP_INGEST_SUBMIT_TIMEOUT = float(os.getenv("HTTP_INGEST_SUBMIT_TIMEOUT", "30"))
+# 请求体读完后等待全部记录提交的最长时间（秒）
+HTTP_INGEST_COMMIT_TIMEOUT = float(os.getenv("HTTP_INGEST_COMMIT_TIMEOUT", "60"))
+# 设备时间戳允许的范围：最多早于当前时间的天数、最多晚于当前时间的秒数
+HTTP_INGEST_MAX_AGE_DAYS = float(os.getenv("HTTP_INGEST_MAX_AGE_DAYS", "30"))
+HTTP_INGEST_MAX_SKEW = 300
+# JSON数组中单条记录的最大长度，超过仍无法解析视为格式错误
+MAX_RECORD_BYTES = 64 * 1024
+# 结构化读数使用的虚拟主题前缀（用于限速键和追踪）
+HTTP_TOPIC_PREFIX = "http"
+
+
+class JsonArrayParser:
+    """增量解析JSON数组：每次 feed 一段文本，返回其中已完整的元素；格式错误时抛出 ValueError"""
+
+    def __init__(self):
+        self._decoder = json.JSONDecoder()
+        self._buffer = ""
+        self._started = False
+        self.finished = False
+
+    def feed(self, text: str, eof: bool = False) -> list:
+        buffer = self._buffer + text
+        pos = 0
+        items = []
+        while not self.finished:
+            while pos < len(buffer) and (buffer[pos] in " \t\r\n" or (self._started and buffer[pos] == ",")):
+                pos += 1
+            if pos >= len(buffer):
+                break
+            if not self._started:
+                if buffer[pos] != "[":
+                    raise ValueError("请求体应为JSON数组或NDJSON")
+                self._started = True
+                pos += 1
+                continue
+            if buffer[pos] == "]":
+                self.finished = True
+                pos += 1
+                break
+            try:
+                item, end = self._decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError as e:
+                # 记录可能只到达了一部分，等待后续数据
+                if eof or len(buffer) - pos > MAX_RECORD_BYTES:
+                    raise ValueError(f"JSON格式错误: {e.msg}")
+                break
+            items.append(item)
+            pos = end
+        self._buffer = buffer[pos:]
+        if eof and not self.finished:
+            raise ValueError("JSON数组不完整")
+        if self.finished and self._buffer.strip():
+            raise ValueError("JSON数组之后还有多余内容")
+        return items
+
+
+async def aiter_records(chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, object, Optional[str]]]:
+    """把请求体字节流增量解析为 (序号, 记录, 错误)：首个非空字符为 [ 时按JSON数组解析，
+    序号为元素序号；否则按NDJSON逐行解析，序号为行号。NDJSON中的坏行只影响该行，
+    JSON数组格式错误时抛出 ValueError"""
+    iterator = chunks.__aiter__()
+    head = b""
+    async for chunk in iterator:
+        head += chunk
+        if head.lstrip(b"\xef\xbb\xbf \t\r\n"):
+            break
+
+    async def body():
+        if head:
+            yield head
+        async for rest in iterator:
+            yield rest
+
+    if head.lstrip(b"\xef\xbb\xbf \t\r\n").startswith(b"["):
+        parser = JsonArrayParser()
+        decoder = codecs.getincrementaldecoder("utf-8-sig")()
+        index = 0
+        async for chunk in body():
+            for item in parser.feed(decoder.decode(chunk)):
+                index += 1
+                yield index, item, None
+        for item in parser.feed(decoder.decode(b"", final=True), eof=True):
+            index += 1
+            yield index, item, None
+        return
+
+    async for line_no, line in aiter_lines(body()):
+        try:
+            yield line_no, json.loads(line), None
+        except ValueError as e:
+            yield line_no, None, f"JSON格式错误: {e}"
+
+
+def _required_str(record: dict, field: str) -> str:
+    value = record.get(field)
+    if not isinstance(value, str) or not value.strip():
+        raise ValueError(f"{field} 不能为空")
+    return value.strip()
+
+
+def parse_record(record) -> Tuple[str, object]:
+    """校验一条采集记录，返回提交给写入管道的 (主题, 载荷)
+
+    - {topic, payload}: 与MQTT消息相同，载荷不是字符串时序列化为JSON
+    - {device, type, value, unit, ts}: 结构化读数，载荷为dict，由 SensorDataProcessor.process_reading 处理
+    """
+    if not isinstance(record, dict):
+        raise ValueError("记录应为JSON对象")
+
+    if "topic" in record:
+        topic = _required_str(record, "topic")
+        if "+" in topic or "#" in topic:
+            raise ValueError(f"主题不能包含通配符: {topic}")
+        payload = record.get("payload")
+        if payload is None:
+            raise ValueError("payload 不能为空")
+        if not isinstance(payload, str):
+            payload = json.dumps(payload, ensure_ascii=False)
+        return topic, payload
+
+    device = _required_str(record, "device")
+    if len(device) > MAX_NAME_LENGTH:
+        raise ValueError(f"device 不能超过 {MAX_NAME_LENGTH} 个字符")
+    sensor_type = _required_str(record, "type")
+    value = record.get("value")
+    if isinstance(value, str):
+        try:
+            value = float(value)
+        except ValueError:
+            raise ValueError(f"value 应为数值: {value!r}")
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        raise ValueError(f"value 应为数值: {value!r}")
+    unit = record.get("unit") or ""
+    if not isinstance(unit, str):
+        raise ValueError("unit 应为字符串")
+
+    ts = None
+    timestamp = None
+    if record.get("ts") is not None:
+        ts = parse_timestamp_value(record["ts"])
+        if ts is None:
+            raise ValueError(f"无法识别的时间戳: {record['ts']!r}")
+        now = time.time()
+        if not now - HTTP_INGEST_MAX_AGE_DAYS * 86400 <= ts <= now + HTTP_INGEST_MAX_SKEW:
+            raise ValueError(f"时间戳超出允许范围: {record['ts']!r}")
+        timestamp = datetime.utcfromtimestamp(ts)
+
+    payload = {"device": device, "type": sensor_type, "value": float(value), "unit": unit,
+               "ts": ts, "timestamp": timestamp}
+    return f"{HTTP_TOPIC_PREFIX}/{device}", payload
+
+
+class HttpIngestBatch:
+    """一次HTTP采集请求：校验记录、分块提交到写入管道，并等待已接收的记录全部处理完
+
+    写入管道中处理失败的记录（进入死信表）随批次提交，但计为失败而不是已提交。
+    """
+
+    def __init__(self, pipeline, submit_timeout: float = HTTP_INGEST_SUBMIT_TIMEOUT):
+        self.pipeline = pipeline
+        self.submit_timeout = submit_timeout
+        self.records = 0
+        self.accepted = 0
+        self.failed = 0
+        self.errors: List[dict] = []
+        self._pending: List[Tuple[int, str, object]] = []
+        # 写入管道已处理（批次已提交）的记录数及其中处理失败的记录数
+        self._processed = 0
+        self._rejected = 0
+        self._condition = threading.Condition()
+        self._started = time.perf_counter()
+
+    def add_error(self, index: int, error: str):
+        # 写入线程也会记录处理失败的记录
+        with self._condition:
+            self.failed += 1
+            if len(self.errors) < MAX_REPORTED_ERRORS:
+                self.errors.append({"index": index, "error": error})
+
+    def add_record(self, index: int, record, error: Optional[str] = None) -> bool:
+        """校验并暂存一条记录，返回暂存的记录是否已攒够一块"""
+        self.records += 1
+        if error is None:
+            try:
+                self._pending.append((index,) + parse_record(record))
+            except ValueError as e:
+                error = str(e)
+        if error is not None:
+            self.add_error(index, error)
+        return len(self._pending) >= HTTP_INGEST_CHUNK
+
+    def _on_committed(self):
+        with self._condition:
+            self._processed += 1
+            self._condition.notify_all()
+
+    def _on_failed(self, index: int, error: str):
+        with self._condition:
+            self._rejected += 1
+            self.add_error(index, error)
+
+    def flush(self):
+        """把暂存的记录提交到写入管道（阻塞，应在线程池中调用）"""
+        pending, self._pending = self._pending, []
+        for index, topic, payload in pending:
+            if self.pipeline.submit(topic, payload, on_committed=self._on_committed,
+                                    timeout=self.submit_timeout, reliable=True,
+                                    on_failed=functools.partial(self._on_failed, index)):
+                self.accepted += 1
+            else:
+                self.add_error(index, "采集队列已满，请稍后重试")
+
+    def wait(self, timeout: float = HTTP_INGEST_COMMIT_TIMEOUT) -> bool:
+        """等待已接收的记录全部处理完（阻塞，应在线程池中调用）"""
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while self._processed < self.accepted:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def result(self) -> dict:
+        elapsed = time.perf_counter() - self._started
+        with self._condition:
+            committed = self._processed - self._rejected
+            failed = self.failed
+            errors = list(self.errors)
+        return {
+            "records": self.records,
+            "accepted": self.accepted,
+            "committed": committed,
+            "failed": failed,
+            "errors": errors,
+            "elapsed_seconds": round(elapsed, 3),
+            "records_per_second": round(self.records / elapsed, 1) if elapsed > 0 else None,
+        }
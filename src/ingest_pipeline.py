@@ -0,0 +1,353 @@
+import queue
+import threading
+import time
+from typing import Callable, List, Optional
+import sys
+import os
+
+from sqlalchemy.exc import OperationalError
+
+# 修复相对导入问题
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+if parent_dir not in sys.path:
+    sys.path.append(parent_dir)
+
+from src.database import SessionLocal, shard_count, shard_for_key, shard_write_session_factory
+from src.admission import AdmissionQueue, OVERLOAD_POLICY, device_key
+from src.sensor_processor import SensorDataProcessor
+from src.tracing import MessageTrace, TraceRecorder
+from src.dead_letters import DEAD_LETTERS, DeadLetterStore, dead_letter_store
+
+# 批次提交失败后两次重试之间的最长等待（秒）
+COMMIT_RETRY_MAX_DELAY = float(os.getenv("INGEST_COMMIT_RETRY_MAX_DELAY", "5"))
+
+
+class IngestMessage:
+    """写入管道中的一条待处理消息"""
+
+    __slots__ = ("topic", "payload", "on_committed", "received_at", "trace", "timestamp", "on_failed")
+
+    def __init__(self, topic: str, payload, on_committed: Optional[Callable[[], None]] = None,
+                 received_at: Optional[float] = None, trace: Optional[MessageTrace] = None,
+                 timestamp: Optional[float] = None, on_failed: Optional[Callable[[str], None]] = None):
+        self.topic = topic
+        self.payload = payload
+        self.on_committed = on_committed
+        # 处理失败（进入死信表或被拒绝）时在批次提交后、on_committed之前调用，参数为错误信息
+        self.on_failed = on_failed
+        self.received_at = received_at or time.monotonic()
+        # 被采样时记录各阶段时间戳
+        self.trace = trace
+        # 补录历史消息时为原始的收到时间（Unix秒），作为读数时间；实时消息为None
+        self.timestamp = timestamp
+
+
+class IngestPipeline:
+    """批量写入管道
+
+    MQTT回调线程只负责把消息放入有界队列，由单独的写入线程按批次处理：
+    每条消息在SAVEPOINT中处理，单条消息出错不影响同批次其他消息；
+    整个批次提交成功后才调用各消息的 on_committed 回调（用于MQTT手动确认），处理失败的消息先调用 on_failed，
+    提交失败（如数据库被锁）时整批退避重试直到成功，从而实现至少一次投递；处理失败的消息写入死信表（与批次一起提交），修复解析后可重放。
+    消息先经过准入队列：单个设备超速的消息被丢弃，
+    队列满时按过载策略（block/drop_oldest/keep_latest/sample）处理，
+    保证刷屏设备不会拖慢其他设备的入库延迟。
+    """
+
+    def __init__(
+        self,
+        processor: Optional[SensorDataProcessor] = None,
+        session_factory=SessionLocal,
+        batch_size: int = 500,
+        flush_interval: float = 0.2,
+        max_queue: int = int(os.getenv("INGEST_MAX_QUEUE", "10000")),
+        commit_retries: int = 3,
+        overload_policy: str = OVERLOAD_POLICY,
+        admission: Optional[AdmissionQueue] = None,
+        tracer: Optional[TraceRecorder] = None,
+        dead_letters: Optional[DeadLetterStore] = None,
+    ):
+        self.processor = processor or SensorDataProcessor()
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.commit_retries = commit_retries
+        self._queue = admission or AdmissionQueue(maxsize=max_queue, policy=overload_policy)
+        self.tracer = tracer or TraceRecorder()
+        if dead_letters is None and DEAD_LETTERS:
+            dead_letters = dead_letter_store
+        self.dead_letters = dead_letters
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.stats = {
+            "received": 0,
+            "committed": 0,
+            "failed": 0,
+            "dead_letters": 0,
+            "batches": 0,
+            "commit_errors": 0,
+            "last_batch_size": 0,
+            "last_batch_ms": 0.0,
+            "last_queue_wait_ms": 0.0,
+        }
+
+    def submit(self, topic: str, payload, on_committed: Optional[Callable[[], None]] = None,
+               timeout: Optional[float] = None, received_at: Optional[float] = None,
+               reliable: bool = False, timestamp: Optional[float] = None,
+               on_failed: Optional[Callable[[str], None]] = None) -> bool:
+        """提交一条消息，返回是否被接收；被限速或过载策略丢弃时返回False（消息已确认），
+        block策略下队列满且超时也返回False。received_at为收到消息时的 time.monotonic()；
+        reliable为True时不限速也不丢弃，队列满时阻塞（HTTP批量采集）。
+        payload为dict时是已解析的结构化读数（见 SensorDataProcessor.process_reading）；
+        timestamp为补录消息的原始收到时间（Unix秒），缺省时读数时间取处理时的当前时间；
+        on_failed在消息处理失败时以错误信息调用，之后仍会调用on_committed"""
+        self.stats["received"] += 1
+        received_at = received_at or time.monotonic()
+        trace = self.tracer.start(topic, payload, received_at)
+        try:
+            return self._queue.put(IngestMessage(topic, payload, on_committed, received_at, trace, timestamp,
+                                                 on_failed),
+                                   timeout=timeout, reliable=reliable)
+        except queue.Full:
+            return False
+
+    def add_observer(self, observer: Callable[[int, str, object], None]):
+        """注册读数观察者（见 SensorDataProcessor.add_observer）"""
+        self.processor.add_observer(observer)
+
+    def start(self):
+        """启动写入线程"""
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name="ingest-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """停止写入线程，停止前会写完队列中已有的消息"""
+        with self._lock:
+            self._stop_event.set()
+            if self._thread:
+                self._thread.join(timeout)
+                self._thread = None
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """等待队列中所有消息处理完成（主要用于测试）"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    @property
+    def queue_size(self) -> int:
+        return self._queue.qsize()
+
+    @property
+    def admission(self) -> AdmissionQueue:
+        return self._queue
+
+    def status(self) -> dict:
+        """写入统计、准入队列的限流/丢弃计数、历史死区过滤及异常检测统计"""
+        history = self.processor.history_filter.status()
+        if self.processor.history_store:
+            history["blocks"] = self.processor.history_store.status()
+        result = dict(self.stats, queue_size=self.queue_size, admission=self._queue.status(), history=history)
+        if self.processor.anomaly_detector:
+            result["anomalies"] = self.processor.anomaly_detector.status()
+        return result
+
+    def _next_batch(self) -> List[IngestMessage]:
+        """取出一个批次：攒满batch_size条或等待flush_interval后返回"""
+        batch: List[IngestMessage] = []
+        try:
+            batch.append(self._queue.get(timeout=self.flush_interval))
+        except queue.Empty:
+            return batch
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stop_event.is_set() or not self._queue.empty():
+            batch = self._next_batch()
+            if not batch:
+                continue
+            try:
+                self.write_batch(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def write_batch(self, batch: List[IngestMessage]) -> bool:
+        """在一个事务中写入一批消息，提交成功后回调确认"""
+        started = time.monotonic()
+        if batch:
+            self.stats["last_queue_wait_ms"] = round((started - batch[0].received_at) * 1000, 2)
+        attempt = 0
+        # 分片会话先提交主库：分片提交失败后重试时，已随主库提交的死信不再重复记录
+        dead_persisted = set()
+        while True:
+            db = self.session_factory()
+            failed = 0
+            dead = 0
+            dead_recorded = []
+            rejected = []
+            try:
+                for message in batch:
+                    trace = message.trace
+                    if trace:
+                        trace.mark("started")
+                    self.processor.trace = trace
+                    self.processor.message_time = message.timestamp
+                    self.processor.begin_message()
+                    try:
+                        with db.begin_nested():
+                            self.processor.process_message(db, message.topic, message.payload)
+                    except OperationalError:
+                        # 数据库被锁等错误需要整批重试
+                        raise
+                    except Exception as e:
+                        # 保存点已回滚（包括释放保存点时flush失败），撤销这条消息暂存的处理器状态
+                        self.processor.message_rolled_back()
+                        failed += 1
+                        rejected.append((message, str(e)))
+                        print(f"处理消息时出错: {message.topic} - {e}")
+                        if self.dead_letters:
+                            if id(message) not in dead_persisted:
+                                self.dead_letters.record(db, message.topic, message.payload, e)
+                                dead_recorded.append(id(message))
+                            dead += 1
+                    finally:
+                        self.processor.trace = None
+                        self.processor.message_time = None
+                    if trace:
+                        trace.mark("processed")
+                self.processor.before_commit(db)
+                db.commit()
+                self.processor.after_commit()
+            except OperationalError as e:
+                if getattr(db, "main_committed", False):
+                    dead_persisted.update(dead_recorded)
+                db.rollback()
+                self.processor.after_rollback()
+                self.stats["commit_errors"] += 1
+                attempt += 1
+                if attempt <= self.commit_retries or attempt % 100 == 0:
+                    print(f"批次提交失败（第{attempt}次）: {e}")
+                if self._stop_event.is_set() and attempt >= self.commit_retries:
+                    break
+                # 连接不断开时broker不会重新投递未确认的消息，放弃这个批次就会丢失它们，
+                # 并且其未确认的消息id会一直占用在途窗口，因此持续退避重试直到提交成功
+                time.sleep(min(0.1 * 2 ** min(attempt - 1, 6), COMMIT_RETRY_MAX_DELAY))
+                continue
+            finally:
+                db.close()
+
+            self.stats["batches"] += 1
+            self.stats["committed"] += len(batch) - failed
+            self.stats["failed"] += failed
+            self.stats["dead_letters"] += dead
+            self.stats["last_batch_size"] = len(batch)
+            self.stats["last_batch_ms"] = round((time.monotonic() - started) * 1000, 2)
+            # 提交后新会话即可通过API读到这些读数
+            for message in batch:
+                if message.trace:
+                    message.trace.mark("committed")
+                    self.tracer.record(message.trace)
+            for message, error in rejected:
+                if message.on_failed:
+                    try:
+                        message.on_failed(error)
+                    except Exception as e:
+                        print(f"消息失败回调出错: {e}")
+            # 解析失败的消息重投也无法成功（已进入死信表），同样确认以免broker反复重发
+            for message in batch:
+                if message.on_committed:
+                    try:
+                        message.on_committed()
+                    except Exception as e:
+                        print(f"消息确认失败: {e}")
+            return True
+
+        # 只有停止管道时才会放弃：不确认这些消息，进程退出、会话重连后由broker重新投递
+        print(f"管道停止时批次仍无法提交，{len(batch)} 条消息未确认，重连后由broker重新投递")
+        return False
+
+
+class ShardedIngestPipeline:
+    """分片写入管道：每个分片一个 IngestPipeline（独立队列、写入线程和处理器），并行提交
+
+    消息按设备键（主题前两级）路由到分片，同一设备的消息始终由同一个写入线程按顺序处理；
+    对外接口与 IngestPipeline 相同。
+    """
+
+    def __init__(self, shards: Optional[int] = None, session_factories: Optional[list] = None,
+                 tracer: Optional[TraceRecorder] = None, **options):
+        count = len(session_factories) if session_factories else (shards or shard_count())
+        self.tracer = tracer or TraceRecorder()
+        self.pipelines = [
+            IngestPipeline(
+                processor=SensorDataProcessor(shard=shard),
+                session_factory=session_factories[shard] if session_factories else shard_write_session_factory(shard),
+                tracer=self.tracer,
+                **options,
+            )
+            for shard in range(count)
+        ]
+
+    def route(self, topic: str) -> "IngestPipeline":
+        return self.pipelines[shard_for_key(device_key(topic)) % len(self.pipelines)]
+
+    def submit(self, topic: str, payload, on_committed: Optional[Callable[[], None]] = None,
+               timeout: Optional[float] = None, received_at: Optional[float] = None,
+               reliable: bool = False, timestamp: Optional[float] = None,
+               on_failed: Optional[Callable[[str], None]] = None) -> bool:
+        return self.route(topic).submit(topic, payload, on_committed, timeout, received_at, reliable, timestamp,
+                                        on_failed)
+
+    def add_observer(self, observer: Callable[[int, str, object], None]):
+        for pipeline in self.pipelines:
+            pipeline.add_observer(observer)
+
+    def start(self):
+        for pipeline in self.pipelines:
+            pipeline.start()
+
+    def stop(self, timeout: float = 10.0):
+        for pipeline in self.pipelines:
+            pipeline.stop(timeout)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for pipeline in self.pipelines:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if not pipeline.flush(remaining):
+                return False
+        return True
+
+    @property
+    def queue_size(self) -> int:
+        return sum(pipeline.queue_size for pipeline in self.pipelines)
+
+    def status(self) -> dict:
+        shards = [pipeline.status() for pipeline in self.pipelines]
+        totals = {key: sum(shard[key] for shard in shards)
+                  for key in ("received", "batches", "committed", "failed", "dead_letters", "commit_errors")}
+        return dict(totals, queue_size=self.queue_size, shards=shards)
+
+
+# 创建全局写入管道实例（DB_SHARDS>1时每个分片一个写入线程）
+ingest_pipeline = IngestPipeline() if shard_count() == 1 else ShardedIngestPipeline()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+独立的MQTT采集进程
+
+HTTP服务以 MQTT_INGEST_ROLE=never 多worker运行时，由本进程负责MQTT订阅和入库：
+    python -m src.ingest_worker
+可以同时运行多个采集进程，它们通过租约选举，只有一个进程实际采集，
+领导者退出后其余进程自动接管。
+"""
+
+import signal
+import threading
+import sys
+import os
+
+# 添加项目根目录到路径中
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+if parent_dir not in sys.path:
+    sys.path.append(parent_dir)
+
+from src.database import Base, engine, init_shards
+from src.leader_service import LeaderElector
+from src.broker_pool import broker_pool
+from src.dashboard import dashboard_aggregator
+from src.latest_values import latest_publisher
+from src.journal import message_journal
+
+
+def on_elected():
+    broker_pool.enabled = True
+    dashboard_aggregator.set_enabled(True)
+    latest_publisher.set_enabled(True)
+    if broker_pool.sync():
+        print("MQTT采集已启动")
+
+
+def on_demoted():
+    broker_pool.enabled = False
+    dashboard_aggregator.set_enabled(False)
+    latest_publisher.set_enabled(False)
+    broker_pool.stop()
+
+
+def on_leader_tick():
+    # 同步HTTP进程中修改的配置
+    broker_pool.sync()
+
+
+def main():
+    Base.metadata.create_all(bind=engine)
+    init_shards()
+
+    stop_event = threading.Event()
+    signal.signal(signal.SIGINT, lambda *_: stop_event.set())
+    signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+
+    broker_pool.enabled = False
+    elector = LeaderElector(
+        name="mqtt_ingest",
+        on_elected=on_elected,
+        on_demoted=on_demoted,
+        on_leader_tick=on_leader_tick,
+    )
+    elector.start()
+    print(f"采集进程 {elector.holder_id} 已启动，等待选举结果...")
+
+    stop_event.wait()
+    print("正在停止采集进程...")
+    elector.stop()
+    message_journal.close()
+
+
+if __name__ == "__main__":
+    main()
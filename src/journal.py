@@ -0,0 +1,372 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+原始消息日志：MQTT消息在交给写入管道之前，按收到的顺序追加到分段的二进制日志文件，
+数据库被锁或进程在批次中途崩溃时可以从日志补录，修复解析后也可以重新处理历史消息：
+    python -m src.journal replay --start "2026-10-19 08:00" --end "2026-10-19 09:00" --workers 4
+    python -m src.journal stats
+补录会替换时间段内的历史（见 replay_journal），重复补录同一时间段是幂等的。
+"""
+
+import argparse
+import functools
+import mmap
+import multiprocessing
+import struct
+import threading
+import time
+import zlib
+from contextlib import redirect_stdout
+from datetime import datetime
+from typing import Iterator, List, Optional, Tuple
+import sys
+import os
+
+# 修复相对导入问题
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+if parent_dir not in sys.path:
+    sys.path.append(parent_dir)
+
+from src.admission import device_key
+from src.database import shard_count, shard_for_key
+
+# 是否记录原始消息日志
+MESSAGE_JOURNAL = os.getenv("MESSAGE_JOURNAL", "0") == "1"
+MESSAGE_JOURNAL_DIR = os.getenv("MESSAGE_JOURNAL_DIR", "./journal")
+# 单个分段文件的大小上限，超过后写入新分段
+JOURNAL_SEGMENT_BYTES = int(os.getenv("JOURNAL_SEGMENT_BYTES", str(64 * 1024 * 1024)))
+# 所有分段的总大小上限，超过后删除最早的分段
+JOURNAL_MAX_BYTES = int(os.getenv("JOURNAL_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+# 两次fsync之间的最长间隔（秒），0表示只写入操作系统缓存（进程崩溃不丢，断电可能丢最近的消息）
+JOURNAL_FSYNC_SECONDS = float(os.getenv("JOURNAL_FSYNC_SECONDS", "1"))
+# 补录时每次等待写入管道处理完的条数，以及提交失败的消息最多重新提交的轮数
+JOURNAL_REPLAY_CHUNK = 10000
+JOURNAL_REPLAY_ROUNDS = 5
+
+# 分段文件：8字节文件头 + 若干记录，文件名为第一条记录的收到时间（微秒），按名称排序即按时间排序
+_MAGIC = b"MQJRNL01"
+_SUFFIX = ".seg"
+# 记录头：主题+载荷的长度、CRC32（覆盖其后的全部字节）、收到时间（Unix秒）、主题长度
+_RECORD = struct.Struct("<IIdH")
+_CHECKED = struct.Struct("<dH")
+_MAX_TOPIC = 0xFFFF
+
+
+def _segment_start(name: str) -> float:
+    return int(name[:-len(_SUFFIX)]) / 1e6
+
+
+def list_segments(directory: str) -> List[Tuple[float, str]]:
+    """按时间排序的 (起始时间, 路径)"""
+    if not os.path.isdir(directory):
+        return []
+    return [(_segment_start(name), os.path.join(directory, name))
+            for name in sorted(os.listdir(directory)) if name.endswith(_SUFFIX) and name[:-len(_SUFFIX)].isdigit()]
+
+
+def encode_record(received: float, topic: str, payload: bytes) -> bytes:
+    topic_bytes = topic.encode()[:_MAX_TOPIC]
+    checked = _CHECKED.pack(received, len(topic_bytes)) + topic_bytes + payload
+    return struct.pack("<II", len(topic_bytes) + len(payload), zlib.crc32(checked)) + checked
+
+
+class MessageJournal:
+    """追加写入的分段日志（MQTT回调线程调用，各broker连接共用一个实例）
+
+    每条记录一次 os.write，进程崩溃时已写入的记录都在操作系统缓存中；启动后总是新建分段，
+    上次崩溃时写了一半的记录只会出现在旧分段末尾，读取时由长度和CRC识别并跳过。
+    """
+
+    def __init__(self, directory: str = MESSAGE_JOURNAL_DIR, segment_bytes: int = JOURNAL_SEGMENT_BYTES,
+                 max_bytes: int = JOURNAL_MAX_BYTES, fsync_seconds: float = JOURNAL_FSYNC_SECONDS):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.fsync_seconds = fsync_seconds
+        self._lock = threading.Lock()
+        self._fd: Optional[int] = None
+        self._size = 0
+        self._last_sync = 0.0
+        self.stats = {"records": 0, "bytes": 0, "segments": 0, "errors": 0}
+
+    def append(self, topic: str, payload, received: Optional[float] = None):
+        """记录一条消息，received 为收到时的Unix时间；写入失败只计数，不影响采集"""
+        received = time.time() if received is None else received
+        if isinstance(payload, str):
+            payload = payload.encode()
+        record = encode_record(received, topic, bytes(payload))
+        with self._lock:
+            try:
+                if self._fd is None or self._size + len(record) > self.segment_bytes:
+                    self._rotate(received)
+                os.write(self._fd, record)
+                self._size += len(record)
+                self.stats["records"] += 1
+                self.stats["bytes"] += len(record)
+                if self.fsync_seconds and time.monotonic() - self._last_sync >= self.fsync_seconds:
+                    os.fsync(self._fd)
+                    self._last_sync = time.monotonic()
+            except OSError as e:
+                self.stats["errors"] += 1
+                if self.stats["errors"] == 1 or self.stats["errors"] % 1000 == 0:
+                    print(f"写入消息日志失败: {e}")
+
+    def _rotate(self, received: float):
+        if self._fd is not None:
+            os.fsync(self._fd)
+            os.close(self._fd)
+            self._fd = None
+        os.makedirs(self.directory, exist_ok=True)
+        start = int(received * 1e6)
+        # 同一微秒内轮转（或时钟回拨）时顺延，保证文件名递增
+        segments = list_segments(self.directory)
+        if segments:
+            start = max(start, int(round(segments[-1][0] * 1e6)) + 1)
+        path = os.path.join(self.directory, f"{start:017d}{_SUFFIX}")
+        self._fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        os.write(self._fd, _MAGIC)
+        self._size = len(_MAGIC)
+        self.stats["segments"] += 1
+        self._enforce_retention(segments)
+
+    def _enforce_retention(self, segments):
+        """删除最早的分段，直到总大小不超过上限（当前分段不删除）"""
+        sizes = [(path, os.path.getsize(path)) for _, path in segments]
+        total = sum(size for _, size in sizes)
+        for path, size in sizes:
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+            print(f"消息日志超过 {self.max_bytes} 字节，已删除分段 {os.path.basename(path)}")
+
+    def close(self):
+        with self._lock:
+            if self._fd is not None:
+                os.fsync(self._fd)
+                os.close(self._fd)
+                self._fd = None
+
+
+def read_segment(path: str, start: float = 0.0, end: float = float("inf")) -> Iterator[Tuple[float, str, bytes]]:
+    """用mmap顺序读取一个分段中收到时间在 [start, end) 内的记录，遇到不完整或校验失败的记录时停止"""
+    with open(path, "rb") as file:
+        size = os.fstat(file.fileno()).st_size
+        if size <= len(_MAGIC):
+            return
+        with mmap.mmap(file.fileno(), size, access=mmap.ACCESS_READ) as view:
+            if view[:len(_MAGIC)] != _MAGIC:
+                print(f"不是消息日志分段: {path}")
+                return
+            position = len(_MAGIC)
+            header = _RECORD.size
+            while position + header <= size:
+                length, checksum, received, topic_length = _RECORD.unpack_from(view, position)
+                body = position + header
+                if body + length > size or topic_length > length or \
+                        zlib.crc32(view[position + 8:body + length]) != checksum:
+                    # 崩溃时写了一半的记录（或正在写入的分段的末尾）
+                    return
+                if start <= received < end:
+                    yield (received, view[body:body + topic_length].decode(errors="replace"),
+                           view[body + topic_length:body + length])
+                position = body + length
+
+
+def read_range(directory: str, start: float = 0.0, end: float = float("inf")) -> Iterator[Tuple[float, str, bytes]]:
+    """按时间顺序读取 [start, end) 内的记录，只打开时间范围有重叠的分段"""
+    segments = list_segments(directory)
+    for index, (segment_start, path) in enumerate(segments):
+        next_start = segments[index + 1][0] if index + 1 < len(segments) else float("inf")
+        if segment_start >= end or next_start <= start:
+            continue
+        try:
+            yield from read_segment(path, start, end)
+        except FileNotFoundError:
+            # 读取期间被保留策略删除
+            continue
+
+
+def journal_bounds(directory: str) -> Optional[Tuple[float, float]]:
+    """日志覆盖的时间范围：(第一个分段的起始时间, 最后一条记录的收到时间)，没有记录时为None"""
+    segments = list_segments(directory)
+    for _, path in reversed(segments):
+        last = None
+        try:
+            for received, _, _ in read_segment(path):
+                last = received
+        except FileNotFoundError:
+            continue
+        if last is not None:
+            return segments[0][0], last
+    return None
+
+
+def _processors(pipeline) -> list:
+    return [shard.processor for shard in getattr(pipeline, "pipelines", [pipeline])]
+
+
+def replay_journal(pipeline, directory: str = MESSAGE_JOURNAL_DIR, start: float = 0.0, end: float = float("inf"),
+                   worker: int = 0, workers: int = 1, chunk: int = JOURNAL_REPLAY_CHUNK,
+                   rounds: int = JOURNAL_REPLAY_ROUNDS, timeout: float = 600.0) -> dict:
+    """把 [start, end) 内的消息按原顺序不限速地交给写入管道，读数时间取消息的收到时间
+
+    workers>1 时按设备所属的分片把消息分给各worker，同一设备的消息始终由同一个worker按顺序处理。
+    每 chunk 条等待写入管道处理完，所在批次多次重试仍提交失败的消息（如与其他写入者争用主库写锁）重新提交，
+    最多 rounds 轮；读数带原始时间，晚到的旧读数不会覆盖更新的最新值。
+    补录以日志为准：[start, end) 与日志实际覆盖的时间范围的交集内，每个补录到的 (设备, 类型) 已有的历史读数和
+    异常事件先被删除（与第一条补录读数在同一事务中），再按日志重新写入，因此重复补录或补录实时采集过的时间段
+    不会产生重复的行；日志中没有消息的序列不受影响。
+    """
+    started = time.perf_counter()
+    totals = {"submitted": 0, "committed": 0}
+    pending: List[Tuple[float, str, bytes]] = []
+
+    def submit(messages):
+        done = []
+        for index, (received, topic, payload) in enumerate(messages):
+            pipeline.submit(topic, payload, on_committed=functools.partial(done.append, index), reliable=True,
+                            timestamp=received)
+        # 队列处理完后，提交成功的消息都已回调
+        pipeline.flush(timeout)
+        committed = set(done)
+        return [message for index, message in enumerate(messages) if index not in committed]
+
+    def drain():
+        remaining = pending[:]
+        del pending[:]
+        totals["submitted"] += len(remaining)
+        count = len(remaining)
+        for _ in range(rounds):
+            remaining = submit(remaining)
+            if not remaining:
+                break
+        totals["committed"] += count - len(remaining)
+
+    bounds = journal_bounds(directory)
+    if bounds is None:
+        return dict(totals, elapsed_seconds=round(time.perf_counter() - started, 3))
+    # 默认时间段为整个日志时，只替换日志覆盖的范围，日志之前和之后的历史保持不变
+    window = (datetime.utcfromtimestamp(max(start, bounds[0])),
+              datetime.utcfromtimestamp(min(end, bounds[1] + 1e-3)))
+    processors = _processors(pipeline)
+    for processor in processors:
+        processor.set_replace_window(window)
+    try:
+        for received, topic, payload in read_range(directory, start, end):
+            if workers > 1 and shard_for_key(device_key(topic)) % workers != worker:
+                continue
+            pending.append((received, topic, payload))
+            if len(pending) >= chunk:
+                drain()
+        drain()
+    finally:
+        for processor in processors:
+            processor.set_replace_window(None)
+    return dict(totals, elapsed_seconds=round(time.perf_counter() - started, 3))
+
+
+def _replay_worker(directory: str, start: float, end: float, worker: int, workers: int, quiet: bool) -> dict:
+    from src.database import engine, init_shards
+    from src.ingest_pipeline import IngestPipeline, ShardedIngestPipeline
+
+    engine.dispose()
+    init_shards()
+    options = {"flush_interval": 0.05}
+    pipeline = IngestPipeline(**options) if shard_count() == 1 else ShardedIngestPipeline(**options)
+    pipeline.start()
+    try:
+        if quiet:
+            # 处理器逐条打印解析过程，补录大量消息时输出本身就是瓶颈
+            with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+                result = replay_journal(pipeline, directory, start, end, worker, workers)
+        else:
+            result = replay_journal(pipeline, directory, start, end, worker, workers)
+    finally:
+        pipeline.stop()
+    result["dead_letters"] = pipeline.status().get("dead_letters", 0)
+    return result
+
+
+def replay_parallel(directory: str = MESSAGE_JOURNAL_DIR, start: float = 0.0, end: float = float("inf"),
+                    workers: int = 1, quiet: bool = True) -> dict:
+    """用 workers 个进程补录，每个进程负责一部分分片（workers 等于 DB_SHARDS 时各进程只写自己的分片库）
+
+    SQLite每个库只有一个写锁，单库时多个进程的批次会互相使对方提交失败，因此只用一个进程。
+    """
+    if workers > 1 and shard_count() == 1:
+        print("未分片（DB_SHARDS=1）时多个进程会争用同一个写锁，改为单进程补录")
+        workers = 1
+    started = time.perf_counter()
+    if workers <= 1:
+        results = [_replay_worker(directory, start, end, 0, 1, quiet)]
+    else:
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(workers) as pool:
+            results = pool.starmap(_replay_worker, [(directory, start, end, worker, workers, quiet)
+                                                    for worker in range(workers)])
+    elapsed = time.perf_counter() - started
+    totals = {key: sum(result[key] for result in results) for key in ("submitted", "committed", "dead_letters")}
+    return dict(totals, workers=workers, elapsed_seconds=round(elapsed, 3),
+                messages_per_second=round(totals["submitted"] / elapsed, 1) if elapsed > 0 else None)
+
+
+def journal_stats(directory: str = MESSAGE_JOURNAL_DIR) -> dict:
+    segments = list_segments(directory)
+    return {
+        "segments": len(segments),
+        "bytes": sum(os.path.getsize(path) for _, path in segments),
+        "first": datetime.utcfromtimestamp(segments[0][0]) if segments else None,
+        "last": datetime.utcfromtimestamp(segments[-1][0]) if segments else None,
+    }
+
+
+# 全局实例：各broker连接的 on_message 共用（MESSAGE_JOURNAL=1 时启用）
+message_journal = MessageJournal()
+
+
+def _parse_time(value: Optional[str], default: float) -> float:
+    """Unix秒或ISO时间（不带时区时按本地时间）"""
+    if not value:
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        moment = datetime.fromisoformat(value)
+        return moment.timestamp() if moment.tzinfo else moment.astimezone().timestamp()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="原始消息日志：统计和补录",
+        epilog="replay 以日志为准替换时间段内的数据：每个补录到的 (设备, 类型) 在 [start, end) 与日志覆盖范围的交集内"
+               "已有的历史读数和异常事件先被删除再按日志重新写入，重复补录同一时间段不会产生重复的行；"
+               "日志中没有消息的设备和类型不受影响，最新值只在补录的读数更新时才被覆盖",
+    )
+    parser.add_argument("command", choices=["stats", "replay"])
+    parser.add_argument("--dir", default=MESSAGE_JOURNAL_DIR, help="日志目录")
+    parser.add_argument("--start", help="起始时间（含），Unix秒或ISO格式，默认日志最早的记录；该时间之后的历史会被替换")
+    parser.add_argument("--end", help="结束时间（不含），默认日志最新的记录；该时间之前的历史会被替换")
+    parser.add_argument("--workers", type=int, default=1, help="并行补录的进程数")
+    parser.add_argument("--verbose", action="store_true", help="保留处理器的逐条输出")
+    args = parser.parse_args()
+
+    if args.command == "stats":
+        stats = journal_stats(args.dir)
+        print(f"{args.dir}: {stats['segments']} 个分段，{stats['bytes']} 字节，"
+              f"最早分段 {stats['first']}，最新分段 {stats['last']}（UTC）")
+        return
+
+    from src.database import Base, engine
+    import src.models  # noqa: F401  注册全部表
+    Base.metadata.create_all(bind=engine)
+    start = _parse_time(args.start, 0.0)
+    end = _parse_time(args.end, float("inf"))
+    result = replay_parallel(args.dir, start, end, max(1, args.workers), quiet=not args.verbose)
+    print(f"补录 {result['submitted']} 条消息，已提交 {result['committed']} 条，其中进入死信表 {result['dead_letters']} 条，"
+          f"{result['workers']} 个进程，{result['elapsed_seconds']} 秒，{result['messages_per_second']} 条/秒")
+
+
+if __name__ == "__main__":
+    main()
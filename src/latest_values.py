@@ -0,0 +1,332 @@
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows没有fcntl，不做多写入者保护
+    fcntl = None
+
+# 修复相对导入问题
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+if parent_dir not in sys.path:
+    sys.path.append(parent_dir)
+
+# 是否由采集进程把最新值发布到共享内存，供各HTTP worker直接读取
+LATEST_VALUES_SHM = os.getenv("LATEST_VALUES_SHM", "0") == "1"
+# 共享内存文件：Linux上默认放在 /dev/shm（内存文件系统）
+LATEST_VALUES_PATH = os.getenv("LATEST_VALUES_PATH", os.path.join(
+    "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "mqtt_iot_latest_values"))
+# 槽位数（设备×传感器类型），满了之后新的序列不再发布（读接口随之整体回退到数据库）
+LATEST_VALUES_SLOTS = int(os.getenv("LATEST_VALUES_SLOTS", "32768"))
+
+# 文件头：魔数、版本、容量、已分配槽位数；其后是槽位用满后未能发布的读数条数
+_HEADER = struct.Struct("<4sIII")
+_OVERFLOW = struct.Struct("<I")
+_OVERFLOW_OFFSET = _HEADER.size
+HEADER_SIZE = 64
+_MAGIC = b"MQLV"
+_VERSION = 1
+# 槽位：seq、device_id、sensor_id、值、时间戳（Unix秒）、类型、单位、告警状态、设备名
+_RECORD = struct.Struct("<Iii4xdd32s12s8s56s")
+RECORD_SIZE = _RECORD.size
+_SEQ = struct.Struct("<I")
+# 时间戳在槽位内的偏移（读者按时间排序时直接在共享内存上建立跨步视图）
+_TIMESTAMP_OFFSET = 24
+# 读者在写入者更新槽位时重试的次数
+_READ_RETRIES = 100
+
+
+def _text(raw: bytes) -> str:
+    return raw.rstrip(b"\0").decode("utf-8", "replace")
+
+
+def _fixed(text: str, size: int) -> bytes:
+    """按UTF-8截断到固定长度，不截断半个字符"""
+    raw = (text or "").encode("utf-8")
+    if len(raw) <= size:
+        return raw
+    return raw[:size].decode("utf-8", "ignore").encode("utf-8")
+
+
+class LatestValueWriter:
+    """共享内存最新值表的写入端（只在采集进程中使用）
+
+    每个 (设备, 传感器类型) 占一个定长槽位，槽位按首次出现的顺序分配且不回收；
+    每个槽位带一个序列号（seqlock）：写入前加一变为奇数，写完再加一变回偶数，
+    读者在序列号为奇数或前后不一致时重试，因此无需跨进程锁。
+    seqlock只允许一个写入者：同一时间只允许一个进程写入（文件锁），其他进程打开时失败；
+    进程内各分片的写入线程通过 _lock 串行写入。
+    """
+
+    def __init__(self, path: str = LATEST_VALUES_PATH, capacity: int = LATEST_VALUES_SLOTS):
+        self.path = path
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._slots: Dict[Tuple[int, str], int] = {}
+        self._lock_file = open(path + ".lock", "a")
+        if fcntl is not None:
+            try:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                self._lock_file.close()
+                raise RuntimeError(f"最新值共享内存已被其他进程写入: {path}")
+        size = HEADER_SIZE + capacity * RECORD_SIZE
+        adopted = False
+        try:
+            fd = os.open(path, os.O_RDWR)
+        except FileNotFoundError:
+            fd = None
+        if fd is not None:
+            try:
+                adopted = self._can_adopt(fd, size)
+                if adopted:
+                    self._map = mmap.mmap(fd, size)
+            finally:
+                os.close(fd)
+        if adopted:
+            # 重启后沿用已有槽位，读者的映射仍然有效
+            count = _HEADER.unpack_from(self._map, 0)[3]
+            for slot in range(count):
+                fields = _RECORD.unpack_from(self._map, HEADER_SIZE + slot * RECORD_SIZE)
+                self._slots[(fields[1], _text(fields[5]))] = slot
+        else:
+            # 新建文件后原子替换：读者仍映射着旧文件时不会因文件被截断而出错，并按inode变化重新映射
+            temp_path = path + ".tmp"
+            fd = os.open(temp_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                os.ftruncate(fd, size)
+                self._map = mmap.mmap(fd, size)
+            finally:
+                os.close(fd)
+            _HEADER.pack_into(self._map, 0, _MAGIC, _VERSION, capacity, 0)
+            os.replace(temp_path, path)
+
+    def _can_adopt(self, fd: int, size: int) -> bool:
+        if os.fstat(fd).st_size != size:
+            return False
+        header = os.pread(fd, _HEADER.size, 0)
+        magic, version, capacity, count = _HEADER.unpack(header)
+        return magic == _MAGIC and version == _VERSION and capacity == self.capacity and count <= capacity
+
+    def _slot(self, device_id: int, sensor_type: str) -> Optional[int]:
+        key = (device_id, sensor_type)
+        slot = self._slots.get(key)
+        if slot is not None:
+            return slot
+        with self._lock:
+            slot = self._slots.get(key)
+            if slot is None:
+                slot = len(self._slots)
+                if slot >= self.capacity:
+                    return None
+                self._slots[key] = slot
+        return slot
+
+    def publish(self, device_id: int, sensor_type: str, value: float, timestamp: float, unit: str = "",
+                alert_status: str = "", device_name: str = "", sensor_id: int = 0) -> bool:
+        """写入一个最新值，槽位已满时返回False（并计入溢出数，读者据此回退到数据库）"""
+        slot = self._slot(device_id, sensor_type)
+        if slot is None:
+            with self._lock:
+                dropped = _OVERFLOW.unpack_from(self._map, _OVERFLOW_OFFSET)[0]
+                _OVERFLOW.pack_into(self._map, _OVERFLOW_OFFSET, min(dropped + 1, 0xFFFFFFFF))
+            return False
+        offset = HEADER_SIZE + slot * RECORD_SIZE
+        packed = (_fixed(sensor_type, 32), _fixed(unit, 12), _fixed(alert_status, 8), _fixed(device_name, 56))
+        # 两个线程同时写同一槽位时序列号会错乱（读者可能读到混合的内容），写入必须串行
+        with self._lock:
+            seq = _SEQ.unpack_from(self._map, offset)[0]
+            # 奇数表示正在写入
+            _SEQ.pack_into(self._map, offset, (seq + 1) & 0xFFFFFFFF)
+            _RECORD.pack_into(self._map, offset, (seq + 1) & 0xFFFFFFFF, device_id, sensor_id or 0, float(value),
+                              timestamp, *packed)
+            _SEQ.pack_into(self._map, offset, (seq + 2) & 0xFFFFFFFF)
+            if slot >= self._published_count():
+                # 槽位内容写完后再对读者可见
+                struct.pack_into("<I", self._map, 12, slot + 1)
+        return True
+
+    def _published_count(self) -> int:
+        return struct.unpack_from("<I", self._map, 12)[0]
+
+    def status(self) -> dict:
+        return {"path": self.path, "capacity": self.capacity, "slots": len(self._slots)}
+
+    def close(self):
+        self._map.close()
+        self._lock_file.close()
+
+
+class LatestValueReader:
+    """共享内存最新值表的读取端（各HTTP worker使用），不查询数据库"""
+
+    def __init__(self, path: str = LATEST_VALUES_PATH):
+        self.path = path
+        self._map: Optional[mmap.mmap] = None
+        self._inode = None
+
+    def _open(self) -> bool:
+        try:
+            inode = os.stat(self.path).st_ino
+        except OSError:
+            return False
+        if self._map is not None and inode == self._inode:
+            return True
+        # 首次打开或写入者重建了文件（旧映射不主动关闭，其他线程可能正在读）
+        try:
+            fd = os.open(self.path, os.O_RDONLY)
+        except OSError:
+            return False
+        try:
+            stat = os.fstat(fd)
+            if stat.st_size < HEADER_SIZE:
+                return False
+            mapped = mmap.mmap(fd, stat.st_size, access=mmap.ACCESS_READ)
+        finally:
+            os.close(fd)
+        magic, version, capacity, _ = _HEADER.unpack_from(mapped, 0)
+        if magic != _MAGIC or version != _VERSION or stat.st_size != HEADER_SIZE + capacity * RECORD_SIZE:
+            mapped.close()
+            return False
+        self._inode = stat.st_ino
+        self._map = mapped
+        return True
+
+    @property
+    def available(self) -> bool:
+        return self._open()
+
+    @property
+    def overflowed(self) -> bool:
+        """槽位已用满、有序列未能发布（这时表中的最新值不完整）"""
+        return self._open() and _OVERFLOW.unpack_from(self._map, _OVERFLOW_OFFSET)[0] > 0
+
+    @staticmethod
+    def _read_slot(mapped: mmap.mmap, slot: int) -> Optional[tuple]:
+        offset = HEADER_SIZE + slot * RECORD_SIZE
+        for _ in range(_READ_RETRIES):
+            before = _SEQ.unpack_from(mapped, offset)[0]
+            if before & 1:
+                continue
+            fields = _RECORD.unpack_from(mapped, offset)
+            if fields[0] == before and _SEQ.unpack_from(mapped, offset)[0] == before:
+                return fields
+        return None
+
+    def _record(self, mapped: mmap.mmap, slot: int) -> Optional[dict]:
+        fields = self._read_slot(mapped, slot)
+        if fields is None or fields[0] == 0:
+            return None
+        _, device_id, sensor_id, value, timestamp, sensor_type, unit, alert_status, device_name = fields
+        return {
+            "id": sensor_id,
+            "device_id": device_id,
+            "device_name": _text(device_name),
+            "type": _text(sensor_type),
+            "value": value,
+            "unit": _text(unit),
+            "alert_status": _text(alert_status),
+            "timestamp": datetime.utcfromtimestamp(timestamp),
+        }
+
+    def _snapshot(self):
+        if not self._open():
+            return None, 0
+        mapped = self._map
+        count = min(_HEADER.unpack_from(mapped, 0)[3], (len(mapped) - HEADER_SIZE) // RECORD_SIZE)
+        return mapped, count
+
+    def records(self) -> List[dict]:
+        """所有槽位的快照（每个槽位内一致），表不可用时返回空列表"""
+        mapped, count = self._snapshot()
+        records = (self._record(mapped, slot) for slot in range(count))
+        return [record for record in records if record is not None]
+
+    def recent(self, limit: int) -> List[dict]:
+        """最近更新的limit个最新值，按时间倒序
+
+        先在共享内存上按时间戳列（不复制）选出候选槽位，只完整读取这些槽位；
+        正在写入的槽位时间戳可能不完整，仅影响排序候选，读取时仍经过序列号校验。
+        """
+        mapped, count = self._snapshot()
+        if not count:
+            return []
+        timestamps = np.ndarray((count,), dtype="<f8", buffer=mapped,
+                                offset=HEADER_SIZE + _TIMESTAMP_OFFSET, strides=(RECORD_SIZE,))
+        if count > limit:
+            slots = np.argpartition(timestamps, count - limit)[count - limit:]
+        else:
+            slots = np.arange(count)
+        del timestamps
+        records = (self._record(mapped, int(slot)) for slot in slots)
+        return sorted((record for record in records if record is not None),
+                      key=lambda record: record["timestamp"], reverse=True)
+
+    def latest_sensors(self, limit: int = 50) -> List[dict]:
+        """与 get_latest_sensors 相同的结构：最近更新的limit个读数按设备分组"""
+        devices = {}
+        for record in self.recent(limit):
+            device = devices.setdefault(record["device_id"], {
+                "device_id": record["device_id"],
+                "device_name": record["device_name"] or f"设备{record['device_id']}",
+                "sensors": [],
+            })
+            device["sensors"].append({key: record[key] for key in ("id", "type", "value", "unit", "timestamp")})
+        return list(devices.values())
+
+
+class LatestValuePublisher:
+    """采集进程中的发布入口：首次发布时打开写入端，打开失败（如另一个进程在写）后不再尝试
+
+    写入端持有文件锁，只能有一个进程发布：enabled 为False的进程（非采集领导者，
+    如其他worker中的HTTP采集）不打开写入端，降级时关闭写入端释放文件锁，供新的领导者打开。
+    """
+
+    def __init__(self, path: str = LATEST_VALUES_PATH, capacity: int = LATEST_VALUES_SLOTS,
+                 enabled: bool = True):
+        self.path = path
+        self.capacity = capacity
+        self.enabled = enabled
+        self._writer: Optional[LatestValueWriter] = None
+        self._failed = False
+        self._lock = threading.Lock()
+
+    def _open(self) -> Optional[LatestValueWriter]:
+        if self._writer is None and not self._failed:
+            try:
+                self._writer = LatestValueWriter(self.path, self.capacity)
+            except (OSError, RuntimeError) as e:
+                self._failed = True
+                print(f"无法打开最新值共享内存，停止发布: {e}")
+        return self._writer
+
+    def set_enabled(self, enabled: bool):
+        """采集领导者当选/降级时调用；当选时重新尝试打开写入端"""
+        with self._lock:
+            self.enabled = enabled
+            self._failed = False
+            if not enabled and self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+    def publish_many(self, values: List[tuple]):
+        # 持锁发布，降级时不会关闭正在写入的映射
+        with self._lock:
+            writer = self._open() if self.enabled else None
+            if writer:
+                for value in values:
+                    writer.publish(*value)
+
+
+# 全局实例：采集领导者发布（当选后启用），HTTP worker读取
+latest_publisher = LatestValuePublisher(enabled=False)
+latest_reader = LatestValueReader()
@@ -0,0 +1,206 @@
+import os
+import socket
+import threading
+import time
+import uuid
+from typing import Callable, Optional
+import sys
+
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+# 修复相对导入问题
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+if parent_dir not in sys.path:
+    sys.path.append(parent_dir)
+
+from src.database import SessionLocal
+from src.models import ServiceLeaseModel
+
+# 采集角色: auto=多个worker竞选，只有领导者负责MQTT采集; always=本进程总是采集; never=只提供HTTP服务
+INGEST_ROLE_AUTO = "auto"
+INGEST_ROLE_ALWAYS = "always"
+INGEST_ROLE_NEVER = "never"
+
+
+def get_ingest_role() -> str:
+    """从环境变量MQTT_INGEST_ROLE读取采集角色"""
+    role = os.getenv("MQTT_INGEST_ROLE", INGEST_ROLE_AUTO).strip().lower()
+    if role not in (INGEST_ROLE_AUTO, INGEST_ROLE_ALWAYS, INGEST_ROLE_NEVER):
+        print(f"未知的MQTT_INGEST_ROLE: {role}，使用 {INGEST_ROLE_AUTO}")
+        return INGEST_ROLE_AUTO
+    return role
+
+
+class LeaderElector:
+    """基于SQLite租约表的领导者选举
+
+    多个uvicorn worker共享同一个数据库，谁持有未过期的租约谁就是采集领导者。
+    领导者定期续约；进程退出或卡住导致租约过期后，其他worker会在下一次
+    续约周期内接管。
+    """
+
+    def __init__(
+        self,
+        name: str = "mqtt_ingest",
+        ttl: float = 15.0,
+        renew_interval: float = 5.0,
+        on_elected: Optional[Callable[[], None]] = None,
+        on_demoted: Optional[Callable[[], None]] = None,
+        on_leader_tick: Optional[Callable[[], None]] = None,
+        session_factory=SessionLocal,
+    ):
+        self.name = name
+        self.ttl = ttl
+        self.renew_interval = renew_interval
+        self.on_elected = on_elected
+        self.on_demoted = on_demoted
+        self.on_leader_tick = on_leader_tick
+        self.session_factory = session_factory
+        self.holder_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.is_leader = False
+        # 最近一次成功获取或续约后租约的到期时间
+        self.lease_expires_at = 0.0
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def try_acquire(self) -> bool:
+        """尝试获取或续约租约，返回当前是否为领导者"""
+        now = time.time()
+        db = self.session_factory()
+        try:
+            # 只有自己持有或租约已过期时才能更新，UPDATE在SQLite中是原子的
+            updated = db.query(ServiceLeaseModel).filter(
+                ServiceLeaseModel.name == self.name,
+                (ServiceLeaseModel.holder == self.holder_id) | (ServiceLeaseModel.expires_at < now),
+            ).update(
+                {
+                    ServiceLeaseModel.holder: self.holder_id,
+                    ServiceLeaseModel.expires_at: now + self.ttl,
+                },
+                synchronize_session=False,
+            )
+            if updated:
+                if not self.is_leader:
+                    db.query(ServiceLeaseModel).filter(
+                        ServiceLeaseModel.name == self.name
+                    ).update({ServiceLeaseModel.acquired_at: now}, synchronize_session=False)
+                db.commit()
+                self.lease_expires_at = now + self.ttl
+                return True
+
+            # 租约记录不存在时插入；并发插入由主键冲突保证只有一个成功
+            if db.query(ServiceLeaseModel).filter(ServiceLeaseModel.name == self.name).first() is None:
+                db.add(ServiceLeaseModel(
+                    name=self.name,
+                    holder=self.holder_id,
+                    expires_at=now + self.ttl,
+                    acquired_at=now,
+                ))
+                db.commit()
+                self.lease_expires_at = now + self.ttl
+                return True
+            db.rollback()
+            return False
+        except (IntegrityError, OperationalError) as e:
+            # 主键冲突或数据库被锁，本轮未能获取或续约租约
+            db.rollback()
+            print(f"获取租约 {self.name} 失败: {e.__class__.__name__}")
+            if isinstance(e, OperationalError) and self.is_leader \
+                    and now + self.renew_interval < self.lease_expires_at:
+                # 续约时数据库暂时被锁：租约尚未过期，其他worker不能接管，保持领导者身份等下一轮再续约；
+                # 下一轮之前租约就会过期时才降级，避免两个领导者同时采集
+                return True
+            return False
+        finally:
+            db.close()
+
+    def release(self):
+        """主动释放租约，便于其他worker立即接管"""
+        db = self.session_factory()
+        try:
+            db.query(ServiceLeaseModel).filter(
+                ServiceLeaseModel.name == self.name,
+                ServiceLeaseModel.holder == self.holder_id,
+            ).update({ServiceLeaseModel.expires_at: 0.0}, synchronize_session=False)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"释放租约 {self.name} 失败: {e}")
+        finally:
+            db.close()
+
+    def current_holder(self) -> Optional[dict]:
+        """返回当前租约信息"""
+        db = self.session_factory()
+        try:
+            lease = db.query(ServiceLeaseModel).filter(ServiceLeaseModel.name == self.name).first()
+            if not lease:
+                return None
+            return {
+                "holder": lease.holder,
+                "expires_in": round(lease.expires_at - time.time(), 2),
+                "acquired_at": lease.acquired_at,
+            }
+        finally:
+            db.close()
+
+    def tick(self):
+        """执行一轮选举并在角色变化时触发回调"""
+        acquired = self.try_acquire()
+        if acquired and not self.is_leader:
+            self.is_leader = True
+            print(f"{self.holder_id} 成为 {self.name} 领导者")
+            if self.on_elected:
+                try:
+                    self.on_elected()
+                except Exception as e:
+                    print(f"领导者启动回调失败: {e}")
+        elif acquired and self.on_leader_tick:
+            # 续约成功时执行巡检，例如其他worker激活了新配置后由领导者启动采集
+            try:
+                self.on_leader_tick()
+            except Exception as e:
+                print(f"领导者巡检回调失败: {e}")
+        elif not acquired and self.is_leader:
+            self.is_leader = False
+            print(f"{self.holder_id} 失去 {self.name} 租约")
+            if self.on_demoted:
+                try:
+                    self.on_demoted()
+                except Exception as e:
+                    print(f"领导者降级回调失败: {e}")
+
+    def _run(self):
+        while not self._stop_event.wait(self.renew_interval):
+            self.tick()
+
+    def start(self):
+        """执行首轮选举并启动后台续约线程"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self.tick()
+        self._thread = threading.Thread(target=self._run, name=f"leader-{self.name}", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """停止选举；若为领导者则先降级再释放租约"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(self.renew_interval + 1)
+        if self.is_leader:
+            self.is_leader = False
+            if self.on_demoted:
+                try:
+                    self.on_demoted()
+                except Exception as e:
+                    print(f"领导者降级回调失败: {e}")
+            self.release()
+
+    def status(self) -> dict:
+        return {
+            "holder_id": self.holder_id,
+            "is_leader": self.is_leader,
+            "lease": self.current_holder(),
+        }
@@ -1,38 +1,23 @@
 import os
 import sys
-from fastapi import FastAPI, Depends, HTTPException, status, Body
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, APIRouter, Depends, HTTPException, status, Body, Query, Header, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean, desc
-from sqlalchemy.orm import declarative_base
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import Any, List, Optional
 import json
+import threading
 from datetime import datetime
-from contextlib import contextmanager
+from contextlib import asynccontextmanager
 
 from fastapi import BackgroundTasks
 
 # 导入CORS中间件
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
 
-# 数据库配置
-SQLALCHEMY_DATABASE_URL = "sqlite:///./mqtt_iot.db"
-
-# 创建引擎
-from sqlalchemy import create_engine
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, 
-    connect_args={"check_same_thread": False}  # 仅用于SQLite
-)
-
-# 创建会话工厂
-from sqlalchemy.orm import sessionmaker
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-
-# 基础模型类
-Base = declarative_base()
+# 数据库配置（引擎、会话工厂和基础模型类统一由src.database提供）
+from src.database import engine, SessionLocal, Base, init_shards
 
 
 def get_db_session():
@@ -47,8 +32,9 @@ def get_db_session():
 # 数据模型定义
 from src.models import DeviceModel, SensorDataModel, MQTTConfigModel, TopicConfigModel
 
-# MQTT服务定义
-from src.mqtt_service import mqtt_service
+# MQTT服务定义（每个broker一个客户端，由连接池统一管理）
+from src.broker_pool import broker_pool
+from src.ingest_pipeline import ingest_pipeline
 
 # Pydantic模型定义
 class DeviceBase(BaseModel):
@@ -81,6 +67,17 @@ class Device(DeviceBase):
         from_attributes = True
 
 
+class DeviceSearchResult(BaseModel):
+    items: List[Device]
+    next_cursor: Optional[str] = None
+
+
+class DeadLetterReplay(BaseModel):
+    reason: Optional[str] = None
+    topic: Optional[str] = None  # 主题前缀
+    ids: Optional[List[int]] = None
+
+
 class SensorDataBase(BaseModel):
     device_id: int
     type: str
@@ -159,20 +156,42 @@ class TopicConfig(TopicConfigBase):
         from_attributes = True
 
 
-    get_devices, get_device, create_device, update_device, delete_device, 
-    get_device_history, get_device_sensors, get_realtime_sensors, get_latest_sensors,
-    get_mqtt_configs, get_mqtt_config_by_id, create_mqtt_config, update_mqtt_config,
-    delete_mqtt_config, activate_mqtt_config, get_active_topic_config, get_active_mqtt_config,  # 添加导入
-    get_topic_configs, get_topic_config_by_id, create_topic_config, update_topic_config,
-    delete_topic_config, activate_topic_config, get_latest_device_sensors, fix_device_status_null_values
->>>>>>> 431a81accd9303063fe1d8167eac1291ec82c540
-)
+class DeviceCommand(BaseModel):
+    command: str
+    value: Optional[Any] = None
+    qos: int = Field(1, ge=0, le=2)
+    timeout: float = Field(10.0, gt=0, le=300)
+    ack_type: Optional[str] = None  # 用于确认的状态类型，默认按命令名推断（relay -> Relay Status）
+    wait: bool = False  # 是否等待设备确认后再返回
+
+
+class BatchCommand(BaseModel):
+    command: str
+    value: Optional[Any] = None
+    device_ids: Optional[List[int]] = None  # 为空时下发给全部设备
+    qos: int = Field(1, ge=0, le=2)
+    timeout: float = Field(30.0, gt=0, le=600)
+    ack_type: Optional[str] = None
+
+
+class ProfileStart(BaseModel):
+    target: str = "ingest"  # ingest / http / all
+    duration: float = Field(30, gt=0)
+    interval_ms: float = Field(10, ge=1, le=1000)
+    include_idle: bool = False  # 是否计入等待中的线程（队列、select等）
+
+
+class MemoryTraceStart(BaseModel):
+    duration: float = Field(300, gt=0)
+    frames: int = Field(10, ge=1, le=64)
+
+
 # 导入数据库操作函数
 from src.db_operations import (
     get_device_by_id, get_device, get_device_by_name, get_devices, create_device, update_device, delete_device,
     get_mqtt_configs, create_mqtt_config, get_mqtt_config_by_id, update_mqtt_config, delete_mqtt_config, activate_mqtt_config,
     get_active_mqtt_config, get_active_topic_config, 
-    delete_topic_config, activate_topic_config, deactivate_topic_config, get_latest_device_sensors, get_device_history, get_device_sensors, get_realtime_sensors, get_latest_sensors, get_topic_configs, get_topic_config_by_id, create_topic_config, update_topic_config,  # 添加get_topic_configs等函数导入
+    delete_topic_config, activate_topic_config, deactivate_topic_config, get_latest_device_sensors, get_device_history, get_anomaly_events, get_device_sensors, get_realtime_sensors, get_latest_sensors, get_recent_sensor_rows, get_topic_configs, get_topic_config_by_id, create_topic_config, update_topic_config,  # 添加get_topic_configs等函数导入
     fix_device_status_null_values
 )
 
@@ -181,42 +200,195 @@ import paho.mqtt.client as mqtt
 import re
 
 # 从外部导入MQTT服务
-from src.mqtt_service import mqtt_service, get_active_mqtt_config, get_active_topic_config
+from src.mqtt_service import get_active_mqtt_config, get_active_topic_config
+
+# 后台启动服务
+from src.startup_service import startup_service
+
+# 设备命令下发
+from src.command_service import CommandError, command_service
+
+# 在线性能分析（采样调用栈、内存增长）
+from src.profiler import ProfilerError, memory_profiler, sampling_profiler
+
+from src.device_search import MAX_SEARCH_LIMIT, ensure_device_search_index, search_devices
+from src.dashboard import dashboard_aggregator, ensure_device_counters, get_dashboard_summary
+from src.traffic import get_traffic_top
+from src.dead_letters import list_dead_letters, replay_dead_letters, summarize_dead_letters
+from src.journal import message_journal
+# 设备批量导入导出
+from src.device_bulk import CONFLICT_SKIP, DeviceImporter, aiter_lines, iter_device_export
+from src.http_ingest import HttpIngestBatch, aiter_records
+from src.static_assets import FRONTEND_DIST, SpaShell, StaticAssets
+# 采集进程发布到共享内存的最新值
+from src.latest_values import LATEST_VALUES_SHM, latest_publisher, latest_reader
+
+# 历史数据统计分析与图表降采样
+from src.analytics import device_stats
+from src.downsample import chart_series
+
+# 多worker采集领导者选举
+from src.leader_service import (
+    LeaderElector, get_ingest_role, INGEST_ROLE_ALWAYS, INGEST_ROLE_NEVER,
+)
 
 
 def start_mqtt_service():
     """启动MQTT服务"""
-    return mqtt_service.start()
+    return broker_pool.sync()
+
+
+def stop_mqtt_service():
+    """停止MQTT服务"""
+    broker_pool.stop()
+
+
+def ensure_mqtt_service():
+    """领导者巡检：同步其他worker修改的配置，启动新激活的broker并停止已停用的broker"""
+    broker_pool.sync()
+
+
+def on_ingest_elected():
+    broker_pool.enabled = True
+    dashboard_aggregator.set_enabled(True)
+    latest_publisher.set_enabled(True)
+    start_mqtt_in_background()
 
 
-# 创建数据库表
-Base.metadata.create_all(bind=engine)
+def on_ingest_demoted():
+    broker_pool.enabled = False
+    dashboard_aggregator.set_enabled(False)
+    latest_publisher.set_enabled(False)
+    stop_mqtt_service()
 
-# 修复数据库中可能存在的NULL状态值
-with SessionLocal() as db:
-    fix_device_status_null_values(db)
 
-# 创建FastAPI应用
-app = FastAPI()
+# 采集领导者选举器（仅在 MQTT_INGEST_ROLE=auto 时启动）
+ingest_elector = LeaderElector(
+    name="mqtt_ingest",
+    on_elected=on_ingest_elected,
+    on_demoted=on_ingest_demoted,
+    on_leader_tick=ensure_mqtt_service,
+)
+
 
-# 添加动态CORS中间件
-app.add_middleware(CORSMiddlewareForLAN)
+# 局域网内的前端开发服务器（如Vite的3000端口）需要跨域访问API
+LAN_ORIGIN_REGEX = (
+    r"https?://(localhost|127\.0\.0\.1|10\.\d+\.\d+\.\d+|192\.168\.\d+\.\d+"
+    r"|172\.(1[6-9]|2\d|3[01])\.\d+\.\d+)(:\d+)?"
+)
 
 # 获取当前文件所在目录的路径
 current_dir = os.path.dirname(os.path.abspath(__file__))
 
 # 使用绝对路径挂载静态文件目录
 static_dir = os.path.join(current_dir, "static")
-app.mount("/static", StaticFiles(directory=static_dir), name="static")
 
+# API路由
+router = APIRouter()
+
+# 前端页面路由，必须在所有API路由之后注册
+spa_router = APIRouter()
 
-@app.get("/api/devices", response_model=List[Device])
+
+@router.get("/healthz")
+async def healthz():
+    """存活探针：进程能响应请求即返回200"""
+    return {"status": "ok"}
+
+
+@router.get("/readyz")
+async def readyz():
+    """就绪探针：数据库预热完成且MQTT已连接（或未配置MQTT）时返回200"""
+    if not broker_pool.enabled:
+        # 非领导者worker只提供HTTP服务
+        mqtt_state = "standby"
+    elif not broker_pool.services:
+        mqtt_state = "disabled" if not startup_service.is_running else "starting"
+    else:
+        mqtt_state = "connected" if broker_pool.is_connected else "connecting"
+    ready = startup_service.db_ready and mqtt_state in ("connected", "disabled", "standby")
+    body = {
+        "status": "ready" if ready else "not_ready",
+        "db": "ready" if startup_service.db_ready else "warming",
+        "mqtt": mqtt_state,
+        "ingest_role": get_ingest_role(),
+        "ingest_leader": ingest_elector.is_leader,
+        "startup": startup_service.status(),
+    }
+    return JSONResponse(body, status_code=200 if ready else 503)
+
+
+@router.get("/api/devices", response_model=List[Device])
 async def get_devices_api(skip: int = 0, limit: int = 100, db: Session = Depends(get_db_session)):
     devices = get_devices(db, skip=skip, limit=limit)
     return devices
 
 
-@app.get("/api/devices/{device_id}", response_model=Device)
+@router.get("/api/devices/search", response_model=DeviceSearchResult)
+def search_devices_api(
+    q: Optional[str] = None,
+    match: str = Query("substring", pattern="^(prefix|substring)$"),
+    status: Optional[List[str]] = Query(None),
+    device_type: Optional[List[str]] = Query(None),
+    mqtt_config_id: Optional[List[int]] = Query(None),
+    topic_config_id: Optional[List[int]] = Query(None),
+    sort: str = Query("id", pattern="^(id|name|location|status|device_type)$"),
+    order: str = Query("asc", pattern="^(asc|desc)$"),
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=MAX_SEARCH_LIMIT),
+    db: Session = Depends(get_db_session),
+):
+    try:
+        return search_devices(db, q=q, match=match, status=status, device_type=device_type,
+                              mqtt_config_id=mqtt_config_id, topic_config_id=topic_config_id,
+                              sort=sort, order=order, cursor=cursor, limit=limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.post("/api/devices/bulk")
+async def bulk_import_devices_api(
+    request: Request,
+    format: Optional[str] = Query(None, pattern="^(csv|ndjson)$", description="默认按Content-Type判断"),
+    on_conflict: str = Query(CONFLICT_SKIP, pattern="^(skip|update|error)$", description="名称已存在时的处理方式"),
+):
+    """批量导入设备：请求体为CSV（首行表头）或NDJSON，边接收边校验，每块在一个事务中写入，返回逐行错误"""
+    fmt = format or ("csv" if "csv" in request.headers.get("content-type", "") else "ndjson")
+    db = SessionLocal()
+    try:
+        importer = DeviceImporter(db, fmt, on_conflict)
+        async for line_no, text in aiter_lines(request.stream(), keep_blank=True):
+            if importer.add_line(line_no, text):
+                await run_in_threadpool(importer.flush)
+        await run_in_threadpool(importer.finish)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        db.close()
+    result = importer.result()
+    print(f"批量导入设备: {result['rows']} 行，新建 {result['created']}，更新 {result['updated']}，"
+          f"跳过 {result['skipped']}，失败 {result['failed']}，耗时 {result['elapsed_ms']} ms")
+    return result
+
+
+@router.get("/api/devices/export")
+def export_devices_api(format: str = Query("csv", pattern="^(csv|ndjson)$")):
+    """导出全部设备及主题别名，格式与批量导入一致"""
+    db = SessionLocal()
+
+    def generate():
+        try:
+            yield from iter_device_export(db, format)
+        finally:
+            db.close()
+
+    media_type = "text/csv; charset=utf-8" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(generate(), media_type=media_type, headers={
+        "Content-Disposition": f'attachment; filename="devices.{format}"',
+    })
+
+
+@router.get("/api/devices/{device_id}", response_model=Device)
 async def get_device_api(device_id: int, db: Session = Depends(get_db_session)):
     device = get_device(db, device_id)
     if not device:
@@ -224,13 +396,13 @@ async def get_device_api(device_id: int, db: Session = Depends(get_db_session)):
     return device
 
 
-@app.post("/api/devices", response_model=Device)
+@router.post("/api/devices", response_model=Device)
 async def create_device_api(device: DeviceCreate, db: Session = Depends(get_db_session)):
     db_device = create_device(db, device)
     return db_device
 
 
-@app.put("/api/devices/{device_id}", response_model=Device)
+@router.put("/api/devices/{device_id}", response_model=Device)
 async def update_device_api(device_id: int, device: DeviceUpdate, db: Session = Depends(get_db_session)):
     db_device = update_device(db, device_id, device)
     if not db_device:
@@ -238,7 +410,7 @@ async def update_device_api(device_id: int, device: DeviceUpdate, db: Session =
     return db_device
 
 
-@app.delete("/api/devices/{device_id}")
+@router.delete("/api/devices/{device_id}")
 async def delete_device_api(device_id: int, db: Session = Depends(get_db_session)):
     success = delete_device(db, device_id)
     if not success:
@@ -246,44 +418,142 @@ async def delete_device_api(device_id: int, db: Session = Depends(get_db_session
     return {"message": "Device deleted successfully"}
 
 
-@app.get("/api/devices/{device_id}/latest-sensors", response_model=List[SensorData])
+@router.get("/api/devices/{device_id}/latest-sensors", response_model=List[SensorData])
 async def get_latest_device_sensors_api(device_id: int, db: Session = Depends(get_db_session)):
     sensors = get_latest_device_sensors(db, device_id)
     return sensors
 
 
-@app.get("/api/devices/{device_id}/history", response_model=List[dict])
-async def get_device_history_api(device_id: int, db: Session = Depends(get_db_session)):
-    history = get_device_history(db, device_id)
+@router.get("/api/devices/{device_id}/history", response_model=List[dict])
+async def get_device_history_api(
+    device_id: int,
+    sensor_type: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    limit: int = 1000,
+    db: Session = Depends(get_db_session),
+):
+    history = get_device_history(db, device_id, sensor_type, start, end, min(limit, 10000))
     return history
 
 
-@app.get("/api/devices/{device_id}/sensors", response_model=List[SensorData])
+@router.get("/api/devices/{device_id}/stats")
+def get_device_stats_api(
+    device_id: int,
+    sensor_type: str = Query(..., alias="type"),
+    start: Optional[datetime] = Query(None, alias="from"),
+    end: Optional[datetime] = Query(None, alias="to"),
+    compare: List[int] = Query([], description="一起对比的其他设备ID"),
+    percentiles: str = "50,90,95,99",
+    window: float = Query(300, gt=0, description="移动平均窗口（秒）"),
+    threshold: Optional[float] = None,
+    db: Session = Depends(get_db_session),
+):
+    """历史数据统计：均值/极值/标准差、分位数、移动平均、变化率、超阈值时长
+
+    计算密集，使用同步函数由线程池执行，不阻塞事件循环。
+    """
+    device_ids = [device_id] + [other for other in compare if other != device_id]
+    found = {row.id for row in db.query(DeviceModel.id).filter(DeviceModel.id.in_(device_ids))}
+    missing = [other for other in device_ids if other not in found]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Device not found: {missing}")
+    try:
+        percentile_list = [float(p) for p in percentiles.split(",") if p.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="percentiles应为逗号分隔的数字")
+    if any(p < 0 or p > 100 for p in percentile_list):
+        raise HTTPException(status_code=400, detail="percentiles应在0-100之间")
+
+    # 分片时按设备合并其所在各分片的历史数据
+    series = device_stats(db, device_ids, sensor_type, start, end,
+                          percentiles=percentile_list, window_s=window, threshold=threshold)
+    return {
+        "type": sensor_type,
+        "from": start.isoformat() if start else None,
+        "to": end.isoformat() if end else None,
+        "series": series,
+    }
+
+
+@router.get("/api/devices/{device_id}/chart")
+def get_device_chart_api(
+    device_id: int,
+    sensor_type: str = Query(..., alias="type"),
+    start: Optional[datetime] = Query(None, alias="from"),
+    end: Optional[datetime] = Query(None, alias="to"),
+    points: int = Query(800, ge=3, le=5000, description="返回的最大点数"),
+    db: Session = Depends(get_db_session),
+):
+    """图表数据：LTTB降采样后的列式数组（timestamps为Unix毫秒），可直接作为ECharts的数据"""
+    if not db.query(DeviceModel.id).filter(DeviceModel.id == device_id).first():
+        raise HTTPException(status_code=404, detail="Device not found")
+    return chart_series(db, device_id, sensor_type, start, end, points)
+
+
+@router.get("/api/anomalies", response_model=List[dict])
+async def get_anomalies_api(
+    device_id: Optional[int] = None,
+    kind: Optional[str] = Query(None, description="spike / stuck / rate_of_change"),
+    start: Optional[datetime] = Query(None, alias="from"),
+    limit: int = Query(100, ge=1, le=1000),
+    db: Session = Depends(get_db_session),
+):
+    """流式异常检测记录的异常事件，最新的在前"""
+    return get_anomaly_events(db, device_id, kind, start, limit)
+
+
+@router.get("/api/devices/{device_id}/sensors", response_model=List[SensorData])
 async def get_device_sensors_api(device_id: int, db: Session = Depends(get_db_session)):
     sensors = get_device_sensors(db, device_id)
     return sensors
 
 
-@app.get("/api/realtime-sensors")
+@router.get("/api/realtime-sensors")
 async def get_realtime_sensors_api(db: Session = Depends(get_db_session)):
     sensors = get_realtime_sensors(db)
     return sensors
 
 
-@app.get("/api/latest-sensors")
-async def get_latest_sensors_api(db: Session = Depends(get_db_session)):
-    sensors = get_latest_sensors(db)
-    return sensors
+@router.get("/api/dashboard/summary")
+def get_dashboard_summary_api(db: Session = Depends(get_db_session)):
+    """仪表盘汇总（计数均为增量维护，请求开销与设备总数无关）"""
+    return get_dashboard_summary(db)
+
+
+@router.get("/api/traffic/top")
+def get_traffic_top_api(
+    kind: str = Query("device", pattern="^(device|topic)$"),
+    window: int = 60,
+    limit: int = Query(20, ge=1, le=50),
+    db: Session = Depends(get_db_session),
+):
+    """滑动窗口内消息最多的设备或主题（Count-Min sketch + Space-Saving，内存固定）"""
+    try:
+        return get_traffic_top(db, kind, window, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.get("/api/latest-sensors")
+def get_latest_sensors_api():
+    # 共享内存中有数据时直接读取，不打开数据库会话；槽位用满后有序列不在表中，最近的读数可能缺失，改查数据库
+    if LATEST_VALUES_SHM and not latest_reader.overflowed:
+        sensors = latest_reader.latest_sensors()
+        if sensors:
+            return sensors
+    with SessionLocal() as db:
+        return get_latest_sensors(db)
 
 
 # MQTT配置相关API
-@app.get("/api/mqtt-configs", response_model=List[MQTTConfig])
+@router.get("/api/mqtt-configs", response_model=List[MQTTConfig])
 async def get_mqtt_configs_api(skip: int = 0, limit: int = 100, db: Session = Depends(get_db_session)):
     configs = get_mqtt_configs(db, skip=skip, limit=limit)
     return configs
 
 
-@app.get("/api/mqtt-configs/{config_id}", response_model=MQTTConfig)
+@router.get("/api/mqtt-configs/{config_id}", response_model=MQTTConfig)
 async def get_mqtt_config_api(config_id: int, db: Session = Depends(get_db_session)):
     config = get_mqtt_config_by_id(db, config_id)
     if not config:
@@ -291,13 +561,13 @@ async def get_mqtt_config_api(config_id: int, db: Session = Depends(get_db_sessi
     return config
 
 
-@app.post("/api/mqtt-configs", response_model=MQTTConfig)
+@router.post("/api/mqtt-configs", response_model=MQTTConfig)
 async def create_mqtt_config_api(config: MQTTConfigCreate, db: Session = Depends(get_db_session)):
     db_config = create_mqtt_config(db, config)
     return db_config
 
 
-@app.put("/api/mqtt-configs/{config_id}", response_model=MQTTConfig)
+@router.put("/api/mqtt-configs/{config_id}", response_model=MQTTConfig)
 async def update_mqtt_config_api(config_id: int, config: MQTTConfigUpdate, db: Session = Depends(get_db_session)):
     db_config = update_mqtt_config(db, config_id, config)
     if not db_config:
@@ -305,7 +575,7 @@ async def update_mqtt_config_api(config_id: int, config: MQTTConfigUpdate, db: S
     return db_config
 
 
-@app.delete("/api/mqtt-configs/{config_id}")
+@router.delete("/api/mqtt-configs/{config_id}")
 async def delete_mqtt_config_api(config_id: int, db: Session = Depends(get_db_session)):
     success = delete_mqtt_config(db, config_id)
     if not success:
@@ -314,7 +584,7 @@ async def delete_mqtt_config_api(config_id: int, db: Session = Depends(get_db_se
 
 
 # 激活MQTT配置API
-@app.post("/api/mqtt-configs/{config_id}/activate")
+@router.post("/api/mqtt-configs/{config_id}/activate")
 async def activate_mqtt_config_api(config_id: int, db: Session = Depends(get_db_session)):
     success = activate_mqtt_config(db, config_id)
     if not success:
@@ -323,7 +593,7 @@ async def activate_mqtt_config_api(config_id: int, db: Session = Depends(get_db_
 
 
 # 测试MQTT连接API
-@app.post("/api/mqtt-configs/{config_id}/test")
+@router.post("/api/mqtt-configs/{config_id}/test")
 async def test_mqtt_connection_api(config_id: int, db: Session = Depends(get_db_session)):
     config = get_mqtt_config_by_id(db, config_id)
     if not config:
@@ -334,13 +604,13 @@ async def test_mqtt_connection_api(config_id: int, db: Session = Depends(get_db_
 
 
 # 主题配置相关API
-@app.get("/api/topic-configs", response_model=List[TopicConfig])
+@router.get("/api/topic-configs", response_model=List[TopicConfig])
 async def get_topic_configs_api(skip: int = 0, limit: int = 100, db: Session = Depends(get_db_session)):
     configs = get_topic_configs(db, skip=skip, limit=limit)
     return configs
 
 
-@app.get("/api/topic-configs/{config_id}", response_model=TopicConfig)
+@router.get("/api/topic-configs/{config_id}", response_model=TopicConfig)
 async def get_topic_config_api(config_id: int, db: Session = Depends(get_db_session)):
     config = get_topic_config_by_id(db, config_id)
     if not config:
@@ -348,13 +618,13 @@ async def get_topic_config_api(config_id: int, db: Session = Depends(get_db_sess
     return config
 
 
-@app.post("/api/topic-configs", response_model=TopicConfig)
+@router.post("/api/topic-configs", response_model=TopicConfig)
 async def create_topic_config_api(config: TopicConfigCreate, db: Session = Depends(get_db_session)):
     db_config = create_topic_config(db, config)
     return db_config
 
 
-@app.put("/api/topic-configs/{config_id}", response_model=TopicConfig)
+@router.put("/api/topic-configs/{config_id}", response_model=TopicConfig)
 async def update_topic_config_api(config_id: int, config: TopicConfigUpdate, db: Session = Depends(get_db_session)):
     config_data = config.model_dump(exclude_unset=True)
     db_config = update_topic_config(db, config_id, config_data)
@@ -363,7 +633,7 @@ async def update_topic_config_api(config_id: int, config: TopicConfigUpdate, db:
     return db_config
 
 
-@app.delete("/api/topic-configs/{config_id}")
+@router.delete("/api/topic-configs/{config_id}")
 async def delete_topic_config_api(config_id: int, db: Session = Depends(get_db_session)):
     success = delete_topic_config(db, config_id)
     if not success:
@@ -372,7 +642,7 @@ async def delete_topic_config_api(config_id: int, db: Session = Depends(get_db_s
 
 
 # 添加激活配置和测试连接API
-@app.post("/api/topic-configs/{config_id}/activate")
+@router.post("/api/topic-configs/{config_id}/activate")
 async def activate_topic_config_api(config_id: int, db: Session = Depends(get_db_session)):
     success = activate_topic_config(db, config_id)
     if not success:
@@ -380,7 +650,7 @@ async def activate_topic_config_api(config_id: int, db: Session = Depends(get_db
     return {"message": "Topic Config activated successfully"}
 
 
-@app.post("/api/topic-configs/{config_id}/deactivate")
+@router.post("/api/topic-configs/{config_id}/deactivate")
 async def deactivate_topic_config_api(config_id: int, db: Session = Depends(get_db_session)):
     success = deactivate_topic_config(db, config_id)
     if not success:
@@ -389,7 +659,7 @@ async def deactivate_topic_config_api(config_id: int, db: Session = Depends(get_
 
 
 # MQTT消费相关的API端点
-@app.post("/api/subscribe-topic")
+@router.post("/api/subscribe-topic")
 async def subscribe_to_topic(
     topic: str = Body(..., embed=True),
     mqtt_config_id: int = Body(..., embed=True),
@@ -403,44 +673,208 @@ async def subscribe_to_topic(
     if not mqtt_config:
         raise HTTPException(status_code=404, detail="MQTT配置不存在")
     
-    # 更新全局MQTT服务的订阅主题
-    global mqtt_service
-    if mqtt_service and mqtt_service.client:
-        # 使用MQTT服务的动态订阅功能
-        mqtt_service.subscribe_to_topic(topic)
+    # 使用对应broker客户端的动态订阅功能
+    service = broker_pool.get(mqtt_config_id)
+    if service and service.client:
+        service.subscribe_to_topic(topic)
         return {"message": f"成功订阅主题: {topic}", "topic": topic}
     
     raise HTTPException(status_code=500, detail="MQTT服务未启动")
 
 
-@app.post("/api/unsubscribe-topic")
+@router.post("/api/unsubscribe-topic")
 async def unsubscribe_from_topic(
     topic: str = Body(..., embed=True),
+    mqtt_config_id: Optional[int] = Body(None, embed=True),
     db: Session = Depends(get_db_session)
 ):
     """
-    取消订阅指定的MQTT主题
+    取消订阅指定的MQTT主题（未指定MQTT配置时从所有broker取消订阅）
     """
-    global mqtt_service
-    if mqtt_service and mqtt_service.client:
-        mqtt_service.unsubscribe_from_topic(topic)
+    if mqtt_config_id is not None:
+        services = [broker_pool.get(mqtt_config_id)]
+    else:
+        services = list(broker_pool.services.values())
+    services = [service for service in services if service and service.client]
+    if services:
+        for service in services:
+            service.unsubscribe_from_topic(topic)
         return {"message": f"成功取消订阅主题: {topic}", "topic": topic}
     
     raise HTTPException(status_code=500, detail="MQTT服务未启动")
 
 
-@app.post("/api/stop-consuming")
+@router.post("/api/stop-consuming")
 async def stop_consuming():
     """停止MQTT消费服务"""
     try:
-        mqtt_service.stop()
+        broker_pool.stop()
         return {"message": "MQTT消费服务已停止"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"停止消费服务失败: {str(e)}")
 
 
+@router.get("/api/mqtt-status")
+async def get_mqtt_status():
+    """获取各broker连接、重连和共享写入管道状态"""
+    return broker_pool.status()
+
+
+@router.get("/api/ingest/latency")
+async def get_ingest_latency(recent: int = Query(0, ge=0, le=200)):
+    """采样消息从MQTT收到到提交（API可读）的各阶段及端到端延迟分位数（毫秒），recent>0时附带最近的链路"""
+    result = ingest_pipeline.tracer.summary()
+    if recent:
+        result["recent"] = ingest_pipeline.tracer.recent(recent)
+    return result
+
+
+@router.post("/api/ingest")
+async def http_ingest_api(request: Request):
+    """HTTP批量采集：请求体为JSON数组或NDJSON，每条为 {device, type, value, unit, ts} 或 {topic, payload}。
+    边接收边解析，分块交给与MQTT相同的写入管道批量提交；全部提交后返回，超时返回504。
+    非采集领导者的worker也在本进程的写入管道中入库，但不更新仪表盘汇总和共享内存最新值（只由领导者维护）"""
+    ingest_pipeline.start()
+    batch = HttpIngestBatch(ingest_pipeline)
+    try:
+        async for index, record, error in aiter_records(request.stream()):
+            if batch.add_record(index, record, error):
+                await run_in_threadpool(batch.flush)
+        await run_in_threadpool(batch.flush)
+    except (ValueError, UnicodeDecodeError) as e:
+        if not batch.accepted:
+            raise HTTPException(status_code=400, detail=str(e))
+        # 之前的记录已经交给写入管道，报告错误后照常提交已解析的部分
+        batch.add_error(batch.records + 1, str(e))
+        await run_in_threadpool(batch.flush)
+    committed = await run_in_threadpool(batch.wait)
+    result = batch.result()
+    print(f"HTTP采集: {result['records']} 条，接收 {result['accepted']}，提交 {result['committed']}，"
+          f"失败 {result['failed']}，耗时 {result['elapsed_seconds']} 秒")
+    if not committed:
+        return JSONResponse(status_code=504, content=result)
+    return result
+
+
+@router.get("/api/dead-letters/summary")
+def get_dead_letter_summary(db: Session = Depends(get_db_session)):
+    """按原因分组的死信条数、时间范围和最近一条样例"""
+    return summarize_dead_letters(db)
+
+
+@router.get("/api/dead-letters")
+def get_dead_letters(reason: Optional[str] = None, topic: Optional[str] = None,
+                     before_id: Optional[int] = None, limit: int = Query(50, ge=1, le=500),
+                     db: Session = Depends(get_db_session)):
+    """按时间倒序列出死信，可按原因和主题前缀过滤；翻页时把上一页最后一条的id作为before_id"""
+    return list_dead_letters(db, reason, topic, before_id, limit)
+
+
+@router.post("/api/dead-letters/replay")
+async def replay_dead_letters_api(replay: DeadLetterReplay):
+    """把匹配的死信重新交给写入管道（修复解析后使用），提交后从死信表删除，仍失败的重新记录"""
+    ingest_pipeline.start()
+    result = await run_in_threadpool(replay_dead_letters, ingest_pipeline, replay.reason, replay.topic, replay.ids)
+    print(f"死信重放: 提交 {result['submitted']} 条，已处理 {result['committed']} 条，剩余 {result['remaining']} 条")
+    return result
+
+
+@router.post("/api/devices/{device_id}/commands")
+async def send_device_command_api(device_id: int, command: DeviceCommand, db: Session = Depends(get_db_session)):
+    """向设备下发命令，设备随后上报的状态与命令值一致时视为确认"""
+    try:
+        pending = command_service.send(db, device_id, command.command, command.value, command.qos,
+                                       command.timeout, command.ack_type)
+    except CommandError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    if command.wait:
+        await run_in_threadpool(command_service.wait, pending)
+    return pending.to_dict()
+
+
+@router.post("/api/commands/batch")
+async def send_batch_command_api(command: BatchCommand, db: Session = Depends(get_db_session)):
+    """批量下发命令（如全部继电器开关），按broker和发布主题合并发送"""
+    try:
+        return command_service.send_batch(db, command.command, command.value, command.device_ids,
+                                          command.qos, command.timeout, command.ack_type)
+    except CommandError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+
+@router.get("/api/commands/stats")
+async def get_command_stats_api():
+    """命令下发、确认、超时计数及往返延迟直方图"""
+    return command_service.status()
+
+
+@router.get("/api/commands/{command_id}")
+async def get_command_api(command_id: str):
+    pending = command_service.get(command_id)
+    if not pending:
+        raise HTTPException(status_code=404, detail="Command not found")
+    return pending.to_dict()
+
+
+# 管理接口口令，设置后 /api/admin/* 需要携带 X-Admin-Token 请求头
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if ADMIN_TOKEN and x_admin_token != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="需要管理员口令")
+
+
+@router.post("/api/admin/profile/start", dependencies=[Depends(require_admin)])
+async def start_profile_api(request: ProfileStart):
+    """开始采样分析：在限定时间内采样采集线程或HTTP处理线程的调用栈，到期自动停止"""
+    try:
+        return sampling_profiler.start(request.target, request.duration, request.interval_ms, request.include_idle)
+    except ProfilerError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+
+@router.post("/api/admin/profile/stop", dependencies=[Depends(require_admin)])
+async def stop_profile_api():
+    return await run_in_threadpool(sampling_profiler.stop)
+
+
+@router.get("/api/admin/profile", dependencies=[Depends(require_admin)])
+async def get_profile_api(format: str = Query("json", pattern="^(json|collapsed)$"),
+                          limit: int = Query(20, ge=1, le=200)):
+    """采样结果（运行中返回当前累计）：collapsed 为火焰图工具可直接使用的文本，json 为最耗时的函数"""
+    if format == "collapsed":
+        return PlainTextResponse(sampling_profiler.collapsed())
+    return dict(sampling_profiler.status(), top=sampling_profiler.top_functions(limit))
+
+
+@router.post("/api/admin/memory/start", dependencies=[Depends(require_admin)])
+async def start_memory_trace_api(request: MemoryTraceStart):
+    """开启tracemalloc并记录基线快照，到期自动关闭"""
+    try:
+        return memory_profiler.start(request.duration, request.frames)
+    except ProfilerError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+
+@router.get("/api/admin/memory/diff", dependencies=[Depends(require_admin)])
+def get_memory_diff_api(limit: int = Query(20, ge=1, le=200),
+                        group_by: str = Query("lineno", pattern="^(lineno|filename|traceback)$"),
+                        reset: bool = False):
+    """当前内存分配与基线的差异，按增长量排序；reset=true 时以当前快照作为新基线"""
+    try:
+        return memory_profiler.diff(limit, group_by, reset)
+    except ProfilerError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+
+@router.post("/api/admin/memory/stop", dependencies=[Depends(require_admin)])
+async def stop_memory_trace_api():
+    return memory_profiler.stop()
+
+
 # 用于获取实时MQTT消息的API
-@app.get("/api/mqtt-messages")
+@router.get("/api/mqtt-messages")
 async def get_mqtt_messages(
     skip: int = 0,
     limit: int = 20,
@@ -450,7 +884,7 @@ async def get_mqtt_messages(
     获取最近的MQTT消息
     """
     # 从传感器数据表获取最近的消息
-    messages = db.query(SensorDataModel).order_by(desc(SensorDataModel.timestamp)).offset(skip).limit(limit).all()
+    messages = get_recent_sensor_rows(db, skip, limit)
     
     # 转换为合适的格式
     result = []
@@ -470,44 +904,50 @@ async def get_mqtt_messages(
     return result
 
 
+# 未构建前端（frontend/dist 不存在）时使用的入口页
+LEGACY_SHELL_HTML = """<!DOCTYPE html>
+<html>
+<head>
+    <title>MQTT IoT 管理系统</title>
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css" rel="stylesheet">
+    <link href="https://cdn.jsdelivr.net/npm/bootstrap-icons@1.10.0/font/bootstrap-icons.css" rel="stylesheet">
+</head>
+<body>
+    <div id="app"></div>
+    <script type="module" src="/static/js/app.js"></script>
+</body>
+</html>
+"""
+
+# Vite生产构建（带内容哈希的文件名）和旧的 src/static 目录，均提供预压缩版本和ETag
+frontend_assets = StaticAssets(FRONTEND_DIST)
+legacy_static = StaticAssets(static_dir, immutable=False)
+spa_shell = SpaShell(os.path.join(FRONTEND_DIST, "index.html"), LEGACY_SHELL_HTML)
+
+
+@spa_router.get("/static/{path:path}")
+async def legacy_static_file(path: str, request: Request):
+    response = legacy_static.response(request, path)
+    if response is None:
+        raise HTTPException(status_code=404, detail="文件不存在")
+    return response
+
+
 # 主页面路由 - 提供前端应用
-@app.get("/")
-async def read_root():
-    return HTMLResponse("""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <title>MQTT IoT 管理系统</title>
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css" rel="stylesheet">
-        <link href="https://cdn.jsdelivr.net/npm/bootstrap-icons@1.10.0/font/bootstrap-icons.css" rel="stylesheet">
-    </head>
-    <body>
-        <div id="app"></div>
-        <script type="module" src="/static/js/app.js"></script>
-    </body>
-    </html>
-    """)
+@spa_router.get("/")
+async def read_root(request: Request):
+    return spa_shell.response(request)
 
 # 为前端路由提供fallback，确保SPA路由正常工作
 # 必须在所有具体路由之后定义
-@app.get("/{full_path:path}")
-async def catch_all(full_path: str):
-    return HTMLResponse("""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <title>MQTT IoT 管理系统</title>
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css" rel="stylesheet">
-        <link href="https://cdn.jsdelivr.net/npm/bootstrap-icons@1.10.0/font/bootstrap-icons.css" rel="stylesheet">
-    </head>
-    <body>
-        <div id="app"></div>
-        <script type="module" src="/static/js/app.js"></script>
-    </body>
-    </html>
-    """)
+@spa_router.get("/{full_path:path}")
+async def catch_all(full_path: str, request: Request):
+    if full_path.startswith("api/"):
+        raise HTTPException(status_code=404, detail="接口不存在")
+    # 构建目录中的文件（assets/下的哈希文件、favicon等），其余路径返回入口页由前端路由处理
+    response = frontend_assets.response(request, full_path)
+    return response or spa_shell.response(request)
 
 # 执行数据库迁移
 def migrate_database():
@@ -537,16 +977,85 @@ def migrate_database():
             db.close()
 
 
-# 启动时执行数据库迁移
-migrate_database()
+def init_database():
+    """创建数据库表并修复历史数据"""
+    Base.metadata.create_all(bind=engine)
+    init_shards()
+    ensure_device_search_index(engine)
+    ensure_device_counters(engine)
+
+    # 修复数据库中可能存在的NULL状态值
+    with SessionLocal() as db:
+        fix_device_status_null_values(db)
+
+
+def start_mqtt_in_background():
+    """启动MQTT服务（连接可能阻塞，只在后台线程中调用）"""
+    if start_mqtt_service():
+        print("MQTT服务启动成功")
+    else:
+        print("MQTT服务未启动")
+
+
+def start_ingest():
+    """按采集角色启动MQTT采集"""
+    role = get_ingest_role()
+    if role == INGEST_ROLE_NEVER:
+        broker_pool.enabled = False
+        print("MQTT_INGEST_ROLE=never，本进程只提供HTTP服务")
+    elif role == INGEST_ROLE_ALWAYS:
+        broker_pool.enabled = True
+        dashboard_aggregator.set_enabled(True)
+        latest_publisher.set_enabled(True)
+        start_mqtt_in_background()
+    else:
+        # 选举前先禁止启动，避免激活配置等接口在非领导者进程中启动采集
+        broker_pool.enabled = False
+        ingest_elector.start()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用生命周期：启动步骤在后台执行，不阻塞HTTP服务"""
+    # 预先加载并压缩前端构建文件，避免首批请求承担压缩开销
+    if os.path.isdir(FRONTEND_DIST):
+        threading.Thread(target=frontend_assets.warm, name="static-warmup", daemon=True).start()
+    startup_service.start(
+        [
+            ("init_database", init_database),
+            ("migrate_database", migrate_database),
+            ("start_mqtt_service", start_ingest),
+        ],
+        db_steps=2,
+    )
+    yield
+    try:
+        ingest_elector.stop()
+        broker_pool.stop()
+    except Exception as e:
+        print(f"停止MQTT服务失败: {e}")
+    message_journal.close()
+
+
+def create_app() -> FastAPI:
+    """应用工厂，可通过 uvicorn --factory src.main:create_app 使用"""
+    app = FastAPI(lifespan=lifespan)
+
+    # 添加局域网CORS中间件
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origin_regex=LAN_ORIGIN_REGEX,
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+
+    app.include_router(router)
+    app.include_router(spa_router)
+    return app
 
 
-# 启动时启动MQTT服务
-try:
-    start_mqtt_service()
-    print("MQTT服务启动成功")
-except Exception as e:
-    print(f"启动MQTT服务失败: {e}")
+app = create_app()
 
 
 if __name__ == "__main__":
@@ -1,6 +1,6 @@
 import sys
 import os
-from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean
+from sqlalchemy import Column, Integer, BigInteger, String, Float, DateTime, Boolean, Index, LargeBinary
 from pydantic import BaseModel, Field
 from typing import List, Optional
 from datetime import datetime
@@ -21,9 +21,33 @@ class DeviceModel(Base):
     name = Column(String, unique=True, index=True)
     device_type = Column(String)
     status = Column(String, default="offline")
-    location = Column(String, nullable=True)
-    mqtt_config_id = Column(Integer, nullable=True)  # 关联的MQTT配置ID
-    topic_config_id = Column(Integer, nullable=True)  # 关联的主题配置ID
+    location = Column(String, nullable=True, index=True)
+    mqtt_config_id = Column(Integer, nullable=True, index=True)  # 关联的MQTT配置ID
+    topic_config_id = Column(Integer, nullable=True, index=True)  # 关联的主题配置ID
+
+    # 设备搜索：状态/类型取值少且分布不均，与排序字段组成复合索引，过滤后无需再排序
+    __table_args__ = (
+        Index("ix_devices_status_name", "status", "name"),
+        Index("ix_devices_status_location", "status", "location"),
+        Index("ix_devices_type_name", "device_type", "name"),
+        Index("ix_devices_type_location", "device_type", "location"),
+    )
+
+
+class DeviceAliasModel(Base):
+    """设备的主题别名：主题前两级（如 stm32/2）对应的设备，批量导入时登记"""
+    __tablename__ = "device_aliases"
+
+    alias = Column(String, primary_key=True)
+    device_id = Column(Integer, index=True)
+
+
+class DeviceShardModel(Base):
+    """设备→分片目录（只在主库）：设备的读数写在哪些分片中，通常只有一个"""
+    __tablename__ = "device_shards"
+
+    device_id = Column(Integer, primary_key=True)
+    shard = Column(Integer, primary_key=True)
 
 
 class SensorDataModel(Base):
@@ -40,6 +64,100 @@ class SensorDataModel(Base):
     alert_status = Column(String)
 
 
+class SensorHistoryModel(Base):
+    """传感器历史读数（经死区过滤后写入，sensors表只保存每种类型的最新值）"""
+    __tablename__ = "sensor_history"
+
+    id = Column(Integer, primary_key=True)
+    device_id = Column(Integer)
+    type = Column(String)
+    value = Column(Float)
+    timestamp = Column(DateTime)
+
+    __table_args__ = (
+        Index("ix_sensor_history_device_type_time", "device_id", "type", "timestamp"),
+    )
+
+
+class SensorBlockModel(Base):
+    """块存储的历史读数：每个 (设备, 类型) 的连续读数压缩为一个BLOB（见 block_codec）"""
+    __tablename__ = "sensor_blocks"
+
+    id = Column(Integer, primary_key=True)
+    device_id = Column(Integer)
+    type = Column(String)
+    start_ts = Column(BigInteger)  # 块内最早时间（Unix毫秒）
+    end_ts = Column(BigInteger)  # 块内最晚时间（Unix毫秒）
+    count = Column(Integer)
+    # 块级汇总，区间聚合时整块落在区间内无需解码
+    min_value = Column(Float)
+    max_value = Column(Float)
+    sum_value = Column(Float)
+    data = Column(LargeBinary)
+
+    __table_args__ = (
+        Index("ix_sensor_blocks_series_start", "device_id", "type", "start_ts"),
+        Index("ix_sensor_blocks_series_end", "device_id", "type", "end_ts"),
+    )
+
+
+class AnomalyEventModel(Base):
+    """流式异常检测发现的异常事件（突变、卡死、变化率超限）"""
+    __tablename__ = "anomaly_events"
+
+    id = Column(Integer, primary_key=True)
+    device_id = Column(Integer)
+    type = Column(String)
+    kind = Column(String)  # spike / stuck / rate_of_change
+    value = Column(Float)
+    expected = Column(Float)  # 检测时的EWMA均值（变化率为上一个读数）
+    score = Column(Float)  # z分数 / 连续相同次数 / 变化率
+    timestamp = Column(DateTime)
+
+    __table_args__ = (
+        Index("ix_anomaly_events_device_time", "device_id", "timestamp"),
+    )
+
+
+class DeviceCounterModel(Base):
+    """设备计数（按状态、位置），由devices表上的触发器增量维护，仪表盘直接读取"""
+    __tablename__ = "device_counters"
+
+    dimension = Column(String, primary_key=True)  # status / location
+    key = Column(String, primary_key=True)  # 位置为空时为空字符串
+    count = Column(Integer, default=0)
+
+    __table_args__ = (
+        Index("ix_device_counters_dimension_count", "dimension", "count"),
+    )
+
+
+class DashboardStateModel(Base):
+    """采集进程定期写入的仪表盘汇总快照（JSON），其他进程的HTTP worker读取"""
+    __tablename__ = "dashboard_state"
+
+    name = Column(String, primary_key=True)
+    payload = Column(String)
+    updated_at = Column(DateTime)
+
+
+class DeadLetterModel(Base):
+    """解析失败的消息（死信）：原始载荷字节和失败原因，条数有上限，修复解析后可批量重放"""
+    __tablename__ = "dead_letters"
+
+    id = Column(Integer, primary_key=True)
+    topic = Column(String, nullable=False)
+    payload = Column(LargeBinary, nullable=False)
+    structured = Column(Boolean, default=False)  # HTTP采集的结构化读数，载荷为JSON
+    reason = Column(String(32), nullable=False)
+    detail = Column(String(200))
+    received_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index("ix_dead_letters_reason_id", "reason", "id"),
+    )
+
+
 class MQTTConfigModel(Base):
     __tablename__ = "mqtt_configs"
 
@@ -63,6 +181,15 @@ class TopicConfigModel(Base):
     mqtt_config_id = Column(Integer, nullable=True)  # 关联的MQTT配置ID
 
 
+class ServiceLeaseModel(Base):
+    __tablename__ = "service_leases"
+
+    name = Column(String, primary_key=True)  # 租约名称，如 mqtt_ingest
+    holder = Column(String)  # 当前持有者标识（主机名:进程号:随机串）
+    expires_at = Column(Float)  # 租约过期时间（Unix时间戳）
+    acquired_at = Column(Float)  # 本次持有开始时间（Unix时间戳）
+
+
 # Pydantic模型定义
 class DeviceBase(BaseModel):
     name: str
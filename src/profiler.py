@@ -0,0 +1,301 @@
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from typing import Dict, Optional, Tuple
+
+# 单次采样分析的最长时间（秒），到期自动停止
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "120"))
+# 内存跟踪的最长时间（秒），tracemalloc会让内存分配变慢，到期自动关闭
+MEMORY_TRACE_MAX_SECONDS = float(os.getenv("MEMORY_TRACE_MAX_SECONDS", "1800"))
+# 单个调用栈最多记录的帧数
+MAX_STACK_DEPTH = 128
+
+# 采样目标对应的线程名前缀：采集（写入线程和各broker的网络线程）与HTTP（事件循环和同步接口的线程池）
+PROFILE_TARGETS = {
+    "ingest": ("ingest-writer", "mqtt-connection"),
+    "http": ("MainThread", "AnyIO worker thread"),
+    "all": (),
+}
+
+# 叶子帧为这些函数时线程处于等待状态（队列/条件变量/select），默认不计入
+IDLE_FUNCTIONS = {
+    ("threading.py", "wait"),
+    ("selectors.py", "select"),
+    ("queue.py", "get"),
+    ("client.py", "_loop"),
+    ("base_events.py", "_run_once"),
+}
+
+# 项目根目录，栈帧中的文件路径相对它显示
+_ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class ProfilerError(Exception):
+    """分析会话无法开始或不存在"""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def frame_label(code) -> str:
+    """栈帧标签 "函数 (文件:首行)"，与py-spy的collapsed输出一致，同一函数的样本会聚合在一起"""
+    filename = code.co_filename
+    if filename.startswith(_ROOT_DIR):
+        filename = os.path.relpath(filename, _ROOT_DIR)
+    else:
+        filename = "/".join(filename.replace("\\", "/").split("/")[-2:])
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """采样分析器
+
+    后台线程按固定间隔读取 sys._current_frames()，把目标线程的调用栈累计为
+    collapsed格式（"线程;外层帧;...;叶子帧 样本数"），可直接交给 flamegraph.pl 或 speedscope 生成火焰图。
+    只读取栈帧、不设置trace钩子，被分析的线程不受影响；采样本身的耗时记录在 overhead_ms 中。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+        self._labels: Dict[object, str] = {}
+        self.stacks: Counter = Counter()
+        self.session: Optional[dict] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, target: str = "ingest", duration: float = 30, interval_ms: float = 10,
+              include_idle: bool = False) -> dict:
+        if target not in PROFILE_TARGETS:
+            raise ProfilerError(f"未知的分析目标: {target}，可选 {', '.join(PROFILE_TARGETS)}")
+        if not 0 < duration <= PROFILE_MAX_SECONDS:
+            raise ProfilerError(f"duration应在0-{PROFILE_MAX_SECONDS:g}秒之间")
+        if interval_ms < 1:
+            raise ProfilerError("interval_ms不能小于1")
+        with self._lock:
+            if self.running:
+                raise ProfilerError("已有分析会话在运行", status_code=409)
+            self.stacks = Counter()
+            self.session = {
+                "target": target,
+                "duration": duration,
+                "interval_ms": interval_ms,
+                "include_idle": include_idle,
+                "started_at": time.time(),
+                "stopped_at": None,
+                "samples": 0,
+                "idle_samples": 0,
+                "overhead_ms": 0.0,
+            }
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+            self._thread.start()
+        return self.status()
+
+    def stop(self) -> dict:
+        self._stop_event.set()
+        thread = self._thread
+        if thread and thread is not threading.current_thread():
+            thread.join(timeout=5)
+        return self.status()
+
+    def _thread_names(self, prefixes: Tuple[str, ...]) -> Dict[int, str]:
+        own = threading.get_ident()
+        return {
+            thread.ident: thread.name for thread in threading.enumerate()
+            if thread.ident != own and (not prefixes or thread.name.startswith(prefixes))
+        }
+
+    def _stack(self, frame) -> Tuple[str, ...]:
+        labels = []
+        while frame is not None and len(labels) < MAX_STACK_DEPTH:
+            code = frame.f_code
+            label = self._labels.get(code)
+            if label is None:
+                label = self._labels[code] = frame_label(code)
+            labels.append(label)
+            frame = frame.f_back
+        labels.reverse()
+        return tuple(labels)
+
+    def _sample(self, prefixes: Tuple[str, ...], include_idle: bool):
+        names = self._thread_names(prefixes)
+        # 先在本地累计，再持锁合并，collapsed()/top_functions() 读取时不会遇到正在修改的Counter
+        stacks: Counter = Counter()
+        samples = idle = 0
+        for ident, frame in sys._current_frames().items():
+            name = names.get(ident)
+            if name is None:
+                continue
+            code = frame.f_code
+            if not include_idle and (os.path.basename(code.co_filename), code.co_name) in IDLE_FUNCTIONS:
+                idle += 1
+                continue
+            # 线程池的线程名带序号，合并为同一个根节点
+            root = name.rstrip("0123456789-_ ")
+            stacks[(root,) + self._stack(frame)] += 1
+            samples += 1
+        with self._lock:
+            self.stacks.update(stacks)
+        return samples, idle
+
+    def _run(self):
+        session = self.session
+        prefixes = PROFILE_TARGETS[session["target"]]
+        interval = session["interval_ms"] / 1000.0
+        deadline = time.monotonic() + session["duration"]
+        try:
+            while not self._stop_event.is_set() and time.monotonic() < deadline:
+                started = time.perf_counter()
+                samples, idle = self._sample(prefixes, session["include_idle"])
+                with self._lock:
+                    session["samples"] += samples
+                    session["idle_samples"] += idle
+                    session["overhead_ms"] += (time.perf_counter() - started) * 1000
+                self._stop_event.wait(interval)
+        finally:
+            with self._lock:
+                session["stopped_at"] = time.time()
+            # 标签缓存持有code对象引用，会话结束后释放
+            self._labels = {}
+            print(f"采样分析结束: 目标={session['target']}, 样本数={session['samples']}")
+
+    def collapsed(self) -> str:
+        """collapsed格式，每行 "帧;帧;帧 样本数"，按样本数降序"""
+        with self._lock:
+            items = self.stacks.most_common()
+        return "\n".join(f"{';'.join(stack)} {count}" for stack, count in items) + ("\n" if items else "")
+
+    def top_functions(self, limit: int = 20) -> dict:
+        """按自身样本（叶子帧）和累计样本（出现在栈中）统计最耗时的函数"""
+        own: Counter = Counter()
+        inclusive: Counter = Counter()
+        with self._lock:
+            items = list(self.stacks.items())
+        for stack, count in items:
+            own[stack[-1]] += count
+            for label in set(stack[1:]):
+                inclusive[label] += count
+        return {
+            "self": [{"function": label, "samples": count} for label, count in own.most_common(limit)],
+            "inclusive": [{"function": label, "samples": count} for label, count in inclusive.most_common(limit)],
+        }
+
+    def status(self) -> dict:
+        with self._lock:
+            session = dict(self.session) if self.session else None
+            stacks = len(self.stacks)
+        if session:
+            session["overhead_ms"] = round(session["overhead_ms"], 3)
+        return {"running": self.running, "session": session, "unique_stacks": stacks}
+
+
+class MemoryProfiler:
+    """内存增长分析
+
+    开启 tracemalloc 并记录基线快照，之后每次对比当前快照与基线，
+    返回按代码行（或调用栈）分组的增长最多的分配位置。到期自动关闭跟踪；
+    进程启动时已通过 -X tracemalloc 开启的跟踪不会被关闭。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._baseline: Optional[tracemalloc.Snapshot] = None
+        self._timer: Optional[threading.Timer] = None
+        self._owns_tracing = False
+        self.session: Optional[dict] = None
+
+    @staticmethod
+    def _snapshot() -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<unknown>"),
+        ))
+
+    def start(self, duration: float = 300, frames: int = 10) -> dict:
+        if not 0 < duration <= MEMORY_TRACE_MAX_SECONDS:
+            raise ProfilerError(f"duration应在0-{MEMORY_TRACE_MAX_SECONDS:g}秒之间")
+        if not 1 <= frames <= 64:
+            raise ProfilerError("frames应在1-64之间")
+        with self._lock:
+            if self.session and self.session["stopped_at"] is None:
+                raise ProfilerError("内存跟踪已在运行", status_code=409)
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(frames)
+                self._owns_tracing = True
+            self._baseline = self._snapshot()
+            self.session = {
+                "duration": duration,
+                "frames": tracemalloc.get_traceback_limit(),
+                "started_at": time.time(),
+                "baseline_at": time.time(),
+                "stopped_at": None,
+            }
+            self._timer = threading.Timer(duration, self.stop)
+            self._timer.daemon = True
+            self._timer.start()
+        return self.status()
+
+    def diff(self, limit: int = 20, group_by: str = "lineno", reset: bool = False) -> dict:
+        """当前快照与基线的差异；reset为True时把当前快照作为新的基线"""
+        if group_by not in ("lineno", "filename", "traceback"):
+            raise ProfilerError("group_by应为 lineno / filename / traceback")
+        with self._lock:
+            if self._baseline is None or not tracemalloc.is_tracing():
+                raise ProfilerError("内存跟踪未开启", status_code=409)
+            snapshot = self._snapshot()
+            stats = snapshot.compare_to(self._baseline, group_by)
+            baseline_at = self.session["baseline_at"]
+            if reset:
+                self._baseline = snapshot
+                self.session["baseline_at"] = time.time()
+        current, peak = tracemalloc.get_traced_memory()
+        return {
+            "since": baseline_at,
+            "traced_bytes": current,
+            "peak_bytes": peak,
+            "size_diff_bytes": sum(stat.size_diff for stat in stats),
+            "top": [
+                {
+                    "location": [f"{frame.filename}:{frame.lineno}" for frame in stat.traceback],
+                    "size_diff_bytes": stat.size_diff,
+                    "size_bytes": stat.size,
+                    "count_diff": stat.count_diff,
+                    "count": stat.count,
+                }
+                for stat in stats[:limit]
+            ],
+        }
+
+    def stop(self) -> dict:
+        with self._lock:
+            if self._timer and self._timer is not threading.current_thread():
+                self._timer.cancel()
+            self._timer = None
+            self._baseline = None
+            if self._owns_tracing and tracemalloc.is_tracing():
+                tracemalloc.stop()
+            self._owns_tracing = False
+            if self.session and self.session["stopped_at"] is None:
+                self.session["stopped_at"] = time.time()
+                print("内存跟踪已关闭")
+        return self.status()
+
+    def status(self) -> dict:
+        return {
+            "tracing": tracemalloc.is_tracing(),
+            "session": dict(self.session) if self.session else None,
+        }
+
+
+# 全局分析器实例
+sampling_profiler = SamplingProfiler()
+memory_profiler = MemoryProfiler()
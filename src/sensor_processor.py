@@ -0,0 +1,626 @@
+import json
+import re
+from datetime import datetime, timezone
+from typing import Callable, List, Optional, Tuple
+from sqlalchemy.orm import Session
+import sys
+import os
+
+# 修复相对导入问题
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+if parent_dir not in sys.path:
+    sys.path.append(parent_dir)
+
+from src.database import shard_count
+from src.models import (
+    AnomalyEventModel, DeviceAliasModel, DeviceModel, DeviceShardModel, SensorDataModel, SensorHistoryModel,
+)
+from src.admission import device_key
+from src.deadband import DeadbandFilter
+from src.block_store import HISTORY_BACKEND, BlockHistoryStore
+from src.anomaly_detector import ANOMALY_DETECTION, AnomalyDetector
+from src.latest_values import LATEST_VALUES_SHM, LatestValuePublisher, latest_publisher
+from src.dashboard import DashboardAggregator, dashboard_aggregator
+from src.dead_letters import (
+    PayloadRejected, REASON_DECODE, REASON_NO_READINGS, REASON_TOPIC, REASON_UNRECOGNIZED,
+)
+
+# 载荷不是已知格式时是否按旧行为把其中的数字存为 Sensor_N 读数（默认拒绝并写入死信表）
+PAYLOAD_FALLBACK_PARSE = os.getenv("PAYLOAD_FALLBACK_PARSE", "0") == "1"
+
+# 已知的传感器文本格式，如 "Temperature1: 22.10 C, Humidity1: 16.10 %"
+READING_PATTERNS = [
+    (re.compile(r'Temperature1:\s*([\d.]+)\s*C'), 'Temperature1', '°C'),
+    (re.compile(r'Humidity1:\s*([\d.]+)\s*%'), 'Humidity1', '%'),
+    (re.compile(r'Temperature2:\s*([\d.]+)\s*C'), 'Temperature2', '°C'),
+    (re.compile(r'Humidity2:\s*([\d.]+)\s*%'), 'Humidity2', '%'),
+    (re.compile(r'Relay Status:\s*(\d)'), 'Relay Status', ''),
+    (re.compile(r'PB8 Level:\s*(\d)'), 'PB8 Level', ''),
+]
+
+
+class SensorDataProcessor:
+    """传感器数据处理器
+
+    负责解析MQTT消息、查找或自动创建设备并写入传感器数据。
+    处理器本身不提交事务，由写入管道在一个批次的所有消息处理完成后统一提交。
+    """
+
+    def __init__(self, history_filter: Optional[DeadbandFilter] = None,
+                 history_store: Optional[BlockHistoryStore] = None,
+                 anomaly_detector: Optional[AnomalyDetector] = None, shard: int = 0,
+                 latest_values: Optional[LatestValuePublisher] = None,
+                 dashboard: Optional[DashboardAggregator] = None):
+        self.db: Optional[Session] = None
+        # 本处理器写入的分片；分片时首次写入某设备会登记到设备→分片目录
+        self.shard = shard
+        self._catalogued = set()
+        self._catalog_batch = set()
+        # 当前消息登记的设备，消息的保存点回滚时从本批次中撤销
+        self._catalog_message: List[int] = []
+        # 当前消息开始时本批次暂存状态的位置，见 begin_message
+        self._message_marks = (0, 0, 0, 0)
+        # 历史数据死区过滤，最新值（sensors表）和读数观察者仍收到每一条读数
+        self.history_filter = history_filter or DeadbandFilter()
+        # 块存储后端，为None时历史读数逐行写入sensor_history表
+        if history_store is None and HISTORY_BACKEND == "blocks":
+            history_store = BlockHistoryStore()
+        self.history_store = history_store
+        # 流式异常检测，检测到的异常与读数在同一事务中写入anomaly_events表
+        if anomaly_detector is None and ANOMALY_DETECTION:
+            anomaly_detector = AnomalyDetector()
+        self.anomaly_detector = anomaly_detector
+        # 共享内存最新值表，批次提交后才发布本批次的最新值
+        if latest_values is None and LATEST_VALUES_SHM:
+            latest_values = latest_publisher
+        self.latest_values = latest_values
+        # 仪表盘汇总，同样在批次提交后按本批次的消息数和最新值增量更新
+        self.dashboard = dashboard or dashboard_aggregator
+        self._latest_batch = []
+        self._batch_messages = 0
+        # 当前消息保存的读数条数，一条都没有的消息作为死信拒绝
+        self._readings = 0
+        # 读数观察者 (device_id, sensor_type, value)，如命令确认匹配；与最新值一样在批次提交后才通知，
+        # 回滚或重试的读数不会确认命令
+        self.observers: List[Callable[[int, str, object], None]] = []
+        self._observed_batch: List[Tuple[int, str, object]] = []
+        # 当前消息的链路追踪（仅被采样的消息），由写入管道设置
+        self.trace = None
+        # 补录的历史消息的收到时间（Unix秒），由写入管道设置，作为没有设备时间戳的读数的时间
+        self.message_time: Optional[float] = None
+        # 补录窗口 [start, end)（UTC）：每个序列补录的第一条读数先删除该序列在窗口内已有的历史和异常事件，
+        # 重复补录同一时间段不会产生重复的行；已删除的序列与死区状态一样按批次暂存
+        self.replace_window: Optional[Tuple[datetime, datetime]] = None
+        self._replaced = set()
+        self._replaced_batch: List[Tuple[int, str]] = []
+
+    def add_observer(self, observer: Callable[[int, str, object], None]):
+        """注册读数观察者，每条读数所在的批次提交后调用"""
+        if observer not in self.observers:
+            self.observers.append(observer)
+
+    def notify_observers(self, device_id, sensor_type, value):
+        for observer in self.observers:
+            try:
+                observer(device_id, sensor_type, value)
+            except Exception as e:
+                print(f"读数观察者处理失败: {e}")
+
+    def mark(self, stage: str):
+        """为被采样的消息记录阶段时间戳"""
+        if self.trace is not None:
+            self.trace.mark(stage)
+
+    def before_commit(self, db: Session):
+        """批次提交前调用：写入本批次改动过的历史块"""
+        if self.history_store:
+            self.history_store.flush(db)
+
+    def after_commit(self):
+        """批次提交后应用本批次暂存的过滤状态，并发布最新值"""
+        self.history_filter.committed()
+        if self.anomaly_detector:
+            self.anomaly_detector.committed()
+        if self.history_store:
+            self.history_store.committed()
+        self._catalogued |= self._catalog_batch
+        self._catalog_batch.clear()
+        self._replaced.update(self._replaced_batch)
+        self._replaced_batch.clear()
+        if self._latest_batch and self.latest_values is not None:
+            self.latest_values.publish_many(self._latest_batch)
+        if self._batch_messages:
+            self.dashboard.observe(self._batch_messages, self._latest_batch)
+        self._latest_batch.clear()
+        self._batch_messages = 0
+        observed, self._observed_batch = self._observed_batch, []
+        for device_id, sensor_type, value in observed:
+            self.notify_observers(device_id, sensor_type, value)
+
+    def after_rollback(self):
+        """批次回滚：丢弃本批次暂存的状态，重试时从上次提交的状态重新计算"""
+        self.history_filter.rolled_back()
+        if self.anomaly_detector:
+            self.anomaly_detector.rolled_back()
+        if self.history_store:
+            self.history_store.rolled_back()
+        self._catalog_batch.clear()
+        self._catalog_message.clear()
+        self._replaced_batch.clear()
+        self._latest_batch.clear()
+        self._observed_batch.clear()
+        self._batch_messages = 0
+
+    def begin_message(self):
+        """每条消息的保存点开始前调用：记录本批次暂存状态的位置"""
+        self._message_marks = (len(self._latest_batch), len(self._replaced_batch), len(self._observed_batch),
+                               self._batch_messages)
+        self._catalog_message.clear()
+        self.history_filter.begin_message()
+        if self.anomaly_detector:
+            self.anomaly_detector.begin_message()
+        if self.history_store:
+            self.history_store.begin_message()
+
+    def message_rolled_back(self):
+        """这条消息的保存点被回滚：撤销它暂存的状态，它的最新值不能发布，它删除的补录窗口和分片登记也随之恢复"""
+        published, replaced, observed, self._batch_messages = self._message_marks
+        del self._latest_batch[published:]
+        del self._replaced_batch[replaced:]
+        del self._observed_batch[observed:]
+        self._catalog_batch.difference_update(self._catalog_message)
+        self._catalog_message.clear()
+        self.history_filter.message_rolled_back()
+        if self.anomaly_detector:
+            self.anomaly_detector.message_rolled_back()
+        if self.history_store:
+            self.history_store.message_rolled_back()
+
+    def set_replace_window(self, window: Optional[Tuple[datetime, datetime]]):
+        """开始（或以None结束）一次补录，见 replace_window"""
+        self.replace_window = window
+        self._replaced.clear()
+        self._replaced_batch.clear()
+
+    def clear_window(self, db: Session, device_id: int, sensor_type: str):
+        """补录某序列的第一条读数前，删除它在补录窗口内已有的历史读数和异常事件"""
+        key = (device_id, sensor_type)
+        if key in self._replaced or key in self._replaced_batch:
+            return
+        start, end = self.replace_window
+        if self.history_store:
+            self.history_store.delete_range(db, device_id, sensor_type, start, end)
+        else:
+            db.query(SensorHistoryModel).filter(
+                SensorHistoryModel.device_id == device_id, SensorHistoryModel.type == sensor_type,
+                SensorHistoryModel.timestamp >= start, SensorHistoryModel.timestamp < end,
+            ).delete(synchronize_session=False)
+        db.query(AnomalyEventModel).filter(
+            AnomalyEventModel.device_id == device_id, AnomalyEventModel.type == sensor_type,
+            AnomalyEventModel.timestamp >= start, AnomalyEventModel.timestamp < end,
+        ).delete(synchronize_session=False)
+        self._replaced_batch.append(key)
+
+    def register_shard(self, db: Session, device_id: int):
+        """在设备→分片目录中登记本分片（目录在主库，随批次一起提交）"""
+        if shard_count() == 1 or device_id in self._catalogued or device_id in self._catalog_batch:
+            return
+        if db.get(DeviceShardModel, (device_id, self.shard)) is None:
+            db.add(DeviceShardModel(device_id=device_id, shard=self.shard))
+        self._catalog_batch.add(device_id)
+        self._catalog_message.append(device_id)
+
+    def find_device_by_alias(self, topic: str) -> Optional[DeviceModel]:
+        """按批量导入时登记的主题别名（主题前两级）查找设备"""
+        alias = self.db.get(DeviceAliasModel, device_key(topic))
+        return self.db.get(DeviceModel, alias.device_id) if alias else None
+
+    def process_message(self, db: Session, topic: str, payload):
+        """在给定会话中处理一条消息（写入管道在保存点中调用，失败时调用 message_rolled_back）"""
+        self.db = db
+        self._readings = 0
+        if isinstance(payload, dict):
+            self.process_reading(payload)
+        else:
+            if isinstance(payload, (bytes, bytearray)):
+                try:
+                    payload = payload.decode()
+                except UnicodeDecodeError as e:
+                    raise PayloadRejected(REASON_DECODE, str(e))
+            self.process_sensor_data(payload, topic)
+            if not self._readings:
+                raise PayloadRejected(REASON_NO_READINGS, "载荷中没有可保存的读数")
+        self._batch_messages += 1
+
+    def process_reading(self, reading: dict):
+        """处理已解析的结构化读数（HTTP批量采集）：device可以是设备名或已登记的主题别名，设备不存在时自动创建"""
+        self.mark("parsed")
+        device_name = reading["device"]
+        device = self.db.query(DeviceModel).filter(DeviceModel.name == device_name).first()
+        if device is None and "/" in device_name:
+            device = self.find_device_by_alias(device_name)
+        if device is None:
+            print(f"设备 {device_name} 不存在，自动创建...")
+            device = DeviceModel(
+                name=device_name,
+                device_type="自动创建设备",
+                status="在线",
+                location="未知位置"
+            )
+            self.db.add(device)
+            self.db.flush()
+        self.mark("resolved")
+        self.save_sensor_data(self.db, device.id, reading["type"], reading["value"], reading.get("unit", ""),
+                              reading.get("timestamp"))
+
+    def process_sensor_data(self, payload, topic):
+        """处理传感器数据"""
+        print(f"处理传感器数据，Topic: {topic}, Payload: {payload}")
+        
+        # 解析传感器数据
+        # 格式示例: "stm32/1 Temperature1: 22.10 C, Humidity1: 16.10 %\nTemperature2: 21.80 C, Humidity2: 23.40 %\nRelay Status: 1\nPB8 Level: 1"
+        
+        # 解析温度1和湿度1
+        temp1_match = re.search(r'Temperature1:\s*([\d.]+)\s*C', payload)
+        hum1_match = re.search(r'Humidity1:\s*([\d.]+)\s*%', payload)
+        
+        # 解析温度2和湿度2
+        temp2_match = re.search(r'Temperature2:\s*([\d.]+)\s*C', payload)
+        hum2_match = re.search(r'Humidity2:\s*([\d.]+)\s*%', payload)
+        
+        # 解析继电器状态
+        relay_match = re.search(r'Relay Status:\s*(\d)', payload)
+        
+        # 解析PB8电平
+        pb8_match = re.search(r'PB8 Level:\s*(\d)', payload)
+        self.mark("parsed")
+        
+        # 尝试通过topic创建传感器数据
+        self.process_topic_based_sensor_data(payload, topic)
+        
+        # 从主题中提取设备信息
+        # 主题格式应为 "prefix/device_name" 或 "prefix/device_id"，例如 "stm32/1" 或 "devices/stm32"
+        parts = topic.split('/')
+        if len(parts) < 2:
+            raise PayloadRejected(REASON_TOPIC, f"主题不足两级: {topic}")
+        
+        # 尝试从数据库中查找设备
+        # 处理不同的topic格式，如 "stm32/2" -> "stm32_2"
+        device_prefix = parts[0]  # 例如 'stm32'
+        device_id = parts[1]      # 例如 '2'
+        
+        # 尝试多种匹配策略，登记了主题别名的设备优先
+        aliased = self.find_device_by_alias(topic)
+        potential_device_names = ([aliased.name] if aliased else []) + [
+            f"{device_prefix}_{device_id}",  # 如 "stm32_2"
+            device_id,                       # 如 "2"
+            device_prefix,                   # 如 "stm32"
+            f"{device_prefix}/{device_id}"   # 如 "stm32/2"
+        ]
+        
+        device = None
+        device_name = None
+        for potential_name in potential_device_names:
+            device = self.db.query(DeviceModel).filter(DeviceModel.name == potential_name).first()
+            if device:
+                device_name = potential_name
+                print(f"找到设备: {device_name} (通过匹配 '{potential_name}')")
+                break
+        
+        # 如果以上策略都失败，尝试模糊匹配
+        if not device:
+            # 尝试查找包含前缀的设备
+            device = self.db.query(DeviceModel).filter(DeviceModel.name.like(f'%{device_prefix}%')).first()
+            if device:
+                device_name = device.name
+                print(f"找到设备: {device_name} (通过模糊匹配)")
+        
+        # 如果仍然没找到，使用原始topic作为设备名
+        if not device:
+            device_name = f"{device_prefix}_{device_id}"  # 使用下划线格式
+            print(f"未找到现有设备，将使用新设备名: {device_name}")
+        
+        # 检查设备名称是否有效（允许字母数字组合）
+        if not device_name or len(device_name) <= 1:
+            print(f"设备名称无效，跳过创建设备: {device_name}")
+            return
+        
+        # 查找设备，如果不存在则自动创建
+        device = self.db.query(DeviceModel).filter(DeviceModel.name == device_name).first()
+        if not device:
+            print(f"设备 {device_name} 不存在，自动创建...")
+            device = DeviceModel(
+                name=device_name,
+                device_type="自动创建设备",
+                status="在线",
+                location="未知位置"
+            )
+            self.db.add(device)
+            self.db.flush()  # 刷新以获取新分配的ID
+            print(f"已创建设备: {device_name}，ID: {device.id}")
+        else:
+            print(f"使用现有设备: {device_name}，ID: {device.id}")
+        self.mark("resolved")
+        
+        # 保存传感器数据
+        if temp1_match:
+            value = float(temp1_match.group(1))
+            print(f"保存Temperature1: {value}")
+            self.save_sensor_data(self.db, device.id, "Temperature1", value, "°C")
+        if hum1_match:
+            value = float(hum1_match.group(1))
+            print(f"保存Humidity1: {value}")
+            self.save_sensor_data(self.db, device.id, "Humidity1", value, "%")
+        if temp2_match:
+            value = float(temp2_match.group(1))
+            print(f"保存Temperature2: {value}")
+            self.save_sensor_data(self.db, device.id, "Temperature2", value, "°C")
+        if hum2_match:
+            value = float(hum2_match.group(1))
+            print(f"保存Humidity2: {value}")
+            self.save_sensor_data(self.db, device.id, "Humidity2", value, "%")
+        if relay_match:
+            value = int(relay_match.group(1))
+            print(f"保存Relay Status: {value}")
+            self.save_sensor_data(self.db, device.id, "Relay Status", value, "")
+        if pb8_match:
+            value = int(pb8_match.group(1))
+            print(f"保存PB8 Level: {value}")
+            self.save_sensor_data(self.db, device.id, "PB8 Level", value, "")
+        
+        print(f"传感器数据已写入当前批次")
+
+    def process_topic_based_sensor_data(self, payload, topic):
+        """根据topic结构处理传感器数据"""
+        print(f"处理基于Topic的传感器数据，Topic: {topic}, Payload: {payload}")
+        # 从主题中提取设备信息和传感器类型
+        # 支持多种主题格式，如:
+        # - "device/1/temperature" -> 设备ID为1，传感器类型为temperature
+        # - "stm32/2" -> 设备名stm32/2，传感器类型从payload中解析
+        # - "sensors/room1/temperature" -> 设备名为room1，传感器类型为temperature
+        
+        parts = topic.split('/')
+        if len(parts) < 2:
+            print(f"主题格式不正确，跳过处理: {topic}")
+            return
+        # 2段式主题的载荷不是已知格式：在查询设备之前拒绝（进入死信表），或按旧行为解析为简单数值
+        if len(parts) == 2 and not PAYLOAD_FALLBACK_PARSE and \
+                not any(pattern.search(payload) for pattern, _, _ in READING_PATTERNS):
+            raise PayloadRejected(REASON_UNRECOGNIZED, "不是已知的传感器数据格式")
+
+        aliased = self.find_device_by_alias(topic)
+
+        # 根据topic格式处理数据
+        if len(parts) >= 3:
+            # 格式如 "sensors/device_name/sensor_type"
+            device_name = aliased.name if aliased else parts[1]
+            sensor_type = parts[2]
+            
+            print(f"检测到3段式Topic: 设备名={device_name}, 传感器类型={sensor_type}")
+            
+            # 尝试从payload中解析数值
+            try:
+                value = float(payload)
+                self.create_or_update_sensor_data(device_name, sensor_type, value, topic)
+            except ValueError:
+                # 如果payload不是数值，尝试解析JSON格式
+                try:
+                    data = json.loads(payload)
+                    if 'value' in data:
+                        self.create_or_update_sensor_data(device_name, sensor_type, data['value'], topic, 
+                                                          unit=data.get('unit', ''))
+                    elif len(data) == 1:
+                        # 如果JSON只有一个键值对，使用键作为传感器类型，值作为数值
+                        key, value = next(iter(data.items()))
+                        if isinstance(value, (int, float)):
+                            self.create_or_update_sensor_data(device_name, key, value, topic)
+                except json.JSONDecodeError:
+                    # 如果不是JSON格式，尝试提取数值
+                    number_match = re.search(r'[\d.]+', payload)
+                    if number_match:
+                        value = float(number_match.group())
+                        self.create_or_update_sensor_data(device_name, sensor_type, value, topic)
+        elif len(parts) == 2:
+            # 格式如 "stm32/2" 或 "device/1"
+            device_prefix = parts[0]  # 例如 "stm32"
+            device_id = parts[1]      # 例如 "2"
+            device_name = f"{device_prefix}/{device_id}"  # 例如 "stm32/2"
+            
+            print(f"检测到2段式Topic: 设备名={device_name}, 原始payload={payload}")
+            
+            # 检查数据库中是否已存在这样的设备名
+            existing_device = self.db.query(DeviceModel).filter(DeviceModel.name == device_name).first()
+            if aliased:
+                print(f"通过主题别名找到设备: {aliased.name}, ID: {aliased.id}")
+                self.parse_payload_for_device(aliased.name, payload, topic)
+            elif existing_device:
+                print(f"找到已存在的设备: {device_name}, ID: {existing_device.id}")
+                # 如果数据库中已存在"stm32/2"这样的设备，则直接使用
+                self.parse_payload_for_device(device_name, payload, topic)
+            else:
+                # 如果不存在，尝试查找匹配的设备，如"stm32_2"
+                # 需要将"stm32/2"转换为可能的数据库存储格式，如"stm32_2"
+                potential_device_names = [
+                    f"{device_prefix}_{device_id}",  # stm32_2
+                    device_id,                       # 2
+                    device_prefix                    # stm32
+                ]
+                
+                found_device = False
+                for potential_name in potential_device_names:
+                    existing_device = self.db.query(DeviceModel).filter(DeviceModel.name == potential_name).first()
+                    if existing_device:
+                        print(f"找到设备: {potential_name}, ID: {existing_device.id}")
+                        self.parse_payload_for_device(potential_name, payload, topic)
+                        found_device = True
+                        break
+                
+                if not found_device:
+                    print(f"未找到设备 {device_name} 或其变体，将创建新设备")
+                    self.parse_payload_for_device(device_name, payload, topic)
+        else:
+            print(f"主题格式不支持: {topic}")
+
+    def parse_payload_for_device(self, device_name, payload, topic):
+        """解析payload并为指定设备创建传感器数据"""
+        print(f"解析设备 {device_name} 的payload: {payload}")
+        
+        # 使用正则表达式解析传感器数据
+        # 匹配格式如 "Temperature1: 22.10 C, Humidity1: 16.10 %"
+        # 或者 "Temperature1: 22.10 C\nHumidity1: 16.10 %"
+        matches = [(match, sensor_type, unit) for pattern, sensor_type, unit in READING_PATTERNS
+                   for match in [pattern.search(payload)] if match]
+        
+        # 查找或创建设备
+        device = self.db.query(DeviceModel).filter(DeviceModel.name == device_name).first()
+        if not device:
+            print(f"设备 {device_name} 不存在，自动创建...")
+            device = DeviceModel(
+                name=device_name,
+                device_type="自动创建设备",
+                status="在线",
+                location="未知位置"
+            )
+            self.db.add(device)
+            self.db.flush()  # 刷新以获取新分配的ID
+            print(f"已创建设备: {device_name}, ID: {device.id}")
+        else:
+            print(f"使用现有设备: {device_name}, ID: {device.id}")
+        
+        for match, sensor_type, unit in matches:
+            try:
+                value = float(match.group(1)) if unit != '' else int(match.group(1))
+                print(f"解析到传感器数据: {sensor_type} = {value} {unit}")
+                self.save_sensor_data(self.db, device.id, sensor_type, value, unit)
+            except ValueError as e:
+                print(f"转换数值失败: {match.group(1)}, 错误: {e}")
+        
+        # 如果没有匹配到已知格式，尝试解析为简单数值
+        if not matches:
+            # 尝试直接解析为数值
+            number_matches = re.findall(r'([\d.]+)\s*([CF%]?)', payload)
+            if number_matches:
+                for value_str, unit in number_matches:
+                    try:
+                        value = float(value_str)
+                        # 简单地使用topic作为传感器类型名
+                        sensor_type = f"Sensor_{len(number_matches)}"
+                        print(f"从数值解析: {sensor_type} = {value} {unit}")
+                        self.save_sensor_data(self.db, device.id, sensor_type, value, unit)
+                    except ValueError as e:
+                        print(f"转换简单数值失败: {value_str}, 错误: {e}")
+
+    def create_or_update_sensor_data(self, device_name, sensor_type, value, topic, unit=''):
+        """根据设备名、传感器类型和值创建或更新传感器数据"""
+        print(f"尝试创建或更新传感器数据: 设备={device_name}, 类型={sensor_type}, 值={value}")
+        
+        # 查找设备，如果不存在则自动创建
+        device = self.db.query(DeviceModel).filter(DeviceModel.name == device_name).first()
+        if not device:
+            print(f"设备 {device_name} 不存在，自动创建...")
+            device = DeviceModel(
+                name=device_name,
+                device_type="自动创建设备",
+                status="在线",
+                location="未知位置"
+            )
+            self.db.add(device)
+            self.db.flush()  # 刷新以获取新分配的ID
+            print(f"已创建设备: {device_name}, ID: {device.id}")
+        
+        # 保存传感器数据
+        self.save_sensor_data(self.db, device.id, sensor_type, value, unit)
+        print(f"已保存传感器数据: 设备={device_name}, 类型={sensor_type}, 值={value}")
+
+    def save_sensor_data(self, db, device_id, sensor_type, value, unit, timestamp: Optional[datetime] = None):
+        """保存传感器数据到数据库；timestamp为设备上报时间（UTC），缺省取补录消息的收到时间或当前时间"""
+        if timestamp is None and self.message_time is not None:
+            timestamp = datetime.utcfromtimestamp(self.message_time)
+        now = timestamp or datetime.utcnow()
+        self._readings += 1
+        self.register_shard(db, device_id)
+        if self.replace_window is not None:
+            self.clear_window(db, device_id, sensor_type)
+        # 检查是否已存在相同类型的传感器数据
+        existing_sensor = db.query(SensorDataModel).filter(
+            SensorDataModel.device_id == device_id,
+            SensorDataModel.type == sensor_type
+        ).first()
+        # 网关补传的旧读数只写历史，不覆盖更新的最新值
+        stale = (existing_sensor is not None and timestamp is not None
+                 and existing_sensor.timestamp is not None and timestamp < existing_sensor.timestamp)
+
+        if existing_sensor and not stale:
+            # 更新现有传感器数据
+            existing_sensor.value = value
+            existing_sensor.unit = unit
+            existing_sensor.timestamp = now
+            # 更新告警状态
+            if 'Temperature' in sensor_type and float(value) > 28:
+                existing_sensor.alert_status = 'alert' if float(value) > 30 else 'warning'
+            elif 'Humidity' in sensor_type and float(value) > 65:
+                existing_sensor.alert_status = 'alert' if float(value) > 70 else 'warning'
+            else:
+                existing_sensor.alert_status = 'normal'
+        elif existing_sensor is None:
+            # 创建新的传感器数据
+            # 确定默认的最小值和最大值
+            min_value = 0.0
+            max_value = 100.0
+            if 'Temperature' in sensor_type:
+                min_value = -40.0  # 常见温度传感器范围
+                max_value = 80.0
+            elif 'Humidity' in sensor_type:
+                min_value = 0.0   # 湿度范围
+                max_value = 100.0
+            
+            sensor_data = SensorDataModel(
+                device_id=device_id,
+                type=sensor_type,
+                value=value,
+                unit=unit,
+                timestamp=now,
+                min_value=min_value,
+                max_value=max_value,
+                alert_status="normal"
+            )
+            
+            # 更新告警状态
+            if 'Temperature' in sensor_type and float(value) > 28:
+                sensor_data.alert_status = 'alert' if float(value) > 30 else 'warning'
+            elif 'Humidity' in sensor_type and float(value) > 65:
+                sensor_data.alert_status = 'alert' if float(value) > 70 else 'warning'
+            else:
+                sensor_data.alert_status = 'normal'
+                
+            db.add(sensor_data)
+            # 同一批次内后续消息需要查到这条记录
+            db.flush()
+
+        if self.history_filter.should_store(device_id, sensor_type, value, now.timestamp()):
+            if self.history_store:
+                self.history_store.append(db, device_id, sensor_type, now, value)
+            else:
+                db.add(SensorHistoryModel(device_id=device_id, type=sensor_type, value=value, timestamp=now))
+
+        if self.anomaly_detector:
+            for event in self.anomaly_detector.observe(device_id, sensor_type, value, now.timestamp()):
+                print(f"检测到异常: 设备={device_id}, 类型={sensor_type}, {event['kind']}, 值={value}")
+                db.add(AnomalyEventModel(
+                    device_id=device_id, type=sensor_type, kind=event["kind"], value=event["value"],
+                    expected=event["expected"], score=event["score"], timestamp=now,
+                ))
+
+        if not stale:
+            self.queue_latest_value(db, existing_sensor or sensor_data, now)
+            if self.observers:
+                self._observed_batch.append((device_id, sensor_type, value))
+
+    def queue_latest_value(self, db, sensor: SensorDataModel, timestamp: datetime):
+        """记录本批次的最新值，提交后发布到共享内存并计入仪表盘汇总（设备名随值一起存放，读取时不必再查设备表）"""
+        device = db.get(DeviceModel, sensor.device_id)
+        self._latest_batch.append((
+            sensor.device_id, sensor.type, float(sensor.value), timestamp.replace(tzinfo=timezone.utc).timestamp(),
+            sensor.unit or "", sensor.alert_status or "", device.name if device else "", sensor.id or 0,
+        ))
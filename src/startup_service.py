@@ -0,0 +1,98 @@
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+import sys
+import os
+
+# 修复相对导入问题
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+if parent_dir not in sys.path:
+    sys.path.append(parent_dir)
+
+
+class StartupService:
+    """后台启动服务
+
+    应用启动时需要执行建表、数据修复、迁移检查和启动MQTT等步骤，
+    这些步骤放到后台线程中依次执行，HTTP服务可以立即响应请求，
+    /readyz 根据这里记录的状态判断服务是否就绪。
+    """
+
+    def __init__(self):
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.db_ready = False
+        self.error: Optional[str] = None
+        self.step_durations: Dict[str, float] = {}
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def start(self, steps: List[Tuple[str, Callable[[], None]]], db_steps: int = 0):
+        """在后台线程中依次执行启动步骤
+
+        Args:
+            steps: (步骤名, 可调用对象) 列表
+            db_steps: 前多少个步骤属于数据库预热，完成后即认为数据库已就绪
+        """
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return self._thread
+            self.started_at = time.monotonic()
+            self.finished_at = None
+            self.db_ready = db_steps == 0
+            self.error = None
+            self.step_durations = {}
+            self._thread = threading.Thread(
+                target=self._run, args=(steps, db_steps), name="startup", daemon=True
+            )
+            self._thread.start()
+            return self._thread
+
+    def _run(self, steps, db_steps):
+        for index, (name, step) in enumerate(steps):
+            step_start = time.monotonic()
+            try:
+                step()
+            except Exception as e:
+                print(f"启动步骤 {name} 失败: {e}")
+                self.error = f"{name}: {e}"
+                # 数据库步骤失败时后续步骤无法正常工作，直接终止
+                if index < db_steps:
+                    break
+            finally:
+                self.step_durations[name] = round((time.monotonic() - step_start) * 1000, 2)
+            if index + 1 == db_steps and not self.error:
+                self.db_ready = True
+        self.finished_at = time.monotonic()
+        print(f"后台启动完成，各步骤耗时(ms): {self.step_durations}")
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """等待后台启动完成（主要用于测试和脚本）"""
+        thread = self._thread
+        if thread:
+            thread.join(timeout)
+            return not thread.is_alive()
+        return True
+
+    @property
+    def is_running(self) -> bool:
+        return bool(self._thread and self._thread.is_alive())
+
+    def status(self) -> dict:
+        """返回启动状态摘要"""
+        elapsed = None
+        if self.started_at is not None:
+            end = self.finished_at if self.finished_at is not None else time.monotonic()
+            elapsed = round((end - self.started_at) * 1000, 2)
+        return {
+            "db_ready": self.db_ready,
+            "finished": self.finished_at is not None,
+            "elapsed_ms": elapsed,
+            "steps_ms": dict(self.step_durations),
+            "error": self.error,
+        }
+
+
+# 创建全局启动服务实例
+startup_service = StartupService()
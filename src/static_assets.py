@@ -0,0 +1,251 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import sys
+from typing import Dict, Optional
+
+from starlette.requests import Request
+from starlette.responses import FileResponse, Response
+
+# 修复相对导入问题
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+if parent_dir not in sys.path:
+    sys.path.append(parent_dir)
+
+try:
+    import brotli
+except ImportError:  # 可选依赖：未安装时只提供gzip（构建时生成的 .br 文件仍会使用）
+    brotli = None
+
+# Vite生产构建目录（cd frontend && npm run build）
+FRONTEND_DIST = os.getenv("FRONTEND_DIST", os.path.join(parent_dir, "frontend", "dist"))
+
+# 文件名带内容哈希的资源永不变化，其余文件（含SPA入口页）每次用ETag验证
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE = "no-cache"
+# Vite默认输出 assets/[name]-[hash].[ext]，哈希为8位base64url字符
+_HASHED_NAME = re.compile(r"-[A-Za-z0-9_-]{8}\.[A-Za-z0-9]+$")
+
+COMPRESSIBLE_EXTENSIONS = {".js", ".mjs", ".css", ".html", ".svg", ".json", ".map", ".txt", ".xml", ".ico", ".wasm"}
+# 太小的文件压缩收益不抵额外开销
+MIN_COMPRESS_SIZE = 512
+# 按优先级排列的编码及预压缩文件后缀
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+
+def _compress(data: bytes, encoding: str) -> Optional[bytes]:
+    if encoding == "gzip":
+        return gzip.compress(data, compresslevel=9, mtime=0)
+    if encoding == "br" and brotli is not None:
+        return brotli.compress(data, quality=11)
+    return None
+
+
+def parse_accept_encoding(header: str) -> set:
+    """解析 Accept-Encoding，返回客户端可接受（q>0）的编码"""
+    accepted = set()
+    for part in (header or "").split(","):
+        name, _, params = part.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            accepted.add(name)
+    return accepted
+
+
+def _etag(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=10).hexdigest()
+
+
+def _not_modified(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    return header.strip() == "*" or etag in [tag.strip() for tag in header.split(",")]
+
+
+class StaticEntry:
+    """一个静态文件：可压缩的文件及其压缩版本常驻内存，其余文件从磁盘发送"""
+
+    __slots__ = ("path", "media_type", "cache_control", "etag", "stat_key", "body", "variants")
+
+    def __init__(self, path: str, cache_control: str):
+        self.path = path
+        self.media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        if self.media_type.startswith("text/") or self.media_type in ("application/javascript", "image/svg+xml"):
+            self.media_type += "; charset=utf-8"
+        self.cache_control = cache_control
+        stat = os.stat(path)
+        self.stat_key = (stat.st_mtime_ns, stat.st_size)
+        self.body: Optional[bytes] = None
+        self.variants: Dict[str, bytes] = {}
+        if os.path.splitext(path)[1].lower() in COMPRESSIBLE_EXTENSIONS:
+            with open(path, "rb") as f:
+                self.body = f.read()
+            self.etag = _etag(self.body)
+            if len(self.body) >= MIN_COMPRESS_SIZE:
+                for encoding, suffix in ENCODINGS:
+                    compressed = self._load_variant(path + suffix, stat.st_mtime_ns) or _compress(self.body, encoding)
+                    if compressed is not None and len(compressed) < len(self.body):
+                        self.variants[encoding] = compressed
+        else:
+            self.etag = hashlib.blake2b(f"{path}:{self.stat_key}".encode(), digest_size=10).hexdigest()
+
+    @staticmethod
+    def _load_variant(path: str, source_mtime_ns: int) -> Optional[bytes]:
+        """读取构建时生成的预压缩文件，早于源文件的视为过期"""
+        try:
+            if os.stat(path).st_mtime_ns < source_mtime_ns:
+                return None
+            with open(path, "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def response(self, request: Request) -> Response:
+        encoding = None
+        if self.variants:
+            accepted = parse_accept_encoding(request.headers.get("accept-encoding", ""))
+            encoding = next((name for name, _ in ENCODINGS if name in self.variants and name in accepted), None)
+        # 不同编码是不同的表示，ETag需要区分
+        etag = f'"{self.etag}-{encoding}"' if encoding else f'"{self.etag}"'
+        headers = {"ETag": etag, "Cache-Control": self.cache_control}
+        if self.variants:
+            headers["Vary"] = "Accept-Encoding"
+        if _not_modified(request, etag):
+            return Response(status_code=304, headers=headers)
+        if encoding:
+            headers["Content-Encoding"] = encoding
+            return Response(self.variants[encoding], media_type=self.media_type, headers=headers)
+        if self.body is not None:
+            return Response(self.body, media_type=self.media_type, headers=headers)
+        return FileResponse(self.path, media_type=self.media_type, headers=headers, method=request.method)
+
+
+class StaticAssets:
+    """为一个目录提供预压缩、可缓存的静态文件
+
+    文件首次被请求时建立条目（读取内容、计算ETag、加载或生成gzip/brotli版本），
+    之后只在文件变化（mtime或大小改变）时重建，请求处理不再压缩。
+    """
+
+    def __init__(self, root: str, immutable: bool = True):
+        self.root = os.path.realpath(root)
+        self.immutable = immutable
+        self._entries: Dict[str, StaticEntry] = {}
+
+    def resolve(self, path: str) -> Optional[str]:
+        """把URL路径映射到目录内的文件，越出目录或不存在时返回None"""
+        full = os.path.realpath(os.path.join(self.root, path.lstrip("/")))
+        if not full.startswith(self.root + os.sep) or not os.path.isfile(full):
+            return None
+        return full
+
+    def lookup(self, path: str) -> Optional[StaticEntry]:
+        full = self.resolve(path)
+        if full is None or full.endswith((".gz", ".br")):
+            return None
+        entry = self._entries.get(full)
+        try:
+            stat = os.stat(full)
+        except OSError:
+            return None
+        if entry is None or entry.stat_key != (stat.st_mtime_ns, stat.st_size):
+            hashed = self.immutable and _HASHED_NAME.search(os.path.basename(full))
+            entry = StaticEntry(full, IMMUTABLE_CACHE if hashed else REVALIDATE_CACHE)
+            self._entries[full] = entry
+        return entry
+
+    def response(self, request: Request, path: str) -> Optional[Response]:
+        entry = self.lookup(path)
+        return entry.response(request) if entry else None
+
+    def warm(self) -> int:
+        """预先为目录中的全部文件建立条目（启动时调用，避免首个请求承担压缩开销）"""
+        count = 0
+        for directory, _, files in os.walk(self.root):
+            for name in files:
+                relative = os.path.relpath(os.path.join(directory, name), self.root)
+                if self.lookup(relative):
+                    count += 1
+        return count
+
+
+class SpaShell:
+    """SPA入口页：存在构建产物时用其 index.html，否则用内置页面；压缩版本和ETag缓存在内存中"""
+
+    def __init__(self, index_path: str, fallback_html: str):
+        self.index_path = index_path
+        self.fallback_html = fallback_html
+        self._entry: Optional[StaticEntry] = None
+        self._fallback: Optional[StaticEntry] = None
+
+    def response(self, request: Request) -> Response:
+        if os.path.isfile(self.index_path):
+            try:
+                stat = os.stat(self.index_path)
+                if self._entry is None or self._entry.stat_key != (stat.st_mtime_ns, stat.st_size):
+                    self._entry = StaticEntry(self.index_path, REVALIDATE_CACHE)
+                return self._entry.response(request)
+            except OSError:
+                pass
+        if self._fallback is None:
+            self._fallback = _MemoryEntry(self.fallback_html.encode(), "text/html; charset=utf-8")
+        return self._fallback.response(request)
+
+
+class _MemoryEntry(StaticEntry):
+    """内容来自内存而非文件的条目（内置的入口页）"""
+
+    def __init__(self, body: bytes, media_type: str):
+        self.path = None
+        self.media_type = media_type
+        self.cache_control = REVALIDATE_CACHE
+        self.stat_key = None
+        self.body = body
+        self.etag = _etag(body)
+        self.variants = {}
+        for encoding, _ in ENCODINGS:
+            compressed = _compress(body, encoding)
+            if compressed is not None and len(compressed) < len(body):
+                self.variants[encoding] = compressed
+
+
+def precompress(root: str) -> dict:
+    """为构建目录中的可压缩文件生成 .gz / .br（部署时运行，服务启动时直接加载）"""
+    written = {"gzip": 0, "br": 0}
+    for directory, _, files in os.walk(root):
+        for name in files:
+            path = os.path.join(directory, name)
+            if name.endswith((".gz", ".br")) or os.path.splitext(name)[1].lower() not in COMPRESSIBLE_EXTENSIONS:
+                continue
+            with open(path, "rb") as f:
+                data = f.read()
+            if len(data) < MIN_COMPRESS_SIZE:
+                continue
+            for encoding, suffix in ENCODINGS:
+                compressed = _compress(data, encoding)
+                if compressed is not None and len(compressed) < len(data):
+                    with open(path + suffix, "wb") as f:
+                        f.write(compressed)
+                    written[encoding] += 1
+    return written
+
+
+if __name__ == "__main__":
+    target = sys.argv[1] if len(sys.argv) > 1 else FRONTEND_DIST
+    result = precompress(target)
+    print(f"预压缩完成: {target}，gzip {result['gzip']} 个，brotli {result['br']} 个"
+          + ("" if brotli else "（未安装brotli，跳过.br）"))
@@ -0,0 +1,188 @@
+import json
+import threading
+import time
+from typing import Dict, List, Optional
+import os
+
+import paho.mqtt.client as mqtt
+
+# 订阅使用QoS1，配合持久会话和手动确认实现至少一次投递
+SUBSCRIBE_QOS = int(os.getenv("MQTT_SUBSCRIBE_QOS", "1"))
+
+
+def parse_topic_specs(topics_str: str, default_qos: int = SUBSCRIBE_QOS) -> Dict[str, int]:
+    """解析主题配置为 {主题: QoS}
+
+    支持JSON数组（元素为主题字符串或 {"topic": "...", "qos": 0-2}），
+    以及按换行符或逗号分隔的主题字符串。
+    """
+    if not topics_str:
+        return {}
+
+    items = None
+    try:
+        parsed = json.loads(topics_str)
+        if isinstance(parsed, list):
+            items = parsed
+        else:
+            return {}
+    except (json.JSONDecodeError, TypeError):
+        # 如果不是JSON格式，则按换行符或逗号分割
+        separator = '\n' if '\n' in topics_str else ','
+        items = [t.strip() for t in topics_str.split(separator) if t.strip()]
+
+    specs: Dict[str, int] = {}
+    for item in items:
+        if isinstance(item, dict):
+            topic = item.get("topic")
+            qos = item.get("qos", default_qos)
+        else:
+            topic, qos = item, default_qos
+        if not isinstance(topic, str) or not topic:
+            continue
+        try:
+            qos = max(0, min(2, int(qos)))
+        except (TypeError, ValueError):
+            qos = default_qos
+        # 同一主题出现多次时取最高QoS
+        specs[topic] = max(qos, specs.get(topic, 0))
+    return specs
+
+
+def merge_topic_specs(*spec_sets: Dict[str, int]) -> Dict[str, int]:
+    """合并多组主题，同一主题取最高QoS"""
+    merged: Dict[str, int] = {}
+    for specs in spec_sets:
+        for topic, qos in specs.items():
+            merged[topic] = max(qos, merged.get(topic, 0))
+    return merged
+
+
+class SubscriptionManager:
+    """订阅管理器
+
+    维护期望订阅的主题集合（配置主题 + 通过API动态添加的主题），
+    配置变更时只对差异部分发送一个批量SUBSCRIBE和一个批量UNSUBSCRIBE报文，
+    未变化的主题保持订阅，连接不中断，不丢消息。
+    """
+
+    def __init__(self, client: Optional[mqtt.Client] = None):
+        self.client = client
+        self.config_topics: Dict[str, int] = {}
+        self.dynamic_topics: Dict[str, int] = {}
+        # 已发送给broker的订阅
+        self.subscribed: Dict[str, int] = {}
+        # broker授予的QoS（128表示订阅失败）
+        self.granted: Dict[str, int] = {}
+        self._pending: Dict[int, List[str]] = {}
+        self._lock = threading.RLock()
+        self.stats = {"reloads": 0, "subscribe_packets": 0, "unsubscribe_packets": 0, "last_reload_ms": 0.0}
+
+    @property
+    def desired(self) -> Dict[str, int]:
+        return merge_topic_specs(self.config_topics, self.dynamic_topics)
+
+    @staticmethod
+    def diff(current: Dict[str, int], desired: Dict[str, int]):
+        """返回 (需要订阅的{主题: QoS}, 需要取消订阅的主题列表)，QoS变化的主题重新订阅"""
+        to_subscribe = {topic: qos for topic, qos in desired.items() if current.get(topic) != qos}
+        to_unsubscribe = [topic for topic in current if topic not in desired]
+        return to_subscribe, to_unsubscribe
+
+    def _send(self, to_subscribe: Dict[str, int], to_unsubscribe: List[str]) -> bool:
+        """先订阅新主题再取消旧主题，避免通配符替换期间出现空档"""
+        if self.client is None:
+            return False
+        if to_subscribe:
+            rc, mid = self.client.subscribe(list(to_subscribe.items()))
+            if rc != mqtt.MQTT_ERR_SUCCESS:
+                return False
+            self._pending[mid] = list(to_subscribe)
+            self.subscribed.update(to_subscribe)
+            self.stats["subscribe_packets"] += 1
+            print(f"已订阅主题: {to_subscribe}")
+        if to_unsubscribe:
+            rc, _ = self.client.unsubscribe(to_unsubscribe)
+            if rc != mqtt.MQTT_ERR_SUCCESS:
+                return False
+            for topic in to_unsubscribe:
+                self.subscribed.pop(topic, None)
+                self.granted.pop(topic, None)
+            self.stats["unsubscribe_packets"] += 1
+            print(f"已取消订阅主题: {to_unsubscribe}")
+        return True
+
+    def sync(self) -> dict:
+        """把broker上的订阅调整为期望集合，返回变更摘要"""
+        with self._lock:
+            started = time.perf_counter()
+            to_subscribe, to_unsubscribe = self.diff(self.subscribed, self.desired)
+            sent = self._send(to_subscribe, to_unsubscribe)
+            elapsed = round((time.perf_counter() - started) * 1000, 3)
+            if to_subscribe or to_unsubscribe:
+                self.stats["reloads"] += 1
+                self.stats["last_reload_ms"] = elapsed
+            return {
+                "subscribed": to_subscribe,
+                "unsubscribed": to_unsubscribe,
+                "sent": sent,
+                "elapsed_ms": elapsed,
+            }
+
+    def apply_config(self, topics: Dict[str, int]) -> dict:
+        """替换配置主题并按差异调整订阅"""
+        with self._lock:
+            self.config_topics = dict(topics)
+            return self.sync()
+
+    def add(self, topic: str, qos: int = SUBSCRIBE_QOS) -> dict:
+        """动态添加订阅"""
+        with self._lock:
+            self.dynamic_topics[topic] = qos
+            return self.sync()
+
+    def remove(self, topic: str) -> dict:
+        """取消订阅主题（同时从配置主题和动态主题中移除，直到下次配置变更）"""
+        with self._lock:
+            self.dynamic_topics.pop(topic, None)
+            self.config_topics.pop(topic, None)
+            return self.sync()
+
+    def clear(self) -> dict:
+        """取消全部订阅"""
+        with self._lock:
+            self.config_topics = {}
+            self.dynamic_topics = {}
+            return self.sync()
+
+    def on_connected(self, session_present: bool):
+        """连接建立后恢复订阅：新会话需要全部重新订阅，持久会话只补发差异"""
+        with self._lock:
+            if not session_present:
+                self.subscribed = {}
+                self.granted = {}
+            self._pending = {}
+            return self.sync()
+
+    def on_disconnected(self):
+        with self._lock:
+            self._pending = {}
+
+    def on_subscribe(self, client, userdata, mid, granted_qos):
+        """SUBACK回调，记录broker授予的QoS"""
+        with self._lock:
+            topics = self._pending.pop(mid, [])
+            for topic, qos in zip(topics, granted_qos):
+                self.granted[topic] = qos
+                if qos == 128:
+                    print(f"broker拒绝订阅主题: {topic}")
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "config_topics": dict(self.config_topics),
+                "dynamic_topics": dict(self.dynamic_topics),
+                "subscribed": dict(self.subscribed),
+                "granted": dict(self.granted),
+                "stats": dict(self.stats),
+            }
@@ -0,0 +1,170 @@
+import json
+import math
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+import os
+
+# 每隔多少条消息采样一条完整链路（1表示全部采样，0表示关闭）
+TRACE_SAMPLE_EVERY = int(os.getenv("TRACE_SAMPLE_EVERY", "100"))
+# 环形缓冲区保留的最近链路数，分位数基于这些链路计算
+TRACE_RING_SIZE = int(os.getenv("TRACE_RING_SIZE", "2048"))
+
+# 阶段顺序：received(MQTT收到) → started(开始处理) → parsed(正则解析完成) → resolved(设备查找/创建完成)
+# → processed(本条消息写入会话) → committed(批次提交，此后API可读到)
+# 各阶段耗时 = 后一个时间戳 - 前一个时间戳；缺少某个时间戳（如主题格式不经过解析）时该阶段不计
+STAGE_SPANS = (
+    ("queue", "received", "started"),
+    ("parse", "started", "parsed"),
+    ("resolve", "parsed", "resolved"),
+    ("write", "resolved", "processed"),
+    ("commit", "processed", "committed"),
+    ("end_to_end", "received", "committed"),
+)
+TRACE_PERCENTILES = (50, 90, 99)
+
+# 载荷中的设备时间戳：JSON字段 ts/timestamp/time，或文本中的 "ts: 1700000000"
+DEVICE_TS_KEYS = ("ts", "timestamp", "time")
+_DEVICE_TS_PATTERN = re.compile(r'\bts[:=]\s*(\d+(?:\.\d+)?)')
+
+
+def parse_device_timestamp(payload) -> Optional[float]:
+    """从载荷中取设备时间戳（Unix秒），毫秒时间戳和ISO字符串会被换算；没有时返回None"""
+    if isinstance(payload, dict):
+        return parse_timestamp_value(next((payload[key] for key in DEVICE_TS_KEYS if key in payload), None))
+    if isinstance(payload, (bytes, bytearray)):
+        payload = payload.decode(errors="replace")
+    value = None
+    text = payload.lstrip()
+    if text.startswith("{"):
+        try:
+            data = json.loads(text)
+        except ValueError:
+            return None
+        if isinstance(data, dict):
+            value = next((data[key] for key in DEVICE_TS_KEYS if key in data), None)
+    else:
+        match = _DEVICE_TS_PATTERN.search(text)
+        if match:
+            value = float(match.group(1))
+    return parse_timestamp_value(value)
+
+
+def parse_timestamp_value(value) -> Optional[float]:
+    """时间戳字段换算为Unix秒：数字（秒或毫秒）或ISO字符串（无时区按UTC），无法识别时返回None"""
+    if isinstance(value, str):
+        try:
+            parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            return None
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        return parsed.timestamp()
+    if isinstance(value, (int, float)) and not isinstance(value, bool) and value > 0:
+        # 大于1e11视为毫秒
+        return value / 1000.0 if value > 1e11 else float(value)
+    return None
+
+
+class MessageTrace:
+    """一条被采样消息在各阶段的单调时钟时间戳"""
+
+    __slots__ = ("topic", "marks", "device_lag_ms")
+
+    def __init__(self, topic: str, received_at: float, payload=None):
+        self.topic = topic
+        self.marks: Dict[str, float] = {"received": received_at}
+        self.device_lag_ms: Optional[float] = None
+        if payload is not None:
+            device_ts = parse_device_timestamp(payload)
+            if device_ts is not None:
+                # 收到时的墙上时间 = 当前墙上时间 - 收到后经过的单调时间
+                received_wall = time.time() - (time.monotonic() - received_at)
+                self.device_lag_ms = round((received_wall - device_ts) * 1000, 3)
+
+    def mark(self, stage: str):
+        self.marks[stage] = time.monotonic()
+
+    def spans(self) -> Dict[str, float]:
+        """各阶段耗时（毫秒）"""
+        marks = self.marks
+        return {
+            name: round((marks[end] - marks[start]) * 1000, 3)
+            for name, start, end in STAGE_SPANS if start in marks and end in marks
+        }
+
+    def to_dict(self) -> dict:
+        result = {"topic": self.topic, "stages_ms": self.spans()}
+        if self.device_lag_ms is not None:
+            result["device_lag_ms"] = self.device_lag_ms
+        return result
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    """最近秩法分位数，输入已排序"""
+    index = max(0, min(len(sorted_values) - 1, math.ceil(p / 100.0 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class TraceRecorder:
+    """消息链路采样
+
+    每 sample_every 条消息采样一条，在各阶段打上单调时钟时间戳，
+    提交后放入固定大小的环形缓冲区；查询时按阶段计算分位数。未采样的消息只有一次计数的开销。
+    """
+
+    def __init__(self, sample_every: int = TRACE_SAMPLE_EVERY, ring_size: int = TRACE_RING_SIZE):
+        self.sample_every = sample_every
+        self._ring: deque = deque(maxlen=ring_size)
+        self._counter = 0
+        self._lock = threading.Lock()
+        self.stats = {"seen": 0, "sampled": 0, "recorded": 0}
+
+    def start(self, topic: str, payload, received_at: float) -> Optional[MessageTrace]:
+        """为新消息决定是否采样，采样时返回链路对象"""
+        if self.sample_every <= 0:
+            return None
+        self._counter += 1
+        if self._counter % self.sample_every:
+            return None
+        self.stats["sampled"] += 1
+        return MessageTrace(topic, received_at, payload)
+
+    def record(self, trace: MessageTrace):
+        with self._lock:
+            self._ring.append(trace)
+            self.stats["recorded"] += 1
+
+    def summary(self) -> dict:
+        """各阶段及设备到采集延迟的分位数（毫秒）"""
+        with self._lock:
+            traces = list(self._ring)
+        spans: Dict[str, List[float]] = {name: [] for name, _, _ in STAGE_SPANS}
+        device_lags: List[float] = []
+        for trace in traces:
+            for name, value in trace.spans().items():
+                spans[name].append(value)
+            if trace.device_lag_ms is not None:
+                device_lags.append(trace.device_lag_ms)
+        if device_lags:
+            spans["device_to_ingest"] = device_lags
+
+        stages = {}
+        for name, values in spans.items():
+            if not values:
+                continue
+            values.sort()
+            stages[name] = dict(
+                {f"p{p}": percentile(values, p) for p in TRACE_PERCENTILES},
+                count=len(values), max=values[-1],
+            )
+        self.stats["seen"] = self._counter
+        return dict(self.stats, sample_every=self.sample_every, traces=len(traces), stages=stages)
+
+    def recent(self, limit: int = 20) -> List[dict]:
+        with self._lock:
+            traces = list(self._ring)[-limit:]
+        return [trace.to_dict() for trace in reversed(traces)]
@@ -0,0 +1,295 @@
+import json
+import threading
+from array import array
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+import sys
+import os
+
+import numpy as np
+
+# 修复相对导入问题
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+if parent_dir not in sys.path:
+    sys.path.append(parent_dir)
+
+from src.database import SessionLocal
+from src.models import DashboardStateModel
+from src.admission import device_key
+
+# 是否在 on_message 中统计流量（主题/设备的热点）
+TRAFFIC_ANALYTICS = os.getenv("TRAFFIC_ANALYTICS", "1") == "1"
+# Count-Min sketch 的宽度和深度：估计值最多多算约 e/宽度 × 窗口总消息数（概率 1-e^-深度）
+TRAFFIC_SKETCH_WIDTH = int(os.getenv("TRAFFIC_SKETCH_WIDTH", "2048"))
+TRAFFIC_SKETCH_DEPTH = int(os.getenv("TRAFFIC_SKETCH_DEPTH", "4"))
+# 每个时间片的 Space-Saving 计数器个数（候选热点数）
+TRAFFIC_TOP_K = int(os.getenv("TRAFFIC_TOP_K", "100"))
+# 滑动窗口由定长时间片组成，窗口只能取以下值（秒）
+TRAFFIC_SLOT_SECONDS = 10
+TRAFFIC_WINDOWS = (60, 300, 900)
+# 采集进程把各窗口的热点写入数据库的间隔（秒），供其他进程的HTTP worker读取
+TRAFFIC_PERSIST_SECONDS = float(os.getenv("TRAFFIC_PERSIST_SECONDS", "5"))
+TRAFFIC_KINDS = ("topic", "device")
+_STATE_NAME = "traffic"
+_PERSISTED_TOP = 50
+
+
+class CountMinSketch:
+    """Count-Min sketch：固定内存的频次估计，只会高估不会低估"""
+
+    def __init__(self, width: int = TRAFFIC_SKETCH_WIDTH, depth: int = TRAFFIC_SKETCH_DEPTH):
+        self.width = width
+        self.depth = depth
+        # 单条更新在 array 上做纯Python加法（比numpy花式索引快数倍），合并和查询用同一块内存的numpy视图
+        self._cells = array("i", bytes(4 * depth * width))
+        self.table = np.frombuffer(self._cells, dtype=np.int32).reshape(depth, width)
+        self._rows = np.arange(depth)
+        self._offsets = [row * width for row in range(depth)]
+
+    def indexes(self, key: str) -> np.ndarray:
+        # 双重哈希：由一个64位哈希派生各行的列号（进程内稳定，sketch不跨进程共享）
+        value = hash(key) & 0xFFFFFFFFFFFFFFFF
+        low, high = value & 0xFFFFFFFF, (value >> 32) | 1
+        return (low + self._rows * high) % self.width
+
+    def add(self, key: str, count: int = 1):
+        value = hash(key) & 0xFFFFFFFFFFFFFFFF
+        low, high = value & 0xFFFFFFFF, (value >> 32) | 1
+        cells, width = self._cells, self.width
+        for row, offset in enumerate(self._offsets):
+            cells[offset + (low + row * high) % width] += count
+
+    def estimate(self, key: str, table: Optional[np.ndarray] = None) -> int:
+        table = self.table if table is None else table
+        return int(table[self._rows, self.indexes(key)].min())
+
+    def clear(self):
+        self.table.fill(0)
+
+
+class SpaceSaving:
+    """Space-Saving 热点统计：最多保留capacity个键，满了以后新键替换计数最小的键并继承其计数
+
+    计数按 count -> 键集合 分桶，最小计数随计数只增不减的特点维护，每次更新O(1)。
+    count 是上界，count - error 是该键确定出现的次数。
+    """
+
+    def __init__(self, capacity: int = TRAFFIC_TOP_K):
+        self.capacity = capacity
+        self.counts: Dict[str, int] = {}
+        self.errors: Dict[str, int] = {}
+        self._buckets: Dict[int, set] = {}
+        self._min = 0
+
+    def _place(self, key: str, count: int):
+        self.counts[key] = count
+        self._buckets.setdefault(count, set()).add(key)
+
+    def _remove(self, key: str) -> int:
+        count = self.counts.pop(key)
+        bucket = self._buckets[count]
+        bucket.discard(key)
+        if not bucket:
+            del self._buckets[count]
+            if count == self._min:
+                self._min = count + 1
+        return count
+
+    def add(self, key: str):
+        count = self.counts.get(key)
+        if count is not None:
+            self._remove(key)
+            self._place(key, count + 1)
+            return
+        if len(self.counts) < self.capacity:
+            self.errors[key] = 0
+            self._place(key, 1)
+            self._min = 1
+            return
+        victim = next(iter(self._buckets[self._min]))
+        error = self._remove(victim)
+        del self.errors[victim]
+        self.errors[key] = error
+        self._place(key, error + 1)
+        # 被替换的键所在桶可能已清空，新的最小值是 error 或 error+1
+        if error in self._buckets:
+            self._min = error
+        else:
+            self._min = error + 1
+
+    def clear(self):
+        self.counts.clear()
+        self.errors.clear()
+        self._buckets.clear()
+        self._min = 0
+
+
+class _Slot:
+    """一个时间片内某类键（主题或设备）的sketch和热点"""
+
+    __slots__ = ("sketch", "top")
+
+    def __init__(self):
+        self.sketch = CountMinSketch()
+        self.top = SpaceSaving()
+
+    def add(self, key: str):
+        self.sketch.add(key)
+        self.top.add(key)
+
+    def clear(self):
+        self.sketch.clear()
+        self.top.clear()
+
+
+class TrafficAnalyzer:
+    """按主题和设备（主题前两级）统计消息数的滑动窗口热点
+
+    最近 max(TRAFFIC_WINDOWS) 秒按 TRAFFIC_SLOT_SECONDS 分成时间片的环形数组，每个时间片每类键
+    一个 Count-Min sketch 和一个 Space-Saving 摘要，内存固定，与主题数量无关。
+    查询某个窗口时合并其中时间片的sketch，候选键为各时间片摘要中的键，按合并后的估计值排序。
+    """
+
+    def __init__(self, slot_seconds: int = TRAFFIC_SLOT_SECONDS, windows=TRAFFIC_WINDOWS):
+        self.slot_seconds = slot_seconds
+        self.windows = tuple(windows)
+        self.slot_count = max(self.windows) // slot_seconds
+        self._slot_ids: List[Optional[int]] = [None] * self.slot_count
+        self._slots: List[Optional[Dict[str, _Slot]]] = [None] * self.slot_count
+        self._totals = [0] * self.slot_count
+        self._lock = threading.Lock()
+        self._persist_thread: Optional[threading.Thread] = None
+        self.observed = 0
+
+    @property
+    def active(self) -> bool:
+        return self.observed > 0
+
+    def _slot(self, slot_id: int) -> Dict[str, _Slot]:
+        index = slot_id % self.slot_count
+        if self._slot_ids[index] != slot_id:
+            # 环形数组转过一圈，复用旧时间片的内存
+            if self._slots[index] is None:
+                self._slots[index] = {kind: _Slot() for kind in TRAFFIC_KINDS}
+            else:
+                for slot in self._slots[index].values():
+                    slot.clear()
+            self._slot_ids[index] = slot_id
+            self._totals[index] = 0
+        return self._slots[index]
+
+    def observe(self, topic: str, now: Optional[float] = None):
+        """记录一条消息（在 on_message 中调用）"""
+        now = time.time() if now is None else now
+        with self._lock:
+            index = int(now // self.slot_seconds)
+            slots = self._slot(index)
+            slots["topic"].add(topic)
+            slots["device"].add(device_key(topic))
+            self._totals[index % self.slot_count] += 1
+            self.observed += 1
+        if self._persist_thread is None:
+            self._start_persisting()
+
+    def validate(self, kind: str, window: int):
+        if kind not in TRAFFIC_KINDS:
+            raise ValueError(f"不支持的统计对象: {kind}")
+        if window not in self.windows:
+            raise ValueError(f"窗口只能为 {', '.join(str(value) for value in self.windows)} 秒")
+
+    def _copy_slots(self, window: int, now: float) -> list:
+        """在锁内复制窗口中各时间片的sketch和摘要，合并和估计在锁外进行，不阻塞 observe"""
+        current = int(now // self.slot_seconds)
+        oldest = current - window // self.slot_seconds
+        copies = []
+        with self._lock:
+            for index, slot_id in enumerate(self._slot_ids):
+                if slot_id is None or not oldest < slot_id <= current:
+                    continue
+                kinds = {kind: (slot.sketch, slot.sketch.table.copy(), dict(slot.top.counts), dict(slot.top.errors))
+                         for kind, slot in self._slots[index].items()}
+                copies.append((slot_id, self._totals[index], kinds))
+        return copies
+
+    def _top_from(self, copies: list, kind: str, window: int, limit: int, now: float) -> dict:
+        current = int(now // self.slot_seconds)
+        oldest = current - window // self.slot_seconds
+        table = sketch = None
+        candidates = {}
+        total = 0
+        for slot_id, slot_total, kinds in copies:
+            if not oldest < slot_id <= current:
+                continue
+            sketch, slot_table, counts, errors = kinds[kind]
+            # 复制的表在 snapshot 的多个窗口间共用，不能原地累加
+            table = slot_table.copy() if table is None else table + slot_table
+            total += slot_total
+            for key, count in counts.items():
+                candidates[key] = candidates.get(key, 0) + count - errors[key]
+        if table is None:
+            return {"kind": kind, "window": window, "total": 0, "items": []}
+        items = [{"key": key, "count": sketch.estimate(key, table), "guaranteed": guaranteed}
+                 for key, guaranteed in candidates.items()]
+        items.sort(key=lambda item: (-item["count"], item["key"]))
+        items = items[:limit]
+        for item in items:
+            item["share"] = round(item["count"] / total, 4) if total else 0.0
+        return {"kind": kind, "window": window, "total": total, "items": items}
+
+    def top(self, kind: str = "device", window: int = 60, limit: int = 20, now: Optional[float] = None) -> dict:
+        """窗口内消息数最多的键：count为估计值（上界），guaranteed为确定的下界"""
+        self.validate(kind, window)
+        now = time.time() if now is None else now
+        return self._top_from(self._copy_slots(window, now), kind, window, limit, now)
+
+    def snapshot(self, now: Optional[float] = None) -> dict:
+        now = time.time() if now is None else now
+        # 最大窗口的时间片只复制一次，各窗口从中筛选
+        copies = self._copy_slots(max(self.windows), now)
+        return {
+            "updated_at": now,
+            "tops": {f"{kind}:{window}": self._top_from(copies, kind, window, _PERSISTED_TOP, now)
+                     for kind in TRAFFIC_KINDS for window in self.windows},
+        }
+
+    def persist(self, now: Optional[float] = None):
+        now = time.time() if now is None else now
+        try:
+            with SessionLocal() as db:
+                db.merge(DashboardStateModel(name=_STATE_NAME, payload=json.dumps(self.snapshot(now), ensure_ascii=False),
+                                             updated_at=datetime.utcfromtimestamp(now)))
+                db.commit()
+        except Exception as e:
+            print(f"保存流量热点失败: {e}")
+
+    def _start_persisting(self):
+        with self._lock:
+            if self._persist_thread is not None:
+                return
+            self._persist_thread = threading.Thread(target=self._persist_loop, name="traffic-persist", daemon=True)
+        self._persist_thread.start()
+
+    def _persist_loop(self):
+        while True:
+            time.sleep(TRAFFIC_PERSIST_SECONDS)
+            self.persist()
+
+
+def get_traffic_top(db, kind: str, window: int, limit: int, analyzer: Optional[TrafficAnalyzer] = None) -> dict:
+    """本进程在采集时直接查询sketch，否则读取采集进程写入的快照"""
+    analyzer = analyzer or traffic_analyzer
+    if analyzer.active:
+        return analyzer.top(kind, window, limit)
+    analyzer.validate(kind, window)
+    row = db.get(DashboardStateModel, _STATE_NAME)
+    state = json.loads(row.payload) if row and row.payload else {"updated_at": None, "tops": {}}
+    result = state["tops"].get(f"{kind}:{window}") or {"kind": kind, "window": window, "total": 0, "items": []}
+    result["items"] = result["items"][:limit]
+    result["updated_at"] = datetime.utcfromtimestamp(state["updated_at"]) if state["updated_at"] else None
+    return result
+
+
+# 全局实例：各broker连接的 on_message 共用
+traffic_analyzer = TrafficAnalyzer()
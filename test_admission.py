@@ -0,0 +1,100 @@
+from src.admission import AdmissionQueue
+from src.ingest_pipeline import IngestMessage, IngestPipeline
+from test_ingest_resilience import latest_value
+
+
+def message(topic, payload, acked=None):
+    return IngestMessage(topic, payload, on_committed=(lambda: acked.append(payload)) if acked is not None else None)
+
+
+def drain(queue):
+    items = []
+    while not queue.empty():
+        items.append(queue.get_nowait())
+        queue.task_done()
+    return items
+
+
+def test_token_bucket_sheds_flooding_device_only():
+    queue = AdmissionQueue(maxsize=1000, policy="block", rate=1, burst=5)
+    acked = []
+    results = [queue.put(message("stm32/1", f"flood {i}", acked)) for i in range(100)]
+    assert results.count(True) == 5
+    assert queue.put(message("stm32/2", "quiet"))
+    # 被限速的消息立即确认，不会被broker重发
+    assert len(acked) == 95
+    status = queue.status()
+    assert status["stats"]["rate_limited"] == 95
+    assert status["top_shed_devices"] == {"stm32/1": 95}
+
+
+def test_drop_oldest_keeps_queue_bounded():
+    queue = AdmissionQueue(maxsize=3, policy="drop_oldest", rate=0)
+    acked = []
+    for i in range(5):
+        assert queue.put(message(f"dev/{i}", i, acked))
+    assert [m.payload for m in drain(queue)] == [2, 3, 4]
+    assert acked == [0, 1]
+    assert queue.stats["dropped_oldest"] == 2
+    assert queue.unfinished_tasks == 0
+
+
+def test_keep_latest_coalesces_per_device():
+    queue = AdmissionQueue(maxsize=2, policy="keep_latest", rate=0)
+    acked = []
+    queue.put(message("stm32/1", "a1", acked))
+    queue.put(message("stm32/2", "b1", acked))
+    queue.put(message("stm32/1", "a2", acked))
+    queue.put(message("stm32/1", "a3", acked))
+    assert [m.payload for m in drain(queue)] == ["a3", "b1"]
+    assert acked == ["a1", "a2"]
+    assert queue.stats["coalesced"] == 2
+
+
+def test_keep_latest_coalesces_full_topic_and_carries_all_fields():
+    queue = AdmissionQueue(maxsize=2, policy="keep_latest", rate=0)
+    queue.put(message("site/dev1/temp", "t1"))
+    queue.put(message("site/dev1/hum", "h1"))
+    # 同一设备前缀下的不同主题是不同的读数，不能互相替换
+    latest = IngestMessage("site/dev1/temp", "t2", trace="trace-t2", timestamp=1700000000.0,
+                           on_failed=print)
+    assert queue.put(latest)
+    items = drain(queue)
+    assert [(m.topic, m.payload) for m in items] == [("site/dev1/temp", "t2"), ("site/dev1/hum", "h1")]
+    assert (items[0].trace, items[0].timestamp, items[0].on_failed) == ("trace-t2", 1700000000.0, print)
+    # 被替换下来的旧内容交还给调用方确认
+    assert (latest.payload, latest.trace, latest.timestamp) == ("t1", None, None)
+
+
+def test_device_rate_limit_is_off_by_default():
+    queue = AdmissionQueue(maxsize=1000, policy="block")
+    assert all(queue.put(message("stm32/1", i)) for i in range(200))
+    assert queue.stats["rate_limited"] == 0
+
+
+def test_sample_above_high_watermark():
+    queue = AdmissionQueue(maxsize=100, policy="sample", rate=0, sample_every=10)
+    for i in range(80):
+        queue.put(message(f"dev/{i}", i))
+    admitted = [queue.put(message("stm32/9", i)) for i in range(30)]
+    assert admitted.count(True) == 3
+    assert queue.stats["sampled_out"] == 27
+
+
+def test_flood_does_not_starve_other_devices():
+    # 每设备限速需显式开启
+    admission = AdmissionQueue(maxsize=100, policy="keep_latest", rate=10, burst=50)
+    pipeline = IngestPipeline(batch_size=200, flush_interval=0.05, admission=admission)
+    pipeline.start()
+    try:
+        for i in range(5000):
+            pipeline.submit("flood/1", f"Temperature1: {i}.0 C")
+            if i % 500 == 0:
+                pipeline.submit("calm/1", f"Temperature1: {i / 100:.1f} C")
+        assert pipeline.flush(timeout=20)
+    finally:
+        pipeline.stop()
+    status = pipeline.status()
+    assert latest_value("calm/1", "Temperature1") == 45.0
+    assert status["admission"]["top_shed_devices"].get("flood/1", 0) > 4000
+    assert "calm/1" not in status["admission"]["top_shed_devices"]
@@ -0,0 +1,131 @@
+import random
+
+from src.anomaly_detector import ANOMALY_RATE, ANOMALY_SPIKE, ANOMALY_STUCK, AnomalyDetector
+from src.database import Base, SessionLocal, engine
+from src.db_operations import get_anomaly_events
+from src.ingest_pipeline import IngestPipeline
+from src.models import DeviceModel
+from src.sensor_processor import SensorDataProcessor
+from test_history import locked_once_factory
+
+Base.metadata.create_all(bind=engine)
+
+
+def feed(detector, values, sensor_type="Humidity1", step_s=10.0, device_id=1):
+    events = []
+    for index, value in enumerate(values):
+        events.extend(detector.observe(device_id, sensor_type, value, index * step_s))
+    return events
+
+
+def noisy(count, center=45.0, seed=3):
+    rng = random.Random(seed)
+    return [round(center + rng.gauss(0, 0.5), 1) for _ in range(count)]
+
+
+def test_normal_noise_is_quiet():
+    detector = AnomalyDetector(max_rates={"Humidity": 5.0})
+    assert feed(detector, noisy(2000)) == []
+    assert detector.status()["observed"] == 2000
+
+
+def test_stuck_sensor_flagged_once_and_rearmed():
+    detector = AnomalyDetector(stuck_limit=20)
+    events = feed(detector, noisy(50) + [16.1] * 100)
+    stuck = [event for event in events if event["kind"] == ANOMALY_STUCK]
+    assert len(stuck) == 1 and stuck[0]["value"] == 16.1
+
+    # 恢复变化后再次卡死会再报告
+    events = feed(detector, [16.3, 16.5] + [17.0] * 30)
+    assert [event["kind"] for event in events].count(ANOMALY_STUCK) == 1
+    # 开关量类型不检测卡死
+    assert feed(detector, [1] * 100, sensor_type="Relay Status") == []
+
+
+def test_spike_and_rate_of_change():
+    detector = AnomalyDetector(max_rates={"Temperature": 1.0}, cooldown=0)
+    values = [round(22 + 0.1 * (i % 3), 1) for i in range(100)]
+    events = feed(detector, values + [35.0], sensor_type="Temperature1")
+    kinds = {event["kind"] for event in events}
+    # 10秒内升高13°C：同时超过变化率上限和z分数阈值
+    assert kinds == {ANOMALY_RATE, ANOMALY_SPIKE}
+    spike = next(event for event in events if event["kind"] == ANOMALY_SPIKE)
+    assert abs(spike["expected"] - 22.1) < 0.2 and spike["score"] > 6
+
+    # 缓慢漂移不超过变化率上限
+    detector = AnomalyDetector(max_rates={"Temperature": 1.0})
+    drift = [22 + 0.01 * i for i in range(500)]
+    assert not [event for event in feed(detector, drift, sensor_type="Temperature1") if event["kind"] == ANOMALY_RATE]
+
+
+def test_pipeline_persists_anomaly_events():
+    processor = SensorDataProcessor(anomaly_detector=AnomalyDetector(stuck_limit=5))
+    pipeline = IngestPipeline(processor=processor, flush_interval=0.05)
+    pipeline.start()
+    try:
+        for _ in range(8):
+            pipeline.submit("anomaly/1", "Humidity1: 16.10 %")
+        assert pipeline.flush(timeout=10)
+    finally:
+        pipeline.stop()
+
+    assert pipeline.status()["anomalies"][ANOMALY_STUCK] == 1
+    with SessionLocal() as db:
+        device = db.query(DeviceModel).filter(DeviceModel.name == "anomaly/1").first()
+        events = get_anomaly_events(db, device_id=device.id)
+    assert [(event["kind"], event["type"], event["value"]) for event in events] == [
+        (ANOMALY_STUCK, "Humidity1", 16.1)
+    ]
+
+
+def test_retried_batch_records_stuck_event_once():
+    """批次提交失败重试时不重复计入状态，卡死事件仍随重试的批次写入"""
+    detector = AnomalyDetector(stuck_limit=5)
+    pipeline = IngestPipeline(processor=SensorDataProcessor(anomaly_detector=detector),
+                              session_factory=locked_once_factory(), flush_interval=0.05)
+    for _ in range(6):
+        pipeline.submit("anomaly/retry", "Humidity1: 16.10 %")
+    pipeline.start()
+    try:
+        assert pipeline.flush(timeout=10)
+    finally:
+        pipeline.stop()
+
+    assert pipeline.stats["commit_errors"] == 1
+    assert detector.status()[ANOMALY_STUCK] == 1
+    with SessionLocal() as db:
+        device = db.query(DeviceModel).filter(DeviceModel.name == "anomaly/retry").first()
+        events = get_anomaly_events(db, device_id=device.id)
+    assert [event["kind"] for event in events] == [ANOMALY_STUCK]
+
+
+def test_rolled_back_message_does_not_update_detector_state():
+    """单条消息的保存点回滚时，它对检测状态的改动也撤销：卡死事件由下一条读数记录"""
+    detector = AnomalyDetector(stuck_limit=5)
+    processor = SensorDataProcessor(anomaly_detector=detector)
+    queue_latest_value = processor.queue_latest_value
+    calls = []
+
+    def failing_queue_latest_value(db, sensor, timestamp):
+        # 第5条读数在异常检测之后失败，它的异常事件随保存点回滚
+        calls.append(sensor.value)
+        if len(calls) == 5:
+            raise ValueError("写入失败")
+        queue_latest_value(db, sensor, timestamp)
+    processor.queue_latest_value = failing_queue_latest_value
+
+    pipeline = IngestPipeline(processor=processor, flush_interval=0.05)
+    for _ in range(6):
+        pipeline.submit("http/anomaly-savepoint", {"device": "anomaly-savepoint", "type": "Humidity1", "value": 16.1,
+                                                   "unit": "%", "timestamp": None})
+    pipeline.start()
+    try:
+        assert pipeline.flush(timeout=10)
+    finally:
+        pipeline.stop()
+
+    assert detector.status()["observed"] == 5
+    with SessionLocal() as db:
+        device = db.query(DeviceModel).filter(DeviceModel.name == "anomaly-savepoint").first()
+        events = get_anomaly_events(db, device_id=device.id)
+    assert [event["kind"] for event in events] == [ANOMALY_STUCK]
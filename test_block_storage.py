@@ -0,0 +1,165 @@
+import random
+from datetime import datetime, timedelta
+
+from src.block_codec import decode_block, encode_block, float_to_bits
+from src.block_store import BlockHistoryStore, query_block_history
+from src.database import Base, SessionLocal, engine
+from src.deadband import DeadbandFilter
+from src.ingest_pipeline import IngestPipeline
+from src.models import DeviceModel, SensorBlockModel
+from src.sensor_processor import SensorDataProcessor
+
+Base.metadata.create_all(bind=engine)
+
+
+def test_codec_round_trip():
+    rng = random.Random(3)
+    for _ in range(50):
+        ts = rng.randint(0, 2 ** 41)
+        timestamps, values = [], []
+        for _ in range(rng.randint(0, 300)):
+            ts += rng.choice([10000, 10000, 10007, 9995, 0, rng.randint(0, 10 ** 9)])
+            timestamps.append(ts)
+            values.append(rng.choice([22.1, 22.1, rng.uniform(-50, 50), round(rng.gauss(20, 1), 1), -0.0, 1e300]))
+        decoded_ts, decoded_values = decode_block(encode_block(timestamps, values))
+        assert decoded_ts == timestamps
+        assert [float_to_bits(v) for v in decoded_values] == [float_to_bits(v) for v in values]
+
+
+def test_regular_series_compresses_well():
+    timestamps = [1700000000000 + i * 10000 for i in range(256)]
+    values = [21.5] * 128 + [21.6] * 128
+    assert len(encode_block(timestamps, values)) < 256 * 0.5
+
+
+def make_series(db, store, device_id, start, count):
+    for i in range(count):
+        store.append(db, device_id, "Temperature1", start + timedelta(seconds=10 * i), 20 + i / 10)
+
+
+def test_block_store_range_query_and_reload():
+    with SessionLocal() as db:
+        device = DeviceModel(name="block_dev", device_type="test")
+        db.add(device)
+        db.commit()
+        device_id = device.id
+
+    start = datetime(2024, 5, 1)
+    store = BlockHistoryStore(block_size=8)
+    with SessionLocal() as db:
+        make_series(db, store, device_id, start, 12)
+        store.flush(db)
+        db.commit()
+        store.committed()
+
+    # 重启后继续向未写满的块追加
+    store = BlockHistoryStore(block_size=8)
+    with SessionLocal() as db:
+        make_series(db, store, device_id, start + timedelta(seconds=120), 8)
+        store.flush(db)
+        db.commit()
+        store.committed()
+
+    with SessionLocal() as db:
+        blocks = db.query(SensorBlockModel).filter(SensorBlockModel.device_id == device_id).all()
+        assert sorted(block.count for block in blocks) == [4, 8, 8]
+        assert sum(block.count for block in blocks) == 20
+
+        points = query_block_history(db, device_id, "Temperature1",
+                                     start + timedelta(seconds=50), start + timedelta(seconds=100))
+        assert [p["timestamp"] for p in points] == [
+            (start + timedelta(seconds=s)).isoformat() for s in range(50, 101, 10)
+        ]
+        assert [p["value"] for p in points] == [20.5, 20.6, 20.7, 20.8, 20.9, 21.0]
+        latest = query_block_history(db, device_id, "Temperature1", limit=3)
+        assert [p["value"] for p in latest] == [20.5, 20.6, 20.7]
+
+
+def test_pipeline_writes_blocks_and_discards_on_rollback():
+    store = BlockHistoryStore(block_size=4)
+    processor = SensorDataProcessor(history_filter=DeadbandFilter(rules={}), history_store=store)
+    pipeline = IngestPipeline(processor=processor, flush_interval=0.05)
+    pipeline.start()
+    try:
+        for value in range(10):
+            pipeline.submit("blocks/1", f"Temperature1: {value}.5 C")
+        assert pipeline.flush(timeout=10)
+    finally:
+        pipeline.stop()
+
+    with SessionLocal() as db:
+        device = db.query(DeviceModel).filter(DeviceModel.name == "blocks/1").first()
+        points = query_block_history(db, device.id, "Temperature1")
+        assert [p["value"] for p in points] == [v + 0.5 for v in range(10)]
+
+        # 回滚后内存中的块被丢弃，下次追加时从数据库重新加载
+        store.append(db, device.id, "Temperature1", datetime.utcnow(), 99.0)
+        store.flush(db)
+        db.rollback()
+        store.rolled_back()
+        assert [p["value"] for p in query_block_history(db, device.id, "Temperature1")][-1] == 9.5
+        store.append(db, device.id, "Temperature1", datetime.utcnow(), 11.0)
+        store.flush(db)
+        db.commit()
+        store.committed()
+        assert [p["value"] for p in query_block_history(db, device.id, "Temperature1")][-2:] == [9.5, 11.0]
+
+
+def test_rolled_back_message_points_are_dropped_from_blocks():
+    """单条消息的保存点回滚时，它追加的点不会随本批次的块写入（包括它开始的新块）"""
+    store = BlockHistoryStore(block_size=4)
+    processor = SensorDataProcessor(history_filter=DeadbandFilter(rules={}), history_store=store)
+    queue_latest_value = processor.queue_latest_value
+
+    def failing_queue_latest_value(db, sensor, timestamp):
+        if sensor.value in (2.5, 5.5):
+            raise ValueError("写入失败")
+        queue_latest_value(db, sensor, timestamp)
+    processor.queue_latest_value = failing_queue_latest_value
+
+    pipeline = IngestPipeline(processor=processor, flush_interval=0.05)
+    start = datetime(2024, 3, 1)
+    for value in range(8):
+        pipeline.submit("http/blocks-savepoint", {"device": "blocks-savepoint", "type": "Temperature1",
+                                                  "value": value + 0.5, "unit": "C",
+                                                  "timestamp": start + timedelta(seconds=value)})
+    pipeline.start()
+    try:
+        assert pipeline.flush(timeout=10)
+    finally:
+        pipeline.stop()
+
+    with SessionLocal() as db:
+        device = db.query(DeviceModel).filter(DeviceModel.name == "blocks-savepoint").first()
+        points = query_block_history(db, device.id, "Temperature1")
+        assert [p["value"] for p in points] == [0.5, 1.5, 3.5, 4.5, 6.5, 7.5]
+        blocks = db.query(SensorBlockModel).filter(SensorBlockModel.device_id == device.id).all()
+        assert sorted(block.count for block in blocks) == [2, 4]
+    assert store.stats["points"] == 6
+
+def test_delete_range_rewrites_overlapping_blocks():
+    with SessionLocal() as db:
+        device = DeviceModel(name="block_delete_dev", device_type="test")
+        db.add(device)
+        db.commit()
+        device_id = device.id
+
+    start = datetime(2024, 6, 1)
+    store = BlockHistoryStore(block_size=8)
+    with SessionLocal() as db:
+        make_series(db, store, device_id, start, 20)
+        store.flush(db)
+        db.commit()
+        store.committed()
+
+        # [30秒, 160秒)：第一块部分重叠（重写），第二块全部落在其中（删除），第三块不受影响
+        deleted = store.delete_range(db, device_id, "Temperature1", start + timedelta(seconds=30),
+                                     start + timedelta(seconds=160))
+        db.commit()
+        assert deleted == 13
+        points = query_block_history(db, device_id, "Temperature1")
+        assert [p["timestamp"] for p in points] == [
+            (start + timedelta(seconds=s)).isoformat() for s in (0, 10, 20, 160, 170, 180, 190)
+        ]
+        assert sorted(block.count for block in db.query(SensorBlockModel).filter(
+            SensorBlockModel.device_id == device_id)) == [3, 4]
@@ -0,0 +1,72 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+from fastapi.testclient import TestClient
+
+from src.block_store import to_epoch_ms
+from src.downsample import chart_series, lttb_indices
+from src.database import SessionLocal
+from src.main import app
+from test_stats import add_device
+
+
+def test_lttb_keeps_endpoints_and_peaks():
+    x = np.arange(10000, dtype=np.int64)
+    y = np.sin(x / 500.0)
+    y[4321] = 50.0
+    keep = lttb_indices(x, y, 200)
+    assert len(keep) == 200
+    assert keep[0] == 0 and keep[-1] == 9999
+    assert np.all(np.diff(keep) > 0)
+    assert 4321 in keep
+    assert lttb_indices(x[:10], y[:10], 200).tolist() == list(range(10))
+
+
+def test_chart_uses_raw_points_then_rollups():
+    start = datetime(2024, 7, 1)
+    values = [20 + (i % 100) / 10 for i in range(5000)]
+    values[2500] = 99.0
+    device_id = add_device("chart_dev", start, values)
+
+    with SessionLocal() as db:
+        raw = chart_series(db, device_id, "Temperature1", points=200)
+        assert raw["source"] == "raw"
+        assert len(raw["timestamps"]) == len(raw["values"]) == 200
+        assert raw["timestamps"][0] == to_epoch_ms(start)
+        assert 99.0 in raw["values"]
+
+        rollup = chart_series(db, device_id, "Temperature1", points=50)
+        assert rollup["source"] == "rollup"
+        assert rollup["raw_points"] == 5000
+        assert len(rollup["values"]) == 50
+        assert max(rollup["max"]) == 99.0
+
+        window = chart_series(db, device_id, "Temperature1", start + timedelta(seconds=100),
+                              start + timedelta(seconds=190), points=200)
+        assert window["values"] == values[10:20]
+
+    response = TestClient(app).get(f"/api/devices/{device_id}/chart", params={"type": "Temperature1", "points": 100})
+    assert response.status_code == 200
+    assert len(response.json()["timestamps"]) == 100
+
+
+def test_chart_rollup_from_blocks_without_decoding(monkeypatch):
+    import src.downsample as downsample
+    from src.block_store import BlockHistoryStore
+
+    device_id = add_device("chart_blocks", datetime(2024, 7, 2), [])
+    store = BlockHistoryStore(block_size=64)
+    start = datetime(2024, 7, 2)
+    with SessionLocal() as db:
+        for i in range(3000):
+            store.append(db, device_id, "Humidity1", start + timedelta(seconds=10 * i), 99.0 if i == 1234 else 50 + i % 7)
+        store.flush(db)
+        db.commit()
+
+    monkeypatch.setattr(downsample, "HISTORY_BACKEND", "blocks")
+    with SessionLocal() as db:
+        chart = chart_series(db, device_id, "Humidity1", points=20)
+    assert chart["source"] == "rollup"
+    assert chart["raw_points"] == 3000
+    assert len(chart["timestamps"]) == 20
+    assert max(chart["max"]) == 99.0
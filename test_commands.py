@@ -0,0 +1,187 @@
+import json
+
+import paho.mqtt.client as mqtt
+import pytest
+
+from src.broker_pool import BrokerPool
+from src.command_service import CommandError, CommandService, LatencyHistogram, PendingCommand
+from src.database import Base, SessionLocal, engine
+from src.ingest_pipeline import IngestPipeline
+from src.models import DeviceModel, MQTTConfigModel, SensorDataModel, TopicConfigModel
+from test_ingest_resilience import deactivate_all_topic_configs, wait_until
+
+Base.metadata.create_all(bind=engine)
+
+
+def test_latency_histogram_quantiles():
+    histogram = LatencyHistogram()
+    for latency in [3, 7, 20, 40, 40, 90, 200, 400, 900, 45000]:
+        histogram.observe(latency)
+    snapshot = histogram.snapshot()
+    assert snapshot["count"] == 10
+    assert snapshot["p50_ms"] == 50
+    assert snapshot["p99_ms"] == 45000
+    assert snapshot["buckets"]["le_inf"] == 1
+
+
+class FakeRelayBoard:
+    """模拟STM32板：收到命令后上报 Relay Status"""
+
+    def __init__(self, port, command_topic):
+        self.commands = []
+        self.client = mqtt.Client()
+        self.client.on_message = self.on_message
+        self.client.connect("127.0.0.1", port)
+        self.client.subscribe(command_topic, qos=1)
+        self.client.loop_start()
+
+    def on_message(self, client, userdata, msg):
+        command = json.loads(msg.payload)
+        self.commands.append(command)
+        names = command.get("devices") or [command["device"]]
+        for name in names:
+            prefix, number = name.split("_")
+            client.publish(f"{prefix}/{number}", f"Relay Status: {command['value']}\nPB8 Level: 1", qos=1)
+
+    def close(self):
+        self.client.loop_stop()
+        self.client.disconnect()
+
+
+def setup_broker(port, publish_topic, device_count):
+    deactivate_all_topic_configs()
+    with SessionLocal() as db:
+        mqtt_config = MQTTConfigModel(name=f"cmd-{port}", server="127.0.0.1", port=port)
+        db.add(mqtt_config)
+        db.flush()
+        topic_config = TopicConfigModel(name=f"cmd-{port}", subscribe_topics='["relay/#"]',
+                                        publish_topic=publish_topic, is_active=True, mqtt_config_id=mqtt_config.id)
+        db.add(topic_config)
+        db.flush()
+        device_ids = []
+        for index in range(device_count):
+            device = DeviceModel(name=f"relay_{port}{index}", device_type="stm32", status="online",
+                                 mqtt_config_id=mqtt_config.id, topic_config_id=topic_config.id)
+            db.add(device)
+            db.flush()
+            device_ids.append(device.id)
+        db.commit()
+        return mqtt_config.id, device_ids
+
+
+def start_pool():
+    pipeline = IngestPipeline(flush_interval=0.05)
+    pool = BrokerPool(pipeline=pipeline)
+    service = CommandService(pool=pool)
+    pipeline.processor.add_observer(service.on_reading)
+    pool.sync()
+    return pool, service
+
+
+def test_command_acknowledged_by_state_report(local_broker):
+    broker = local_broker().start()
+    config_id, (device_id,) = setup_broker(broker.port, "cmd/{device}", 1)
+    board = FakeRelayBoard(broker.port, "cmd/#")
+    pool, service = start_pool()
+    try:
+        assert wait_until(lambda: pool.get(config_id).is_connected)
+        with SessionLocal() as db:
+            pending = service.send(db, device_id, "relay", 1, qos=1, timeout=10)
+        assert pending.topic == f"cmd/relay_{broker.port}0"
+        service.wait(pending)
+        assert pending.status == "acked"
+        assert board.commands[0]["id"] == pending.command_id
+        assert service.status()["latency"]["count"] == 1
+
+        # 上报值与命令值不一致时不视为确认
+        with SessionLocal() as db:
+            pending = service.send(db, device_id, "relay", 0, timeout=0.5, ack_type="PB8 Level")
+        service.wait(pending)
+        assert pending.status == "timeout"
+    finally:
+        board.close()
+        pool.stop()
+        deactivate_all_topic_configs()
+
+
+def test_fleet_command_is_batched(local_broker):
+    broker = local_broker().start()
+    config_id, device_ids = setup_broker(broker.port, "cmd/all", 120)
+    board = FakeRelayBoard(broker.port, "cmd/all")
+    pool, service = start_pool()
+    try:
+        assert wait_until(lambda: pool.get(config_id).is_connected)
+        with SessionLocal() as db:
+            result = service.send_batch(db, "relay", 1, device_ids=device_ids, timeout=20)
+        # 主题不含设备占位符，120个设备合并为一条消息
+        assert result["devices"] == 120
+        assert result["messages"] == 1
+        assert wait_until(lambda: service.stats["acked"] == 120, timeout=20)
+        assert service.status()["pending"] == 0
+    finally:
+        board.close()
+        pool.stop()
+        deactivate_all_topic_configs()
+
+
+def test_non_leader_rejects_commands():
+    config_id, (device_id,) = setup_broker(1, "cmd/{device}", 1)
+    pool = BrokerPool(pipeline=IngestPipeline(flush_interval=0.05))
+    pool.enabled = False
+    service = CommandService(pool=pool)
+    try:
+        with SessionLocal() as db:
+            with pytest.raises(CommandError) as excinfo:
+                service.send(db, device_id, "relay", 1)
+            assert excinfo.value.status_code == 503
+            with pytest.raises(CommandError) as excinfo:
+                service.send_batch(db, "relay", 1, device_ids=[device_id])
+            assert excinfo.value.status_code == 503
+    finally:
+        deactivate_all_topic_configs()
+
+
+def test_ack_matched_only_for_committed_readings():
+    with SessionLocal() as db:
+        device = DeviceModel(name="ackrb_1", device_type="stm32", status="online")
+        db.add(device)
+        db.commit()
+        device_id = device.id
+    pipeline = IngestPipeline(flush_interval=0.05)
+    processor = pipeline.processor
+    service = CommandService(pool=BrokerPool(pipeline=pipeline))
+    processor.add_observer(service.on_reading)
+    committed = []
+
+    def check_committed(observed_id, sensor_type, value):
+        # 观察者在读数所在批次提交后才收到通知
+        if observed_id == device_id and sensor_type == "Relay Status":
+            with SessionLocal() as db:
+                sensor = db.query(SensorDataModel).filter(SensorDataModel.device_id == device_id,
+                                                          SensorDataModel.type == sensor_type).one()
+                committed.append(sensor.value == value)
+    processor.add_observer(check_committed)
+
+    queue_latest_value = processor.queue_latest_value
+
+    def failing_queue_latest_value(db, sensor, timestamp):
+        # 第一条消息在继电器状态之后的读数处失败，整条消息的保存点回滚
+        if sensor.type == "PB8 Level" and sensor.value == 1:
+            raise ValueError("写入失败")
+        queue_latest_value(db, sensor, timestamp)
+    processor.queue_latest_value = failing_queue_latest_value
+
+    command = PendingCommand("ack-test", device_id, "cmd/ackrb_1", "Relay Status", 1, timeout=30)
+    service.pending[device_id] = [command]
+    pipeline.start()
+    try:
+        pipeline.submit("ackrb/1", "Relay Status: 1\nPB8 Level: 1")
+        pipeline.submit("ackrb/1", "Relay Status: 0\nPB8 Level: 0")
+        assert pipeline.flush(timeout=10)
+        assert command.status == "pending"
+        pipeline.submit("ackrb/1", "Relay Status: 1\nPB8 Level: 0")
+        assert pipeline.flush(timeout=10)
+    finally:
+        pipeline.stop()
+    assert command.status == "acked"
+    assert committed and all(committed)
@@ -0,0 +1,109 @@
+from fastapi.testclient import TestClient
+
+from src.dashboard import DashboardAggregator, ensure_device_counters, get_dashboard_summary, summarize_ingest
+from src.database import Base, SessionLocal, engine
+from src.ingest_pipeline import IngestPipeline
+from src.main import app
+from src.models import DeviceModel
+from src.sensor_processor import SensorDataProcessor
+
+Base.metadata.create_all(bind=engine)
+ensure_device_counters(engine)
+
+
+def test_device_counters_follow_every_write_path():
+    client = TestClient(app)
+    with SessionLocal() as db:
+        db.query(DeviceModel).filter(DeviceModel.location == "仪表盘测试区").delete(synchronize_session=False)
+        db.commit()
+    before = client.get("/api/dashboard/summary").json()["devices"]
+
+    with SessionLocal() as db:
+        devices = [DeviceModel(name=f"dash-dev-{index}", device_type="传感器", status="在线", location="仪表盘测试区")
+                   for index in range(3)]
+        db.add_all(devices)
+        db.commit()
+        devices[0].status = "维护"
+        db.commit()
+        db.delete(devices[1])
+        db.commit()
+
+    after = client.get("/api/dashboard/summary").json()["devices"]
+    assert after["total"] == before["total"] + 2
+    assert after["by_location"]["仪表盘测试区"] == 2
+    assert after["by_status"]["维护"] == before["by_status"].get("维护", 0) + 1
+    assert after["by_status"]["在线"] == before["by_status"].get("在线", 0) + 1
+    assert after["online"] + after["offline"] == after["total"]
+
+
+def test_aggregator_liveness_alerts_and_rate():
+    aggregator = DashboardAggregator(online_seconds=60, persist_interval=3600)
+    aggregator._loaded = True  # 不从数据库加载
+    now = 1_700_000_000.0
+    aggregator.observe(2, [
+        (1, "Temperature1", 31.0, now, "C", "alert", "冷库1号", 1),
+        (2, "Temperature1", 29.0, now - 5, "C", "warning", "冷库2号", 2),
+    ], now=now)
+    aggregator.observe(1, [(1, "Humidity1", 50.0, now + 30, "%", "normal", "冷库1号", 3)], now=now + 30)
+
+    state = aggregator.snapshot(now + 30)
+    summary = summarize_ingest(state, now + 30)
+    assert summary["online"] == 2 and summary["messages_per_minute"] == 3 and summary["series"] == 3
+    assert summary["alerts"] == {"warning": 1, "alert": 1}
+    assert summary["latest_by_type"]["Temperature1"]["device_name"] == "冷库1号"
+
+    # 告警恢复后计数减少；设备2超过60秒没有读数后离线，速率窗口滑过
+    aggregator.observe(1, [(1, "Temperature1", 25.0, now + 80, "C", "normal", "冷库1号", 1)], now=now + 80)
+    summary = summarize_ingest(aggregator.snapshot(now + 80), now + 80)
+    assert summary["alerts"] == {"warning": 1, "alert": 0}
+    assert summary["online"] == 1 and summary["messages_per_minute"] == 2
+    assert summarize_ingest(aggregator.snapshot(now + 200), now + 200)["online"] == 0
+
+
+def test_committed_batches_update_summary():
+    aggregator = DashboardAggregator(persist_interval=0)
+    pipeline = IngestPipeline(processor=SensorDataProcessor(dashboard=aggregator), flush_interval=0.05)
+    pipeline.start()
+    try:
+        for value in range(5):
+            pipeline.submit("dash/summary-dev", f"Temperature1: {26 + value}.0 C, Humidity1: 40.0 %")
+        assert pipeline.flush(timeout=10)
+    finally:
+        pipeline.stop()
+
+    assert aggregator.active
+    with SessionLocal() as db:
+        summary = get_dashboard_summary(db, aggregator)
+        assert summary["ingest"]["messages_per_minute"] == 5
+        latest = summary["sensors"]["latest_by_type"]["Temperature1"]
+        assert latest["device_name"] == "dash/summary-dev" and latest["value"] == 30.0
+        assert summary["devices"]["online"] >= 1
+
+        # 其他进程读取采集进程写入数据库的快照
+        idle = DashboardAggregator()
+        from_snapshot = get_dashboard_summary(db, idle)
+        assert from_snapshot["ingest"]["messages_per_minute"] == 5
+        assert not idle.active
+
+
+def test_only_ingest_leader_persists_snapshot():
+    now = 1_700_000_000.0
+    leader = DashboardAggregator(persist_interval=0)
+    leader._loaded = True
+    leader.observe(4, [(1, "Temperature1", 21.0, now, "C", "normal", "冷库1号", 1)], now=now)
+
+    # 非领导者进程（如HTTP worker中的采集）不覆盖领导者的快照
+    follower = DashboardAggregator(persist_interval=0, enabled=False)
+    follower.observe(1, [(2, "Temperature1", 99.0, now + 1, "C", "alert", "冷库2号", 2)], now=now + 1)
+    assert not follower.active
+    with SessionLocal() as db:
+        summary = get_dashboard_summary(db, follower)
+    assert summary["sensors"]["latest_by_type"]["Temperature1"]["value"] == 21.0
+
+    # 降级后不再使用内存中的汇总，改读数据库快照
+    leader.set_enabled(False)
+    assert not leader.active
+    leader.observe(1, [(3, "Temperature1", 50.0, now + 2, "C", "normal", "冷库3号", 3)], now=now + 2)
+    with SessionLocal() as db:
+        summary = get_dashboard_summary(db, leader)
+    assert summary["sensors"]["latest_by_type"]["Temperature1"]["value"] == 21.0
@@ -0,0 +1,71 @@
+from fastapi.testclient import TestClient
+
+import src.sensor_processor as sensor_processor
+from src.database import Base, SessionLocal, engine
+from src.dead_letters import DeadLetterStore, PayloadRejected, replay_dead_letters
+from src.ingest_pipeline import IngestPipeline
+from src.main import app
+from src.models import DeadLetterModel, DeviceModel, SensorDataModel
+
+Base.metadata.create_all(bind=engine)
+
+
+def _clear(prefix):
+    with SessionLocal() as db:
+        db.query(DeadLetterModel).filter(DeadLetterModel.topic.like(f"{prefix}%")).delete(synchronize_session=False)
+        db.commit()
+
+
+def test_rejected_payloads_are_dead_lettered_and_replayed(monkeypatch):
+    _clear("dlq/")
+    pipeline = IngestPipeline(flush_interval=0.05, dead_letters=DeadLetterStore())
+    pipeline.start()
+    try:
+        pipeline.submit("dlq/good", b"Temperature1: 21.5 C")
+        pipeline.submit("dlq/binary", b"\xff\xfe\x00\x01")
+        for index in range(3):
+            pipeline.submit(f"dlq/legacy-{index}", f"v={index}.5".encode())
+        pipeline.submit("dlq/empty/temperature", b"{}")
+        assert pipeline.flush(timeout=10)
+    finally:
+        pipeline.stop()
+    assert pipeline.stats["dead_letters"] == 5
+
+    client = TestClient(app)
+    summary = client.get("/api/dead-letters/summary").json()
+    counts = {group["reason"]: group["count"] for group in summary["reasons"]}
+    assert counts["unrecognized_format"] >= 3 and counts["decode_error"] >= 1 and counts["no_readings"] >= 1
+    items = client.get("/api/dead-letters", params={"topic": "dlq/legacy-", "limit": 2}).json()
+    assert [item["topic"] for item in items] == ["dlq/legacy-2", "dlq/legacy-1"]
+    assert items[0]["payload"] == "v=2.5" and items[0]["reason"] == "unrecognized_format"
+    with SessionLocal() as db:
+        # 被拒绝的消息不会留下自动创建的设备
+        assert db.query(DeviceModel).filter(DeviceModel.name == "dlq/legacy-0").first() is None
+
+    # “修复解析”后重放：这些消息被处理并从死信表删除，其他原因的死信保留
+    monkeypatch.setattr(sensor_processor, "PAYLOAD_FALLBACK_PARSE", True)
+    pipeline = IngestPipeline(flush_interval=0.05, dead_letters=DeadLetterStore())
+    pipeline.start()
+    try:
+        result = replay_dead_letters(pipeline, reason="unrecognized_format", topic="dlq/legacy-")
+    finally:
+        pipeline.stop()
+    assert result["submitted"] == 3 and result["committed"] == 3 and result["remaining"] == 0
+    with SessionLocal() as db:
+        device = db.query(DeviceModel).filter(DeviceModel.name == "dlq/legacy-1").one()
+        assert db.query(SensorDataModel).filter(SensorDataModel.device_id == device.id).one().value == 1.5
+        assert db.query(DeadLetterModel).filter(DeadLetterModel.topic == "dlq/binary").count() == 1
+
+
+def test_dead_letter_store_is_capped():
+    _clear("cap/")
+    with SessionLocal() as db:
+        db.query(DeadLetterModel).delete()
+        store = DeadLetterStore(max_rows=100)
+        for index in range(250):
+            store.record(db, f"cap/{index}", b"x", PayloadRejected("no_readings"))
+        db.commit()
+        remaining = [row.topic for row in db.query(DeadLetterModel).order_by(DeadLetterModel.id)]
+    # 每写入1%上限的条数裁剪一次
+    assert 100 <= len(remaining) <= 101
+    assert remaining[-1] == "cap/249"
@@ -0,0 +1,121 @@
+import csv
+import io
+import json
+
+from fastapi.testclient import TestClient
+
+from src.database import Base, SessionLocal, engine
+from src.device_bulk import import_devices
+from src.ingest_pipeline import IngestPipeline
+from src.main import app
+from src.models import DeviceAliasModel, DeviceModel
+from test_ingest_resilience import latest_value
+
+Base.metadata.create_all(bind=engine)
+
+
+def test_csv_import_reports_row_errors_and_conflicts():
+    lines = [
+        "name,device_type,location,topic_config_id,topic",
+        "bulk-a,温湿度,一楼,,site1/a",
+        "bulk-b,温湿度,,,",
+        ",温湿度,,,",
+        "bulk-c,,,,",
+        "bulk-d,温湿度,,abc,",
+        "bulk-a,温湿度,,,",
+        "bulk-e,温湿度,,,site1/a",
+        "bulk-f,温湿度",
+    ]
+    with SessionLocal() as db:
+        result = import_devices(db, lines, "csv", chunk_size=3)
+        assert (result["rows"], result["created"], result["failed"]) == (8, 3, 6)
+        errors = {error["line"]: error["error"] for error in result["errors"]}
+        assert set(errors) == {4, 5, 6, 7, 8, 9}
+        assert "name" in errors[4] and "device_type" in errors[5] and "topic_config_id" in errors[6]
+        assert "重复" in errors[7]
+        # bulk-e 已创建，但别名已属于 bulk-a
+        assert "site1/a" in errors[8]
+        device = db.query(DeviceModel).filter(DeviceModel.name == "bulk-a").one()
+        assert device.location == "一楼" and device.status == "offline"
+        assert db.get(DeviceAliasModel, "site1/a").device_id == device.id
+
+        # 再次导入：默认跳过已存在的，update 模式更新字段，error 模式逐行报错
+        again = ["name,device_type,location", "bulk-a,温湿度,二楼", "bulk-new,温湿度,"]
+        result = import_devices(db, again, "csv")
+        assert (result["created"], result["skipped"]) == (1, 1)
+        result = import_devices(db, again, "csv", on_conflict="update")
+        assert (result["updated"], result["skipped"]) == (2, 0)
+        db.expire_all()
+        assert db.query(DeviceModel).filter(DeviceModel.name == "bulk-a").one().location == "二楼"
+        result = import_devices(db, again, "csv", on_conflict="error")
+        assert result["failed"] == 2
+
+
+def test_imported_alias_routes_ingest_to_device():
+    with SessionLocal() as db:
+        result = import_devices(db, [json.dumps({"name": "冷库3号", "device_type": "温湿度", "topic": "cold/3"})],
+                                "ndjson")
+        assert result["created"] == 1 and result["aliases"] == 1
+
+    pipeline = IngestPipeline(flush_interval=0.05)
+    pipeline.start()
+    try:
+        pipeline.submit("cold/3", "Temperature1: 4.50 C")
+        assert pipeline.flush(timeout=10)
+    finally:
+        pipeline.stop()
+    assert latest_value("冷库3号", "Temperature1") == 4.5
+    with SessionLocal() as db:
+        assert db.query(DeviceModel).filter(DeviceModel.name == "cold/3").first() is None
+
+
+def test_bulk_endpoints_round_trip():
+    client = TestClient(app)
+    body = "\n".join(
+        json.dumps({"name": f"fleet-{index}", "device_type": "网关", "aliases": [f"fleet/{index}"]})
+        for index in range(5000)
+    ) + "\n{not json}\n"
+    response = client.post("/api/devices/bulk", content=body.encode(),
+                           headers={"Content-Type": "application/x-ndjson"})
+    assert response.status_code == 200
+    result = response.json()
+    assert (result["created"], result["aliases"], result["failed"]) == (5000, 5000, 1)
+    assert result["errors"][0]["line"] == 5001 and result["rows_per_second"] > 0
+
+    assert client.post("/api/devices/bulk", params={"format": "csv"}, content=b"foo,bar\n1,2\n").status_code == 400
+
+    exported = client.get("/api/devices/export", params={"format": "csv"})
+    assert exported.headers["content-type"].startswith("text/csv")
+    rows = {row["name"]: row for row in csv.DictReader(io.StringIO(exported.text))}
+    assert rows["fleet-42"]["aliases"] == "fleet/42" and rows["fleet-42"]["device_type"] == "网关"
+
+    ndjson = client.get("/api/devices/export", params={"format": "ndjson"}).text.splitlines()
+    records = {record["name"]: record for record in map(json.loads, ndjson)}
+    assert records["fleet-7"]["aliases"] == ["fleet/7"]
+    assert len(records) == len(rows)
+
+
+def test_csv_quoted_field_may_span_lines():
+    client = TestClient(app)
+    body = ('name,device_type,location\r\n'
+            'multiline-a,温湿度,"一号楼\r\n\r\n东侧, 3层"\r\n'
+            'multiline-b,温湿度,二楼\r\n'
+            'multiline-c,,\r\n'
+            'multiline-d,温湿度,"未闭合\r\n')
+    response = client.post("/api/devices/bulk", params={"format": "csv"}, content=body.encode())
+    assert response.status_code == 200
+    result = response.json()
+    assert (result["rows"], result["created"], result["failed"]) == (4, 2, 2)
+    # 错误按记录的起始行报告
+    assert [error["line"] for error in result["errors"]] == [6, 7]
+    with SessionLocal() as db:
+        device = db.query(DeviceModel).filter(DeviceModel.name == "multiline-a").one()
+        assert device.location == "一号楼\n\n东侧, 3层"
+
+    # 导出的CSV中带换行的字段可以原样重新导入
+    exported = client.get("/api/devices/export", params={"format": "csv"}).text
+    with SessionLocal() as db:
+        result = import_devices(db, exported.splitlines(), "csv", on_conflict="update")
+        assert result["failed"] == 0
+        db.expire_all()
+        assert db.query(DeviceModel).filter(DeviceModel.name == "multiline-a").one().location == "一号楼\n\n东侧, 3层"
@@ -0,0 +1,84 @@
+from fastapi.testclient import TestClient
+
+from src.database import Base, SessionLocal, engine
+from src.device_search import ensure_device_search_index
+from src.main import app
+from src.models import DeviceModel
+
+Base.metadata.create_all(bind=engine)
+ensure_device_search_index(engine)
+
+client = TestClient(app)
+
+
+def setup_module():
+    with SessionLocal() as db:
+        db.query(DeviceModel).filter(DeviceModel.name.like("qzx-%")).delete(synchronize_session=False)
+        for index in range(30):
+            db.add(DeviceModel(
+                name=f"qzx-{index:02d}-{'Pump' if index % 3 == 0 else 'fan'}",
+                device_type="泵" if index % 3 == 0 else "风机",
+                status="在线" if index % 2 == 0 else "离线",
+                location=None if index % 5 == 0 else f"冷库{index % 4}号",
+                mqtt_config_id=index % 2,
+            ))
+        db.commit()
+        # 改名后全文索引随之更新
+        device = db.query(DeviceModel).filter(DeviceModel.name == "qzx-29-fan").one()
+        device.name = "qzx-29-blower"
+        db.commit()
+
+
+def search(**params):
+    response = client.get("/api/devices/search", params=params)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def names(result):
+    return [device["name"] for device in result["items"]]
+
+
+def own(result):
+    """只看本模块创建的设备（其他测试也会创建位置为“冷库N号”的设备）"""
+    return [name for name in names(result) if name.startswith("qzx-")]
+
+
+def test_substring_prefix_and_filters():
+    # trigram子串匹配不区分大小写
+    assert names(search(q="PUMP", limit=100)) == [f"qzx-{index:02d}-Pump" for index in range(0, 30, 3)]
+    assert names(search(q="blower")) == ["qzx-29-blower"]
+    assert search(q="29-fan")["items"] == []
+    # 位置也参与匹配，两个字符的子串退回LIKE
+    assert len(own(search(q="冷库2", limit=500))) == len([i for i in range(30) if i % 5 and i % 4 == 2])
+    assert len(own(search(q="库3", limit=500))) == len([i for i in range(30) if i % 5 and i % 4 == 3])
+    assert len(search(q="qzx-1", match="prefix", limit=100)["items"]) == 10
+    assert search(q="zx-1", match="prefix")["items"] == []
+
+    result = search(q="qzx", status="在线", device_type=["泵"], mqtt_config_id=0, limit=100)
+    assert names(result) == [f"qzx-{index:02d}-Pump" for index in range(0, 30, 6)]
+
+
+def test_keyset_paging_is_stable():
+    for sort, order in (("id", "asc"), ("id", "desc"), ("location", "asc"), ("location", "desc"), ("name", "desc")):
+        expected = names(search(q="qzx", sort=sort, order=order, limit=500))
+        assert len(expected) == 30
+        pages, cursor = [], None
+        while True:
+            params = {"q": "qzx", "sort": sort, "order": order, "limit": 7}
+            if cursor:
+                params["cursor"] = cursor
+            result = search(**params)
+            pages.extend(names(result))
+            cursor = result["next_cursor"]
+            if not cursor:
+                break
+        assert pages == expected, (sort, order)
+
+    locations = [device["location"] for device in search(q="qzx", sort="location", limit=500)["items"]]
+    assert locations[:6] == [None] * 6 and locations[6:] == sorted(locations[6:])
+
+    cursor = search(q="qzx", sort="name", limit=5)["next_cursor"]
+    assert client.get("/api/devices/search", params={"sort": "id", "cursor": cursor}).status_code == 400
+    assert client.get("/api/devices/search", params={"cursor": "not-a-cursor"}).status_code == 400
+    assert client.get("/api/devices/search", params={"sort": "password"}).status_code == 422
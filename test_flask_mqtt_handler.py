@@ -0,0 +1,69 @@
+from datetime import datetime
+
+import pytest
+
+from mqtt_client import MQTTHandler
+
+
+@pytest.fixture
+def flask_app(tmp_path, monkeypatch):
+    # create_app 把数据库建在当前目录
+    monkeypatch.chdir(tmp_path)
+    from app import create_app
+    app = create_app()
+    yield app
+    with app.app_context():
+        app.db.engine.dispose()
+
+
+def test_batch_creates_missing_devices_and_one_row_per_value(flask_app):
+    handler = MQTTHandler(app=flask_app)
+    handler.process_sensor_data({'device_id': 'existing', 'temperature': 20.0})
+    # 一个批次同时包含已有设备和新设备；布尔值和元数据字段不写入读数
+    with flask_app.app_context():
+        assert handler.write_batch([
+            {'device_id': 'existing', 'temperature': 21.5, 'humidity': 55, 'location': '实验室1'},
+            {'device_id': 'new', 'temperature': 22.0, 'alarm': True, 'location': '实验室2'},
+            {'device_id': 'existing', 'temperature': 23.0},
+        ])
+        Device = flask_app.db.iot_models['Device']
+        SensorReading = flask_app.db.iot_models['SensorReading']
+        devices = {device.name: device for device in Device.query.all()}
+        assert sorted(devices) == ['existing', 'new']
+        assert devices['new'].location == '实验室2'
+        assert all(device.status == '在线' for device in devices.values())
+        assert SensorReading.query.count() == 5
+        assert SensorReading.query.filter_by(device_id=devices['existing'].id).count() == 4
+        assert SensorReading.query.filter_by(type='alarm').count() == 0
+    assert handler.stats['readings'] == 5
+
+
+def test_millisecond_timestamps_are_converted(flask_app):
+    handler = MQTTHandler(app=flask_app)
+    seconds = 1_700_000_000
+    handler.process_sensor_data({'device_id': 'ms', 'temperature': 1.0, 'timestamp': seconds * 1000 + 250})
+    handler.process_sensor_data({'device_id': 's', 'temperature': 1.0, 'timestamp': seconds})
+    with flask_app.app_context():
+        SensorReading = flask_app.db.iot_models['SensorReading']
+        timestamps = [reading.timestamp for reading in SensorReading.query.order_by(SensorReading.id).all()]
+    assert timestamps[0] == datetime(2023, 11, 14, 22, 13, 20, 250000)
+    assert timestamps[1] == datetime(2023, 11, 14, 22, 13, 20)
+
+
+def test_flush_and_stop_drain_the_queue(flask_app):
+    handler = MQTTHandler(app=flask_app, batch_size=50, flush_interval=0.05)
+    for index in range(300):
+        handler.submit({'device_id': f'dev-{index % 7}', 'temperature': float(index)})
+    assert handler.flush(timeout=10)
+    assert handler.stats['written'] == 300
+
+    # 停止写入线程前写完队列中剩余的消息
+    for index in range(200):
+        handler.submit({'device_id': f'dev-{index % 7}', 'humidity': float(index)})
+    handler.stop_writer()
+    assert handler._queue.empty()
+    with flask_app.app_context():
+        SensorReading = flask_app.db.iot_models['SensorReading']
+        assert SensorReading.query.count() == 500
+    assert handler.stats['written'] == 500
+    assert handler.stats['failed'] == 0
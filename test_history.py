@@ -0,0 +1,129 @@
+import math
+import random
+
+from sqlalchemy.exc import OperationalError
+
+from src.database import SessionLocal
+from src.deadband import DeadbandFilter
+from src.ingest_pipeline import IngestPipeline
+from src.models import DeviceModel, SensorHistoryModel
+from test_ingest_resilience import latest_value
+
+
+def test_deadband_reduces_rows_with_bounded_error():
+    """一天每10秒一条温度读数：写入行数下降一个数量级，保持重建误差不超过阈值"""
+    history_filter = DeadbandFilter(rules={"Temperature": (0.2, 600)})
+    rng = random.Random(7)
+    readings = []
+    for step in range(8640):
+        now = step * 10.0
+        # 日变化 ±3°C，叠加0.1°C分辨率的噪声
+        value = round(22 + 3 * math.sin(2 * math.pi * now / 86400) + rng.choice([-0.1, 0, 0, 0.1]), 1)
+        readings.append((now, value))
+
+    stored = []
+    for now, value in readings:
+        if history_filter.should_store(1, "Temperature1", value, now):
+            stored.append((now, value))
+
+    assert len(stored) * 10 <= len(readings)
+    # 按前一个存储点保持重建
+    index, max_error = 0, 0.0
+    for now, value in readings:
+        while index + 1 < len(stored) and stored[index + 1][0] <= now:
+            index += 1
+        max_error = max(max_error, abs(value - stored[index][1]))
+    assert max_error <= 0.2 + 1e-9
+    # 心跳保证两点间隔不超过600秒
+    assert max(b[0] - a[0] for a, b in zip(stored, stored[1:])) <= 600
+
+
+def test_rules_per_device_and_type():
+    history_filter = DeadbandFilter(rules={"Temperature": (0.5, 300), "7:Temperature1": (0.0, 300)})
+    assert history_filter.rule_for(1, "Temperature2") == (0.5, 300)
+    assert history_filter.rule_for(7, "Temperature1") == (0.0, 300)
+    assert history_filter.rule_for(1, "Relay Status") == history_filter.default
+
+
+def test_latest_value_sees_every_reading_history_is_filtered():
+    pipeline = IngestPipeline(flush_interval=0.05)
+    pipeline.start()
+    try:
+        for value in ["21.00", "21.05", "21.10", "21.00", "25.00", "25.10"]:
+            pipeline.submit("hist/1", f"Temperature1: {value} C")
+        assert pipeline.flush(timeout=10)
+    finally:
+        pipeline.stop()
+
+    assert latest_value("hist/1", "Temperature1") == 25.1
+    with SessionLocal() as db:
+        device = db.query(DeviceModel).filter(DeviceModel.name == "hist/1").first()
+        rows = db.query(SensorHistoryModel).filter(
+            SensorHistoryModel.device_id == device.id, SensorHistoryModel.type == "Temperature1"
+        ).order_by(SensorHistoryModel.id).all()
+    assert [row.value for row in rows] == [21.0, 25.0]
+    assert pipeline.status()["history"]["suppressed"] >= 4
+
+
+def locked_once_factory():
+    """第一个批次提交时报 database is locked，模拟写入管道的整批重试"""
+    failures = [1]
+
+    def factory():
+        db = SessionLocal()
+        if failures:
+            failures.pop()
+
+            def commit():
+                raise OperationalError("COMMIT", {}, Exception("database is locked"))
+            db.commit = commit
+        return db
+    return factory
+
+
+def test_retried_batch_is_not_suppressed_by_rolled_back_state():
+    pipeline = IngestPipeline(session_factory=locked_once_factory(), flush_interval=0.05)
+    pipeline.processor.history_filter = DeadbandFilter(rules={"Temperature": (0.2, 600)})
+    for value in ["30.00", "30.05", "35.00"]:
+        pipeline.submit("hist/retry", f"Temperature1: {value} C")
+    pipeline.start()
+    try:
+        assert pipeline.flush(timeout=10)
+    finally:
+        pipeline.stop()
+
+    assert pipeline.stats["commit_errors"] == 1
+    with SessionLocal() as db:
+        device = db.query(DeviceModel).filter(DeviceModel.name == "hist/retry").first()
+        rows = db.query(SensorHistoryModel).filter(SensorHistoryModel.device_id == device.id).all()
+    assert sorted(row.value for row in rows) == [30.0, 35.0]
+    assert pipeline.status()["history"]["stored"] == 2
+
+
+def test_rolled_back_message_does_not_move_deadband_reference():
+    pipeline = IngestPipeline(flush_interval=0.05)
+    processor = pipeline.processor
+    processor.history_filter = DeadbandFilter(rules={"Temperature": (0.2, 600)})
+    queue_latest_value = processor.queue_latest_value
+
+    def failing_queue_latest_value(db, sensor, timestamp):
+        # 死区判断之后失败，这条消息的保存点被回滚
+        if sensor.value == 40.0:
+            raise ValueError("写入失败")
+        queue_latest_value(db, sensor, timestamp)
+    processor.queue_latest_value = failing_queue_latest_value
+
+    for value in ["30.00", "40.00", "40.05"]:
+        pipeline.submit("hist/savepoint", f"Temperature1: {value} C")
+    pipeline.start()
+    try:
+        assert pipeline.flush(timeout=10)
+    finally:
+        pipeline.stop()
+
+    # 40.05 与实际写入的30.00比较，而不是与已回滚的40.00比较
+    with SessionLocal() as db:
+        device = db.query(DeviceModel).filter(DeviceModel.name == "hist/savepoint").first()
+        rows = db.query(SensorHistoryModel).filter(SensorHistoryModel.device_id == device.id).all()
+    assert sorted(row.value for row in rows) == [30.0, 40.05]
+    assert pipeline.status()["history"]["stored"] == 2
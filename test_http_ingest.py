@@ -0,0 +1,90 @@
+import json
+import time
+
+from fastapi.testclient import TestClient
+
+from src.database import Base, SessionLocal, engine
+from src.http_ingest import JsonArrayParser
+from src.main import app
+from src.models import DeviceModel, SensorHistoryModel
+from test_ingest_resilience import latest_value
+
+Base.metadata.create_all(bind=engine)
+
+
+def test_json_array_parser_handles_split_chunks():
+    text = json.dumps([{"device": "a", "value": i, "unit": "温度℃"} for i in range(50)])
+    parser = JsonArrayParser()
+    items = []
+    for start in range(0, len(text), 7):
+        items.extend(parser.feed(text[start:start + 7]))
+    items.extend(parser.feed("", eof=True))
+    assert [item["value"] for item in items] == list(range(50))
+
+    parser = JsonArrayParser()
+    parser.feed('[{"device": "a"}, {"dev')
+    try:
+        parser.feed("", eof=True)
+        assert False, "不完整的数组应报错"
+    except ValueError:
+        pass
+
+
+def test_ndjson_stream_is_batched_through_pipeline():
+    now = time.time()
+    count = 5000
+
+    def body():
+        # 分多段发送，模拟网关流式上传
+        for start in range(0, count, 500):
+            lines = [json.dumps({"device": "http-gw-1", "type": "Temperature1", "value": 20 + index % 10,
+                                 "unit": "C", "ts": now - count + index})
+                     for index in range(start, start + 500)]
+            yield ("\n".join(lines) + "\n").encode()
+        yield b'{"device": "http-gw-1", "type": "Temperature1", "value": "abc"}\n{oops\n'
+        # 补传的旧读数只进历史，不覆盖最新值
+        yield json.dumps({"device": "http-gw-1", "type": "Temperature1", "value": 99,
+                          "ts": now - 2 * count}).encode()
+
+    client = TestClient(app)
+    response = client.post("/api/ingest", content=body(), headers={"Content-Type": "application/x-ndjson"})
+    assert response.status_code == 200
+    result = response.json()
+    # 同一设备的大批量读数不受每设备限速影响
+    assert (result["records"], result["accepted"], result["committed"], result["failed"]) == \
+           (count + 3, count + 1, count + 1, 2)
+    assert [error["index"] for error in result["errors"]] == [count + 1, count + 2]
+    assert latest_value("http-gw-1", "Temperature1") == 20 + (count - 1) % 10
+
+    with SessionLocal() as db:
+        device = db.query(DeviceModel).filter(DeviceModel.name == "http-gw-1").one()
+        oldest = db.query(SensorHistoryModel).filter(SensorHistoryModel.device_id == device.id) \
+            .order_by(SensorHistoryModel.timestamp).first()
+        assert oldest.value == 99
+
+
+def test_json_array_with_topic_payload_records():
+    client = TestClient(app)
+    body = json.dumps([
+        {"topic": "stm32/http", "payload": "Temperature1: 21.50 C"},
+        {"device": "http-gw-2", "type": "Humidity1", "value": 55.5, "unit": "%", "ts": "2000-01-01T00:00:00Z"},
+        {"device": "http-gw-2", "type": "Humidity1", "value": 56.5, "unit": "%"},
+    ])
+    result = client.post("/api/ingest", content=body.encode(), headers={"Content-Type": "application/json"}).json()
+    assert (result["accepted"], result["failed"]) == (2, 1)
+    assert "时间戳" in result["errors"][0]["error"]
+    assert latest_value("http-gw-2", "Humidity1") == 56.5
+
+    assert client.post("/api/ingest", content=b'[{"device": ').status_code == 400
+
+
+def test_records_rejected_by_pipeline_count_as_failed():
+    client = TestClient(app)
+    body = json.dumps([
+        {"device": "http-gw-3", "type": "Temperature1", "value": 22.5, "unit": "C"},
+        {"topic": "stm32/http-reject", "payload": "没有读数"},
+    ])
+    result = client.post("/api/ingest", content=body.encode(), headers={"Content-Type": "application/json"}).json()
+    # 第二条通过了校验，但在写入管道中因没有读数进入死信表
+    assert (result["accepted"], result["committed"], result["failed"]) == (2, 1, 1)
+    assert result["errors"][0]["index"] == 2
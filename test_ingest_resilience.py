@@ -0,0 +1,187 @@
+import time
+
+import paho.mqtt.client as mqtt
+from sqlalchemy.exc import OperationalError
+
+from src.broker_pool import BrokerPool
+from src.connection_manager import ReconnectBackoff
+from src.database import Base, SessionLocal, engine
+from src.ingest_pipeline import IngestPipeline
+from src.models import DeviceModel, MQTTConfigModel, SensorDataModel, TopicConfigModel
+
+Base.metadata.create_all(bind=engine)
+
+
+def wait_until(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def latest_value(device_name, sensor_type):
+    with SessionLocal() as db:
+        device = db.query(DeviceModel).filter(DeviceModel.name == device_name).first()
+        if not device:
+            return None
+        sensor = db.query(SensorDataModel).filter(
+            SensorDataModel.device_id == device.id, SensorDataModel.type == sensor_type
+        ).first()
+        return sensor.value if sensor else None
+
+
+def publish(port, topic, payload):
+    client = mqtt.Client()
+    client.connect("127.0.0.1", port)
+    client.loop_start()
+    client.publish(topic, payload, qos=1).wait_for_publish(5)
+    client.loop_stop()
+    client.disconnect()
+
+
+def add_broker_config(port, topics):
+    """为本地broker创建MQTT配置和激活的主题配置"""
+    with SessionLocal() as db:
+        mqtt_config = MQTTConfigModel(name=f"itest-{port}", server="127.0.0.1", port=port)
+        db.add(mqtt_config)
+        db.flush()
+        db.add(TopicConfigModel(name=f"itest-{port}", subscribe_topics=topics,
+                                is_active=True, mqtt_config_id=mqtt_config.id))
+        db.commit()
+        return mqtt_config.id
+
+
+def deactivate_all_topic_configs():
+    with SessionLocal() as db:
+        db.query(TopicConfigModel).update({TopicConfigModel.is_active: False})
+        db.commit()
+
+
+def test_backoff_grows_with_jitter_and_cap():
+    backoff = ReconnectBackoff(initial=1.0, maximum=8.0, multiplier=2.0, jitter=0.5)
+    delays = [backoff.next_delay() for _ in range(6)]
+    for attempt, delay in enumerate(delays):
+        base = min(8.0, 2.0 ** attempt)
+        assert base * 0.5 <= delay <= base
+    backoff.reset()
+    assert backoff.next_delay() <= 1.0
+
+
+def test_ack_only_after_batch_commit():
+    """确认回调在批次提交之后执行，解析出错的消息不影响同批次其他消息"""
+    pipeline = IngestPipeline(batch_size=10, flush_interval=0.05)
+    acked = []
+
+    def ack(tag):
+        # 确认时数据必须已经提交、可被其他连接读到
+        def callback():
+            acked.append((tag, latest_value("ack_dev", "temperature")))
+        return callback
+
+    pipeline.submit("sensors/ack_dev/temperature", b"21.5", on_committed=ack("ok"))
+    pipeline.submit("sensors/ack_dev/humidity", b'{"value": "bad"}', on_committed=ack("bad"))
+    pipeline.start()
+    assert pipeline.flush(5)
+    pipeline.stop()
+
+    assert acked == [("ok", 21.5), ("bad", 21.5)]
+    assert pipeline.stats["committed"] == 1
+    assert pipeline.stats["failed"] == 1
+    assert latest_value("ack_dev", "humidity") is None
+
+
+def test_batch_retried_until_commit_succeeds():
+    """数据库持续被锁超过 commit_retries 次时不放弃批次，提交成功后才确认"""
+    failures = [5]
+
+    def session_factory():
+        db = SessionLocal()
+        if failures[0]:
+            failures[0] -= 1
+
+            def commit():
+                raise OperationalError("COMMIT", {}, Exception("database is locked"))
+            db.commit = commit
+        return db
+
+    pipeline = IngestPipeline(session_factory=session_factory, flush_interval=0.05, commit_retries=3)
+    acked = []
+    pipeline.submit("sensors/locked_dev/temperature", b"19.5", on_committed=lambda: acked.append(True))
+    pipeline.start()
+    try:
+        assert pipeline.flush(15)
+    finally:
+        pipeline.stop()
+
+    assert pipeline.stats["commit_errors"] == 5
+    assert acked == [True]
+    assert latest_value("locked_dev", "temperature") == 19.5
+
+
+def test_reconnects_after_broker_restart(local_broker):
+    broker = local_broker()
+    deactivate_all_topic_configs()
+    config_id = add_broker_config(broker.port, '["itest/#"]')
+
+    # broker尚未启动时服务也能启动，并在broker可用后自动连上
+    pool = BrokerPool(pipeline=IngestPipeline(flush_interval=0.05))
+    try:
+        assert pool.sync()
+        service = pool.get(config_id)
+        service.connection.backoff = ReconnectBackoff(initial=0.1, maximum=0.5)
+        broker.start()
+        assert wait_until(lambda: service.is_connected, 15)
+        publish(broker.port, "itest/dev1", "Temperature1: 22.10 C")
+        assert wait_until(lambda: latest_value("itest/dev1", "Temperature1") == 22.1)
+
+        broker.kill()
+        assert wait_until(lambda: not service.is_connected, 10)
+
+        broker.start()
+        assert wait_until(lambda: service.is_connected, 15)
+        assert service.connection.connects >= 2
+        publish(broker.port, "itest/dev1", "Temperature1: 23.50 C")
+        assert wait_until(lambda: latest_value("itest/dev1", "Temperature1") == 23.5)
+    finally:
+        pool.stop()
+        deactivate_all_topic_configs()
+
+
+def test_pool_ingests_from_multiple_brokers(local_broker):
+    """不同broker上的激活主题配置同时采集，共享同一个写入管道"""
+    site_a = local_broker().start()
+    site_b = local_broker().start()
+    deactivate_all_topic_configs()
+    id_a = add_broker_config(site_a.port, '["site_a/#"]')
+    id_b = add_broker_config(site_b.port, "site_b/#")
+
+    pipeline = IngestPipeline(flush_interval=0.05)
+    pool = BrokerPool(pipeline=pipeline)
+    try:
+        assert pool.sync()
+        assert set(pool.services) == {id_a, id_b}
+        assert wait_until(lambda: pool.is_connected, 15)
+
+        publish(site_a.port, "site_a/dev1", "Temperature1: 20.10 C")
+        publish(site_b.port, "site_b/dev1", "Humidity1: 45.00 %")
+        assert wait_until(lambda: latest_value("site_a/dev1", "Temperature1") == 20.1)
+        assert wait_until(lambda: latest_value("site_b/dev1", "Humidity1") == 45.0)
+
+        status = pool.status()
+        assert {broker["mqtt_config_id"]: broker["stats"]["received"] for broker in status["brokers"]} == {
+            id_a: 1, id_b: 1,
+        }
+        assert status["pipeline"]["committed"] >= 2
+
+        # 停用一个broker的主题配置后，只停止该broker
+        with SessionLocal() as db:
+            db.query(TopicConfigModel).filter(TopicConfigModel.mqtt_config_id == id_b).update(
+                {TopicConfigModel.is_active: False})
+            db.commit()
+        pool.sync()
+        assert set(pool.services) == {id_a}
+    finally:
+        pool.stop()
+        deactivate_all_topic_configs()
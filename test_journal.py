@@ -0,0 +1,110 @@
+import time
+from datetime import datetime
+
+from src.database import Base, SessionLocal, engine
+from src.dead_letters import DeadLetterStore
+from src.ingest_pipeline import IngestPipeline
+from src.journal import MessageJournal, list_segments, read_range, replay_journal
+from src.models import DeviceModel, SensorDataModel, SensorHistoryModel
+
+Base.metadata.create_all(bind=engine)
+
+
+def test_segments_rotate_and_survive_torn_tail(tmp_path):
+    journal = MessageJournal(str(tmp_path), segment_bytes=256, max_bytes=10 ** 6, fsync_seconds=0)
+    t0 = 1_700_000_000.0
+    for index in range(40):
+        journal.append(f"plant/dev-{index % 4}", f"Temperature1: {index}.5 C".encode(), received=t0 + index)
+    journal.close()
+    segments = list_segments(str(tmp_path))
+    assert len(segments) > 3
+
+    records = list(read_range(str(tmp_path), t0 + 5, t0 + 12))
+    assert [received for received, _, _ in records] == [t0 + index for index in range(5, 12)]
+    assert records[0][1:] == ("plant/dev-1", b"Temperature1: 5.5 C")
+
+    # 崩溃时最后一条只写了一半：读取到此为止，之前的记录都在
+    with open(segments[-1][1], "ab") as file:
+        file.write(b"\x40\x00\x00\x00garbage")
+    assert len(list(read_range(str(tmp_path)))) == 40
+
+    # 超过总大小上限时删除最早的分段
+    small = MessageJournal(str(tmp_path), segment_bytes=256, max_bytes=600, fsync_seconds=0)
+    small.append("plant/dev-0", b"Temperature1: 1.0 C", received=t0 + 100)
+    small.close()
+    remaining = list(read_range(str(tmp_path)))
+    assert remaining[-1][0] == t0 + 100 and len(remaining) < 40
+
+
+def test_replay_backfills_with_original_receive_time(tmp_path):
+    journal = MessageJournal(str(tmp_path), fsync_seconds=0)
+    t0 = time.time() - 3600
+    for index in range(10):
+        journal.append("journal/replay-dev", f"Temperature1: {20 + index}.0 C".encode(), received=t0 + index * 60)
+    journal.append("journal/replay-dev", b"\xff\xfe", received=t0 + 600)
+    journal.close()
+
+    pipeline = IngestPipeline(flush_interval=0.05, dead_letters=DeadLetterStore())
+    pipeline.start()
+    try:
+        # 只补录后半段
+        result = replay_journal(pipeline, str(tmp_path), start=t0 + 300)
+    finally:
+        pipeline.stop()
+    assert result["submitted"] == 6 and result["committed"] == 6
+    assert pipeline.stats["dead_letters"] == 1
+
+    with SessionLocal() as db:
+        device = db.query(DeviceModel).filter(DeviceModel.name == "journal/replay-dev").one()
+        latest = db.query(SensorDataModel).filter(SensorDataModel.device_id == device.id,
+                                                  SensorDataModel.type == "Temperature1").one()
+        assert latest.value == 29.0
+        assert abs((latest.timestamp - datetime.utcfromtimestamp(t0 + 540)).total_seconds()) < 1
+        # 历史读数也按收到时间写入，而不是补录时的当前时间
+        oldest = db.query(SensorHistoryModel).filter(
+            SensorHistoryModel.device_id == device.id,
+            SensorHistoryModel.timestamp >= datetime.utcfromtimestamp(t0 + 290),
+        ).order_by(SensorHistoryModel.timestamp).first()
+        assert abs((oldest.timestamp - datetime.utcfromtimestamp(t0 + 300)).total_seconds()) < 1
+
+
+def test_replay_is_idempotent_within_window(tmp_path):
+    journal = MessageJournal(str(tmp_path), fsync_seconds=0)
+    t0 = time.time() - 7200
+    for index in range(5):
+        journal.append("journal/idempotent-dev", f"Temperature1: {20 + index}.0 C".encode(),
+                       received=t0 + index * 60)
+    journal.close()
+
+    def replay():
+        pipeline = IngestPipeline(flush_interval=0.05, dead_letters=DeadLetterStore())
+        pipeline.start()
+        try:
+            return replay_journal(pipeline, str(tmp_path))
+        finally:
+            pipeline.stop()
+
+    def history(device_id):
+        with SessionLocal() as db:
+            return [(row.timestamp, row.value) for row in db.query(SensorHistoryModel).filter(
+                SensorHistoryModel.device_id == device_id, SensorHistoryModel.type == "Temperature1",
+            ).order_by(SensorHistoryModel.timestamp)]
+
+    assert replay()["committed"] == 5
+    with SessionLocal() as db:
+        device_id = db.query(DeviceModel.id).filter(DeviceModel.name == "journal/idempotent-dev").scalar()
+        # 实时采集时写入的行（时间略晚于收到时间）和日志之前的行
+        db.add(SensorHistoryModel(device_id=device_id, type="Temperature1", value=21.0,
+                                  timestamp=datetime.utcfromtimestamp(t0 + 60.2)))
+        db.add(SensorHistoryModel(device_id=device_id, type="Temperature1", value=1.0,
+                                  timestamp=datetime.utcfromtimestamp(t0 - 600)))
+        db.commit()
+    first = history(device_id)
+    assert len(first) == 7
+
+    replay()
+    second = history(device_id)
+    # 窗口内只剩日志中的读数，日志之前的行保持不变
+    assert [value for _, value in second] == [1.0, 20.0, 21.0, 22.0, 23.0, 24.0]
+    replay()
+    assert history(device_id) == second
@@ -0,0 +1,106 @@
+import os
+import struct
+
+from fastapi.testclient import TestClient
+
+import src.main as main_module
+from src.database import Base, engine
+from src.ingest_pipeline import IngestPipeline
+from src.latest_values import HEADER_SIZE, LatestValuePublisher, LatestValueReader, LatestValueWriter
+from src.sensor_processor import SensorDataProcessor
+
+Base.metadata.create_all(bind=engine)
+
+
+def test_writer_and_reader_share_slots(tmp_path):
+    path = str(tmp_path / "latest")
+    writer = LatestValueWriter(path, capacity=4)
+    reader = LatestValueReader(path)
+    assert reader.records() == []
+
+    assert writer.publish(1, "Temperature1", 21.5, 1700000000.0, "C", "normal", "车间一号", 7)
+    assert writer.publish(1, "Temperature1", 22.5, 1700000060.0, "C", "normal", "车间一号", 7)
+    assert writer.publish(2, "Humidity1", 55.0, 1700000030.0, "%")
+    [first, second] = reader.records()
+    assert first["value"] == 22.5 and first["device_name"] == "车间一号" and first["id"] == 7
+    assert second["type"] == "Humidity1" and second["unit"] == "%"
+
+    # 写入进行中（序列号为奇数）的槽位读者跳过，不会读到一半的记录
+    struct.pack_into("<I", writer._map, HEADER_SIZE, 5)
+    assert [record["device_id"] for record in reader.records()] == [2]
+    struct.pack_into("<I", writer._map, HEADER_SIZE, 6)
+
+    # 槽位用完后拒绝新的序列
+    for device_id in (3, 4):
+        assert writer.publish(device_id, "Temperature1", 1.0, 1700000000.0)
+    assert not writer.publish(5, "Temperature1", 1.0, 1700000000.0)
+
+    # 写入者重启时沿用已有槽位
+    writer.close()
+    restarted = LatestValueWriter(path, capacity=4)
+    assert restarted.status()["slots"] == 4
+    assert restarted.publish(2, "Humidity1", 60.0, 1700000090.0)
+    assert {record["device_id"]: record["value"] for record in reader.records()}[2] == 60.0
+    restarted.close()
+
+    # 容量变化时重建文件，读者按inode变化重新映射
+    rebuilt = LatestValueWriter(path, capacity=8)
+    rebuilt.publish(9, "Temperature1", 30.0, 1700000100.0)
+    assert [record["device_id"] for record in reader.records()] == [9]
+    rebuilt.close()
+
+
+def test_committed_readings_are_published(tmp_path, monkeypatch):
+    path = str(tmp_path / "latest")
+    publisher = LatestValuePublisher(path, capacity=64)
+    pipeline = IngestPipeline(processor=SensorDataProcessor(latest_values=publisher), flush_interval=0.05)
+    pipeline.start()
+    try:
+        pipeline.submit("latest/shm-dev-1", "Temperature1: 31.5 C, Humidity1: 40.0 %")
+        pipeline.submit("latest/shm-dev-2", "Temperature1: 18.0 C")
+        assert pipeline.flush(timeout=10)
+    finally:
+        pipeline.stop()
+
+    monkeypatch.setattr(main_module, "LATEST_VALUES_SHM", True)
+    monkeypatch.setattr(main_module, "latest_reader", LatestValueReader(path))
+    devices = TestClient(main_module.app).get("/api/latest-sensors").json()
+    values = {(device["device_name"], sensor["type"]): sensor["value"]
+              for device in devices for sensor in device["sensors"]}
+    assert values == {("latest/shm-dev-1", "Temperature1"): 31.5, ("latest/shm-dev-1", "Humidity1"): 40.0,
+                      ("latest/shm-dev-2", "Temperature1"): 18.0}
+    assert os.path.exists(path)
+
+
+def test_only_enabled_publisher_holds_writer(tmp_path):
+    path = str(tmp_path / "latest")
+    leader = LatestValuePublisher(path, capacity=8)
+    follower = LatestValuePublisher(path, capacity=8, enabled=False)
+    leader.publish_many([(1, "Temperature1", 20.0, 1700000000.0)])
+    # 非领导者不打开写入端，不会与领导者争用文件锁
+    follower.publish_many([(2, "Temperature1", 30.0, 1700000001.0)])
+    reader = LatestValueReader(path)
+    assert [record["device_id"] for record in reader.records()] == [1]
+
+    # 领导权转移：旧领导者关闭写入端后新领导者可以打开
+    leader.set_enabled(False)
+    follower.set_enabled(True)
+    follower.publish_many([(2, "Temperature1", 30.0, 1700000001.0)])
+    assert sorted(record["device_id"] for record in reader.records()) == [1, 2]
+    follower.set_enabled(False)
+
+
+def test_overflowed_table_falls_back_to_database(tmp_path, monkeypatch):
+    path = str(tmp_path / "latest")
+    writer = LatestValueWriter(path, capacity=1)
+    reader = LatestValueReader(path)
+    assert writer.publish(1, "Temperature1", 20.0, 1700000000.0)
+    assert not reader.overflowed
+    assert not writer.publish(2, "Temperature1", 21.0, 1700000001.0)
+    assert reader.overflowed
+    writer.close()
+
+    monkeypatch.setattr(main_module, "LATEST_VALUES_SHM", True)
+    monkeypatch.setattr(main_module, "latest_reader", reader)
+    monkeypatch.setattr(main_module, "get_latest_sensors", lambda db: [{"device_id": 0, "source": "db"}])
+    assert TestClient(main_module.app).get("/api/latest-sensors").json() == [{"device_id": 0, "source": "db"}]
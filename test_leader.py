@@ -0,0 +1,71 @@
+import time
+
+from src.database import Base, engine
+from src.leader_service import LeaderElector
+
+
+def test_single_leader_and_failover():
+    """同一时刻只有一个选举器持有租约，领导者失联后其他选举器在租约过期后接管"""
+    Base.metadata.create_all(bind=engine)
+    events = []
+
+    first = LeaderElector(name="test_lease", ttl=0.5, on_elected=lambda: events.append("first"))
+    second = LeaderElector(name="test_lease", ttl=0.5, on_elected=lambda: events.append("second"))
+
+    first.tick()
+    second.tick()
+    assert first.is_leader and not second.is_leader
+    assert events == ["first"]
+
+    # 模拟领导者进程被杀：不再续约，也不释放租约
+    time.sleep(0.6)
+    second.tick()
+    assert second.is_leader
+    assert events == ["first", "second"]
+
+    # 原领导者恢复后发现租约已被接管，应降级
+    demoted = []
+    first.on_demoted = lambda: demoted.append(True)
+    first.tick()
+    assert not first.is_leader
+    assert demoted == [True]
+
+    # 主动释放后立即可被接管
+    second.stop()
+    first.tick()
+    assert first.is_leader
+    first.stop()
+
+
+def test_transient_lock_on_renewal_keeps_leadership_until_lease_expires():
+    from sqlalchemy.exc import OperationalError
+    from src.database import SessionLocal
+
+    Base.metadata.create_all(bind=engine)
+    locked = []
+
+    def session_factory():
+        db = SessionLocal()
+        if locked:
+            def commit():
+                raise OperationalError("UPDATE service_leases", {}, Exception("database is locked"))
+            db.commit = commit
+        return db
+
+    demoted = []
+    elector = LeaderElector(name="test_lease_locked", ttl=1.0, renew_interval=0.3,
+                            on_demoted=lambda: demoted.append(True), session_factory=session_factory)
+    elector.tick()
+    assert elector.is_leader
+
+    # 续约时数据库被锁：租约还够下一轮，保持领导者
+    locked.append(True)
+    elector.tick()
+    assert elector.is_leader and demoted == []
+
+    # 下一轮之前租约就会过期时降级
+    time.sleep(0.8)
+    elector.tick()
+    assert not elector.is_leader and demoted == [True]
+    locked.clear()
+    elector.stop()
@@ -0,0 +1,75 @@
+import time
+
+from fastapi.testclient import TestClient
+
+from src.database import Base, engine
+from src.ingest_pipeline import IngestPipeline
+from src.main import app
+from src.profiler import MemoryProfiler, SamplingProfiler
+
+Base.metadata.create_all(bind=engine)
+
+
+def test_sampling_profiler_collects_ingest_stacks():
+    profiler = SamplingProfiler()
+    pipeline = IngestPipeline(flush_interval=0.01)
+    pipeline.start()
+    try:
+        profiler.start("ingest", duration=5, interval_ms=2)
+        for index in range(300):
+            pipeline.submit(f"profile/{index % 30}", f"Temperature1: {20 + index % 10}.00 C, Humidity1: 40.00 %")
+        assert pipeline.flush(timeout=20)
+        status = profiler.stop()
+    finally:
+        pipeline.stop()
+
+    assert not status["running"] and status["session"]["samples"] > 0
+    lines = profiler.collapsed().splitlines()
+    assert lines and all(line.startswith("ingest-writer;") for line in lines)
+    stack, count = lines[0].rsplit(" ", 1)
+    assert int(count) >= 1
+    assert "process_message (src/sensor_processor.py:" in profiler.collapsed()
+    top = profiler.top_functions(5)
+    assert top["inclusive"][0]["samples"] >= top["self"][0]["samples"]
+
+
+def test_profile_window_is_bounded():
+    profiler = SamplingProfiler()
+    profiler.start("all", duration=0.2, interval_ms=5, include_idle=True)
+    time.sleep(0.6)
+    status = profiler.status()
+    assert not status["running"] and status["session"]["stopped_at"] is not None
+
+
+def test_memory_diff_reports_growth():
+    profiler = MemoryProfiler()
+    profiler.start(duration=30, frames=5)
+    try:
+        retained = [bytearray(1024) for _ in range(2000)]
+        diff = profiler.diff(limit=5)
+        assert diff["size_diff_bytes"] >= 2000 * 1024
+        assert "test_profiler.py" in diff["top"][0]["location"][0]
+        # 重设基线后，没有新增分配
+        profiler.diff(reset=True)
+        assert profiler.diff()["size_diff_bytes"] < 1024 * 1024
+    finally:
+        status = profiler.stop()
+    assert not status["tracing"] and len(retained) == 2000
+
+
+def test_admin_endpoints():
+    client = TestClient(app)
+    response = client.post("/api/admin/profile/start", json={"target": "nope"})
+    assert response.status_code == 400
+    response = client.post("/api/admin/profile/start", json={"target": "http", "duration": 5, "interval_ms": 2})
+    assert response.status_code == 200 and response.json()["running"]
+    assert client.post("/api/admin/profile/start", json={"target": "http"}).status_code == 409
+    assert client.post("/api/admin/profile/stop").json()["running"] is False
+    assert client.get("/api/admin/profile").json()["session"]["target"] == "http"
+    collapsed = client.get("/api/admin/profile", params={"format": "collapsed"})
+    assert collapsed.headers["content-type"].startswith("text/plain")
+
+    assert client.get("/api/admin/memory/diff").status_code == 409
+    assert client.post("/api/admin/memory/start", json={"duration": 10}).json()["tracing"]
+    assert "top" in client.get("/api/admin/memory/diff", params={"limit": 3}).json()
+    assert client.post("/api/admin/memory/stop").json()["tracing"] is False
@@ -0,0 +1,158 @@
+import zlib
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+
+from src.database import (
+    Base, SessionLocal, configure_shards, engine, init_shards, shard_count, shard_engines, shard_session_factory,
+)
+from src.db_operations import get_device_history, get_device_shards, get_latest_device_sensors
+from src.dead_letters import DeadLetterStore
+from src.ingest_pipeline import ShardedIngestPipeline
+from src.main import app
+from src.models import DeadLetterModel, DeviceModel, SensorDataModel, SensorHistoryModel
+
+Base.metadata.create_all(bind=engine)
+
+
+@pytest.fixture
+def shards(tmp_path):
+    configure_shards([f"sqlite:///{tmp_path / f'shard{index}.db'}" for index in (1, 2)])
+    init_shards()
+    yield shard_count()
+    configure_shards([])
+
+
+def reading(device, value, sensor_type="Temperature1"):
+    return f"http/{device}", {"device": device, "type": sensor_type, "value": value, "unit": "C",
+                              "ts": None, "timestamp": None}
+
+
+def test_readings_are_routed_to_per_device_shards(shards):
+    assert shards == 3
+    # 选出落在三个不同分片上的设备名
+    names = {}
+    index = 0
+    while len(names) < 3:
+        name = f"shard-dev-{index}"
+        names.setdefault(zlib.crc32(f"http/{name}".encode()) % 3, name)
+        index += 1
+
+    pipeline = ShardedIngestPipeline(flush_interval=0.05)
+    pipeline.start()
+    try:
+        for value in range(5):
+            for name in names.values():
+                pipeline.submit(*reading(name, 20.0 + value))
+        assert pipeline.flush(timeout=10)
+    finally:
+        pipeline.stop()
+    assert pipeline.status()["committed"] == 15
+
+    with SessionLocal() as db:
+        for shard, name in names.items():
+            device = db.query(DeviceModel).filter(DeviceModel.name == name).one()
+            # 分片0（主库）总是包括在内
+            assert get_device_shards(db, device.id) == sorted({0, shard})
+            # 读数只写在所属分片中
+            for other in range(3):
+                with shard_session_factory(other)() as session:
+                    rows = session.query(SensorDataModel).filter(SensorDataModel.device_id == device.id).count()
+                assert rows == (1 if other == shard else 0)
+            assert [sensor.value for sensor in get_latest_device_sensors(db, device.id)] == [24.0]
+            assert len(get_device_history(db, device.id, "Temperature1")) >= 2
+
+    # 跨设备的读接口合并所有分片
+    client = TestClient(app)
+    recent = {message["device_name"] for message in client.get("/api/mqtt-messages?limit=50").json()}
+    assert set(names.values()) <= recent
+
+
+def name_on_shard(prefix, shard, count=3):
+    index = 0
+    while zlib.crc32(f"{prefix}{index}".encode()) % count != shard:
+        index += 1
+    return f"{prefix}{index}"
+
+
+def test_device_reads_include_rows_written_before_sharding(shards):
+    """分片前写在主库中的历史，与分片后写到其他分片的读数一起出现在统计和图表中"""
+    name = name_on_shard("http/premigrate-", 2)[len("http/"):]
+    earlier = datetime.utcnow() - timedelta(hours=1)
+    with SessionLocal() as db:
+        device = DeviceModel(name=name, device_type="test", status="在线", location="test")
+        db.add(device)
+        db.flush()
+        db.add_all([SensorHistoryModel(device_id=device.id, type="Temperature1", value=20.0 + index,
+                                       timestamp=earlier + timedelta(minutes=index)) for index in range(4)])
+        db.commit()
+        device_id = device.id
+
+    pipeline = ShardedIngestPipeline(flush_interval=0.05)
+    pipeline.start()
+    try:
+        for value in (30.0, 31.0, 32.0):
+            pipeline.submit(*reading(name, value))
+        assert pipeline.flush(timeout=10)
+    finally:
+        pipeline.stop()
+
+    with SessionLocal() as db:
+        assert get_device_shards(db, device_id) == [0, 2]
+    client = TestClient(app)
+    stats = client.get(f"/api/devices/{device_id}/stats?type=Temperature1").json()["series"][0]
+    assert stats["count"] == 7 and stats["min"] == 20.0 and stats["max"] == 32.0
+    chart = client.get(f"/api/devices/{device_id}/chart?type=Temperature1").json()
+    assert chart["raw_points"] == 7
+    assert chart["values"] == [20.0, 21.0, 22.0, 23.0, 30.0, 31.0, 32.0]
+
+
+def test_rejected_first_message_does_not_lose_shard_registration(shards):
+    """新设备的第一条消息保存点回滚后，后续读数仍登记到设备→分片目录，分片读取能看到它"""
+    name = name_on_shard("http/rejected-first-", 1)[len("http/"):]
+    pipeline = ShardedIngestPipeline(flush_interval=0.05)
+    pipeline.start()
+    try:
+        pipeline.submit(*reading(name, "bad"))
+        pipeline.submit(*reading(name, 40.0))
+        assert pipeline.flush(timeout=10)
+    finally:
+        pipeline.stop()
+
+    with SessionLocal() as db:
+        device = db.query(DeviceModel).filter(DeviceModel.name == name).one()
+        assert get_device_shards(db, device.id) == [0, 1]
+        assert [sensor.value for sensor in get_latest_device_sensors(db, device.id)] == [40.0]
+
+def test_shard_commit_failure_after_main_commit_is_retried(shards):
+    """主库先提交：分片提交失败后重试，设备不重复创建，死信不重复记录，读数最终写入分片"""
+    topic = name_on_shard("split-commit/dev", 1)
+    failures = [1]
+
+    def fail_once(conn):
+        if failures:
+            failures.pop()
+            raise OperationalError("COMMIT", {}, Exception("database is locked"))
+
+    event.listen(shard_engines[1], "commit", fail_once)
+    pipeline = ShardedIngestPipeline(flush_interval=0.05, dead_letters=DeadLetterStore())
+    try:
+        pipeline.submit(topic, b"Temperature1: 21.50 C")
+        pipeline.submit(topic, b"\xff\xfe")
+        pipeline.start()
+        assert pipeline.flush(timeout=10)
+    finally:
+        pipeline.stop()
+        event.remove(shard_engines[1], "commit", fail_once)
+
+    assert pipeline.status()["commit_errors"] == 1
+    assert pipeline.status()["dead_letters"] == 1
+    with SessionLocal() as db:
+        assert db.query(DeadLetterModel).filter(DeadLetterModel.topic == topic).count() == 1
+        device = db.query(DeviceModel).filter(DeviceModel.name == topic).one()
+        assert get_device_shards(db, device.id) == [0, 1]
+    with shard_session_factory(1)() as session:
+        assert session.query(SensorDataModel).filter(SensorDataModel.device_id == device.id).one().value == 21.5
@@ -0,0 +1,41 @@
+import threading
+import time
+
+from fastapi.testclient import TestClient
+
+import src.main as main_module
+from src.startup_service import startup_service
+
+
+def test_startup_does_not_block_on_mqtt(monkeypatch):
+    """MQTT连接阻塞时，应用仍应立即响应/healthz，并在就绪前/readyz返回503"""
+    release = threading.Event()
+
+    def slow_start_mqtt_service():
+        # 模拟broker不可达时阻塞的同步connect
+        release.wait(10)
+        return False
+
+    monkeypatch.setattr(main_module, "start_mqtt_service", slow_start_mqtt_service)
+
+    app = main_module.create_app()
+    begin = time.perf_counter()
+    with TestClient(app) as client:
+        response = client.get("/healthz")
+        startup_time = time.perf_counter() - begin
+        print(f"启动到首个/healthz响应耗时: {startup_time * 1000:.1f} ms")
+        assert response.status_code == 200
+        assert startup_time < 1.0
+
+        response = client.get("/readyz")
+        assert response.status_code == 503
+        assert response.json()["mqtt"] == "starting"
+
+        release.set()
+        assert startup_service.wait(5)
+
+        response = client.get("/readyz")
+        assert response.status_code == 200
+        body = response.json()
+        assert body["db"] == "ready"
+        assert set(body["startup"]["steps_ms"]) == {"init_database", "migrate_database", "start_mqtt_service"}
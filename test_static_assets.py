@@ -0,0 +1,72 @@
+import gzip
+import os
+
+from fastapi.testclient import TestClient
+
+import src.main as main_module
+from src.static_assets import IMMUTABLE_CACHE, REVALIDATE_CACHE, SpaShell, StaticAssets, parse_accept_encoding
+
+
+def make_dist(tmp_path):
+    assets = tmp_path / "assets"
+    assets.mkdir()
+    script = ("console.log('仪表盘');\n" * 500).encode()
+    (assets / "index-B7x_9kQa.js").write_bytes(script)
+    (assets / "logo-Cq1dE3fG.png").write_bytes(b"\x89PNG" + os.urandom(2000))
+    (tmp_path / "index.html").write_text(
+        '<!doctype html><html><head><script type="module" src="/assets/index-B7x_9kQa.js"></script></head>'
+        '<body><div id="app"></div></body></html>', encoding="utf-8")
+    return script
+
+
+def test_accept_encoding_parsing():
+    assert parse_accept_encoding("gzip, deflate, br;q=0") == {"gzip", "deflate"}
+    assert parse_accept_encoding("") == set()
+
+
+def test_hashed_assets_are_compressed_and_immutable(tmp_path, monkeypatch):
+    script = make_dist(tmp_path)
+    monkeypatch.setattr(main_module, "frontend_assets", StaticAssets(str(tmp_path)))
+    monkeypatch.setattr(main_module, "spa_shell", SpaShell(str(tmp_path / "index.html"), "<html></html>"))
+    client = TestClient(main_module.app)
+
+    response = client.get("/assets/index-B7x_9kQa.js", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["cache-control"] == IMMUTABLE_CACHE
+    assert response.headers["content-encoding"] == "gzip" and response.headers["vary"] == "Accept-Encoding"
+    assert int(response.headers["content-length"]) < len(script) / 10
+    assert response.content == script
+
+    # 同一表示的ETag命中时返回304
+    etag = response.headers["etag"]
+    cached = client.get("/assets/index-B7x_9kQa.js", headers={"Accept-Encoding": "gzip", "If-None-Match": etag})
+    assert cached.status_code == 304 and not cached.content
+
+    identity = client.get("/assets/index-B7x_9kQa.js", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in identity.headers and identity.headers["etag"] != etag
+
+    image = client.get("/assets/logo-Cq1dE3fG.png", headers={"Accept-Encoding": "gzip"})
+    assert image.status_code == 200 and "content-encoding" not in image.headers
+    assert image.headers["cache-control"] == IMMUTABLE_CACHE
+
+    # 前端路由和入口页返回构建的 index.html，每次用ETag验证
+    shell = client.get("/devices/3", headers={"Accept-Encoding": "gzip"})
+    assert shell.headers["cache-control"] == REVALIDATE_CACHE and "/assets/index-B7x_9kQa.js" in shell.text
+    assert client.get("/", headers={"If-None-Match": shell.headers["etag"],
+                                    "Accept-Encoding": "gzip"}).status_code == 304
+    # 不能越出构建目录
+    assert main_module.frontend_assets.resolve("../" + tmp_path.name + "/index.html") is not None
+    assert main_module.frontend_assets.resolve("../../etc/passwd") is None
+    assert client.get("/api/no-such-endpoint").status_code == 404
+
+
+def test_prebuilt_variant_is_served(tmp_path):
+    script = make_dist(tmp_path)
+    path = tmp_path / "assets" / "index-B7x_9kQa.js"
+    # 构建时生成的 .gz 优先于运行时压缩
+    prebuilt = gzip.compress(script, compresslevel=1)
+    (tmp_path / "assets" / "index-B7x_9kQa.js.gz").write_bytes(prebuilt)
+    entry = StaticAssets(str(tmp_path)).lookup("assets/index-B7x_9kQa.js")
+    assert entry.variants["gzip"] == prebuilt
+    assert StaticAssets(str(tmp_path)).lookup("assets/index-B7x_9kQa.js.gz") is None
+    assert os.path.exists(path)
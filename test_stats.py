@@ -0,0 +1,97 @@
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from fastapi.testclient import TestClient
+
+from src.analytics import compute_stats, load_series, moving_average
+from src.block_store import to_epoch_ms
+from src.database import Base, SessionLocal, engine
+from src.main import app
+from src.models import DeviceModel, SensorHistoryModel
+
+Base.metadata.create_all(bind=engine)
+
+
+def add_device(name, start, values, step_s=10):
+    with SessionLocal() as db:
+        device = DeviceModel(name=name, device_type="test")
+        db.add(device)
+        db.flush()
+        db.execute(SensorHistoryModel.__table__.insert(), [
+            {"device_id": device.id, "type": "Temperature1", "value": float(value),
+             "timestamp": start + timedelta(seconds=step_s * i)}
+            for i, value in enumerate(values)
+        ])
+        db.commit()
+        return device.id
+
+
+def test_compute_stats_known_series():
+    ts = np.array([0, 10_000, 20_000, 30_000, 60_000], dtype=np.int64)
+    values = np.array([20.0, 22.0, 30.0, 24.0, 20.0])
+    stats = compute_stats(ts, values, percentiles=[50], window_s=15, threshold=25)
+    assert stats["count"] == 5
+    assert stats["mean"] == 23.2
+    assert stats["min"] == 20.0 and stats["max"] == 30.0
+    assert stats["percentiles"] == {"p50": 22.0}
+    # 按前一点保持：20*10 + 22*10 + 30*10 + 24*30 = 1440 / 60
+    assert stats["time_weighted_mean"] == 24.0
+    assert stats["time_above_threshold"] == {"threshold": 25, "seconds": 10.0, "ratio": 10 / 60}
+    assert stats["rate_of_change"]["max"] == 0.8
+    assert stats["rate_of_change"]["min"] == -0.6
+    assert moving_average(ts, values, 15).tolist() == [20.0, 21.0, 26.0, 27.0, 20.0]
+    assert compute_stats(ts[:0], values[:0]) == {"count": 0}
+
+
+def test_stats_endpoint_compares_devices():
+    start = datetime(2024, 6, 1)
+    first = add_device("stats_a", start, [20, 21, 22, 23, 24, 25])
+    second = add_device("stats_b", start, [30, 30, 30, 30, 30, 30])
+    client = TestClient(app)
+
+    response = client.get(f"/api/devices/{first}/stats", params={
+        "type": "Temperature1", "compare": [second], "from": (start + timedelta(seconds=10)).isoformat(),
+        "to": (start + timedelta(seconds=40)).isoformat(), "percentiles": "0,100", "threshold": 22.5,
+    })
+    assert response.status_code == 200
+    series = response.json()["series"]
+    assert [s["device_id"] for s in series] == [first, second]
+    assert series[0]["count"] == 4
+    assert series[0]["percentiles"] == {"p0": 21.0, "p100": 24.0}
+    assert series[0]["time_above_threshold"]["seconds"] == 10.0
+    assert series[1]["std"] == 0.0
+
+    assert client.get(f"/api/devices/{first}/stats", params={"type": "Temperature1", "compare": [999999]}).status_code == 404
+
+
+def test_million_points_within_budget():
+    rng = np.random.default_rng(1)
+    values = np.round(22 + rng.normal(0, 1, 1_000_000), 1)
+    ts = np.arange(1_000_000, dtype=np.int64) * 1000
+    started = time.perf_counter()
+    stats = compute_stats(ts, values, threshold=23)
+    assert stats["count"] == 1_000_000
+    assert time.perf_counter() - started < 1.0
+
+
+def test_load_series_from_rows():
+    start = datetime(2024, 6, 2)
+    device_id = add_device("stats_load", start, range(50))
+    with SessionLocal() as db:
+        ts, values = load_series(db, device_id, "Temperature1", start + timedelta(seconds=100), start + timedelta(seconds=200))
+    assert values.tolist() == [float(v) for v in range(10, 21)]
+    assert ts[0] == to_epoch_ms(start + timedelta(seconds=100))
+
+
+def test_load_series_converts_aware_bounds_to_utc():
+    start = datetime(2024, 6, 3)
+    device_id = add_device("stats_load_tz", start, range(50))
+    # +08:00 的 08:01:40 即 UTC 00:01:40
+    local = timezone(timedelta(hours=8))
+    lower = (start + timedelta(hours=8, seconds=100)).replace(tzinfo=local)
+    upper = (start + timedelta(hours=8, seconds=200)).replace(tzinfo=local)
+    with SessionLocal() as db:
+        ts, values = load_series(db, device_id, "Temperature1", lower, upper)
+    assert values.tolist() == [float(v) for v in range(10, 21)]
+    assert ts[0] == to_epoch_ms(lower)
@@ -0,0 +1,136 @@
+import time
+
+import paho.mqtt.client as mqtt
+
+from src.broker_pool import BrokerPool
+from src.database import Base, SessionLocal, engine
+from src.ingest_pipeline import IngestPipeline
+from src.models import MQTTConfigModel, TopicConfigModel
+from src.subscription_manager import SubscriptionManager, parse_topic_specs
+
+Base.metadata.create_all(bind=engine)
+
+
+class FakeClient:
+    """记录发出的SUBSCRIBE/UNSUBSCRIBE报文"""
+
+    def __init__(self):
+        self.packets = []
+        self.mid = 0
+
+    def subscribe(self, topics):
+        self.mid += 1
+        self.packets.append(("subscribe", topics))
+        return mqtt.MQTT_ERR_SUCCESS, self.mid
+
+    def unsubscribe(self, topics):
+        self.mid += 1
+        self.packets.append(("unsubscribe", topics))
+        return mqtt.MQTT_ERR_SUCCESS, self.mid
+
+
+def test_parse_topic_specs_with_per_topic_qos():
+    assert parse_topic_specs('["stm32/#", {"topic": "alarm/#", "qos": 2}]', default_qos=1) == {
+        "stm32/#": 1, "alarm/#": 2,
+    }
+    assert parse_topic_specs("a/#, b/#", default_qos=0) == {"a/#": 0, "b/#": 0}
+    assert parse_topic_specs("a/#\nb/#\na/#", default_qos=1) == {"a/#": 1, "b/#": 1}
+
+
+def test_reload_sends_only_diff_in_batched_packets():
+    client = FakeClient()
+    manager = SubscriptionManager(client)
+    manager.apply_config({"a/#": 1, "b/#": 1, "c/#": 1})
+    assert client.packets == [("subscribe", [("a/#", 1), ("b/#", 1), ("c/#", 1)])]
+
+    client.packets.clear()
+    result = manager.apply_config({"a/#": 1, "b/#": 2, "d/#": 0, "e/#": 1})
+    # 未变化的a/#不重发；b/#的QoS变化需重新订阅；新增主题与之合并为一个报文
+    assert client.packets == [
+        ("subscribe", [("b/#", 2), ("d/#", 0), ("e/#", 1)]),
+        ("unsubscribe", ["c/#"]),
+    ]
+    assert result["unsubscribed"] == ["c/#"]
+
+    client.packets.clear()
+    manager.apply_config({"a/#": 1, "b/#": 2, "d/#": 0, "e/#": 1})
+    assert client.packets == []
+
+
+def test_dynamic_topics_survive_config_reload():
+    client = FakeClient()
+    manager = SubscriptionManager(client)
+    manager.apply_config({"a/#": 1})
+    manager.add("debug/#", 0)
+    client.packets.clear()
+    manager.apply_config({"b/#": 1})
+    assert client.packets == [("subscribe", [("b/#", 1)]), ("unsubscribe", ["a/#"])]
+    assert manager.subscribed == {"debug/#": 0, "b/#": 1}
+
+
+def test_reconnect_restores_subscriptions_for_new_session():
+    client = FakeClient()
+    manager = SubscriptionManager(client)
+    manager.apply_config({"a/#": 1, "b/#": 1})
+    client.packets.clear()
+    # 持久会话仍在：无需重发
+    manager.on_connected(session_present=True)
+    assert client.packets == []
+    # 会话丢失：一次性重新订阅全部主题
+    manager.on_connected(session_present=False)
+    assert client.packets == [("subscribe", [("a/#", 1), ("b/#", 1)])]
+
+
+def test_topic_change_applies_live_without_reconnect(local_broker):
+    broker = local_broker().start()
+    with SessionLocal() as db:
+        db.query(TopicConfigModel).update({TopicConfigModel.is_active: False})
+        mqtt_config = MQTTConfigModel(name=f"reload-{broker.port}", server="127.0.0.1", port=broker.port)
+        db.add(mqtt_config)
+        db.flush()
+        topic_config = TopicConfigModel(name=f"reload-{broker.port}", subscribe_topics='["keep/#", "old/#"]',
+                                        is_active=True, mqtt_config_id=mqtt_config.id)
+        db.add(topic_config)
+        db.commit()
+        config_id, topic_config_id = mqtt_config.id, topic_config.id
+
+    pool = BrokerPool(pipeline=IngestPipeline(flush_interval=0.05))
+    publisher = mqtt.Client()
+    try:
+        pool.sync()
+        service = pool.get(config_id)
+        deadline = time.monotonic() + 15
+        while not service.is_connected and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert service.is_connected
+
+        publisher.connect("127.0.0.1", broker.port)
+        publisher.loop_start()
+
+        with SessionLocal() as db:
+            db.query(TopicConfigModel).filter(TopicConfigModel.id == topic_config_id).update(
+                {TopicConfigModel.subscribe_topics: '["keep/#", {"topic": "new/#", "qos": 0}]'})
+            db.commit()
+        pool.sync()
+
+        status = service.subscriptions.status()
+        assert status["subscribed"] == {"keep/#": 1, "new/#": 0}
+        assert status["stats"]["last_reload_ms"] < 50
+        assert service.stats["connects"] == 1
+
+        for index in range(5):
+            publisher.publish("keep/dev", f"{index}", qos=1).wait_for_publish(5)
+        publisher.publish("new/dev", "1", qos=1).wait_for_publish(5)
+        publisher.publish("old/dev", "1", qos=1).wait_for_publish(5)
+        deadline = time.monotonic() + 10
+        while service.stats["received"] < 6 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        time.sleep(0.3)
+        assert service.stats["received"] == 6
+        assert service.stats["connects"] == 1
+    finally:
+        publisher.loop_stop()
+        pool.stop()
+        with SessionLocal() as db:
+            db.query(TopicConfigModel).update({TopicConfigModel.is_active: False})
+            db.commit()
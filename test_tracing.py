@@ -0,0 +1,60 @@
+import time
+
+from fastapi.testclient import TestClient
+
+from src.database import Base, engine
+from src.ingest_pipeline import IngestPipeline
+from src.main import app
+from src.tracing import TraceRecorder, parse_device_timestamp, percentile
+
+Base.metadata.create_all(bind=engine)
+
+
+def test_parse_device_timestamp():
+    assert parse_device_timestamp(b'{"ts": 1700000000123, "value": 1}') == 1700000000.123
+    assert parse_device_timestamp('{"timestamp": "2024-01-01T00:00:00Z"}') == 1704067200.0
+    assert parse_device_timestamp("Temperature1: 22.10 C\nts: 1700000000") == 1700000000.0
+    assert parse_device_timestamp("Temperature1: 22.10 C, Humidity1: 16.10 %") is None
+    assert parse_device_timestamp("{broken") is None
+
+
+def test_percentile_nearest_rank():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile([5.0], 90) == 5.0
+
+
+def test_pipeline_traces_stages_until_commit():
+    pipeline = IngestPipeline(flush_interval=0.02, tracer=TraceRecorder(sample_every=2))
+    pipeline.start()
+    try:
+        sent_at = time.time() - 1.5
+        for index in range(20):
+            pipeline.submit(f"trace/{index % 5}", f"Temperature1: 21.{index % 10}0 C\nts: {sent_at:.3f}")
+        assert pipeline.flush(timeout=10)
+    finally:
+        pipeline.stop()
+
+    summary = pipeline.tracer.summary()
+    assert summary["sampled"] == 10 and summary["traces"] == 10
+    stages = summary["stages"]
+    for name in ("queue", "parse", "resolve", "write", "commit", "end_to_end"):
+        assert stages[name]["count"] == 10
+        assert 0 <= stages[name]["p50"] <= stages[name]["p99"] <= stages[name]["max"]
+    assert stages["end_to_end"]["max"] >= stages["commit"]["max"]
+    # 设备时间戳比收到时间早1.5秒
+    assert 1400 < stages["device_to_ingest"]["p50"] < 3000
+
+    trace = pipeline.tracer.recent(1)[0]
+    assert trace["topic"].startswith("trace/")
+    parts = sum(trace["stages_ms"][name] for name in ("queue", "parse", "resolve", "write", "commit"))
+    assert abs(parts - trace["stages_ms"]["end_to_end"]) < 0.01
+
+
+def test_latency_endpoint():
+    client = TestClient(app)
+    response = client.get("/api/ingest/latency", params={"recent": 5})
+    assert response.status_code == 200
+    body = response.json()
+    assert "stages" in body and "recent" in body and body["sample_every"] >= 0
@@ -0,0 +1,90 @@
+import random
+from collections import Counter
+
+from fastapi.testclient import TestClient
+
+import src.traffic as traffic
+from src.database import Base, SessionLocal, engine
+from src.main import app
+from src.traffic import SpaceSaving, TrafficAnalyzer, get_traffic_top
+
+Base.metadata.create_all(bind=engine)
+
+
+def test_space_saving_bounds():
+    random.seed(7)
+    stream = [f"hot/{index % 5}" for index in range(5000)] + [f"cold/{index}" for index in range(20000)]
+    random.shuffle(stream)
+    summary = SpaceSaving(capacity=50)
+    for key in stream:
+        summary.add(key)
+    exact = Counter(stream)
+    assert len(summary.counts) == 50
+    for index in range(5):
+        key = f"hot/{index}"
+        # count 为上界，count - error 为下界
+        assert summary.counts[key] - summary.errors[key] <= exact[key] <= summary.counts[key]
+
+
+def test_chatty_devices_found_among_many_topics(monkeypatch):
+    analyzer = TrafficAnalyzer()
+    monkeypatch.setattr(analyzer, "_start_persisting", lambda: None)
+    now = 1_700_000_000.0
+    # 很久以前的流量不计入任何窗口
+    for _ in range(500):
+        analyzer.observe("site/old-chatty/data", now=now - 1000)
+    random.seed(3)
+    exact = Counter()
+    for index in range(100000):
+        second = now - 250 + index * 250 / 100000
+        if index % 10 == 0:
+            exact[f"plant/chatty-{index % 3}"] += 1
+            analyzer.observe(f"plant/chatty-{index % 3}/telemetry/{index % 7}", now=second)
+        else:
+            analyzer.observe(f"plant/dev-{random.randrange(50000)}/telemetry", now=second)
+
+    result = analyzer.top("device", 300, 5, now=now)
+    assert result["total"] == 100000
+    assert sorted(item["key"] for item in result["items"][:3]) == sorted(exact)
+    for item in result["items"][:3]:
+        assert item["guaranteed"] <= exact[item["key"]] <= item["count"]
+    assert "site/old-chatty" not in [item["key"] for item in result["items"]]
+
+    # 一分钟窗口只含最近6个时间片
+    minute = analyzer.top("device", 60, 3, now=now)
+    assert 0 < minute["total"] < 30000
+    topics = analyzer.top("topic", 300, 21, now=now)
+    assert sum(item["key"].startswith("plant/chatty-") for item in topics["items"]) == 21
+
+
+def test_snapshot_matches_top_for_every_window(monkeypatch):
+    analyzer = TrafficAnalyzer()
+    monkeypatch.setattr(analyzer, "_start_persisting", lambda: None)
+    now = 1_700_000_000.0
+    for index in range(3000):
+        analyzer.observe(f"plant/dev-{index % 40}/telemetry", now=now - 800 + index * 800 / 3000)
+
+    # 快照的各窗口共用一次复制的时间片，结果与单独查询一致
+    tops = analyzer.snapshot(now)["tops"]
+    for kind in traffic.TRAFFIC_KINDS:
+        for window in analyzer.windows:
+            assert tops[f"{kind}:{window}"] == analyzer.top(kind, window, traffic._PERSISTED_TOP, now)
+
+
+def test_traffic_endpoint_and_snapshot(monkeypatch):
+    analyzer = TrafficAnalyzer()
+    monkeypatch.setattr(analyzer, "_start_persisting", lambda: None)
+    for index in range(30):
+        analyzer.observe(f"line/{'busy' if index % 3 else 'quiet'}/data")
+    monkeypatch.setattr(traffic, "traffic_analyzer", analyzer)
+    client = TestClient(app)
+    response = client.get("/api/traffic/top", params={"kind": "device", "window": 60})
+    assert response.status_code == 200
+    assert [(item["key"], item["count"]) for item in response.json()["items"]] == [("line/busy", 20), ("line/quiet", 10)]
+    assert client.get("/api/traffic/top", params={"window": 61}).status_code == 400
+
+    # 其他进程读取采集进程保存的快照
+    analyzer.persist()
+    with SessionLocal() as db:
+        snapshot = get_traffic_top(db, "device", 60, 1, analyzer=TrafficAnalyzer())
+    assert [item["key"] for item in snapshot["items"]] == ["line/busy"]